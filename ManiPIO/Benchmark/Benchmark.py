@@ -0,0 +1,357 @@
+# Copyright 2021 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ManiPIO Benchmark
+#
+# This program starts local pymodbus TCP servers as stand-ins for PLCs and runs
+# synthetic ManiPIO scenarios against them. Scenarios are written as ManiPIO scripts,
+# compiled and built the same way the constructor does, and then run through the
+# Event and Trigger classes. Each scenario reports writes and reads per second,
+# write latency, trigger reaction latency, CPU use and memory.
+# Results are saved as JSON and can be compared with an earlier run to catch regressions.
+# Everything runs on the local machine, no network or PLCs are needed.
+
+# Import the needed stuff
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import platform
+import tempfile
+import argparse
+import threading
+import multiprocessing
+
+#ManiPIO lives in the folder above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ManiPIO as M
+
+#Version of the results layout
+RESULTS_VERSION = 1
+#First port the stand-in servers listen on, one port per PLC
+BASE_PORT = 15020
+#Registers and coils each stand-in server holds
+SERVER_SIZE = 10000
+
+#Scenario suites
+#kind is 'single' (persistent writers run for duration seconds), 'ramp' (ramp Events run to the end)
+#or 'trigger' (Triggers watching a register that the benchmark sets, repeats times)
+SUITES = {
+    'quick': [
+        {'name':'single_1plc_1event_1addr', 'kind':'single', 'plcs':1, 'events':1, 'addrs':1, 'format':'32_float', 'duration':2.0},
+        {'name':'single_1plc_8event_16addr', 'kind':'single', 'plcs':1, 'events':8, 'addrs':16, 'format':'32_float', 'duration':2.0},
+        {'name':'single_4plc_16event_8addr', 'kind':'single', 'plcs':4, 'events':16, 'addrs':8, 'format':'32_float', 'duration':2.0},
+        {'name':'ramp_1plc_4event_rate200', 'kind':'ramp', 'plcs':1, 'events':4, 'addrs':4, 'format':'32_float', 'length':1.0, 'rate':200},
+        {'name':'trigger_1plc_4trigger', 'kind':'trigger', 'plcs':1, 'events':4, 'addrs':1, 'format':'32_float', 'repeats':5},
+    ],
+    'full': [
+        {'name':'single_1plc_1event_1addr', 'kind':'single', 'plcs':1, 'events':1, 'addrs':1, 'format':'32_float', 'duration':5.0},
+        {'name':'single_1plc_1event_1addr_16int', 'kind':'single', 'plcs':1, 'events':1, 'addrs':1, 'format':'16_int', 'duration':5.0},
+        {'name':'single_1plc_1event_1addr_64float', 'kind':'single', 'plcs':1, 'events':1, 'addrs':1, 'format':'64_float', 'duration':5.0},
+        {'name':'single_1plc_8event_16addr', 'kind':'single', 'plcs':1, 'events':8, 'addrs':16, 'format':'32_float', 'duration':5.0},
+        {'name':'single_1plc_4event_120addr', 'kind':'single', 'plcs':1, 'events':4, 'addrs':120, 'format':'16_uint', 'duration':5.0},
+        {'name':'single_4plc_16event_8addr', 'kind':'single', 'plcs':4, 'events':16, 'addrs':8, 'format':'32_float', 'duration':5.0},
+        {'name':'single_8plc_64event_4addr', 'kind':'single', 'plcs':8, 'events':64, 'addrs':4, 'format':'32_float', 'duration':5.0},
+        {'name':'ramp_1plc_1event_fast', 'kind':'ramp', 'plcs':1, 'events':1, 'addrs':1, 'format':'32_float', 'length':2.0, 'rate':0},
+        {'name':'ramp_1plc_4event_rate200', 'kind':'ramp', 'plcs':1, 'events':4, 'addrs':4, 'format':'32_float', 'length':2.0, 'rate':200},
+        {'name':'ramp_4plc_16event_rate100_10s', 'kind':'ramp', 'plcs':4, 'events':16, 'addrs':4, 'format':'32_float', 'length':10.0, 'rate':100},
+        {'name':'trigger_1plc_1trigger', 'kind':'trigger', 'plcs':1, 'events':1, 'addrs':1, 'format':'32_float', 'repeats':10},
+        {'name':'trigger_4plc_16trigger', 'kind':'trigger', 'plcs':4, 'events':16, 'addrs':1, 'format':'32_float', 'repeats':10},
+    ],
+}
+
+#Run pymodbus TCP servers on ports until the process is stopped
+def serve(ports):
+    from pymodbus.server import StartTcpServer
+    from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
+    for port in ports:
+        store = ModbusSlaveContext(hr=ModbusSequentialDataBlock(0, [0]*SERVER_SIZE), co=ModbusSequentialDataBlock(0, [0]*SERVER_SIZE))
+        context = ModbusServerContext(slaves=store, single=True)
+        thread = threading.Thread(target=StartTcpServer, kwargs={'context':context, 'address':('127.0.0.1', port)})
+        thread.daemon = True
+        thread.start()
+    while True:
+        time.sleep(1)
+
+#Start the stand-in servers, in their own process unless in_process is set
+#in_process servers share the CPU and GIL with ManiPIO, so CPU numbers include them
+#returns the process, or None when the servers run in this process
+def start_servers(ports, in_process=False):
+    process = None
+    if in_process:
+        thread = threading.Thread(target=serve, args=(ports,))
+        thread.daemon = True
+        thread.start()
+    else:
+        process = multiprocessing.Process(target=serve, args=(ports,))
+        process.daemon = True
+        process.start()
+
+    #wait for every server to take connections
+    deadline = time.monotonic() + 10
+    for port in ports:
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError('Stand-in server on port %u did not start' % port)
+                time.sleep(0.05)
+    return process
+
+#Write the ManiPIO script for a scenario
+#Events are spread over the PLCs in turn, each writing its own run of addresses
+def scenario_script(scenario):
+    count = M.reg_count(scenario['format'])
+    lines = []
+    for p in range(scenario['plcs']):
+        lines.extend(['PLC %u' % (p+1), 'IP:127.0.0.1', 'Port:%u' % (BASE_PORT + p), ''])
+
+    for e in range(scenario['events']):
+        start = 1000 + (e // scenario['plcs']) * scenario['addrs'] * count
+        mem = [str(start + a*count) for a in range(scenario['addrs'])]
+        lines.extend(['Event %u' % (e+1), 'PLC:%u' % (e % scenario['plcs'] + 1), 'Mem:[%s]' % ','.join(mem), 'Format:[%s]' % ','.join([scenario['format']]*len(mem))])
+        if scenario['kind'] == 'ramp':
+            lines.extend(['Type:ramp', 'Values:[0,100]', 'Timing:%s' % scenario['length']])
+            if scenario.get('rate', 0) > 0:
+                lines.append('Rate:%s' % scenario['rate'])
+        elif scenario['kind'] == 'single':
+            lines.extend(['Values:[%s]' % ','.join(str(a + 0.5) for a in range(len(mem))), 'Persist:True'])
+        else:
+            lines.append('Values:[%u]' % (e+1))
+        lines.append('')
+
+    #each Trigger watches register 10 on its Event's PLC
+    if scenario['kind'] == 'trigger':
+        for e in range(scenario['events']):
+            lines.extend(['Trigger %u' % (e+1), 'Event:%u' % (e+1), 'PLC:%u' % (e % scenario['plcs'] + 1), 'Mem:10', 'Conditions:>', 'Values:0.5', ''])
+    return '\n'.join(lines) + '\n'
+
+#Compile and build a scenario the way the constructor does
+def build_scenario(scenario, folder):
+    path = os.path.join(folder, scenario['name'] + '.txt')
+    FILE = open(path, 'w')
+    FILE.write(scenario_script(scenario))
+    FILE.close()
+    plan = M.compile_script(path, cache=False)
+    return M.build(plan)
+
+#Start a scenario from clean connections and metrics so nothing carries over
+def reset():
+    M.CONNECTIONS.close_all()
+    M.CONNECTIONS.connections.clear()
+    M.METRICS.metrics = []
+
+#Current resident memory in MB
+def rss_mb():
+    try:
+        FILE = open('/proc/self/statm')
+        pages = int(FILE.read().split()[1])
+        FILE.close()
+        return pages * resource.getpagesize() / 1e6
+    except (OSError, ValueError, IndexError):
+        return None
+
+#Run Events, stopping persistent ones after duration seconds
+def run_events(Events, duration, engine):
+    if engine == 'async':
+        M.Async_Engine(timeout=duration).run(Events, [])
+        return
+    for event in Events:
+        event.run()
+    if duration is not None:
+        time.sleep(duration)
+        for event in Events:
+            event.stop()
+    else:
+        for event in Events:
+            event.wait()
+
+#Run Triggers and set the watched register once they are polling
+#returns the seconds from setting the register to each Trigger firing
+def run_triggers(Triggers, PLCS, engine):
+    if engine == 'async':
+        thread = threading.Thread(target=M.Async_Engine(timeout=30).run, args=([], Triggers))
+        thread.daemon = True
+        thread.start()
+    else:
+        for trigger in Triggers:
+            trigger.run()
+
+    #let every Trigger reach its poll loop before setting the register
+    time.sleep(0.2)
+    sent = time.perf_counter()
+    for PLC in PLCS.values():
+        PLC.write(10, 1.0)
+
+    if engine == 'async':
+        thread.join()
+    else:
+        for trigger in Triggers:
+            trigger.wait()
+    #each Trigger keeps the time it fired
+    return [trigger.fired_at - sent for trigger in Triggers if trigger.fired_at is not None]
+
+#Percentiles of a list of seconds
+def percentiles(values):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    pick = lambda p: values[min(len(values)-1, int(p/100.0*len(values)))]
+    return {'count':len(values), 'mean':sum(values)/len(values), 'p50':pick(50), 'p90':pick(90), 'p99':pick(99), 'max':values[-1]}
+
+#Run one scenario and measure it
+def run_scenario(scenario, folder, engine):
+    reset()
+    setup = M.MB_PLC('127.0.0.1', BASE_PORT)
+    setup.connect()
+    reactions = []
+    fire_to_write = []
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    if scenario['kind'] == 'trigger':
+        for repeat in range(scenario['repeats']):
+            #clear the watched register on every PLC and build new Triggers, they only fire once
+            PLCS, Events, Triggers = build_scenario(scenario, folder)
+            for PLC in PLCS.values():
+                PLC.connect()
+                PLC.write(10, 0.0)
+            reactions.extend(run_triggers(list(Triggers.values()), PLCS, engine))
+            for trigger in Triggers.values():
+                histogram = trigger.metrics.histograms.get('fire_to_write')
+                if histogram is not None:
+                    fire_to_write.append(histogram.sum / histogram.count)
+            for PLC in PLCS.values():
+                PLC.close()
+    else:
+        PLCS, Events, Triggers = build_scenario(scenario, folder)
+        run_events(list(Events.values()), scenario.get('duration'), engine)
+    elapsed = time.perf_counter() - start
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    setup.close()
+
+    #add up the PLC metrics of the scenario
+    summary = M.METRICS.summary()
+    writes = sum(plc['counts'].get('writes', 0) for plc in summary['plc'].values())
+    reads = sum(plc['counts'].get('reads', 0) for plc in summary['plc'].values())
+    retries = sum(plc['counts'].get('write_retries', 0) for plc in summary['plc'].values())
+    failures = sum(plc['counts'].get('write_failures', 0) for plc in summary['plc'].values())
+    latency = {}
+    for name in ['write', 'read', 'lock_wait']:
+        p50 = [plc['latency'][name]['p50'] for plc in summary['plc'].values() if name in plc['latency']]
+        p99 = [plc['latency'][name]['p99'] for plc in summary['plc'].values() if name in plc['latency']]
+        if len(p50) > 0:
+            latency[name] = {'p50':max(p50), 'p99':max(p99)}
+    cpu = (used.ru_utime - usage.ru_utime) + (used.ru_stime - usage.ru_stime)
+
+    result = {
+        'name':scenario['name'],
+        'scenario':scenario,
+        'engine':engine,
+        'elapsed':elapsed,
+        'writes':writes,
+        'writes_per_second':writes/elapsed,
+        'reads_per_second':reads/elapsed,
+        'write_retries':retries,
+        'write_failures':failures,
+        'latency':latency,
+        'cpu_seconds':cpu,
+        'cpu_percent':100.0*cpu/elapsed,
+        'rss_mb':rss_mb(),
+        'max_rss_mb':used.ru_maxrss/1000.0 }
+    if scenario['kind'] == 'trigger':
+        result['reaction'] = percentiles(reactions)
+        result['fire_to_write'] = percentiles(fire_to_write)
+    return result
+
+#Compare results with an earlier run, returns a list of regressions bigger than threshold (0.1 is 10%)
+def compare(results, baseline, threshold):
+    regressions = []
+    old = {r['name']: r for r in baseline['scenarios']}
+    for result in results['scenarios']:
+        #only the same scenario on the same engine can be compared
+        before = old.get(result['name'])
+        if before is None or before['engine'] != result['engine']:
+            continue
+        #throughput going down and time going up are both regressions
+        checks = [('writes_per_second', result['writes_per_second'], before['writes_per_second'], -1),
+            ('cpu_seconds per write', result['cpu_seconds']/max(result['writes'],1), before['cpu_seconds']/max(before['writes'],1), 1)]
+        if result.get('reaction') and before.get('reaction'):
+            checks.append(('reaction p50', result['reaction']['p50'], before['reaction']['p50'], 1))
+        for name, now, then, direction in checks:
+            if then > 0 and direction*(now - then)/then > threshold:
+                regressions.append('%s: %s %.6g -> %.6g' % (result['name'], name, then, now))
+    return regressions
+
+#main program
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ManiPIO benchmark against local Modbus servers')
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick', help='Scenarios to run (default quick)')
+    parser.add_argument('--only', default=None, help='Only run scenarios whose name contains this')
+    parser.add_argument('--engine', choices=['thread', 'async'], default='thread', help='ManiPIO engine to run scenarios on')
+    parser.add_argument('--in-process', action='store_true', help='Run the servers in this process instead of their own')
+    parser.add_argument('--output', default='bench_results.json', help='File to save results to (default bench_results.json)')
+    parser.add_argument('--compare', default=None, help='Earlier results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Change counted as a regression (default 0.1 is 10%%)')
+    args = parser.parse_args()
+
+    scenarios = [s for s in SUITES[args.suite] if args.only is None or args.only in s['name']]
+    ports = [BASE_PORT + p for p in range(max(s['plcs'] for s in scenarios))]
+    server = start_servers(ports, args.in_process)
+
+    results = {
+        'version':RESULTS_VERSION,
+        'time':time.time(),
+        'suite':args.suite,
+        'python':platform.python_version(),
+        'platform':platform.platform(),
+        'cpus':os.cpu_count(),
+        'numpy':M.np is not None,
+        'servers':'in process' if args.in_process else 'own process',
+        'scenarios':[] }
+    folder = tempfile.mkdtemp(prefix='manipio_bench_')
+    for scenario in scenarios:
+        result = run_scenario(scenario, folder, args.engine)
+        results['scenarios'].append(result)
+        line = '%-34s %10.1f writes/s  cpu %5.1f%%  rss %6.1f MB' % (result['name'], result['writes_per_second'], result['cpu_percent'], result['rss_mb'] or 0)
+        if result.get('reaction'):
+            line = line + '  reaction p50 %.2f ms' % (1000*result['reaction']['p50'])
+        print(line)
+
+    FILE = open(args.output, 'w')
+    json.dump(results, FILE, indent=1)
+    FILE.close()
+    print('Results saved to %s' % args.output)
+    if server is not None:
+        server.terminate()
+
+    if args.compare is not None:
+        FILE = open(args.compare)
+        baseline = json.load(FILE)
+        FILE.close()
+        if baseline.get('servers') != results['servers'] or baseline.get('cpus') != results['cpus']:
+            print('Warning: %s was run with servers %s on %s CPUs, numbers may not compare' % (args.compare, baseline.get('servers'), baseline.get('cpus')))
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('Regression ' + regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+        print('No regressions against %s' % args.compare)
@@ -0,0 +1,111 @@
+# Copyright 2021 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Capture_Modbus Benchmark
+#
+# This program measures how many packets a second Capture_Modbus decodes and logs
+# from raw frame bytes, and compares it with dissecting the same frames with scapy
+# the way Capture_Modbus used to. Frames are built in memory, nothing is captured,
+# so it does not need root or a network.
+
+# Import the needed stuff
+import os
+import sys
+import time
+import socket
+import struct
+import argparse
+
+#Capture_Modbus lives in the Capture_ModBus folder next to this one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Capture_ModBus'))
+import Capture_Modbus as C
+
+# Build an Ethernet frame carrying one Modbus/TCP ADU
+def build_frame(IP_src, sport, IP_dst, dport, Trans_ID, pdu, unit=1):
+    payload = C.MBAP.pack(Trans_ID, 0, len(pdu) + 1, unit) + pdu
+    tcp = struct.pack('>HHIIBBHHH', sport, dport, 1, 1, 5 << 4, 0x18, 512, 0, 0)
+    ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp) + len(payload), 1, 0x4000, 64, 6, 0,
+        socket.inet_aton(IP_src), socket.inet_aton(IP_dst))
+    return b'\x00' * 12 + struct.pack('>H', C.ETH_P_IP) + ip + tcp + payload
+
+# Frames of a PLC being polled, a write of count floats, a read request and its response
+def benchmark_frames(count=10):
+    values = struct.pack('>%uf' % count, *[i * 1.5 for i in range(count)])
+    frames = []
+    for Trans_ID in range(1, 101):
+        frames.append(build_frame('10.0.0.1', 40000, '10.0.0.2', C.MODBUS_PORT, Trans_ID, struct.pack('>BHHB', 0x10, 100, count * 2, len(values)) + values))
+        frames.append(build_frame('10.0.0.1', 40000, '10.0.0.2', C.MODBUS_PORT, Trans_ID, struct.pack('>BHH', 0x3, 200, count * 2)))
+        frames.append(build_frame('10.0.0.2', C.MODBUS_PORT, '10.0.0.1', 40000, Trans_ID, struct.pack('>BB', 0x3, len(values)) + values))
+    return frames
+
+# What the scapy callbacks of Capture_Modbus did with every packet before, dissect it and read the fields off its layers
+def scapy_dissect(packet, mb):
+    values = None
+    if mb.ModbusADURequest in packet:
+        layer4 = packet.getlayer(4)
+        if layer4.funcCode == 0x10:
+            fields = (packet.getlayer(1).src, packet.getlayer(1).dst, packet.getlayer(2).sport, packet.getlayer(2).dport, layer4.startAddr)
+            hexVal = layer4.outputsValue
+            values = [struct.unpack('>f', struct.pack('>HH', hexVal[i*2], hexVal[i*2+1]))[0] for i in range(int(layer4.quantityRegisters/2))]
+        if layer4.funcCode == 0x3:
+            fields = (packet.getlayer(1).src, packet.getlayer(1).dst, packet.getlayer(2).sport, packet.getlayer(2).dport, packet.getlayer(3).transId, layer4.startAddr, layer4.quantity)
+    if mb.ModbusADUResponse in packet:
+        layer4 = packet.getlayer(4)
+        if layer4.funcCode == 0x3:
+            fields = (packet.getlayer(1).src, packet.getlayer(1).dst, packet.getlayer(2).sport, packet.getlayer(2).dport, packet.getlayer(3).transId)
+            hexVal = layer4.registerVal
+            values = [struct.unpack('>f', struct.pack('>HH', hexVal[i*2], hexVal[i*2+1]))[0] for i in range(int(layer4.byteCount/4))]
+    return values
+
+# Packets per second decoded and logged by parse_frame and by scapy dissection, for the same frames
+# Logs go to the null device so only the decoding is timed
+def benchmark(seconds=2.0):
+    frames = benchmark_frames()
+    FILE = open(os.devnull, 'w')
+    log = C.Modbus_Log(FILE, echo=False)
+    N = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for frame in frames:
+            log.frame(frame)
+        N = N + len(frames)
+    fast = N / (time.perf_counter() - start)
+    FILE.close()
+    print("struct parser: %.0f packets/s" % fast)
+    try:
+        from scapy.layers.l2 import Ether
+        import scapy.contrib.modbus as mb
+    except ImportError:
+        print("scapy is not installed, nothing to compare against")
+        return fast, None
+    N = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for frame in frames:
+            scapy_dissect(Ether(frame), mb)
+        N = N + len(frames)
+    slow = N / (time.perf_counter() - start)
+    print("scapy dissection: %.0f packets/s" % slow)
+    print("struct parser is %.1fx faster" % (fast / slow))
+    return fast, slow
+
+#main program
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Capture_Modbus decoding speed against scapy dissection')
+    parser.add_argument('--seconds', type=float, default=2.0, help='Seconds to decode for with each (default 2)')
+    args = parser.parse_args()
+    benchmark(args.seconds)
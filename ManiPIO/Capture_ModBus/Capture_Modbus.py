@@ -23,316 +23,298 @@
 # "eth" reffers to ethernet
 # "lo" reffers to loopback 
 # Currently only 32bit floats are decoded.
-# This program is dependant on scapy for python3
+# On Linux packets are read from raw sockets and decoded straight
+# from their bytes, which keeps up with busy PLC polling loops.
+# Elsewhere, or with --scapy, scapy captures the packets instead.
 # Linux is the recommended OS, but it can run on Windows
 # as long as you manually specify the loopback and ethernet adaptor
 # when it asks.
 
 # Import the needed stuff
-from scapy.all import *
-import scapy.contrib.modbus as mb
 import struct
+import socket
+import ctypes
 import threading
-import netifaces
 import datetime
+import argparse
+import time
+# scapy is only needed where raw sockets can not be used
+try:
+    from scapy.all import sniff
+except ImportError:
+    sniff = None
+# netifaces finds the network adaptors, the socket module does on Linux without it
+try:
+    import netifaces
+except ImportError:
+    netifaces = None
+
+MODBUS_PORT = 502
+
+# Bytes before the IP header for each link layer a frame can start with
+# ether is Ethernet (Linux loopback too), sll is Linux cooked capture,
+# null is the BSD and Windows loopback, raw starts at the IP header
+LINK_HEADERS = {'ether':14, 'sll':16, 'null':4, 'raw':0}
+# Link layer of the hardware types a raw socket reports
+HARDWARE_LINKS = {1:'ether', 772:'ether', 65534:'raw'}
+# Link layer of the first layer scapy gives a packet
+SCAPY_LINKS = {'Ether':'ether', 'CookedLinux':'sll', 'Loopback':'null', 'IP':'raw'}
+
+# Headers read straight from the packet bytes
+MBAP = struct.Struct('>HHHB')
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_8021Q = 0x8100
+SO_ATTACH_FILTER = 26
+# Receive buffer of a raw socket, room for bursts while a line is being written
+CAPTURE_BUFFER = 8 * 1024 * 1024
+# Read requests waiting for their response, the oldest are forgotten past this many
+# or once they have waited this many seconds, so requests never answered do not pile up
+PENDING_MAX = 10000
+PENDING_TIMEOUT = 60.0
+
+# Kernel filter for "tcp port 502" on IPv4 over Ethernet, with or without an 802.1Q VLAN tag
+# X holds how far the IP header is moved by a tag, 0 or 4, and the IP and TCP headers are loaded from X on
+# Packets that are not Modbus never wake the capture thread
+def port_filter(port=MODBUS_PORT):
+    return [(0x01, 0, 0, 0), (0x28, 0, 0, 12), (0x15, 0, 2, ETH_P_8021Q), (0x01, 0, 0, 4),
+        (0x48, 0, 0, 12), (0x15, 0, 14, ETH_P_IP), (0x50, 0, 0, 23), (0x15, 0, 12, 6),
+        (0x48, 0, 0, 20), (0x45, 10, 0, 0x1fff), (0x50, 0, 0, 14), (0x54, 0, 0, 0xf),
+        (0x64, 0, 0, 2), (0x0c, 0, 0, 0), (0x07, 0, 0, 0), (0x48, 0, 0, 14),
+        (0x15, 2, 0, port), (0x48, 0, 0, 16), (0x15, 0, 1, port), (0x06, 0, 0, 0x40000), (0x06, 0, 0, 0)]
+
+# Find the Modbus/TCP ADUs in one captured frame
+# Headers are read where they sit in the frame, nothing is copied or dissected
+# link is the frame's link layer, see LINK_HEADERS
+# returns a list of (IP_src, sport, IP_dst, dport, Trans_ID, unit, pdu), pdu is a memoryview from the function code on
+# A TCP segment can carry more than one ADU, and frames that are not Modbus/TCP over IPv4 give an empty list
+def parse_frame(frame, link='ether', port=MODBUS_PORT):
+    frame = memoryview(frame)
+    o = LINK_HEADERS[link]
+    # runt frames too short for their link header are dropped, not decoded
+    if len(frame) < o:
+        return []
+    if link == 'ether' or link == 'sll':
+        (kind,) = struct.unpack_from('>H', frame, o - 2)
+        # skip a VLAN tag
+        if kind == ETH_P_8021Q and link == 'ether':
+            if len(frame) < o + 4:
+                return []
+            (kind,) = struct.unpack_from('>H', frame, o + 2)
+            o = o + 4
+        if kind != ETH_P_IP:
+            return []
+    elif link == 'null' and frame[0] != 2 and frame[3] != 2:
+        return []
+    if len(frame) < o + 20 or frame[o] >> 4 != 4 or frame[o + 9] != 6:
+        return []
+    (total, fragment) = struct.unpack_from('>H2xH', frame, o + 2)
+    # fragments past the first have no TCP header
+    if fragment & 0x1fff:
+        return []
+    t = o + (frame[o] & 15) * 4
+    if len(frame) < t + 20:
+        return []
+    (sport, dport) = struct.unpack_from('>HH', frame, t)
+    if sport != port and dport != port:
+        return []
+    p = t + (frame[t + 12] >> 4) * 4
+    # Ethernet pads short frames, the IP length says where the segment ends
+    end = min(len(frame), o + total)
+    if p + 8 > end:
+        return []
+    IP_src = socket.inet_ntoa(frame[o+12:o+16])
+    IP_dst = socket.inet_ntoa(frame[o+16:o+20])
+    adus = []
+    while p + 8 <= end:
+        (Trans_ID, protocol, length, unit) = MBAP.unpack_from(frame, p)
+        if protocol != 0 or length < 2:
+            break
+        adus.append((IP_src, sport, IP_dst, dport, Trans_ID, unit, frame[p+7:min(p + 6 + length, end)]))
+        p = p + 6 + length
+    return adus
+
+# Decode as many 32bit floats as asked for from the registers in data
+# Floats the packet was too short for are left 0, like an incomplete packet always was
+def decode_floats(data, count):
+    whole = min(count, len(data) // 4)
+    return list(struct.unpack_from('>%uf' % whole, data)) + [0] * (count - whole)
+
+# Log of the Modbus traffic seen on one interface
+# Read requests are remembered by connection and transaction ID so the address of their response is known
+class Modbus_Log:
+    def __init__(self, FILE, port=MODBUS_PORT, echo=True):
+        self.file = FILE
+        self.port = port
+        self.echo = echo
+        self.pending = {}
+        # The last address matched, used when a response's request was not seen,
+        # loopback sees every packet twice when scapy captures it
+        self.Last_reg = 0
+        self.packets = 0
+        self.adus = 0
+        self.errors = 0
+
+    # write transaction information to file and print out to cmd
+    def log(self, s):
+        if self.echo:
+            print(s)
+        self.file.write(s)
+
+    # Log a packet scapy captured, its bytes are decoded the same way as a raw socket's
+    def packet(self, packet):
+        self.frame(bytes(packet), SCAPY_LINKS.get(type(packet).__name__, 'ether'))
+
+    # Log every ADU in a captured frame
+    # A frame that still fails to decode is counted and skipped so the capture keeps going
+    def frame(self, frame, link='ether'):
+        self.packets = self.packets + 1
+        try:
+            adus = parse_frame(frame, link, self.port)
+        except (struct.error, IndexError, ValueError):
+            self.errors = self.errors + 1
+            return
+        for adu in adus:
+            self.adus = self.adus + 1
+            if adu[3] == self.port:
+                self.request(*adu)
+            else:
+                self.response(*adu)
 
-# Define lists for storing index of transaction information
-# so it can be refferenced to identify return packet values
-# register address.
-ID = []
-Address = []
-# Global storage needed esp for loopback, since register
-# value requests are seen twice.
-global Last_reg
-Last_reg = 0
-
-ID2 = []
-Address2 = []
-global Last_reg2
-Last_reg2 = 0
-
-# Open files to log info
-lo_file = open('lo_log.txt','w')
-eth_file = open('eth_log.txt','w')
+    def request(self, IP_src, sport, IP_dst, dport, Trans_ID, unit, pdu):
+        if len(pdu) < 5:
+            return
+        function = pdu[0]
+        (addr, quantity) = struct.unpack_from('>HH', pdu, 1)
+        date = str(datetime.datetime.now()).split('.')[0]
 
-# Callbacks for scapy sniff when a packet is captured
-def gotpacket_lo(packet):
-    #check if packet is Modbus Request
-    #packet.show()
-    if mb.ModbusADURequest in packet:
-        #packet.show()
-        # Get layer info to determine what function is called
-        layer4 = packet.getlayer(4)
-
-        if layer4.funcCode == 0x10:
+        if function == 0x10 and len(pdu) >= 6:
             # Write Register function code with values
-
-            layer1 = packet.getlayer(1)
-            layer2 = packet.getlayer(2)
-            layer3 = packet.getlayer(3)
-
-            # Collect packet info
-            IP_src = layer1.src
-            IP_dst = layer1.dst
-            sport = layer2.sport
-            dport = layer2.dport
-            
-            
-            numReg = layer4.quantityRegisters/2
-            hexVal = layer4.outputsValue
-            addr = layer4.startAddr
-            Value = [0] * int(numReg)
-
-            #write transaction information to file and print out to cmd
-            date = str(datetime.datetime.now()).split('.')[0]
-            s = "[%s] Write Registers IP: %s:%u --> %s:%u Memory Address: %d\n" % (date, IP_src, sport, IP_dst, dport, addr)
-            print(s)
-            lo_file.write(s)
-            
+            self.log("[%s] Write Registers IP: %s:%u --> %s:%u Memory Address: %d\n" % (date, IP_src, sport, IP_dst, dport, addr))
             # Attempt to decode values, sometimes fails due to incomplete packet.
-            for i in range(0,int(numReg)):
-                try:
-                    mypack = struct.pack('>HH',hexVal[i*2],hexVal[i*2+1])
-                    Value[i] = struct.unpack('>f',mypack)[0]
-                    #Value[i] = struct.unpack('!f', bytes.fromhex('{0:02x}'.format(hexVal[i*2]) + '{0:02x}'.format(hexVal[i*2+1])))[0]
-                except:
-                    pass
-            s = "Values: " + str(Value) + "\n"
-            print(s)
-            lo_file.write(s)
+            self.log("Values: " + str(decode_floats(pdu[6:6+pdu[5]], quantity // 2)) + "\n")
 
-            
-        if layer4.funcCode == 0x3:
+        if function == 0x3:
             # Request read registers
+            self.log("[%s] Read Registers ID: %u IP: %s:%u --> %s:%u Start Address: %d #Addresses: %d\n" % (date, Trans_ID, IP_src, sport, IP_dst, dport, addr, quantity // 2))
+            # Save the memory address, the response comes back on the same connection with the same transaction ID
+            self.remember((IP_src, sport, IP_dst, dport, Trans_ID), addr)
+
+    # Keep the address of a read request until its response, the dict stays in the order requests came in
+    def remember(self, key, addr):
+        now = time.monotonic()
+        self.pending.pop(key, None)
+        self.pending[key] = (addr, now)
+        while len(self.pending) > 0:
+            oldest = next(iter(self.pending))
+            if len(self.pending) <= PENDING_MAX and now - self.pending[oldest][1] <= PENDING_TIMEOUT:
+                break
+            del self.pending[oldest]
+
+    def response(self, IP_src, sport, IP_dst, dport, Trans_ID, unit, pdu):
+        if len(pdu) < 2 or pdu[0] != 0x3:
+            return
+        # Read registers response
+        pending = self.pending.pop((IP_dst, dport, IP_src, sport, Trans_ID), None)
+        if pending is None:
+            # probably the same request as the last one, esp on loopback
+            Register = self.Last_reg
+        else:
+            Register = pending[0]
+        self.Last_reg = Register
+        date = str(datetime.datetime.now()).split('.')[0]
+        self.log("[%s] Read Registers ID: %u IP: %s:%u --> %s:%u Memory Address: %d\n" % (date, Trans_ID, IP_src, sport, IP_dst, dport, Register))
+        # Try to decode and print 32bit floats
+        self.log("Values: " + str(decode_floats(pdu[2:2+pdu[1]], pdu[1] // 4)) + "\n")
 
-            layer1 = packet.getlayer(1)
-            layer2 = packet.getlayer(2)
-            layer3 = packet.getlayer(3)
-            
-            IP_src = layer1.src
-            IP_dst = layer1.dst
-            sport = layer2.sport
-            dport = layer2.dport
-
-            numReg = layer4.quantity/2
-            Trans_ID = layer3.transId
-            addr = layer4.startAddr
-
-            # print out info on request
-            date = str(datetime.datetime.now()).split('.')[0]
-            s = "[%s] Read Registers ID: %u IP: %s:%u --> %s:%u Start Address: %d #Addresses: %d\n" % (date,Trans_ID, IP_src, sport, IP_dst, dport, addr, numReg)
-            print(s)
-            lo_file.write(s)
-
-            # Save the transaction ID and memory address
-            # These are needed on the response packet side to know what address values came from
-            if Trans_ID not in ID:
-                ID.append(Trans_ID)
-                Address.append(addr)
-
-    if mb.ModbusADUResponse in packet:
-        # Packet is a modbus response
-        #packet.show()
-        global Last_reg
-        
-        layer4 = packet.getlayer(4)
-
-        if layer4.funcCode == 0x3:
-            #Read registers response
-
-            layer1 = packet.getlayer(1)
-            layer2 = packet.getlayer(2)
-            layer3 = packet.getlayer(3)
-            IP_src = layer1.src
-            IP_dst = layer1.dst
-            sport = layer2.sport
-            dport = layer2.dport
-
-            bytecount = layer4.byteCount/4
-            #print(bytecount)
-            hexVal = layer4.registerVal
-            Trans_ID = layer3.transId
-            
-            # Try to find transaction ID in ID list. If its not there,
-            # it was probably the last ID and mem address too, esp on loopback
-            # Hopefully wont be confused with a bunch of PLCs otherwise need to add
-            # filter on dst and src IPs.
-            if Trans_ID in ID:
-                idx = ID.index(Trans_ID)
-                Register = Address[idx]
-                del ID[idx]
-                del Address[idx]     #Don't want memory killing sized list
-                Last_reg = Register
-            else:
-                Register = Last_reg
-            Value = [0] * int(bytecount)
-            date = str(datetime.datetime.now()).split('.')[0]
-            s = "[%s] Read Registers ID: %u IP: %s:%u --> %s:%u Memory Address: %d\n" % (date, Trans_ID, IP_src, sport, IP_dst, dport, Register)
-            print(s)
-            #layer4.show()
-            lo_file.write(s)
-
-            # Try to decode and print 32bit floats
-            
-            for i in range(0,int(bytecount)):
-                try:
-                    mypack = struct.pack('>HH',hexVal[i*2],hexVal[i*2+1])
-                    Value[i] = struct.unpack('>f',mypack)[0]
-                except:
-                    pass
-            
-            s = "Values: " + str(Value) + "\n"
-            print(s)
-            lo_file.write(s)
-
-            
+    def __repr__(self):
+        return "Modbus_Log('{}','{}')".format(self.port,self.packets)
 
-def gotpacket_eth(packet):
-    #Same as gotpacket_lo but different logs to eth_log.txt
-    #check if packet is Modbus Request
-    if mb.ModbusADURequest in packet:
-        #packet.show()
-        # Get layer info to determine what function is called
-        layer4 = packet.getlayer(4)
-
-        if layer4.funcCode == 0x10:
-            # Write Register function code with values
+# Logs of each interface, made when the capture starts
+lo_log = None
+eth_log = None
 
-            layer1 = packet.getlayer(1)
-            layer2 = packet.getlayer(2)
-            layer3 = packet.getlayer(3)
-
-            # Collect packet info
-            IP_src = layer1.src
-            IP_dst = layer1.dst
-            sport = layer2.sport
-            dport = layer2.dport
-            
-            
-            numReg = layer4.quantityRegisters/2
-            hexVal = layer4.outputsValue
-            addr = layer4.startAddr
-            Value = [0] * int(numReg)
-
-            #write transaction information to file and print out to cmd
-            date = str(datetime.datetime.now()).split('.')[0]
-            s = "[%s] Write Registers IP: %s:%u --> %s:%u Memory Address: %d\n" % (date, IP_src, sport, IP_dst, dport, addr)
-            print(s)
-            eth_file.write(s)
-            
-            # Attempt to decode values, sometimes fails due to incomplete packet.
-            for i in range(0,int(numReg)):
-                try:
-                    mypack = struct.pack('>HH',hexVal[i*2],hexVal[i*2+1])
-                    Value[i] = struct.unpack('>f',mypack)[0]
-                    #Value[i] = struct.unpack('!f', bytes.fromhex('{0:02x}'.format(hexVal[i*2]) + '{0:02x}'.format(hexVal[i*2+1])))[0]
-                except:
-                    pass
-            s = "Values: " + str(Value) + "\n"
-            print(s)
-            eth_file.write(s)
-
-            
-        if layer4.funcCode == 0x3:
-            # Request read registers
+# Callbacks for scapy sniff when a packet is captured
+def gotpacket_lo(packet):
+    lo_log.packet(packet)
 
-            layer1 = packet.getlayer(1)
-            layer2 = packet.getlayer(2)
-            layer3 = packet.getlayer(3)
-            
-            IP_src = layer1.src
-            IP_dst = layer1.dst
-            sport = layer2.sport
-            dport = layer2.dport
-
-            numReg = layer4.quantity/2
-            Trans_ID = layer3.transId
-            addr = layer4.startAddr
-
-            # print out info on request
-            date = str(datetime.datetime.now()).split('.')[0]
-            s = "[%s] Read Registers ID: %u IP: %s:%u --> %s:%u Start Address: %d #Addresses: %d\n" % (date, Trans_ID, IP_src, sport, IP_dst, dport, addr, numReg)
-            print(s)
-            eth_file.write(s)
-
-            # Save the transaction ID and memory address
-            # These are needed on the response packet side to know what address values came from
-            if Trans_ID not in ID:
-                ID.append(Trans_ID)
-                Address.append(addr)
-
-    if mb.ModbusADUResponse in packet:
-        # Packet is a modbus response
-        #packet.show()
-        global Last_reg
-        
-        layer4 = packet.getlayer(4)
-
-        if layer4.funcCode == 0x3:
-            #Read registers response
-
-            layer1 = packet.getlayer(1)
-            layer2 = packet.getlayer(2)
-            layer3 = packet.getlayer(3)
-            IP_src = layer1.src
-            IP_dst = layer1.dst
-            sport = layer2.sport
-            dport = layer2.dport
-
-            bytecount = layer4.byteCount/4
-            #print(bytecount)
-            hexVal = layer4.registerVal
-            Trans_ID = layer3.transId
-            
-            # Try to find transaction ID in ID list. If its not there,
-            # it was probably the last ID and mem address too, esp on loopback
-            # Hopefully wont be confused with a bunch of PLCs otherwise need to add
-            # filter on dst and src IPs.
-            if Trans_ID in ID:
-                idx = ID.index(Trans_ID)
-                Register = Address[idx]
-                del ID[idx]
-                del Address[idx]     #Don't want memory killing sized list
-                Last_reg = Register
-            else:
-                Register = Last_reg
-            Value = [0] * int(bytecount)
-            date = str(datetime.datetime.now()).split('.')[0]
-            s = "[%s] Read Registers ID: %u IP: %s:%u --> %s:%u Memory Address: %d\n" % (date, Trans_ID, IP_src, sport, IP_dst, dport, Register)
-            print(s)
-            #layer4.show()
-            eth_file.write(s)
-
-            # Try to decode and print 32bit floats
-            
-            for i in range(0,int(bytecount)):
-                try:
-                    mypack = struct.pack('>HH',hexVal[i*2],hexVal[i*2+1])
-                    Value[i] = struct.unpack('>f',mypack)[0]
-                except:
-                    pass
-            
-            s = "Values: " + str(Value) + "\n"
-            print(s)
-            eth_file.write(s)
+def gotpacket_eth(packet):
+    #Same as gotpacket_lo but logs to eth_log.txt
+    eth_log.packet(packet)
+
+# Capture Modbus frames from an interface with a raw socket, Linux only
+# skip_outgoing drops the copy of each packet loopback sees as it is sent, so it is only logged once
+def raw_capture(iface, log, skip_outgoing=False):
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    sock.bind((iface, ETH_P_ALL))
+    link = HARDWARE_LINKS.get(sock.getsockname()[3])
+    if link is None:
+        sock.close()
+        raise OSError('%s has a link layer Capture_Modbus does not know' % iface)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CAPTURE_BUFFER)
+        if link == 'ether':
+            # the kernel copies the filter, the buffer only needs to last for the call
+            code = port_filter(log.port)
+            program = ctypes.create_string_buffer(b''.join(struct.pack('HBBI', *op) for op in code))
+            sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack('HL', len(code), ctypes.addressof(program)))
+    except OSError:
+        # without the filter every packet is read and parse_frame drops the ones that are not Modbus
+        pass
+    buffer = bytearray(65536)
+    view = memoryview(buffer)
+    while True:
+        (size, address) = sock.recvfrom_into(buffer)
+        if skip_outgoing and address[2] == socket.PACKET_OUTGOING:
+            continue
+        log.frame(view[:size], link)
+
+# Capture from an interface, with a raw socket where there are raw sockets, scapy otherwise
+def capture(iface, log, callback, loopback=False, use_scapy=False):
+    if not use_scapy and hasattr(socket, 'AF_PACKET'):
+        try:
+            raw_capture(iface, log, loopback)
+            return
+        except OSError as error:
+            print("Raw capture on %s failed: %s" % (iface, error))
+    if sniff is None:
+        print("Capture on %s needs scapy, pip3 install scapy" % iface)
+        return
+    sniff(iface=iface, filter="port %u" % log.port, prn=callback, store=False)
 
 # Set up threads for each sniff call
 # enable keyboard interupts to stop and close files
 def lo_thread():
     try:
-        sniff(iface=interface[0], filter="port 502", prn=gotpacket_lo)
+        capture(interface[0], lo_log, gotpacket_lo, True, args.scapy)
     except KeyboardInterrupt:
-        lo_file.close()
+        lo_log.file.close()
 
 def eth_thread():
     try:
-        sniff(iface=interface[1], filter="port 502", prn=gotpacket_eth)
+        capture(interface[1], eth_log, gotpacket_eth, False, args.scapy)
     except KeyboardInterrupt:
-        eth_file.close()
+        eth_log.file.close()
+
+# Network adaptor names
+def interfaces():
+    if netifaces is not None:
+        return netifaces.interfaces()
+    return [name for index, name in socket.if_nameindex()]
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Capture and log Modbus traffic')
+    parser.add_argument('--scapy', action='store_true', help='Capture with scapy instead of raw sockets')
+    parser.add_argument('--quiet', action='store_true', help='Only write the logs, do not print every packet')
+    parser.add_argument('--port', type=int, default=MODBUS_PORT, help='Modbus/TCP port (default 502)')
+    args = parser.parse_args()
+
+    # Open files to log info
+    lo_log = Modbus_Log(open('lo_log.txt','w'), args.port, not args.quiet)
+    eth_log = Modbus_Log(open('eth_log.txt','w'), args.port, not args.quiet)
+
     #scan for network adaptors
-    faces = netifaces.interfaces()
+    faces = interfaces()
     print("Network interfaces: " + str(faces))
     interface = [None, None]
     # See if any network adaptor names match what we expect for loopback and ethernet
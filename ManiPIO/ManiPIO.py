@@ -23,441 +23,3363 @@
 # the MB_PLC class formalizes how these functions need to work. This should allow flexibilty to add new ICS protocols, however the script 
 # constructor that reads input files is a little more rigid and only uses the modbus PLC class as of now. Minor modifications to the script reader
 # would allow more ICS classes by adding a PLC 'type' option.
+# MB_PLC objects at the same address share one connection, .connect() borrows it and .close() gives it back.
 # 
 # ManiPIO is dependent on pymodbus.
 # pip install  -U pymodbus
 # 
 from pymodbus.client import ModbusTcpClient as ModbusClient
-from pymodbus.payload import BinaryPayloadBuilder, BinaryPayloadDecoder
 from pymodbus.constants import Endian
+from pymodbus.register_read_message import ReadWriteMultipleRegistersRequest
 import sys
+import struct
+import array
+import heapq
+import bisect
+import itertools
+import math
+import random
+import re
+import os
+import json
+import csv
+import hashlib
+from types import MappingProxyType
 import signal
 import time
 import threading
+import socket
+import ipaddress
 import argparse
+import asyncio
+import multiprocessing
 
-#Define class for modbus PLCs
-class MB_PLC:
+#NumPy is optional, it is only used to encode and decode whole arrays of values at once
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-    def __init__(self, IP, Port):
-        self.ip = IP
-        self.Mem_default = '32_float'
-        self.port = Port
-        self.client = ModbusClient(IP, port=self.port)
-        self.byteOrder = Endian.BIG
-        self.wordOrder = Endian.BIG
-        self.mlock = threading.Lock()
+#Modbus limits on the number of registers in a single request
+MAX_READ_REGS = 125
+MAX_WRITE_REGS = 123
+#and on the number of coils
+MAX_READ_COILS = 2000
+MAX_WRITE_COILS = 1968
+#Number of unused registers a read may span to join two addresses into one request
+READ_GAP = 8
+#Seconds between reconnect attempts to a PLC that is down
+RECONNECT_INTERVAL = 1.0
 
-    #Define how to connect with PLC
-    def connect(self):
-        client = self.client
-        if not client.connect():
-            print("Failed to connect to %s\n" % self.ip)
+#Find the number of 16 bit registers a memory format uses
+def reg_count(formating):
+    bits = int(formating.split('_')[0])
+    if bits >= 16:
+        return int(bits/16)
+    return 1
 
-    #Define how to read values from PLCs
-    def read(self, mem_addr, formating=None):
-        #define decode options
-        def float_64(decode):
-            return decode.decode_64bit_float()
-        def float_32(decode):
-            return decode.decode_32bit_float()
-        def float_16(decode):
-            return decode.decode_16bit_float()
-        def int_64(decode):
-            return decode.decode_64bit_int()
-        def int_32(decode):
-            return decode.decode_32bit_int()
-        def int_16(decode):
-            return decode.decode_16bit_int()
-        def uint_64(decode):
-            return decode.decode_64bit_uint()
-        def uint_32(decode):
-            return decode.decode_32bit_uint()
-        def uint_16(decode):
-            return decode.decode_16bit_uint()
-
-        #Check formatting and split off bit count
-        if formating is None:
-            formating = self.Mem_default
-        Format = formating.split('_')
+#A run of registers that goes out in a single request
+#items hold (index in the planned address list, register offset in block, format)
+#coils blocks count coils instead of registers
+class IO_Block:
+    def __init__(self, start, coils=False):
+        self.start = start
+        self.count = 0
+        self.items = []
+        self.coils = coils
 
-        if int(Format[0]) >= 16:  #determine number of registers to read
-            count = int(int(Format[0])/16)
-        else:
-            count = 1
+    def __repr__(self):
+        return "IO_Block('{}','{}')".format(self.start,self.count)
 
-        client = self.client #define client
+#Group memory addresses into the fewest blocks that fit within limit registers
+#gap is how many unused registers may sit between two addresses in one block
+#Coils are their own address space, they get blocks of their own of at most coil_limit coils
+def plan_blocks(mem_addr, mem_format, limit, gap=0, coil_limit=None):
+    if coil_limit is None:
+        coil_limit = limit
+    #sort by address, keeping the original index so values can be matched back up
+    order = sorted(range(len(mem_addr)), key=lambda i: (mem_format[i] == COIL_FORMAT, int(mem_addr[i])))
 
-        #Need to used mutex's to lock read/writes
-        #This is because conflicts were found to happen with multiple Events using same PLC
-        self.mlock.acquire()
-        try:
-            results = client.read_holding_registers(mem_addr,count,unit=1) #read client PLC
-        except:
-            results = None
-        self.mlock.release()
+    blocks = []
+    block = None
+    for i in order:
+        addr = int(mem_addr[i])
+        count = reg_count(mem_format[i])
+        coils = mem_format[i] == COIL_FORMAT
+        if block is not None and block.coils == coils:
+            end = max(block.start + block.count, addr + count)
+            if addr <= block.start + block.count + gap and end - block.start <= (coil_limit if coils else limit):
+                block.count = end - block.start
+                block.items.append((i, addr - block.start, mem_format[i]))
+                continue
+        block = IO_Block(addr, coils)
+        block.count = count
+        block.items.append((i, 0, mem_format[i]))
+        blocks.append(block)
 
-        #Set up decoder
-        decoder = BinaryPayloadDecoder.fromRegisters(results.registers, byteorder=self.byteOrder, wordorder=self.wordOrder)
+    #write items in their original order so overlapping addresses resolve the same as single writes
+    for block in blocks:
+        block.items.sort()
+    return blocks
 
-        #decoder dictionary
-        Decode_dict = { '16_float':float_16, '32_float':float_32, '64_float':float_64, '16_int':int_16, '32_int':int_32, '64_int':int_64, '16_uint':uint_16, '32_uint':uint_32, '64_uint':uint_64 }
+#Number of memory addresses in a plan of blocks
+def plan_size(blocks):
+    N = 0
+    for block in blocks:
+        N = N + len(block.items)
+    return N
 
-        return Decode_dict[formating](decoder)
-        #return decoded value
+#struct codes for each memory format
+FORMAT_CODES = { '16_float':'e', '32_float':'f', '64_float':'d', '16_int':'h', '32_int':'i', '64_int':'q', '16_uint':'H', '32_uint':'I', '64_uint':'Q' }
+#memory format of a single coil, it is read and written with the coil functions instead of the register ones
+COIL_FORMAT = '1_coil'
+MEM_FORMATS = list(FORMAT_CODES) + [COIL_FORMAT]
 
-    #define how to read coils from PLC
-    def readcoil(self, mem_addr):
-        client = self.client
-        self.mlock.acquire()
-        result = client.read_coils(mem_addr,1)
-        self.mlock.release()
-        return result.bits[0]
+#Compiled encoder/decoder for one memory format, byte order and word order
+#This packs the same register layout as pymodbus BinaryPayloadBuilder/Decoder
+class Codec:
+    def __init__(self, formating, byteOrder, wordOrder):
+        code = FORMAT_CODES[formating]
+        self.format = formating
+        self.count = reg_count(formating)
+        self.integer = code not in 'efd'
 
-    #Define how to write to coils
-    def writecoil(self, mem_addr, value):
-        client = self.client
-        self.mlock.acquire()
-        client.write_coil(mem_addr, value)
-        self.mlock.release()
+        #The word order sets the endianness of the packed value, and when the byte order
+        #differs from the word order the bytes inside each register are swapped
+        if wordOrder == Endian.LITTLE:
+            value_order = '<'
+        else:
+            value_order = '>'
+        if byteOrder == wordOrder:
+            reg_order = '>'
+        else:
+            reg_order = '<'
 
-    #define how to write to registers
-    def write(self, mem_addr, value, formating=None):
-        #define encode options
-        def float_64(build, value):
-            build.add_64bit_float(value)
-        def float_32(build, value):
-            build.add_32bit_float(value)
-        def float_16(build, value):
-            build.add_16bit_float(value)
-        def int_16(build, value):
-            build.add_16bit_int(value)
-        def int_32(build, value):
-            build.add_32bit_int(value)
-        def int_64(build, value):
-            build.add_64bit_int(value)
-        def uint_16(build, value):
-            build.add_16bit_uint(value)
-        def uint_32(build, value):
-            build.add_32bit_uint(value)
-        def uint_64(build, value):
-            build.add_64bit_uint(value)
-
-        #Catch default format conditions and split bits value to determine register write count
-        if formating is None:
-            formating = self.Mem_default
-        Format = formating.split('_')
+        self.value = struct.Struct(value_order + code)
+        self.regs = struct.Struct(reg_order + 'H'*self.count)
+        self.np_value = value_order + code
+        self.np_regs = reg_order + 'u2'
 
+    #Encode one value into a list of registers
+    def encode(self, value):
         #Catch incorrect formating of ints
-        if Format[1] == 'int' or Format[1] == 'uint':
-            if type(value) is not int:
-                value = int(value)
+        if self.integer and type(value) is not int:
+            value = int(value)
+        return list(self.regs.unpack(self.value.pack(value)))
 
+    #Decode a list of registers into one value
+    def decode(self, registers):
+        return self.value.unpack(self.regs.pack(*registers))[0]
 
-        if int(Format[0]) >= 16:  #determine number of registers to write
-            count = int(Format[0])/16
-        else:
-            count = 1
+    #Encode an array of values into one flat array of registers
+    def encode_array(self, values):
+        if np is None:
+            registers = []
+            for value in values:
+                registers.extend(self.encode(value))
+            return registers
+        values = np.ascontiguousarray(values, dtype=self.np_value)
+        return values.view(self.np_regs).astype(np.uint16)
 
-        client = self.client #define client
+    #Decode a flat array of registers into an array of values
+    def decode_array(self, registers):
+        if np is None:
+            return [self.decode(registers[i:i+self.count]) for i in range(0, len(registers), self.count)]
+        registers = np.ascontiguousarray(registers, dtype=np.uint16).astype(self.np_regs)
+        return registers.view(self.np_value)
 
-        #start builder for writng to registers
-        builder = BinaryPayloadBuilder(byteorder=self.byteOrder, wordorder=self.wordOrder)
+    def __repr__(self):
+        return "Codec('{}')".format(self.format)
 
-        #encoder dictionary
-        Encode_dict = { '16_float':float_16, '32_float':float_32, '64_float':float_64, '16_int':int_16, '32_int':int_32, '64_int':int_64, '16_uint':uint_16, '32_uint':uint_32, '64_uint':uint_64 }
+#Codec for coils, each value is one coil that is on for any value but 0
+#Values are kept as 0 or 1 so coil payloads compare and shadow the same as register payloads
+class Coil_Codec:
+    def __init__(self):
+        self.format = COIL_FORMAT
+        self.count = 1
+        self.integer = True
 
-        #Encode value with builder
-        Encode_dict[formating](builder, value)
+    def encode(self, value):
+        return [1 if value else 0]
 
-        payload = builder.to_registers()
-        
-        #Lock out read/write operations to stop conflicts
-        self.mlock.acquire()
-        try:
-            Check_write = client.write_registers(mem_addr, payload)
-        except:
-            print("Write Check has failed!!\n")
-            ### Add error checking ###
-            pass
+    def decode(self, registers):
+        return 1 if registers[0] else 0
 
-        while Check_write.isError():
-            try:
-                Check_write = client.write_registers(mem_addr, payload)
-            except:
-                pass
-            
-        self.mlock.release()
+    def encode_array(self, values):
+        if np is None:
+            return [1 if value else 0 for value in values]
+        return (np.asarray(values) != 0).astype(np.uint16)
 
-    #define how to close connection to PLC
-    def close(self):
-        client = self.client
-        client.close()
+    def decode_array(self, registers):
+        if np is None:
+            return [1 if register else 0 for register in registers]
+        return (np.asarray(registers) != 0).astype(np.int64)
 
     def __repr__(self):
-        return "MB_PLC('{}','{}')".format(self.ip,self.port)
+        return "Coil_Codec('{}')".format(self.format)
 
-#Begin Event class
-class Event:
-    def __init__(self, PLC):
-        self.plc = PLC
-        self.mem_addr = []
-        self.mem_format = []
-        self.Event = 'single'
-        self.timing = 0
-        self.timing_units = 'sec'
-        self.time_delay = 0
-        self.values = []
-        self.persist = False
-        self.thread = None
-        self.thread_stop = False
-    
-    def add_mem_addr(self, addr=None, types=None): #add memory addresses to roster with memory format
-        #Figure out and set memory formats
-        if types is None and type(addr) is list:
-            types = [self.plc.Mem_default for i in range(len(addr))]
-        if types is None and type(addr) is not list:
-            types = self.plc.Mem_default
-        if addr is None:
-            addr = []
+#Codecs are compiled once per (format, byteOrder, wordOrder) and shared by all PLCs
+CODECS = {}
 
-        #Write new memory and formats to self if in list format
-        if type(addr) is list:
-            for i in range(len(addr)):
-                self.mem_addr.append(addr[i])
-                self.mem_format.append(types[i])
-        
-        #write new memory if single value
-        if type(addr) is int or type(addr) is str:
-            self.mem_addr.append(addr)
-            self.mem_format.append(types)
+def get_codec(formating, byteOrder, wordOrder):
+    key = (formating, byteOrder, wordOrder)
+    codec = CODECS.get(key)
+    if codec is None:
+        if formating == COIL_FORMAT:
+            codec = Coil_Codec()
+        else:
+            codec = Codec(formating, byteOrder, wordOrder)
+        CODECS[key] = codec
+    return codec
 
-    #Define method to change all options in Event
-    def set_Event(self, **kwargs):
-        #uses dictionary to parse kargs
-        options = {
-            'mem_addr':self.mem_addr,
-            'mem_format':self.mem_format,
-            'Event':self.Event,
-            'timing':self.timing,
-            'timing_units':self.timing_units,
-            'time_delay':self.time_delay,
-            'values':self.values,
-            'persist':self.persist }
-        options.update(kwargs)
+#Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
 
-        #setting memory format if none exist
-        if len(options['mem_format'])==0:
-            self.mem_format = [self.plc.Mem_default for i in range(len(options['mem_addr']))]
+#Latency histogram with fixed buckets, percentiles are interpolated inside a bucket
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0 for i in range(len(bounds) + 1)]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
 
-        elif len(options['mem_format']) != len(options['mem_addr']): #setting memory format if mismatch of input lengths
-            self.mem_format.append([self.mem_format[-1] for i in range(len(options['mem_addr'])-len(options['mem_format']))])
-            print('Wrong number of format elements, rest set to last format')
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count = self.count + 1
+        self.sum = self.sum + value
+        if value > self.max:
+            self.max = value
 
-        else:
-            self.mem_format = options['mem_format']
+    def percentile(self, p):
+        rank = p/100.0*self.count
+        running = 0
+        for i in range(len(self.buckets)):
+            n = self.buckets[i]
+            if n > 0 and running + n >= rank:
+                low = self.bounds[i-1] if i > 0 else 0.0
+                high = min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+                return low + (high - low)*(rank - running)/n
+            running = running + n
+        return 0.0
 
-        #set options
-        self.mem_addr = options['mem_addr']
-        self.Event = options['Event']
-        self.timing = options['timing']
-        self.timing_units = options['timing_units']
-        self.time_delay = options['time_delay']
-        self.values = options['values']
-        self.persist = options['persist']
-        
-    #define 'single' type Event
-    def single(self):
-        #Error checking
-        Error_Check = True
-        if type(self.mem_addr) is list and len(self.mem_addr) == 0:
-            print('No memory address!')
-            Error_Check = False
-        if self.mem_addr == None:
-            print('No memory address!')
-            Error_Check = False
-        if type(self.time_delay) is list:
-            self.time_delay = self.time_delay[0]
-        if type(self.timing) is list:
-            timing = self.timing[0]
-        else:
-            timing = self.timing
+    def __repr__(self):
+        return "Histogram('{}')".format(self.count)
 
+#Counters and latency histograms for one PLC, Event or Trigger
+#kind and label name it in the Prometheus output, e.g. plc="127.0.0.1:502"
+class Metrics:
+    __slots__ = ('kind', 'label', 'lock', 'counters', 'histograms', 'started')
 
-        #time delay
-        if self.time_delay != 0:
-            time.sleep(self.time_delay)
+    def __init__(self, kind, label):
+        self.kind = kind
+        self.label = label
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.monotonic()
 
-        #connect to PLC
-        PLC = self.plc 
-        PLC.connect() 
-        
-        #Setup timing mechanism
-        time_end = time.time()
-        #check errors and start loop
-        if Error_Check:
-            while True:
-                #if timing is set, start interval mechanism
-                if self.timing != 0:
-                    time1 = 0
-                    while time1 < timing and self.thread_stop == False:
-                        time1 = time.time() - time_end
-                    
-                #loop to write values out to all memory addresses specified
-                for i in range(len(self.mem_addr)):
-                    if len(self.values) == 0:
-                        value = 0
-                    elif len(self.values)-1 < i:
-                        value = self.values[-1]
-                    else:
-                        value = self.values[i]
-                    
-                    PLC.write(self.mem_addr[i],value, self.mem_format[i])
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
 
-                #if this is not a persistant Event, break out of loop
-                if self.persist == False:
-                    break
-                time_end = time.time()
-        #close PLC connection
-        PLC.close()
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(seconds)
 
-    #setup 'ramp' type Event
-    def ramp(self):
+    #counters, rates per second since the start, and latency percentiles in seconds
+    def summary(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            summary = {'counts':dict(self.counters), 'per_second':{}, 'latency':{}}
+            for name in self.counters:
+                summary['per_second'][name] = self.counters[name]/elapsed
+            for name, histogram in self.histograms.items():
+                summary['latency'][name] = {'count':histogram.count, 'mean':histogram.sum/histogram.count, 'max':histogram.max,
+                    'p50':histogram.percentile(50), 'p90':histogram.percentile(90), 'p99':histogram.percentile(99)}
+        return summary
 
-        Error_Check = True
-        #check for invalid config
-        if type(self.mem_addr) is list and len(self.mem_addr) == 0:
-            print('No memory address!')
-            Error_Check = False
-        if self.mem_addr == None:
-            print('No memory address!')
-            Error_Check = False
-        if type(self.timing) is not list and self.timing == 0:
-            print('Timing for ramp cannot be 0')
-            Error_Check = False
-        if type(self.timing) is list:
-            for i in range(len(self.timing)):
-                if self.timing[i] == 0:
-                    print('Timing for ramp cannot be 0')
-                    Error_Check = False
-        if type(self.time_delay) is list:
-            self.time_delay = self.time_delay[0]
-        if type(self.values) is not list or len(self.values) < 2:
-            print('Not enough values to preform ramp!')
-            Error_Check = False
-        
-        #time delay
-        if int(self.time_delay) != 0:
-            time.sleep(self.time_delay)
-        
-        PLC = self.plc
-        PLC.connect()
+    def __repr__(self):
+        return "Metrics('{}','{}')".format(self.kind,self.label)
 
-        if Error_Check: #Check for errors
-            #begin persistance loop
-            while True:
-                #begin assembling ramp info
-                for i in range(len(self.values)-1):
-                    #checking for timing variable and conditioning for all possible variances
-                    if type(self.timing) is not list:
-                        dt = float(self.values[i+1] - self.values[i])/float(self.timing)
-                    elif len(self.timing) == 1:
-                        dt = float(self.values[i+1] - self.values[i])/float(self.timing[0])
-                    else:
-                        if (i+1) > len(self.timing):
-                            dt = float(self.values[i+1] - self.values[i])/float(self.timing[-1])
-                        else:
-                            dt = float(self.values[i+1] - self.values[i])/float(self.timing[i])
+#Every Metrics made in this process, rendered as Prometheus text or a JSON summary
+class Metrics_Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
 
-                    dV = float(self.values[i+1] - self.values[i])
-                    value = self.values[i]
-                    start_time = time.time()
-                    #begin ramp function
-                    while abs(dV) > abs((value - self.values[i])) and self.thread_stop == False:                        
-                        value = self.values[i] + dt*(time.time() - start_time)
-                        if abs(dV) < abs((value - self.values[i])):
-                            value = self.values[i+1]
-                        for n in range(len(self.mem_addr)):
-                            PLC.write(self.mem_addr[n],value, self.mem_format[n])
-                if self.persist == False:
-                    break
-        
-        
-        PLC.close()
+    def new(self, kind, label):
+        metrics = Metrics(kind, label)
+        with self.lock:
+            self.metrics.append(metrics)
+        return metrics
 
-    #Define how to run Event in seperate thread
-    def run(self):
-        Event_lib = {
-            'single':self.single,
-            'ramp':self.ramp
-        }
+    #Prometheus text exposition format
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        counters = {}
+        histograms = {}
+        for m in metrics:
+            with m.lock:
+                for name, value in m.counters.items():
+                    counters.setdefault('manipio_%s_%s_total' % (m.kind, name), []).append((m.kind, m.label, value))
+                for name, histogram in m.histograms.items():
+                    histograms.setdefault('manipio_%s_%s_seconds' % (m.kind, name), []).append((m.kind, m.label, list(histogram.buckets), histogram.sum, histogram.count))
 
-        thread = threading.Thread(target=Event_lib[self.Event])
-        thread.daemon = True
-        thread.start()
-        self.thread = thread
-    #Define how to stop Event thread
-    def stop(self):
-        self.persist = False
-        self.thread_stop = True
-        self.thread.join()
-    #wait for Event to finish
-    def wait(self):
-        self.thread.join()
+        lines = []
+        for family in sorted(counters):
+            lines.append('# TYPE %s counter' % family)
+            for kind, label, value in counters[family]:
+                lines.append('%s{%s="%s"} %s' % (family, kind, label, value))
+        for family in sorted(histograms):
+            lines.append('# TYPE %s histogram' % family)
+            for kind, label, buckets, total, count in histograms[family]:
+                running = 0
+                for i in range(len(LATENCY_BUCKETS)):
+                    running = running + buckets[i]
+                    lines.append('%s_bucket{%s="%s",le="%s"} %u' % (family, kind, label, LATENCY_BUCKETS[i], running))
+                lines.append('%s_bucket{%s="%s",le="+Inf"} %u' % (family, kind, label, count))
+                lines.append('%s_sum{%s="%s"} %.9f' % (family, kind, label, total))
+                lines.append('%s_count{%s="%s"} %u' % (family, kind, label, count))
+        return '\n'.join(lines) + '\n'
+
+    #summary of every PLC, Event and Trigger keyed by kind then label
+    def summary(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        summary = {'time':time.time(), 'plc':{}, 'event':{}, 'trigger':{}}
+        #objects that have done nothing, like ones another shard runs, are left out
+        for m in metrics:
+            if len(m.counters) > 0 or len(m.histograms) > 0:
+                summary.setdefault(m.kind, {})[m.label] = m.summary()
+        return summary
 
     def __repr__(self):
-        return "Event('{}')".format(self.plc)
+        return "Metrics_Registry('{}')".format(len(self.metrics))
 
-#define trigger class that will launch Event when conditions are met        
-class Trigger:
-    def __init__(self, Event):
-        self.plc = []
-        self.Event = Event
-        self.trigger_mem = []
-        self.mem_alloc = []
-        self.trigger_format = []
-        self.trigger_value = []
-        self.trigger_conditions = []
-        self.thread_stop = False
-        self.threaded = None
-    
-    #define method to set all trigger options
-    def set_trigger(self, **kwargs):
-        options = {
-            'plc':self.plc,
-            'Event':self.Event,
-            'mem_alloc':self.mem_alloc,
-            'trigger_mem':self.trigger_mem,
-            'trigger_format':self.trigger_format,
-            'trigger_value':self.trigger_value,
-            'trigger_conditions':self.trigger_conditions }
-        options.update(kwargs)
+METRICS = Metrics_Registry()
 
-        #memory format checking
-        if len(options['trigger_format'])==0:
-            if type(options['plc']) is list:
-                plc = options['plc'][-1]
+#Serve the metrics over HTTP, /metrics is Prometheus text and /summary is JSON
+#returns the server, it runs on a daemon thread until shutdown() is called
+def serve_metrics(port, host='127.0.0.1'):
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/summary'):
+                body = json.dumps(METRICS.summary(), indent=1)
+                content = 'application/json'
             else:
-                plc = options['plc']
-            self.trigger_mem = [plc.Mem_default for i in range(len(options['trigger_mem']))]
+                body = METRICS.render()
+                content = 'text/plain; version=0.0.4'
+            body = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
-        elif len(options['trigger_format']) != len(options['trigger_mem']):
-            self.trigger_mem.append([options['trigger_format'][-1] for i in range(len(options['trigger_mem'])-len(options['trigger_format']))])
-            print('Wrong number of format elements, rest set to last format')
+        #no per request logging
+        def log_message(self, *args):
+            pass
 
-        else:
-            self.trigger_mem.append(options['trigger_mem'])
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print('Metrics on http://%s:%u/metrics' % (host, port))
+    return server
 
-        self.plc = options['plc']
+#Append a JSON summary of the metrics to a file every interval seconds, and once more when stopped
+class Metrics_Writer:
+    def __init__(self, path, interval=10.0):
+        self.path = path
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self):
+        try:
+            FILE = open(self.path, 'a')
+            FILE.write(json.dumps(METRICS.summary()) + '\n')
+            FILE.close()
+        except OSError as error:
+            print('Could not write metrics to %s: %s' % (self.path, error))
+
+    def loop(self):
+        while not self.stopping.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.write()
+
+    def __repr__(self):
+        return "Metrics_Writer('{}','{}')".format(self.path,self.interval)
+
+#Start the metrics endpoint and summary file that are asked for
+#In a sharded run each shard adds its number to the port and to the end of the file name
+#returns the server and writer, give them to stop_metrics when done
+def start_metrics(port=None, path=None, interval=10.0, shard=None):
+    server = None
+    writer = None
+    if port is not None:
+        if shard is not None:
+            port = port + shard
+        try:
+            server = serve_metrics(port)
+        except OSError as error:
+            print('Could not serve metrics on port %u: %s' % (port, error))
+    if path is not None:
+        if shard is not None:
+            path = '%s.%u' % (path, shard)
+        writer = Metrics_Writer(path, interval)
+    return server, writer
+
+def stop_metrics(server, writer):
+    if writer is not None:
+        writer.stop()
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+#Binary recordings of the values written and the Trigger samples read
+#A header record then fixed width records: time since the recording started, PLC number, address, kind, format, register count and up to 4 raw registers
+#Records are RECORD.size bytes apart so a recording can be memory mapped and indexed directly, see load_recording
+RECORD = struct.Struct('<dHHBBBx4H')
+RECORD_HEADER = struct.Struct('<8sdHH4x')
+RECORD_MAGIC = b'MANIPIO1'
+RECORD_WRITE = 0
+RECORD_READ = 1
+#Seconds between flushes of a recording to disk
+RECORD_FLUSH = 1.0
+
+#Append-only recorder, the PLCs are numbered in the order they are first seen
+#Their addresses are kept in a JSON file next to the recording, path + '.json'
+class Recorder:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.plcs = []
+        self.numbers = {}
+        self.records = 0
+        start = time.time()
+        #an existing recording is appended to, keeping its start time and PLC numbers
+        if os.path.exists(path) and os.path.getsize(path) >= RECORD_HEADER.size:
+            start, self.plcs = recording_info(path)
+            self.numbers = {tuple(self.plcs[i]): i+1 for i in range(len(self.plcs))}
+            self.FILE = open(path, 'ab')
+            #drop a record cut short when the last run stopped
+            self.FILE.truncate(os.path.getsize(path) - (os.path.getsize(path) - RECORD_HEADER.size) % RECORD.size)
+        else:
+            self.FILE = open(path, 'wb')
+            self.FILE.write(RECORD_HEADER.pack(RECORD_MAGIC, start, RECORD.size, 1))
+        self.base = time.perf_counter() - (time.time() - start)
+        self.flushed = time.monotonic()
+
+    #number of a PLC address, saving the PLC list the first time one is seen
+    def number(self, PLC):
+        key = (PLC.ip, PLC.port, PLC.unit)
+        number = self.numbers.get(key)
+        if number is None:
+            self.plcs.append(list(key))
+            number = self.numbers[key] = len(self.plcs)
+            FILE = open(self.path + '.json', 'w')
+            json.dump({'plcs':self.plcs}, FILE)
+            FILE.close()
+        return number
+
+    #Record the values in a run of registers, split by the formats the PLC planned for them
+    #Registers with no planned format are recorded one at a time as 16_uint
+    def write(self, PLC, mem_addr, payload, coils=False):
+        now = time.perf_counter() - self.base
+        items = []
+        offset = 0
+        while offset < len(payload):
+            formating = PLC.formats.get((coils, mem_addr + offset), COIL_FORMAT if coils else '16_uint')
+            count = reg_count(formating)
+            if offset + count > len(payload):
+                formating = '16_uint'
+                count = 1
+            items.append((mem_addr + offset, formating, payload[offset:offset+count]))
+            offset = offset + count
+        self.add(PLC, now, RECORD_WRITE, items)
+
+    #Record the values read for one planned block
+    def read(self, PLC, block, registers):
+        now = time.perf_counter() - self.base
+        items = []
+        for idx, offset, formating in block.items:
+            count = reg_count(formating)
+            items.append((block.start + offset, formating, registers[offset:offset+count]))
+        self.add(PLC, now, RECORD_READ, items)
+
+    def add(self, PLC, now, kind, items):
+        with self.lock:
+            number = self.number(PLC)
+            for addr, formating, registers in items:
+                padded = [int(register) for register in registers] + [0, 0, 0]
+                self.FILE.write(RECORD.pack(now, number, addr, kind, MEM_FORMATS.index(formating), len(registers), *padded[:4]))
+            self.records = self.records + len(items)
+            if time.monotonic() - self.flushed > RECORD_FLUSH:
+                self.FILE.flush()
+                self.flushed = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self.FILE.close()
+
+    def __repr__(self):
+        return "Recorder('{}','{}')".format(self.path,self.records)
+
+#The recorder of this process, None when nothing is recorded
+RECORDER = None
+
+#Start recording to path, each shard records to its own file
+def start_recording(path=None, shard=None):
+    global RECORDER
+    if path is None:
+        return None
+    if shard is not None:
+        path = '%s.%u' % (path, shard)
+    RECORDER = Recorder(path)
+    return RECORDER
+
+def stop_recording(recorder):
+    global RECORDER
+    if recorder is not None:
+        if RECORDER is recorder:
+            RECORDER = None
+        recorder.close()
+        print('Recorded %u values to %s' % (recorder.records, recorder.path))
+
+#Start time and PLC list of a recording, raises ValueError if it is not one
+def recording_info(path):
+    FILE = open(path, 'rb')
+    header = FILE.read(RECORD_HEADER.size)
+    FILE.close()
+    if len(header) < RECORD_HEADER.size:
+        raise ValueError('%s is not a ManiPIO recording' % path)
+    magic, start, size, version = RECORD_HEADER.unpack(header)
+    if magic != RECORD_MAGIC or size != RECORD.size:
+        raise ValueError('%s is not a ManiPIO recording' % path)
+    plcs = []
+    if os.path.exists(path + '.json'):
+        FILE = open(path + '.json', 'r')
+        plcs = json.load(FILE)['plcs']
+        FILE.close()
+    return start, plcs
+
+#NumPy layout of a record, the padding byte is left out
+if np is not None:
+    RECORD_DTYPE = np.dtype({'names':['time', 'plc', 'address', 'kind', 'format', 'count', 'registers'],
+        'formats':['<f8', '<u2', '<u2', 'u1', 'u1', 'u1', ('<u2', 4)], 'offsets':[0, 8, 10, 12, 13, 14, 16], 'itemsize':RECORD.size})
+
+#Load a recording, returns (start time, PLC list, records)
+#With NumPy the records are a read only memory map with RECORD_DTYPE fields, without it a list of
+#(time, plc, address, kind, format, count, registers) tuples
+def load_recording(path):
+    start, plcs = recording_info(path)
+    N = (os.path.getsize(path) - RECORD_HEADER.size) // RECORD.size
+    if np is not None:
+        if N == 0:
+            return start, plcs, np.zeros(0, dtype=RECORD_DTYPE)
+        return start, plcs, np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=RECORD_HEADER.size, shape=(N,))
+    FILE = open(path, 'rb')
+    FILE.seek(RECORD_HEADER.size)
+    data = FILE.read(N * RECORD.size)
+    FILE.close()
+    return start, plcs, [row[:6] + (row[6:],) for row in RECORD.iter_unpack(data)]
+
+#Sleep until a perf_counter deadline, finishing the last couple of milliseconds without sleeping for accuracy
+#stop is checked at least every 0.1 seconds, returns False if it turned true first
+def wait_until(deadline, stop=None):
+    while stop is None or not stop():
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return True
+        if remaining > 0.002:
+            time.sleep(remaining - 0.002 if stop is None else min(remaining - 0.002, 0.1))
+        else:
+            time.sleep(0)
+    return False
+
+#Replay the writes of a recording at speed times the pace they were recorded at
+#targets maps recorded PLC numbers to (ip, port, unit) to send their writes somewhere else, the rest go where they were recorded
+#Values written together are written together again, as contiguous runs of registers or coils
+#returns the replay timing stats
+def replay(path, speed=1.0, targets={}):
+    start, plcs, records = load_recording(path)
+    if np is not None:
+        records = records[records['kind'] == RECORD_WRITE].tolist()
+    else:
+        records = [row for row in records if row[3] == RECORD_WRITE]
+    records.sort(key=lambda row: row[0])
+
+    PLCS = {}
+    for n in range(1, len(plcs)+1):
+        ip, port, unit = targets.get(n, plcs[n-1])
+        PLCS[n] = MB_PLC(ip, port, unit)
+        PLCS[n].connect()
+
+    #group records written at the same time to the same PLC into runs of contiguous addresses
+    batches = []
+    for row in records:
+        t, number, addr, kind, formating, count, registers = row
+        coils = MEM_FORMATS[formating] == COIL_FORMAT
+        if len(batches) == 0 or batches[-1][0] != t or batches[-1][1] != number:
+            batches.append((t, number, []))
+        runs = batches[-1][2]
+        if len(runs) > 0 and runs[-1][0] == coils and runs[-1][1] + len(runs[-1][2]) == addr:
+            runs[-1][2].extend(registers[:count])
+        else:
+            runs.append((coils, addr, list(registers[:count])))
+
+    writes = 0
+    error_total = 0.0
+    error_max = 0.0
+    if len(batches) > 0:
+        base = time.perf_counter() - batches[0][0]/speed
+    for t, number, runs in batches:
+        deadline = base + t/speed
+        wait_until(deadline)
+        error = time.perf_counter() - deadline
+        error_total = error_total + error
+        error_max = max(error_max, error)
+        for coils, addr, registers in runs:
+            PLCS[number].write_registers(addr, registers, coils=coils)
+            writes = writes + 1
+
+    for PLC in PLCS.values():
+        PLC.close()
+    stats = {'batches':len(batches), 'writes':writes, 'speed':speed, 'error_mean':error_total/max(len(batches), 1), 'error_max':error_max}
+    print('Replayed %u writes from %s at %gx, timing error mean %.6f s max %.6f s' % (writes, path, speed, stats['error_mean'], error_max))
+    return stats
+
+#Default number of requests a pipelined connection keeps in flight
+PIPELINE_WINDOW = 8
+#Seconds a pipelined request waits for its response
+PIPELINE_TIMEOUT = 3.0
+
+#Response to a pipelined request, it answers the same way the pymodbus responses MB_PLC uses do
+#registers are filled for register reads, bits for coil reads
+class Pipeline_Response:
+    def __init__(self, function, pdu):
+        self.function_code = function
+        self.registers = []
+        self.bits = []
+        self.error = None
+        if len(pdu) < 2 or pdu[0] & 0x80:
+            self.error = 'exception code %u' % pdu[1] if len(pdu) > 1 else 'empty response'
+        elif function in (3, 23):
+            self.registers = list(struct.unpack_from('>%uH' % (pdu[1] // 2), pdu, 2))
+        elif function == 1:
+            self.bits = [bool(pdu[2 + i // 8] >> (i % 8) & 1) for i in range(pdu[1] * 8)]
+
+    def isError(self):
+        return self.error is not None
+
+    def __str__(self):
+        return 'Modbus function %u error: %s' % (self.function_code, self.error)
+
+    def __repr__(self):
+        return "Pipeline_Response('{}','{}')".format(self.function_code,self.error)
+
+#One request in flight on a pipelined connection, result() waits for its response
+class Pipeline_Request:
+    def __init__(self, function):
+        self.function = function
+        self.done = threading.Event()
+        self.pdu = None
+        self.error = None
+        self.sent = time.perf_counter()
+        self.rtt = None
+
+    def finish(self, pdu=None, error=None):
+        self.pdu = pdu
+        self.error = error
+        self.rtt = time.perf_counter() - self.sent
+        self.done.set()
+
+    #returns the Pipeline_Response, raises if the connection dropped or the response did not come in time
+    def result(self, timeout=PIPELINE_TIMEOUT):
+        if not self.done.wait(timeout):
+            raise TimeoutError('no response in %.1f seconds' % timeout)
+        if self.error is not None:
+            raise self.error
+        return Pipeline_Response(self.function, self.pdu)
+
+    def __repr__(self):
+        return "Pipeline_Request('{}','{}')".format(self.function,self.done.is_set())
+
+#Modbus/TCP client that keeps up to window requests in flight on one socket
+#Responses are matched to requests by transaction ID, so threads share the socket without waiting on each other
+#The pymodbus sync client sends one request and waits for its answer, so it can not do this
+class Pipeline_Client:
+    def __init__(self, IP, Port, window=PIPELINE_WINDOW, timeout=PIPELINE_TIMEOUT):
+        self.host = IP
+        self.port = Port
+        self.window = window
+        self.timeout = timeout
+        self.slots = threading.Semaphore(window)
+        self.send_lock = threading.Lock()
+        self.plock = threading.Lock()
+        self.pending = {}
+        self.transactions = itertools.count(1)
+        self.sock = None
+
+    def connect(self):
+        self.close()
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError:
+            return False
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        threading.Thread(target=self.receive, args=(sock,), daemon=True).start()
+        return True
+
+    def is_socket_open(self):
+        return self.sock is not None
+
+    #close the socket, requests still in flight fail
+    def close(self):
+        sock = self.sock
+        self.sock = None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        with self.plock:
+            pending = self.pending
+            self.pending = {}
+        for request in pending.values():
+            request.finish(error=ConnectionError('connection to %s closed' % self.host))
+            self.slots.release()
+
+    #Send a request without waiting for the response, blocks while window requests are already in flight
+    #returns the Pipeline_Request to wait on
+    def submit(self, unit, function, data):
+        request = Pipeline_Request(function)
+        self.slots.acquire()
+        with self.plock:
+            #transaction IDs are 16 bits, skip any still in flight after wrapping
+            tid = next(self.transactions) & 0xFFFF
+            while tid in self.pending:
+                tid = next(self.transactions) & 0xFFFF
+            self.pending[tid] = request
+        frame = struct.pack('>HHHBB', tid, 0, len(data) + 2, unit, function) + data
+        sock = self.sock
+        try:
+            if sock is None:
+                raise ConnectionError('not connected to %s' % self.host)
+            with self.send_lock:
+                sock.sendall(frame)
+        except OSError as error:
+            self.complete(tid, error=error)
+        return request
+
+    #Hand a response to the request waiting on its transaction ID
+    #Late responses to requests that already failed are dropped
+    def complete(self, tid, pdu=None, error=None):
+        with self.plock:
+            request = self.pending.pop(tid, None)
+        if request is not None:
+            request.finish(pdu, error)
+            self.slots.release()
+
+    #Receiver thread, splits the stream into MBAP frames until the socket closes
+    def receive(self, sock):
+        buffer = bytearray()
+        while True:
+            try:
+                chunk = sock.recv(65536)
+            except OSError:
+                break
+            if not chunk:
+                break
+            buffer += chunk
+            while len(buffer) >= 7:
+                tid, pid, length = struct.unpack_from('>HHH', buffer)
+                if len(buffer) < 6 + length:
+                    break
+                self.complete(tid, bytes(buffer[7:6+length]))
+                del buffer[:6+length]
+        if self.sock is sock:
+            self.close()
+
+    #wait for a request, failing it if the response does not come in time
+    def wait(self, request):
+        try:
+            return request.result(self.timeout)
+        except TimeoutError:
+            with self.plock:
+                tid = [tid for tid in self.pending if self.pending[tid] is request]
+            for key in tid:
+                self.complete(key, error=TimeoutError('no response from %s' % self.host))
+            raise
+
+    #Requests in the same form the pymodbus client takes them
+    def read_holding_registers(self, address, count=1, slave=1):
+        return self.wait(self.submit(slave, 3, struct.pack('>HH', address, count)))
+
+    def write_registers(self, address, values, slave=1):
+        return self.wait(self.submit_write(address, values, slave))
+
+    def read_coils(self, address, count=1, slave=1):
+        return self.wait(self.submit(slave, 1, struct.pack('>HH', address, count)))
+
+    def write_coil(self, address, value, slave=1):
+        return self.wait(self.submit(slave, 5, struct.pack('>HH', address, 0xFF00 if value else 0)))
+
+    def write_coils(self, address, values, slave=1):
+        return self.wait(self.submit_write_coils(address, values, slave))
+
+    def readwrite_registers(self, read_address=0, read_count=0, write_address=0, values=(), slave=1):
+        data = struct.pack('>HHHHB%uH' % len(values), read_address, read_count, write_address, len(values), 2 * len(values), *values)
+        return self.wait(self.submit(slave, 23, data))
+
+    def submit_read(self, address, count=1, slave=1):
+        return self.submit(slave, 3, struct.pack('>HH', address, count))
+
+    def submit_read_coils(self, address, count=1, slave=1):
+        return self.submit(slave, 1, struct.pack('>HH', address, count))
+
+    def submit_write(self, address, values, slave=1):
+        return self.submit(slave, 16, struct.pack('>HHB%uH' % len(values), address, len(values), 2 * len(values), *values))
+
+    #coils are packed 8 to a byte, the first coil in the lowest bit
+    def submit_write_coils(self, address, values, slave=1):
+        packed = bytearray((len(values) + 7) // 8)
+        for i in range(len(values)):
+            if values[i]:
+                packed[i // 8] |= 1 << (i % 8)
+        return self.submit(slave, 15, struct.pack('>HHB', address, len(values), len(packed)) + bytes(packed))
+
+    def __repr__(self):
+        return "Pipeline_Client('{}','{}','{}')".format(self.host,self.port,self.window)
+
+#Read/write multiple registers request (function 23)
+#pymodbus renamed the readwrite_registers arguments between 3.x releases, the request takes the same ones in all of them
+def readwrite_request(read_address, read_count, write_address, values, unit):
+    return ReadWriteMultipleRegistersRequest(read_address=read_address, read_count=read_count, write_address=write_address,
+        write_registers=list(values), unit=unit, slave=unit)
+
+#Stands in for the request lock of a pipelined connection, its requests do not need to wait for each other
+class No_Lock:
+    def acquire(self, blocking=True, timeout=-1):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return True
+
+    def __exit__(self, *args):
+        return False
+
+#Shared connection to one PLC address (ip, port)
+#Events and Triggers borrow it, and the last one to give it back closes the socket
+#PLCs behind a gateway at the same address share it too, each request carries its own unit ID
+class Connection:
+    def __init__(self, IP, Port):
+        self.key = (IP, Port)
+        self.client = ModbusClient(IP, port=Port) if SIMULATOR is None else SIMULATOR.client(IP, Port)
+        #mlock guards reconnects, request_lock is held for each request and is the same lock unless pipelined
+        self.mlock = threading.Lock()
+        self.request_lock = self.mlock
+        self.window = 0
+        self.rlock = threading.Lock()
+        self.refs = 0
+        self.healthy = False
+        self.next_try = 0
+        self.retry_interval = RECONNECT_INTERVAL
+        #circuit breaker state, failed write calls in a row and when the circuit closes again
+        self.failures = 0
+        self.open_until = 0
+        #shadow of the registers last written and confirmed, (unit, coils, register) -> (value, time written)
+        self.shadow = {}
+        self.slock = threading.Lock()
+        self.metrics = {}
+
+    #Metrics of one unit at this address, unit 1 is labelled by the address alone
+    def unit_metrics(self, unit=1):
+        with self.rlock:
+            if unit not in self.metrics:
+                label = '%s:%s' % self.key if unit == 1 else '%s:%s/%s' % (self.key + (unit,))
+                self.metrics[unit] = METRICS.new('plc', label)
+            return self.metrics[unit]
+
+    #Switch to pipelined requests with up to window of them in flight, 0 sends one request at a time
+    #PLCs sharing the address get the largest window any of them asks for
+    #A simulated PLC answers straight away, so it is never pipelined
+    def set_window(self, window):
+        with self.mlock:
+            if window <= self.window or isinstance(self.client, Sim_Client):
+                return
+            self.client.close()
+            self.healthy = False
+            self.window = window
+            self.client = Pipeline_Client(self.key[0], self.key[1], window)
+            self.request_lock = No_Lock()
+
+    #Take a reference on the connection and make sure it is up
+    def borrow(self):
+        with self.rlock:
+            self.refs = self.refs + 1
+        self.check()
+
+    #Give back a reference, closing the socket when nothing is using it
+    def release(self):
+        with self.rlock:
+            self.refs = self.refs - 1
+            if self.refs > 0:
+                return
+            self.refs = 0
+        with self.mlock:
+            self.client.close()
+            self.healthy = False
+
+    #Health check, reconnects a dropped connection at most once every retry_interval seconds
+    def check(self):
+        if self.healthy and self.client.is_socket_open():
+            return True
+        with self.mlock:
+            if self.healthy and self.client.is_socket_open():
+                return True
+            now = time.monotonic()
+            if now < self.next_try:
+                return False
+            self.client.close()
+            self.healthy = self.client.connect()
+            if not self.healthy:
+                print("Failed to connect to %s\n" % self.key[0])
+                self.next_try = now + self.retry_interval
+        return self.healthy
+
+    #Circuit breaker, returns False while writes to this address are paused
+    def allow(self, policy):
+        if policy.breaker <= 0:
+            return True
+        return time.monotonic() >= self.open_until
+
+    #Record how a write call ended, opening the circuit after policy.breaker failed calls in a row
+    #Failures are not reset when the circuit opens, so one more failure after the cooldown opens it again
+    def record(self, ok, policy):
+        with self.rlock:
+            if ok:
+                self.failures = 0
+                return
+            self.failures = self.failures + 1
+            if policy.breaker > 0 and self.failures >= policy.breaker:
+                self.open_until = time.monotonic() + policy.cooldown
+                print("Circuit open for %s, writes paused for %.1f seconds\n" % (self.key[0], policy.cooldown))
+
+    #Remember registers the PLC confirmed writing
+    def shadow_update(self, unit, mem_addr, registers, coils=False):
+        now = time.monotonic()
+        with self.slock:
+            for i in range(len(registers)):
+                self.shadow[(unit, coils, mem_addr + i)] = (registers[i], now)
+
+    #Forget registers after a failed write, what the PLC holds is not known anymore
+    def shadow_forget(self, unit, mem_addr, count, coils=False):
+        with self.slock:
+            for i in range(count):
+                self.shadow.pop((unit, coils, mem_addr + i), None)
+
+    #True if the last confirmed write of every register matches the payload
+    def shadow_matches(self, unit, mem_addr, payload, coils=False):
+        with self.slock:
+            for i in range(len(payload)):
+                if self.shadow.get((unit, coils, mem_addr + i), (None, 0))[0] != payload[i]:
+                    return False
+        return True
+
+    #Seconds since the oldest of the registers was last written, inf if one was never written
+    def shadow_age(self, unit, mem_addr, count, coils=False):
+        with self.slock:
+            written = [self.shadow.get((unit, coils, mem_addr + i), (None, None))[1] for i in range(count)]
+        if None in written:
+            return float('inf')
+        return time.monotonic() - min(written)
+
+    def __repr__(self):
+        return "Connection('{}','{}')".format(*self.key)
+
+#Registry of shared connections keyed by (ip, port)
+class Connection_Manager:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    #find the shared connection for an address, making it the first time it is asked for
+    def get(self, IP, Port):
+        key = (IP, Port)
+        with self.lock:
+            if key not in self.connections:
+                self.connections[key] = Connection(IP, Port)
+            return self.connections[key]
+
+    #forget connections so new ones are made for the same addresses, only those of simulated PLCs unless simulated is False
+    def forget(self, simulated=True):
+        with self.lock:
+            for key in [key for key in self.connections if not simulated or isinstance(self.connections[key].client, Sim_Client)]:
+                del self.connections[key]
+
+    #close every connection no matter who is still using it
+    def close_all(self):
+        with self.lock:
+            for connection in self.connections.values():
+                connection.refs = 1
+                connection.release()
+
+    def __repr__(self):
+        return "Connection_Manager('{}')".format(len(self.connections))
+
+CONNECTIONS = Connection_Manager()
+
+#Retry policy for register writes
+#attempts is the most tries per call, the delay before each retry doubles up to max_delay and is spread by +/- jitter
+#deadline bounds a whole call in seconds, breaker opens the circuit after that many failed calls in a row (0 is off)
+class Retry_Policy:
+    def __init__(self, attempts=5, delay=0.05, max_delay=1.0, jitter=0.5, deadline=None, breaker=0, cooldown=5.0):
+        self.attempts = max(1, int(attempts))
+        self.delay = delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.breaker = int(breaker)
+        self.cooldown = cooldown
+
+    #delay before retry number 'retry', counting from 1
+    def backoff(self, retry):
+        delay = min(self.delay * 2 ** (retry - 1), self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def __repr__(self):
+        return "Retry_Policy('{}','{}','{}')".format(self.attempts,self.deadline,self.breaker)
+
+#Result of one write call, true if the write made it
+class Write_Result:
+    def __init__(self):
+        self.ok = False
+        self.attempts = 0
+        self.error = None
+        self.elapsed = 0.0
+
+    #retries are the attempts after the first
+    @property
+    def retries(self):
+        return max(0, self.attempts - 1)
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return "Write_Result('{}','{}','{}')".format(self.ok,self.attempts,self.error)
+
+#Simulated PLCs keep their registers in memory so whole scenarios run without a network or a Modbus server
+#Every (IP, Port) is one simulated device answering for any unit, and the MB_PLC above it runs unchanged
+#Registers a simulated unit has, addresses past it answer with an illegal address exception
+SIM_REGISTERS = 65536
+
+#Response of a simulated PLC, it answers the same way the pymodbus responses MB_PLC uses do
+class Sim_Response:
+    def __init__(self, function, registers=None, bits=None, error=None):
+        self.function_code = function
+        self.registers = [] if registers is None else registers
+        self.bits = [] if bits is None else bits
+        self.error = error
+
+    def isError(self):
+        return self.error is not None
+
+    def __str__(self):
+        return 'Modbus function %u error: %s' % (self.function_code, self.error)
+
+    def __repr__(self):
+        return "Sim_Response('{}','{}')".format(self.function_code,self.error)
+
+#Register and coil image of one simulated unit
+#registers are 16 bit words over a bytearray, coils one byte each, image() shows them as NumPy arrays
+class Sim_Memory:
+    def __init__(self, size=SIM_REGISTERS):
+        self.size = size
+        self.register_bytes = bytearray(2 * size)
+        self.registers = memoryview(self.register_bytes).cast('H')
+        self.coils = bytearray(size)
+
+    #The registers or coils from mem_addr, None if they run past the end of the image
+    def read(self, mem_addr, count, coils=False):
+        if mem_addr < 0 or count < 1 or mem_addr + count > self.size:
+            return None
+        if coils:
+            return [value for value in self.coils[mem_addr:mem_addr+count]]
+        return self.registers[mem_addr:mem_addr+count].tolist()
+
+    #Store values from mem_addr, returns False if they run past the end of the image
+    def write(self, mem_addr, values, coils=False):
+        if mem_addr < 0 or len(values) < 1 or mem_addr + len(values) > self.size:
+            return False
+        if coils:
+            self.coils[mem_addr:mem_addr+len(values)] = bytes(1 if value else 0 for value in values)
+        else:
+            self.registers[mem_addr:mem_addr+len(values)] = array.array('H', values)
+        return True
+
+    #The whole image, a NumPy array sharing the memory when NumPy is installed
+    def image(self, coils=False):
+        if coils:
+            return self.coils if np is None else np.frombuffer(self.coils, dtype=np.uint8)
+        return self.registers if np is None else np.frombuffer(self.register_bytes, dtype=np.uint16)
+
+    def __repr__(self):
+        return "Sim_Memory('{}')".format(self.size)
+
+#One simulated address (ip, port), it holds a Sim_Memory for each unit asked for and counts what it was sent
+class Sim_Device:
+    def __init__(self, IP, Port, size=SIM_REGISTERS):
+        self.key = (IP, Port)
+        self.size = size
+        self.units = {}
+        self.lock = threading.Lock()
+        self.counts = {'reads':0, 'writes':0, 'failed':0, 'dropped':0}
+
+    def memory(self, unit=1):
+        with self.lock:
+            if unit not in self.units:
+                self.units[unit] = Sim_Memory(self.size)
+            return self.units[unit]
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts[name] + 1
+
+    #Answer one request, function is the Modbus function code
+    #read_addr and count are read, values are written to mem_addr first for function 23
+    def request(self, function, unit, read_addr=0, count=0, mem_addr=0, values=None):
+        memory = self.memory(unit)
+        with self.lock:
+            if values is not None:
+                if not memory.write(mem_addr, values, function in (5, 15)):
+                    return Sim_Response(function, error='exception code 2')
+                self.counts['writes'] = self.counts['writes'] + 1
+            registers = None
+            if count > 0:
+                registers = memory.read(read_addr, count, function == 1)
+                if registers is None:
+                    return Sim_Response(function, error='exception code 2')
+                self.counts['reads'] = self.counts['reads'] + 1
+        if function == 1:
+            return Sim_Response(function, bits=[bool(value) for value in registers])
+        return Sim_Response(function, registers)
+
+    def __repr__(self):
+        return "Sim_Device('{}','{}')".format(*self.key)
+
+#In memory stand in for every PLC of a scenario
+#latency is the seconds each request takes, spread by +/- jitter seconds
+#fail is the chance a request answers with a device failure exception, drop the chance it drops the connection instead
+class Simulator:
+    def __init__(self, latency=0.0, jitter=0.0, fail=0.0, drop=0.0, seed=None, size=SIM_REGISTERS):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail = fail
+        self.drop = drop
+        self.size = size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.devices = {}
+
+    #find the simulated device at an address, making it the first time it is asked for
+    def device(self, IP, Port):
+        key = (IP, Port)
+        with self.lock:
+            if key not in self.devices:
+                self.devices[key] = Sim_Device(IP, Port, self.size)
+            return self.devices[key]
+
+    #Client for a Connection in place of the pymodbus one
+    def client(self, IP, Port):
+        return Sim_Client(self, self.device(IP, Port))
+
+    #Client for an Async_MB_PLC in place of the pymodbus one
+    def async_client(self, IP, Port):
+        return Async_Sim_Client(self, self.device(IP, Port))
+
+    #Seconds the next request takes
+    def delay(self):
+        if self.jitter <= 0:
+            return self.latency
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    #The fault injected into the next request, None, 'fail' or 'drop'
+    def fault(self):
+        if self.fail <= 0 and self.drop <= 0:
+            return None
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.drop:
+            return 'drop'
+        if draw < self.drop + self.fail:
+            return 'fail'
+        return None
+
+    #The whole register image of one unit, see Sim_Memory.image
+    def image(self, IP, Port, unit=1, coils=False):
+        return self.device(IP, Port).memory(unit).image(coils)
+
+    #Final value of every address the PLCs planned writes to, decoded with the PLC's format and endianness
+    #PLCS are the built MB_PLCs by number, PLCs whose device was never sent anything are left out
+    def state(self, PLCS):
+        state = {}
+        for n in sorted(PLCS):
+            PLC = PLCS[n]
+            device = self.devices.get((PLC.ip, PLC.port))
+            if device is None or device.counts['reads'] + device.counts['writes'] == 0:
+                continue
+            memory = device.memory(PLC.unit)
+            values = {}
+            coils = {}
+            for (coil, mem_addr), formating in sorted(PLC.formats.items()):
+                codec = PLC.codec(formating)
+                registers = memory.read(mem_addr, codec.count, coil)
+                if registers is not None:
+                    (coils if coil else values)[str(mem_addr)] = codec.decode(registers)
+            state[str(n)] = {'address':'%s:%s/%s' % (PLC.ip, PLC.port, PLC.unit), 'values':values, 'coils':coils}
+        return state
+
+    #Totals of every device, reads, writes, failed and dropped requests
+    def totals(self):
+        totals = {'reads':0, 'writes':0, 'failed':0, 'dropped':0}
+        for device in list(self.devices.values()):
+            for name in totals:
+                totals[name] = totals[name] + device.counts[name]
+        return totals
+
+    def __repr__(self):
+        return "Simulator('{}','{}','{}','{}')".format(self.latency,self.jitter,self.fail,self.drop)
+
+#Client of one simulated device, it takes the calls MB_PLC makes on a pymodbus client
+class Sim_Client:
+    def __init__(self, simulator, device):
+        self.simulator = simulator
+        self.device = device
+        self.open = False
+
+    def connect(self):
+        self.open = True
+        return True
+
+    def is_socket_open(self):
+        return self.open
+
+    def close(self):
+        self.open = False
+
+    #Fault a request may get before it is answered, raises if the connection is down or drops
+    def inject(self, function):
+        if not self.open:
+            raise ConnectionError('not connected to simulated %s' % self.device.key[0])
+        fault = self.simulator.fault()
+        if fault == 'drop':
+            self.open = False
+            self.device.count('dropped')
+            raise ConnectionError('simulated connection drop')
+        if fault == 'fail':
+            self.device.count('failed')
+            return Sim_Response(function, error='exception code 4')
+        return None
+
+    #Answer a request after the simulated latency
+    def request(self, function, unit, read_addr=0, count=0, mem_addr=0, values=None):
+        delay = self.simulator.delay()
+        if delay > 0:
+            time.sleep(delay)
+        return self.inject(function) or self.device.request(function, unit, read_addr, count, mem_addr, values)
+
+    def read_holding_registers(self, address, count=1, slave=1):
+        return self.request(3, slave, address, count)
+
+    def read_coils(self, address, count=1, slave=1):
+        return self.request(1, slave, address, count)
+
+    def write_registers(self, address, values, slave=1):
+        return self.request(16, slave, mem_addr=address, values=list(values))
+
+    def write_coils(self, address, values, slave=1):
+        return self.request(15, slave, mem_addr=address, values=list(values))
+
+    def readwrite_registers(self, read_address, read_count, write_address, values, slave=1):
+        return self.request(23, slave, read_address, read_count, write_address, list(values))
+
+    #Only the read/write multiple registers request MB_PLC.write_read sends goes through execute
+    def execute(self, request):
+        return self.readwrite_registers(request.read_address, request.read_count, request.write_address, request.write_registers, request.slave_id)
+
+    def __repr__(self):
+        return "Sim_Client('{}','{}')".format(*self.device.key)
+
+#Sim_Client for the asyncio engine, the latency is awaited so other tasks keep going
+class Async_Sim_Client(Sim_Client):
+    @property
+    def connected(self):
+        return self.open
+
+    async def connect(self):
+        return Sim_Client.connect(self)
+
+    async def request(self, function, unit, read_addr=0, count=0, mem_addr=0, values=None):
+        delay = self.simulator.delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.inject(function) or self.device.request(function, unit, read_addr, count, mem_addr, values)
+
+    def __repr__(self):
+        return "Async_Sim_Client('{}','{}')".format(*self.device.key)
+
+#The simulator of this process, None when PLCs are real
+SIMULATOR = None
+
+#Start simulating every PLC built from now on, options are those of Simulator
+def start_simulator(options=None):
+    global SIMULATOR
+    if options is None:
+        return None
+    SIMULATOR = Simulator(**options)
+    return SIMULATOR
+
+#Stop simulating, printing what the simulated PLCs were sent
+#path saves the final state of the PLCS as JSON, each shard saves to its own file
+def stop_simulator(simulator, PLCS={}, path=None, shard=None):
+    global SIMULATOR
+    if simulator is None:
+        return
+    if SIMULATOR is simulator:
+        SIMULATOR = None
+    CONNECTIONS.forget()
+    totals = simulator.totals()
+    #devices make a unit's memory the first time it is sent a request, so this counts the PLCs that were used
+    used = [device for device in list(simulator.devices.values()) if len(device.units) > 0]
+    print('Simulated %u PLCs at %u addresses: %u reads, %u writes, %u failed, %u dropped' % (sum(len(device.units) for device in used), len(used),
+        totals['reads'], totals['writes'], totals['failed'], totals['dropped']))
+    if path is not None:
+        if shard is not None:
+            path = '%s.%u' % (path, shard)
+        FILE = open(path, 'w')
+        json.dump(simulator.state(PLCS), FILE, indent=1)
+        FILE.close()
+        print('Saved simulated PLC state to %s' % path)
+
+#Define class for modbus PLCs
+class MB_PLC:
+
+    def __init__(self, IP, Port, unit=1):
+        self.ip = IP
+        self.Mem_default = '32_float'
+        self.port = Port
+        self.unit = unit
+        #Every MB_PLC at the same address shares one connection, client, and lock, whatever its unit
+        self.connection = CONNECTIONS.get(IP, Port)
+        self.byteOrder = Endian.BIG
+        self.wordOrder = Endian.BIG
+        self.metrics = self.connection.unit_metrics(unit)
+        self.read_gap = READ_GAP
+        #memory format planned for each (coils, address) written, recordings use it to split payloads into values
+        self.formats = {}
+        #writes are retried with backoff, see Retry_Policy
+        self.retry = Retry_Policy()
+        self.last_write = None
+        self.write_counts = {'calls':0, 'ok':0, 'failed':0, 'rejected':0, 'retries':0, 'skipped':0}
+        self.stats_lock = threading.Lock()
+
+    #the connection's client and request lock, both change when the connection is pipelined
+    @property
+    def client(self):
+        return self.connection.client
+
+    @property
+    def mlock(self):
+        return self.connection.request_lock
+
+    #Pipeline requests to this PLC's address, keeping up to window of them in flight on the one connection
+    def set_pipeline(self, window=PIPELINE_WINDOW):
+        self.connection.set_window(int(window))
+
+    #Set how writes are retried, takes the same options as Retry_Policy
+    def set_retry(self, **kwargs):
+        #uses dictionary to parse kargs
+        options = {
+            'attempts':self.retry.attempts,
+            'delay':self.retry.delay,
+            'max_delay':self.retry.max_delay,
+            'jitter':self.retry.jitter,
+            'deadline':self.retry.deadline,
+            'breaker':self.retry.breaker,
+            'cooldown':self.retry.cooldown }
+        options.update(kwargs)
+        self.retry = Retry_Policy(**options)
+
+    #Count the result of a write call, rejected calls were stopped by an open circuit
+    def record_write(self, result):
+        with self.stats_lock:
+            self.last_write = result
+            self.write_counts['calls'] = self.write_counts['calls'] + 1
+            self.write_counts['retries'] = self.write_counts['retries'] + result.retries
+            if result.ok:
+                self.write_counts['ok'] = self.write_counts['ok'] + 1
+            elif result.attempts == 0:
+                self.write_counts['rejected'] = self.write_counts['rejected'] + 1
+            else:
+                self.write_counts['failed'] = self.write_counts['failed'] + 1
+        self.metrics.count('writes')
+        if result.retries > 0:
+            self.metrics.count('write_retries', result.retries)
+        if not result.ok:
+            self.metrics.count('write_failures' if result.attempts > 0 else 'write_rejected')
+
+    #Count a write that was not sent because the PLC already holds the value
+    def record_skip(self):
+        with self.stats_lock:
+            self.write_counts['skipped'] = self.write_counts['skipped'] + 1
+        self.metrics.count('write_skipped')
+
+    #Write counts so far, calls, ok, failed, rejected, retries and skipped
+    def stats(self):
+        with self.stats_lock:
+            return dict(self.write_counts)
+
+    #Define how to connect with PLC
+    #This borrows the shared connection, every connect() needs a matching close()
+    def connect(self):
+        self.connection.borrow()
+
+    #Check the shared connection is still up and reconnect it if it dropped
+    def check(self):
+        return self.connection.check()
+
+    #Define how to read values from PLCs
+    def read(self, mem_addr, formating=None):
+        #Check formatting and find number of registers to read
+        if formating is None:
+            formating = self.Mem_default
+        count = reg_count(formating)
+        coils = formating == COIL_FORMAT
+
+        results = self.read_registers(mem_addr, count, coils)
+
+        #return decoded value
+        return self.decode(self.result_registers(results, count, coils), formating)
+
+    #Define how to read a block of raw registers from PLC
+    #coils reads that many coils instead (function 1)
+    def read_registers(self, mem_addr, count, coils=False):
+        client = self.client #define client
+
+        #Need to used mutex's to lock read/writes
+        #This is because conflicts were found to happen with multiple Events using same PLC
+        waited = time.perf_counter()
+        self.mlock.acquire()
+        sent = time.perf_counter()
+        try:
+            if coils:
+                results = client.read_coils(mem_addr,count,slave=self.unit)
+            else:
+                results = client.read_holding_registers(mem_addr,count,slave=self.unit) #read client PLC
+        except:
+            results = None
+            self.connection.healthy = False
+        self.mlock.release()
+
+        self.metrics.observe('lock_wait', sent - waited)
+        self.metrics.observe('read', time.perf_counter() - sent)
+        self.metrics.count('reads')
+        if results is None or results.isError():
+            self.metrics.count('read_errors')
+        return results
+
+    #Read a run of coils (function 1), returns the response with one bit per coil
+    def read_coils(self, mem_addr, count=1):
+        return self.read_registers(mem_addr, count, True)
+
+    #The registers a read returned, for coils a 0 or 1 for each of the count coils
+    def result_registers(self, results, count, coils=False):
+        if coils:
+            return [1 if bit else 0 for bit in results.bits[:count]]
+        return results.registers
+
+    #Define how to decode registers into a value
+    def decode(self, registers, formating=None):
+        if formating is None:
+            formating = self.Mem_default
+        return self.codec(formating).decode(registers)
+
+    #Find the compiled codec for a memory format with this PLC's byte and word order
+    def codec(self, formating=None):
+        if formating is None:
+            formating = self.Mem_default
+        return get_codec(formating, self.byteOrder, self.wordOrder)
+
+    #Plan reads of many memory addresses as a few contiguous blocks
+    def plan_read(self, mem_addr, mem_format=None):
+        if mem_format is None or len(mem_format) == 0:
+            mem_format = [self.Mem_default for i in range(len(mem_addr))]
+        return plan_blocks(mem_addr, mem_format, MAX_READ_REGS, self.read_gap, MAX_READ_COILS)
+
+    #Plan writes of many memory addresses as a few contiguous blocks
+    #Writes never span gaps, that would overwrite registers nobody asked for
+    def plan_write(self, mem_addr, mem_format=None):
+        if mem_format is None or len(mem_format) == 0:
+            mem_format = [self.Mem_default for i in range(len(mem_addr))]
+        for i in range(len(mem_addr)):
+            self.formats[(mem_format[i] == COIL_FORMAT, int(mem_addr[i]))] = mem_format[i]
+        return plan_blocks(mem_addr, mem_format, MAX_WRITE_REGS, 0, MAX_WRITE_COILS)
+
+    #Read a planned set of blocks, returns values in the order the addresses were planned
+    #Addresses that could not be read come back as None
+    def read_blocks(self, blocks):
+        values = [None for i in range(plan_size(blocks))]
+
+        for block, results in zip(blocks, self.read_many(blocks)):
+            if results is None or results.isError():
+                #A spanned gap may hold registers the PLC does not have, fall back to reading each address
+                if len(block.items) > 1:
+                    for idx, offset, formating in block.items:
+                        try:
+                            values[idx] = self.read(block.start + offset, formating)
+                        except:
+                            values[idx] = None
+                continue
+            self.block_values(block, self.result_registers(results, block.count, block.coils), values)
+
+        return values
+
+    #Read the registers of every block
+    #On a pipelined connection every request goes out before waiting for any response
+    def read_many(self, blocks):
+        if self.connection.window == 0 or len(blocks) < 2:
+            return [self.read_registers(block.start, block.count, block.coils) for block in blocks]
+        client = self.client
+        requests = []
+        for block in blocks:
+            submit = client.submit_read_coils if block.coils else client.submit_read
+            requests.append(submit(block.start, block.count, self.unit))
+        responses = []
+        for request in requests:
+            try:
+                results = client.wait(request)
+            except Exception:
+                results = None
+                self.connection.healthy = False
+            self.metrics.observe('read', request.rtt)
+            self.metrics.count('reads')
+            if results is None or results.isError():
+                self.metrics.count('read_errors')
+            responses.append(results)
+        return responses
+
+    #Decode the registers read for one block into the planned value list
+    def block_values(self, block, registers, values):
+        if RECORDER is not None:
+            RECORDER.read(self, block, registers)
+        for idx, offset, formating in block.items:
+            codec = self.codec(formating)
+            values[idx] = codec.decode(registers[offset:offset+codec.count])
+
+    #Write a planned set of blocks, values are in the order the addresses were planned
+    #returns the Write_Result of each block
+    #On a pipelined connection the first attempt of every block goes out at once, failed blocks are retried one at a time
+    def write_blocks(self, blocks, values):
+        payloads = [self.block_payload(block, values) for block in blocks]
+        if self.connection.window == 0 or len(blocks) < 2 or not self.connection.allow(self.retry):
+            return [self.write_registers(blocks[i].start, payloads[i], coils=blocks[i].coils) for i in range(len(blocks))]
+        client = self.client
+        requests = []
+        for i in range(len(blocks)):
+            submit = client.submit_write_coils if blocks[i].coils else client.submit_write
+            requests.append(submit(blocks[i].start, payloads[i], self.unit))
+        results = []
+        for i in range(len(blocks)):
+            result = Write_Result()
+            result.attempts = 1
+            try:
+                Check_write = client.wait(requests[i])
+                result.ok = not Check_write.isError()
+                result.error = None if result.ok else str(Check_write)
+            except Exception as error:
+                result.error = str(error) or type(error).__name__
+                self.connection.healthy = False
+            result.elapsed = requests[i].rtt
+            self.metrics.observe('write', requests[i].rtt)
+            if result.ok:
+                self.finish_write(blocks[i].start, payloads[i], result, blocks[i].coils)
+            else:
+                result = self.write_registers(blocks[i].start, payloads[i], result, blocks[i].coils)
+            results.append(result)
+        return results
+
+    #Decide if a payload still needs writing, see write_changed
+    def needs_write(self, mem_addr, payload, current, refresh, coils=False):
+        if current is None:
+            same = self.connection.shadow_matches(self.unit, mem_addr, payload, coils)
+        else:
+            same = list(current) == list(payload)
+        #refresh rewrites anyway once the last write is that many seconds old
+        if same and refresh > 0:
+            same = self.connection.shadow_age(self.unit, mem_addr, len(payload), coils) < refresh
+        if same:
+            self.record_skip()
+        return not same
+
+    #Write a block of registers only if the PLC does not already hold the payload
+    #The last confirmed write to each register is shadowed per connection, verify reads the registers back instead of trusting it
+    #returns the Write_Result, or None if the write was skipped
+    def write_changed(self, mem_addr, payload, verify=False, refresh=0, coils=False):
+        current = None
+        if verify:
+            results = self.read_registers(mem_addr, len(payload), coils)
+            #a failed read-back can not show the value is there, so write it
+            current = [] if results is None or results.isError() else self.result_registers(results, len(payload), coils)
+        if self.needs_write(mem_addr, payload, current, refresh, coils):
+            return self.write_registers(mem_addr, payload, coils=coils)
+        return None
+
+    #Encode a whole profile of values written to every planned address at once
+    #A 2-D profile has a column for each planned address instead of one value for all of them
+    #returns one array per block with a payload row per sample, or None without NumPy
+    def profile_payloads(self, blocks, profile):
+        if np is None:
+            return None
+        profile = np.asarray(profile)
+        N = len(profile)
+        payloads = []
+        for block in blocks:
+            payload = np.zeros((N, block.count), dtype=np.uint16)
+            for idx, offset, formating in block.items:
+                codec = self.codec(formating)
+                column = profile[:, idx] if profile.ndim == 2 else profile
+                payload[:, offset:offset+codec.count] = codec.encode_array(column).reshape(N, codec.count)
+            payloads.append(payload)
+        return payloads
+
+    #Encode the planned values that fall in one block into its register payload
+    def block_payload(self, block, values):
+        payload = [0 for i in range(block.count)]
+        for idx, offset, formating in block.items:
+            registers = self.encode(values[idx], formating)
+            payload[offset:offset+len(registers)] = registers
+        return payload
+
+    #define how to read coils from PLC
+    def readcoil(self, mem_addr):
+        result = self.read_coils(mem_addr, 1)
+        return result.bits[0]
+
+    #Define how to write to coils
+    def writecoil(self, mem_addr, value):
+        return self.write_coils(mem_addr, [value])
+
+    #Write a run of coils in one request (function 15), returns a Write_Result
+    def write_coils(self, mem_addr, values):
+        return self.write_registers(mem_addr, [1 if value else 0 for value in values], coils=True)
+
+    #define how to write to registers
+    def write(self, mem_addr, value, formating=None):
+        #Catch default format conditions
+        if formating is None:
+            formating = self.Mem_default
+        self.formats[(formating == COIL_FORMAT, mem_addr)] = formating
+
+        return self.write_registers(mem_addr, self.encode(value, formating), coils=formating == COIL_FORMAT)
+
+    #Define how to encode a value into registers
+    def encode(self, value, formating=None):
+        if formating is None:
+            formating = self.Mem_default
+        return self.codec(formating).encode(value)
+
+    #Define how to write a block of raw registers to PLC
+    #Retries follow self.retry, the lock is only held for each attempt so other Events keep going during backoff
+    #result carries on from attempts already made, coils writes the payload to coils instead (function 15)
+    #returns a Write_Result
+    def write_registers(self, mem_addr, payload, result=None, coils=False):
+        if coils:
+            send = lambda client: client.write_coils(mem_addr, [bool(value) for value in payload], slave=self.unit)
+        else:
+            send = lambda client: client.write_registers(mem_addr, payload, slave=self.unit)
+        return self.write_request(send, mem_addr, payload, result, coils)
+
+    #Write a block of registers and read a block back in one request (function 23)
+    #The PLC does the write first, so a read of the written registers shows the new values
+    #returns the Write_Result and the registers read, None if the request failed
+    def write_read(self, mem_addr, payload, read_addr, count):
+        responses = []
+        def send(client):
+            if self.connection.window > 0:
+                response = client.readwrite_registers(read_addr, count, mem_addr, payload, slave=self.unit)
+            else:
+                response = client.execute(readwrite_request(read_addr, count, mem_addr, payload, self.unit))
+            responses.append(response)
+            return response
+        result = self.write_request(send, mem_addr, payload)
+        if result.ok:
+            self.metrics.count('reads')
+            return result, responses[-1].registers
+        return result, None
+
+    #Send a write with the retry policy, send does one attempt with the client it is given
+    def write_request(self, send, mem_addr, payload, result=None, coils=False):
+        policy = self.retry
+        if result is None:
+            result = Write_Result()
+        start = time.monotonic() - result.elapsed
+
+        while True:
+            if result.attempts > 0:
+                if result.ok or result.attempts >= policy.attempts:
+                    break
+                delay = policy.backoff(result.attempts)
+                if policy.deadline is not None and time.monotonic() - start + delay > policy.deadline:
+                    break
+                time.sleep(delay)
+                #reconnect a dropped connection before trying again
+                self.check()
+            if not self.connection.allow(policy):
+                break
+            result.attempts = result.attempts + 1
+            client = self.client #define client
+            #Lock out read/write operations to stop conflicts
+            waited = time.perf_counter()
+            self.mlock.acquire()
+            sent = time.perf_counter()
+            try:
+                Check_write = send(client)
+                result.ok = not Check_write.isError()
+                result.error = None if result.ok else str(Check_write)
+            except Exception as error:
+                result.error = str(error) or type(error).__name__
+                self.connection.healthy = False
+            self.mlock.release()
+            self.metrics.observe('lock_wait', sent - waited)
+            self.metrics.observe('write', time.perf_counter() - sent)
+
+        result.elapsed = time.monotonic() - start
+        self.finish_write(mem_addr, payload, result, coils)
+        return result
+
+    #Record how a write call ended, feeding the circuit breaker, the shadow and the write counts
+    def finish_write(self, mem_addr, payload, result, coils=False):
+        if result.attempts > 0:
+            self.connection.record(result.ok, self.retry)
+            if not result.ok:
+                print("Write to %s at %u failed after %u attempts: %s\n" % (self.ip, mem_addr, result.attempts, result.error))
+        else:
+            result.error = 'circuit open'
+        if result.ok:
+            self.connection.shadow_update(self.unit, mem_addr, payload, coils)
+            if RECORDER is not None:
+                RECORDER.write(self, mem_addr, payload, coils)
+        else:
+            self.connection.shadow_forget(self.unit, mem_addr, len(payload), coils)
+        self.record_write(result)
+
+    #define how to close connection to PLC
+    #This gives back the shared connection, it only closes once nothing is using it
+    def close(self):
+        self.connection.release()
+
+    def __repr__(self):
+        return "MB_PLC('{}','{}','{}')".format(self.ip,self.port,self.unit)
+
+#Periodic timer handed out by the Scheduler
+#Deadlines are absolute on the monotonic clock so timing errors do not add up from one period to the next
+class Timer:
+    def __init__(self, scheduler, period, stop=None):
+        self.scheduler = scheduler
+        self.period = period
+        self.stop = stop
+        self.deadline = time.monotonic() + period
+        self.wake = threading.Event()
+        self.stopped = False
+        #timing measurements, jitter is how late a wait returned after its deadline
+        self.ticks = 0
+        self.missed = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+
+    #Block until the next deadline, returns False if the timer was cancelled or stop was set
+    #A timer with a stop Event sleeps on that Event instead of the scheduler, so setting it wakes the timer straight away
+    def wait(self):
+        if self.stopped or (self.stop is not None and self.stop.is_set()):
+            return False
+        if self.stop is None:
+            self.wake.wait()
+        else:
+            delay = self.deadline - time.monotonic()
+            while delay > 0 and not self.stopped:
+                if self.stop.wait(delay):
+                    return False
+                delay = self.deadline - time.monotonic()
+        if self.stopped:
+            return False
+        self.wake.clear()
+
+        now = time.monotonic()
+        late = now - self.deadline
+        self.ticks = self.ticks + 1
+        self.jitter_total = self.jitter_total + late
+        if late > self.jitter_max:
+            self.jitter_max = late
+
+        #next deadline follows the last one, skipping any periods that were overrun
+        self.deadline = self.deadline + self.period
+        if self.deadline <= now:
+            skip = int((now - self.deadline)/self.period) + 1
+            self.missed = self.missed + skip
+            self.deadline = self.deadline + skip*self.period
+        if self.stop is None:
+            self.scheduler.add(self)
+        return True
+
+    #Stop the timer, a thread blocked in wait() returns right away, or at its deadline if it sleeps on a stop Event
+    def cancel(self):
+        self.stopped = True
+        self.wake.set()
+
+    #Timing summary in seconds
+    def stats(self):
+        mean = 0.0
+        if self.ticks > 0:
+            mean = self.jitter_total/self.ticks
+        return {'ticks':self.ticks, 'missed':self.missed, 'jitter_mean':mean, 'jitter_max':self.jitter_max}
+
+    def __repr__(self):
+        return "Timer('{}')".format(self.period)
+
+#One thread that keeps a heap of timer deadlines and wakes each timer when its deadline passes
+#Threads waiting on timers sleep instead of spinning on the clock
+class Scheduler:
+    def __init__(self):
+        self.heap = []
+        self.count = 0
+        self.cond = threading.Condition()
+        self.thread = None
+
+    #Start a periodic timer, the first deadline is one period from now
+    #raises ValueError for a period that is not above 0, it would never wait
+    def every(self, period, stop=None):
+        if not period > 0:
+            raise ValueError('timer period must be above 0, not %r' % period)
+        timer = Timer(self, period, stop)
+        if stop is None:
+            self.add(timer)
+        return timer
+
+    #Put a timer on the heap at its deadline
+    def add(self, timer):
+        with self.cond:
+            self.count = self.count + 1
+            heapq.heappush(self.heap, (timer.deadline, self.count, timer))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop)
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+
+    #Wake timers as their deadlines pass, sleeping until the earliest deadline in between
+    def loop(self):
+        with self.cond:
+            while True:
+                if len(self.heap) == 0:
+                    self.cond.wait()
+                    continue
+                delay = self.heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                deadline, count, timer = heapq.heappop(self.heap)
+                if not timer.stopped:
+                    timer.wake.set()
+
+    #Cancel every timer
+    def stop(self):
+        with self.cond:
+            for deadline, count, timer in self.heap:
+                timer.cancel()
+            self.heap = []
+            self.cond.notify()
+
+    def __repr__(self):
+        return "Scheduler('{}')".format(len(self.heap))
+
+SCHEDULER = Scheduler()
+
+#Waveform Event types, they run on schedule like a ramp with a rate
+WAVE_TYPES = ['sine', 'square', 'noise', 'step']
+#Samples per second of a waveform without a rate
+WAVE_RATE = 10.0
+#Rows of a playback file read and encoded at a time
+PLAYBACK_CHUNK = 1024
+
+#Read a playback file a chunk of rows at a time, yields (times, values) with a column of values per address
+#.npy files hold a 2-D array and are memory mapped, other files are read as CSV with an optional header row
+#The first column is the time in seconds, the next N_mem are the values, any after them are ignored
+#raises ValueError if the file does not have enough columns
+def playback_chunks(path, N_mem, chunk=PLAYBACK_CHUNK):
+    if path.endswith('.npy'):
+        if np is None:
+            raise ValueError('%s can only be played back with NumPy' % path)
+        data = np.load(path, mmap_mode='r')
+        if data.ndim != 2 or data.shape[1] < N_mem + 1:
+            raise ValueError('%s needs a time column and %u value columns' % (path, N_mem))
+        for i in range(0, data.shape[0], chunk):
+            rows = np.asarray(data[i:i+chunk], dtype=float)
+            yield rows[:, 0], rows[:, 1:N_mem+1]
+        return
+
+    FILE = open(path, newline='')
+    try:
+        rows = []
+        for n, row in enumerate(csv.reader(FILE)):
+            if len(row) == 0 or row[0].startswith('#'):
+                continue
+            try:
+                numbers = [float(x) for x in row[:N_mem+1]]
+            except ValueError:
+                if n == 0:
+                    continue
+                raise ValueError('%s line %u is not a row of numbers' % (path, n+1))
+            if len(numbers) < N_mem + 1:
+                raise ValueError('%s line %u needs a time and %u values' % (path, n+1, N_mem))
+            rows.append(numbers)
+            if len(rows) == chunk:
+                yield playback_rows(rows)
+                rows = []
+        if len(rows) > 0:
+            yield playback_rows(rows)
+    finally:
+        FILE.close()
+
+#split rows read from a CSV into (times, values)
+def playback_rows(rows):
+    if np is not None:
+        rows = np.array(rows)
+        return rows[:, 0], rows[:, 1:]
+    return [row[0] for row in rows], [row[1:] for row in rows]
+
+#Begin Event class
+class Event:
+    #Events are numbered in the order they are made unless they are given a name
+    numbers = itertools.count(1)
+    #template blocks can make tens of thousands of Events, slots keep each one small
+    __slots__ = ('plc', 'name', 'metrics', 'fired', 'go', 'sync', 'resumed', 'mem_addr', 'mem_format', 'Event', 'timing', 'timing_units',
+        'time_delay', 'values', 'persist', 'rate', 'period', 'file', 'suppress', 'verify', 'refresh', 'thread', 'thread_stop', 'timer', 'ramp_stats')
+
+    def __init__(self, PLC, name=None):
+        self.plc = PLC
+        self.name = str(next(Event.numbers)) if name is None else name
+        self.metrics = METRICS.new('event', self.name)
+        #(Trigger, time it fired) until the first write after a Trigger starts this Event
+        self.fired = None
+        #set when a Trigger arms the Event, the Event then waits for it after getting ready
+        self.go = None
+        #Start_Barrier of a synchronized start until the Event's first write
+        self.sync = None
+        #made the first time the Event is paused, cleared while it is paused
+        self.resumed = None
+        self.mem_addr = []
+        self.mem_format = []
+        self.Event = 'single'
+        self.timing = 0
+        self.timing_units = 'sec'
+        self.time_delay = 0
+        self.values = []
+        self.persist = False
+        self.rate = 0
+        #waveform period in seconds and the file a playback Event streams from
+        self.period = 0
+        self.file = None
+        #persistent single Events can skip writes the PLC already holds
+        self.suppress = False
+        self.verify = False
+        self.refresh = 0
+        self.thread = None
+        self.thread_stop = False
+        self.timer = None
+        self.ramp_stats = None
+    
+    def add_mem_addr(self, addr=None, types=None): #add memory addresses to roster with memory format
+        #Figure out and set memory formats
+        if types is None and type(addr) is list:
+            types = [self.plc.Mem_default for i in range(len(addr))]
+        if types is None and type(addr) is not list:
+            types = self.plc.Mem_default
+        if addr is None:
+            addr = []
+
+        #Write new memory and formats to self if in list format
+        if type(addr) is list:
+            for i in range(len(addr)):
+                self.mem_addr.append(addr[i])
+                self.mem_format.append(types[i])
+        
+        #write new memory if single value
+        if type(addr) is int or type(addr) is str:
+            self.mem_addr.append(addr)
+            self.mem_format.append(types)
+
+    #Define method to change all options in Event
+    def set_Event(self, **kwargs):
+        #uses dictionary to parse kargs
+        options = {
+            'mem_addr':self.mem_addr,
+            'mem_format':self.mem_format,
+            'Event':self.Event,
+            'timing':self.timing,
+            'timing_units':self.timing_units,
+            'time_delay':self.time_delay,
+            'values':self.values,
+            'persist':self.persist,
+            'rate':self.rate,
+            'period':self.period,
+            'file':self.file,
+            'suppress':self.suppress,
+            'verify':self.verify,
+            'refresh':self.refresh }
+        options.update(kwargs)
+
+        #setting memory format if none exist
+        if len(options['mem_format'])==0:
+            self.mem_format = [self.plc.Mem_default for i in range(len(options['mem_addr']))]
+
+        elif len(options['mem_format']) != len(options['mem_addr']): #setting memory format if mismatch of input lengths
+            self.mem_format.append([self.mem_format[-1] for i in range(len(options['mem_addr'])-len(options['mem_format']))])
+            print('Wrong number of format elements, rest set to last format')
+
+        else:
+            self.mem_format = options['mem_format']
+
+        #set options
+        self.mem_addr = options['mem_addr']
+        self.Event = options['Event']
+        self.timing = options['timing']
+        self.timing_units = options['timing_units']
+        self.time_delay = options['time_delay']
+        self.values = options['values']
+        self.persist = options['persist']
+        self.rate = options['rate']
+        self.period = options['period']
+        self.file = options['file']
+        self.suppress = options['suppress']
+        self.verify = options['verify']
+        self.refresh = options['refresh']
+        
+    #Check a 'single' Event for errors, returns the error check and the rewrite period
+    def single_check(self):
+        #Error checking
+        Error_Check = True
+        if type(self.mem_addr) is list and len(self.mem_addr) == 0:
+            print('No memory address!')
+            Error_Check = False
+        if self.mem_addr == None:
+            print('No memory address!')
+            Error_Check = False
+        if type(self.time_delay) is list:
+            self.time_delay = self.time_delay[0]
+        if type(self.timing) is list:
+            timing = self.timing[0]
+        else:
+            timing = self.timing
+        if type(self.refresh) is list:
+            self.refresh = self.refresh[0]
+        return Error_Check, timing
+
+    #match values to memory addresses, missing values repeat the last value
+    def single_values(self):
+        values = []
+        for i in range(len(self.mem_addr)):
+            if len(self.values) == 0:
+                values.append(0)
+            elif len(self.values)-1 < i:
+                values.append(self.values[-1])
+            else:
+                values.append(self.values[i])
+        return values
+
+    #Count a round of writes, the first one after a Trigger fired also records how long it took to go out
+    def wrote(self, n=1):
+        self.metrics.count('writes', n)
+        fired = self.fired
+        if fired is not None:
+            self.fired = None
+            latency = time.perf_counter() - fired[1]
+            fired[0].metrics.observe('fire_to_write', latency)
+            self.metrics.observe('fire_to_write', latency)
+            print("Event %s on PLC IP: %s first write %.3f ms after Trigger %s fired" % (self.name, self.plc.ip, 1000*latency, fired[0].name))
+        sync = self.sync
+        if sync is not None:
+            self.sync = None
+            sync.wrote(self, time.perf_counter())
+        self.hold()
+
+    #Wait while the Event is paused, a paused Event finishes the round it was writing and holds before the next
+    def hold(self):
+        resumed = self.resumed
+        if resumed is not None and not resumed.is_set():
+            resumed.wait()
+
+    #Wait for the Trigger if the Event is armed, then the time delay, an Event paused before it started holds first
+    #returns False if the Event was stopped while it waited
+    def start_wait(self):
+        self.hold()
+        if self.thread_stop:
+            return False
+        if self.go is not None:
+            self.go.wait()
+            if self.thread_stop:
+                return False
+        if self.time_delay != 0:
+            time.sleep(self.time_delay)
+            #the fire to write gap is ManiPIO's own time, the delay asked for is not part of it
+            fired = self.fired
+            if fired is not None:
+                self.fired = (fired[0], time.perf_counter())
+        return True
+
+    #define 'single' type Event
+    def single(self):
+        Error_Check, timing = self.single_check()
+
+        #time delay, an armed Event gets ready first and waits after
+        if self.go is None and not self.start_wait():
+            return
+
+        #connect to PLC
+        PLC = self.plc 
+        PLC.connect() 
+        
+        #check errors and start loop
+        if Error_Check:
+            #match values to memory addresses and group addresses into blocks once
+            values = self.single_values()
+            blocks = PLC.plan_write(self.mem_addr, self.mem_format)
+            payloads = [PLC.block_payload(block, values) for block in blocks]
+            skipped = 0
+
+            #an armed Event is ready to write, wait for its Trigger
+            if self.go is not None and not self.start_wait():
+                PLC.close()
+                return
+
+            #if timing is set, the scheduler wakes this thread every period, timing 0 writes without waiting
+            self.timer = None
+            if timing > 0:
+                self.timer = SCHEDULER.every(timing)
+
+            while True:
+                #a stopped Event does not write again
+                if self.timer is not None and not self.timer.wait():
+                    break
+                self.hold()
+                if self.thread_stop:
+                    break
+
+                #write values out to all memory addresses specified
+                cycle = time.perf_counter()
+                PLC.check()
+                for b in range(len(blocks)):
+                    if self.suppress:
+                        if PLC.write_changed(blocks[b].start, payloads[b], self.verify, self.refresh, blocks[b].coils) is None:
+                            skipped = skipped + 1
+                    else:
+                        PLC.write_registers(blocks[b].start, payloads[b], coils=blocks[b].coils)
+                self.wrote(len(blocks))
+                self.metrics.observe('cycle', time.perf_counter() - cycle)
+
+                #if this is not a persistant Event, break out of loop
+                if self.persist == False:
+                    break
+
+            if self.timer is not None:
+                self.timer.cancel()
+                if self.timer.ticks > 1:
+                    stats = self.timer.stats()
+                    print("Event on PLC IP: %s wrote %u times, jitter mean %.6f s max %.6f s, %u periods missed" % (PLC.ip, stats['ticks'], stats['jitter_mean'], stats['jitter_max'], stats['missed']))
+            if self.suppress:
+                print("Event on PLC IP: %s skipped %u unchanged block writes" % (PLC.ip, skipped))
+        #close PLC connection
+        PLC.close()
+
+    #Check a 'ramp' Event for errors
+    def ramp_check(self):
+        Error_Check = True
+        #check for invalid config
+        if type(self.mem_addr) is list and len(self.mem_addr) == 0:
+            print('No memory address!')
+            Error_Check = False
+        if self.mem_addr == None:
+            print('No memory address!')
+            Error_Check = False
+        #sine and square waves without timing run for one period
+        periodic = self.one_period()
+        if type(self.timing) is not list and self.timing == 0 and not periodic:
+            print('Timing for ramp cannot be 0')
+            Error_Check = False
+        if type(self.timing) is list and not periodic:
+            for i in range(len(self.timing)):
+                if self.timing[i] == 0:
+                    print('Timing for ramp cannot be 0')
+                    Error_Check = False
+        if type(self.time_delay) is list:
+            self.time_delay = self.time_delay[0]
+        if type(self.values) is not list or len(self.values) < 2:
+            print('Not enough values to preform ramp!')
+            Error_Check = False
+        if self.Event in ['sine', 'square'] and self.wave_period() <= 0:
+            print('Period for %s wave must be above 0' % self.Event)
+            Error_Check = False
+        return Error_Check
+
+    #sine and square waves run for one period without timing or with timing 0, parsed timing is a list such as [0.0]
+    def one_period(self):
+        timing = self.timing
+        if type(timing) is list:
+            timing = timing[0] if len(timing) > 0 else 0
+        return self.Event in ['sine', 'square'] and float(timing) == 0
+
+    #Find how long ramp segment i lasts, conditioning for all possible timing variances
+    def ramp_time(self, i):
+        if type(self.timing) is not list:
+            return float(self.timing)
+        elif len(self.timing) == 1:
+            return float(self.timing[0])
+        elif (i+1) > len(self.timing):
+            return float(self.timing[-1])
+        else:
+            return float(self.timing[i])
+
+    #Find the target ramp update rate in samples per second, 0 writes as fast as the PLC allows
+    #Waveforms always run on schedule, at WAVE_RATE unless a rate is set
+    def ramp_rate(self):
+        if type(self.rate) is list:
+            rate = float(self.rate[0]) if len(self.rate) > 0 else 0.0
+        else:
+            rate = float(self.rate)
+        if rate <= 0 and self.Event in WAVE_TYPES:
+            return WAVE_RATE
+        return rate
+
+    #Find the waveform period in seconds
+    def wave_period(self):
+        if type(self.period) is list:
+            return float(self.period[0]) if len(self.period) > 0 else 0.0
+        return float(self.period)
+
+    #Sample times and values of a scheduled Event at rate samples per second
+    def profile(self, rate):
+        if self.Event in WAVE_TYPES:
+            return self.wave_profile(rate)
+        return self.ramp_profile(rate)
+
+    #Precompute a waveform at rate samples per second, values are the low and high it swings between
+    #sine and square run for timing seconds, one period without it or with timing 0, and noise is uniform between low and high
+    #step holds each value in turn for its timing, the same as the segments of a ramp
+    #returns the sample times from the start of the waveform and the value at each sample
+    def wave_profile(self, rate):
+        low = float(self.values[0])
+        high = float(self.values[1])
+        if self.Event == 'step':
+            knot_times = [0.0]
+            for i in range(len(self.values)-1):
+                knot_times.append(knot_times[-1] + self.ramp_time(i))
+            duration = knot_times[-1]
+        elif self.one_period():
+            duration = self.wave_period()
+        else:
+            duration = self.ramp_time(0)
+        N = int(math.ceil(duration*rate - 1e-9)) + 1
+        times = [k/rate for k in range(N)] if np is None else np.arange(N)/rate
+
+        if self.Event == 'step':
+            levels = [float(x) for x in self.values]
+            if np is not None:
+                return times, np.array(levels)[np.searchsorted(knot_times, times, side='right') - 1]
+            return times, [levels[bisect.bisect_right(knot_times, t) - 1] for t in times]
+        if self.Event == 'noise':
+            if np is not None:
+                return times, np.random.default_rng().uniform(low, high, N)
+            return times, [random.uniform(low, high) for t in times]
+
+        mid = (low + high)/2
+        amplitude = (high - low)/2
+        period = self.wave_period()
+        if self.Event == 'sine':
+            if np is not None:
+                return times, mid + amplitude*np.sin(2*np.pi*times/period)
+            return times, [mid + amplitude*math.sin(2*math.pi*t/period) for t in times]
+        #square waves start high for the first half of each period
+        if np is not None:
+            return times, np.where((times/period) % 1.0 < 0.5, high, low)
+        return times, [high if (t/period) % 1.0 < 0.5 else low for t in times]
+
+    #Precompute the whole piecewise-linear ramp across values/timing at rate samples per second
+    #returns the sample times from the start of the ramp and the value at each sample
+    def ramp_profile(self, rate):
+        knot_times = [0.0]
+        for i in range(len(self.values)-1):
+            knot_times.append(knot_times[-1] + self.ramp_time(i))
+        knot_values = [float(x) for x in self.values]
+
+        #samples sit on a fixed grid, the last one lands on or just after the end of the ramp
+        period = 1.0/rate
+        N = int(math.ceil(knot_times[-1]*rate - 1e-9)) + 1
+
+        if np is not None:
+            times = np.arange(N)*period
+            return times, np.interp(times, knot_times, knot_values)
+
+        times = [k*period for k in range(N)]
+        profile = []
+        i = 0
+        for t in times:
+            while i < len(knot_times)-2 and t > knot_times[i+1]:
+                i = i + 1
+            if t >= knot_times[-1]:
+                profile.append(knot_values[-1])
+            else:
+                profile.append(knot_values[i] + (knot_values[i+1] - knot_values[i])*(t - knot_times[i])/(knot_times[i+1] - knot_times[i]))
+        return times, profile
+
+    #Write a precomputed ramp profile with samples sent at their scheduled instants
+    #prepared is (times, profile, payloads) from ramp_prepare
+    def ramp_scheduled(self, PLC, blocks, rate, prepared):
+        times, profile, payloads = prepared
+        N_mem = len(self.mem_addr)
+        N = len(times)
+
+        writes = 0
+        skipped = 0
+        error_total = 0.0
+        error_max = 0.0
+        k = 0
+        start = time.monotonic()
+        self.timer = SCHEDULER.every(1.0/rate)
+        PLC.check()
+        while self.thread_stop == False:
+            #timing error is how far after its scheduled instant a sample went out
+            error = time.monotonic() - (start + times[k])
+            error_total = error_total + error
+            if error > error_max:
+                error_max = error
+
+            if payloads is None:
+                PLC.write_blocks(blocks, [profile[k] for n in range(N_mem)])
+            else:
+                for b in range(len(blocks)):
+                    PLC.write_registers(blocks[b].start, payloads[b][k].tolist(), coils=blocks[b].coils)
+            writes = writes + 1
+            self.wrote(len(blocks))
+
+            if k == N-1 or not self.timer.wait():
+                break
+            #send the sample that is due now, skipping any the PLC was too slow for
+            due = min(int((time.monotonic() - start)*rate), N-1)
+            if due > k + 1:
+                skipped = skipped + due - k - 1
+            k = max(due, k + 1)
+        self.timer.cancel()
+
+        elapsed = time.monotonic() - start
+        achieved = 0.0
+        if elapsed > 0:
+            achieved = (writes - 1)/elapsed
+        self.ramp_stats = {'writes':writes, 'skipped':skipped, 'elapsed':elapsed, 'rate':achieved, 'target_rate':rate,
+            'error_mean':error_total/max(writes, 1), 'error_max':error_max}
+        print("%s on PLC IP: %s wrote %u samples in %.3f s, %.1f/s for target %.1f/s, timing error mean %.6f s max %.6f s, %u samples skipped" % (self.Event.capitalize(), PLC.ip, writes, elapsed, achieved, rate, self.ramp_stats['error_mean'], error_max, skipped))
+
+    #setup 'ramp' type Event
+    #Compute a rate controlled ramp's profile and encode its payloads, the same for every loop
+    #returns (times, profile, payloads), or None without a rate
+    def ramp_prepare(self, PLC, blocks, rate):
+        if rate <= 0:
+            return None
+        times, profile = self.profile(rate)
+        return times, profile, PLC.profile_payloads(blocks, profile)
+
+    def ramp(self):
+        Error_Check = self.ramp_check()
+        
+        #time delay, an armed Event gets ready first and waits after
+        if self.go is None and not self.start_wait():
+            return
+        
+        PLC = self.plc
+        PLC.connect()
+
+        if Error_Check: #Check for errors
+            #group memory addresses into blocks once, every address gets the same ramp value
+            blocks = PLC.plan_write(self.mem_addr, self.mem_format)
+            N_mem = len(self.mem_addr)
+            rate = self.ramp_rate()
+            prepared = self.ramp_prepare(PLC, blocks, rate)
+
+            #an armed Event is ready to write, wait for its Trigger
+            if self.go is not None and not self.start_wait():
+                PLC.close()
+                return
+
+            #begin persistance loop
+            while True:
+                #with a rate set, send the precomputed profile on schedule
+                if rate > 0:
+                    self.ramp_scheduled(PLC, blocks, rate, prepared)
+                    if self.persist == False:
+                        break
+                    #noise is new every time around
+                    if self.Event == 'noise':
+                        prepared = self.ramp_prepare(PLC, blocks, rate)
+                    continue
+
+                #begin assembling ramp info
+                for i in range(len(self.values)-1):
+                    dV = float(self.values[i+1] - self.values[i])
+                    dt = dV/self.ramp_time(i)
+                    value = self.values[i]
+                    start_time = time.time()
+                    PLC.check()
+                    #begin ramp function
+                    while abs(dV) > abs((value - self.values[i])) and self.thread_stop == False:                        
+                        value = self.values[i] + dt*(time.time() - start_time)
+                        if abs(dV) < abs((value - self.values[i])):
+                            value = self.values[i+1]
+                        PLC.write_blocks(blocks, [value for n in range(N_mem)])
+                        self.wrote(len(blocks))
+                if self.persist == False:
+                    break
+        
+        
+        PLC.close()
+
+    #define 'playback' type Event
+    #Streams rows of a time and a value for each address from self.file, writing each row at its time from the start
+    #The file is read a chunk at a time so its size does not matter, see playback_chunks
+    def playback(self):
+        Error_Check = True
+        if self.file is None or len(self.mem_addr) == 0:
+            print('Playback needs a file and memory addresses!')
+            Error_Check = False
+        if type(self.time_delay) is list:
+            self.time_delay = self.time_delay[0]
+
+        if self.go is None and not self.start_wait():
+            return
+
+        PLC = self.plc
+        PLC.connect()
+
+        while Error_Check:
+            blocks = PLC.plan_write(self.mem_addr, self.mem_format)
+            chunks = playback_chunks(self.file, len(self.mem_addr))
+            #the first chunk is read and encoded before an armed Event waits for its Trigger
+            try:
+                first = next(chunks, None)
+                first = first and (first, PLC.profile_payloads(blocks, first[1]))
+            except (ValueError, OSError) as error:
+                print('Playback of %s failed: %s' % (self.file, error))
+                break
+            if self.go is not None and not self.start_wait():
+                break
+            self.playback_run(PLC, blocks, first, chunks)
+            if self.persist == False or self.thread_stop:
+                break
+
+        PLC.close()
+
+    #Write the rows of a playback file on schedule, a row is skipped if the next one is already due
+    #first is the first chunk and its payloads, chunks gives the rest
+    def playback_run(self, PLC, blocks, first, chunks):
+        writes = 0
+        skipped = 0
+        error_total = 0.0
+        error_max = 0.0
+        start = time.perf_counter()
+        stop = lambda: self.thread_stop
+        t0 = None
+        chunk = first
+        PLC.check()
+        while chunk is not None and not self.thread_stop:
+            (times, values), payloads = chunk
+            if t0 is None and len(times) > 0:
+                t0 = times[0]
+            for k in range(len(times)):
+                if k+1 < len(times) and time.perf_counter() > start + times[k+1] - t0:
+                    skipped = skipped + 1
+                    continue
+                deadline = start + times[k] - t0
+                if not wait_until(deadline, stop):
+                    break
+                error = time.perf_counter() - deadline
+                error_total = error_total + error
+                error_max = max(error_max, error)
+                if payloads is None:
+                    PLC.write_blocks(blocks, list(values[k]))
+                else:
+                    for b in range(len(blocks)):
+                        PLC.write_registers(blocks[b].start, payloads[b][k].tolist(), coils=blocks[b].coils)
+                writes = writes + 1
+                self.wrote(len(blocks))
+            try:
+                chunk = next(chunks, None)
+                chunk = chunk and (chunk, PLC.profile_payloads(blocks, chunk[1]))
+            except (ValueError, OSError) as error:
+                print('Playback of %s stopped: %s' % (self.file, error))
+                chunk = None
+
+        elapsed = time.perf_counter() - start
+        self.ramp_stats = {'writes':writes, 'skipped':skipped, 'elapsed':elapsed, 'error_mean':error_total/max(writes, 1), 'error_max':error_max}
+        print("Playback on PLC IP: %s wrote %u rows in %.3f s, timing error mean %.6f s max %.6f s, %u rows skipped" % (PLC.ip, writes, elapsed, self.ramp_stats['error_mean'], error_max, skipped))
+
+    #Define how to run Event in seperate thread
+    def run(self):
+        self.go = None
+        self.start()
+
+    #Arm the Event for a Trigger, it connects and encodes its payloads now and writes once release() is called
+    def arm(self):
+        self.go = threading.Event()
+        self.start()
+
+    #Let an armed Event write
+    def release(self):
+        self.go.set()
+
+    #Start the Event as part of a synchronized start, it gets ready and then waits at barrier with the others
+    def sync_start(self, barrier):
+        self.go = barrier
+        self.sync = barrier
+        self.start()
+
+    #Run an Event type in the Event's thread
+    #an Event that ends without reaching its start barrier, such as one with errors, stops holding up the others
+    def body(self, function):
+        try:
+            function()
+        finally:
+            if isinstance(self.go, Start_Barrier):
+                self.go.leave()
+
+    def start(self):
+        self.thread_stop = False
+        Event_lib = {
+            'single':self.single,
+            'ramp':self.ramp,
+            'sine':self.ramp,
+            'square':self.ramp,
+            'noise':self.ramp,
+            'step':self.ramp,
+            'playback':self.playback
+        }
+
+        self.metrics.count('runs')
+        thread = threading.Thread(target=self.body, args=(Event_lib[self.Event],))
+        thread.daemon = True
+        thread.start()
+        self.thread = thread
+    #Define how to stop Event thread
+    def stop(self):
+        self.persist = False
+        self.thread_stop = True
+        if self.timer is not None:
+            self.timer.cancel()
+        #a stopped Event leaves a synchronized start, the others still start together
+        if isinstance(self.go, Start_Barrier):
+            self.go.leave(self.thread)
+        elif self.go is not None:
+            self.go.set()
+        if self.resumed is not None:
+            self.resumed.set()
+        self.thread.join()
+    #wait for Event to finish
+    def wait(self):
+        self.thread.join()
+
+    #Hold the Event's writes until resume()
+    def pause(self):
+        if self.resumed is None:
+            self.resumed = threading.Event()
+        self.resumed.clear()
+
+    def resume(self):
+        if self.resumed is not None:
+            self.resumed.set()
+
+    #idle before it is run, armed while it waits for its Trigger, then running, paused, stopped or done
+    def state(self):
+        if self.thread is None:
+            return 'idle'
+        if not self.thread.is_alive():
+            return 'stopped' if self.thread_stop else 'done'
+        if self.resumed is not None and not self.resumed.is_set():
+            return 'paused'
+        if isinstance(self.go, threading.Event) and not self.go.is_set():
+            return 'armed'
+        return 'running'
+
+    def __repr__(self):
+        return "Event('{}')".format(self.plc)
+
+#Seconds between the last Event of a synchronized start getting ready and all of them being released
+#gives every waiting thread time to wake up before the instant they all start at
+START_LEAD = 0.01
+
+#Releases the Events of a synchronized start at one perf_counter instant once all of them are connected and ready
+#Used as the go of each Event, see Event.sync_start, and measures the skew of their first writes
+#shared is the (multiprocessing Barrier, Value) of a start spanning worker processes, see join_shards
+class Start_Barrier:
+    def __init__(self, parties, lead=START_LEAD, shared=None):
+        self.parties = parties
+        self.lead = lead
+        self.shared = shared
+        self.cond = threading.Condition()
+        #the threads (or tasks) that are waiting or were released, and the ones that left before the start
+        self.arrived = set()
+        self.left = set()
+        self.instant = None
+        self.aborted = False
+        #thread waiting for the other shards, see join_shards
+        self.joiner = None
+        #first write time of each Event
+        self.first = {}
+
+    #the caller waiting at the barrier, the thread itself since idents are reused once a thread ends
+    def party(self):
+        return threading.current_thread()
+
+    #Wait until every Event is ready, then until the instant they all start at
+    #an Event that left before the start, see leave, returns straight away
+    def wait(self):
+        party = self.party()
+        with self.cond:
+            if party in self.left:
+                return
+            self.arrived.add(party)
+            self.check()
+            while self.instant is None and not self.aborted and party not in self.left:
+                self.cond.wait()
+            instant = self.instant if party not in self.left else None
+        if instant is not None:
+            wait_until(instant)
+
+    #pick the start instant once everything still running has arrived, the caller holds cond
+    #a start spanning worker processes waits for the other shards first, without holding cond
+    def check(self):
+        if self.instant is None and self.joiner is None and len(self.arrived) >= self.parties:
+            if self.shared is not None:
+                self.joiner = threading.Thread(target=self.join_shards)
+                self.joiner.daemon = True
+                self.joiner.start()
+                return
+            self.instant = time.perf_counter() + self.lead
+            self.cond.notify_all()
+
+    #every Event has been started, a shard with none of the start's Events is ready straight away
+    def begin(self):
+        with self.cond:
+            self.check()
+
+    #Wait for every shard to be ready, then release at one instant
+    #the first shard through picks a wall clock time that each shard turns into its own perf_counter instant
+    def join_shards(self):
+        barrier, start = self.shared
+        try:
+            if barrier.wait() == 0:
+                start.value = time.time() + self.lead
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            self.set()
+            return
+        with self.cond:
+            self.instant = time.perf_counter() + (start.value - time.time())
+            self.cond.notify_all()
+
+    #wait until every shard has been released, a shard with none of the start's Events has nothing else to wait for
+    def join(self):
+        if self.joiner is not None:
+            self.joiner.join()
+
+    #an Event is done or stopped, if it has not been released the others stop waiting for it and start without it
+    #party is the Event's thread (or task), the caller's own by default
+    def leave(self, party=None):
+        if party is None:
+            party = self.party()
+        with self.cond:
+            if self.instant is not None or party in self.left:
+                return
+            self.left.add(party)
+            self.arrived.discard(party)
+            self.parties = self.parties - 1
+            self.check()
+            self.cond.notify_all()
+
+    #stopping the whole scenario lets everything waiting go at once, in every shard if they have not been released yet
+    def set(self):
+        with self.cond:
+            self.aborted = True
+            self.cond.notify_all()
+            shared = self.shared if self.instant is None else None
+        if shared is not None:
+            shared[0].abort()
+
+    #record an Event's first write, its delay is taken off so only the skew of the start itself is measured
+    def wrote(self, event, when):
+        delay = event.time_delay[0] if type(event.time_delay) is list else event.time_delay
+        with self.cond:
+            self.first[event] = when - float(delay or 0)
+
+    #Skew of the first writes, the spread across Events and across PLCs using each PLC's first Event to write
+    #returns a dict of times in seconds, or None if nothing was written after the start instant
+    def stats(self):
+        with self.cond:
+            first = dict(self.first)
+            instant = self.instant
+        if instant is None or len(first) == 0:
+            return None
+        plcs = {}
+        for event, when in first.items():
+            key = (event.plc.ip, event.plc.port, event.plc.unit)
+            plcs[key] = min(plcs.get(key, when), when)
+        return {'events':len(first), 'plcs':len(plcs),
+            'event_skew':max(first.values()) - min(first.values()),
+            'plc_skew':max(plcs.values()) - min(plcs.values()),
+            'first_write':min(first.values()) - instant,
+            'last_write':max(first.values()) - instant}
+
+    #print the skew of a finished start
+    def report(self):
+        stats = self.stats()
+        if stats is None:
+            print('Synchronized start: no Event wrote')
+            return None
+        print("Synchronized start of %u Events on %u PLCs: first write skew %.3f ms across PLCs, %.3f ms across Events, first writes %.3f to %.3f ms after release" %
+            (stats['events'], stats['plcs'], 1000*stats['plc_skew'], 1000*stats['event_skew'], 1000*stats['first_write'], 1000*stats['last_write']))
+        return stats
+
+    def __repr__(self):
+        return "Start_Barrier('{}','{}')".format(len(self.arrived), self.parties)
+
+#Trigger condition operators, the first six compare against the trigger value
+#range and outside compare against a low and high value written after them
+CONDITION_OPS = ['>', '<', '>=', '<=', '==', '!=', 'range', 'outside']
+#Marks a register value that could not be read
+MISSING = float('nan')
+
+#Parse one trigger condition written as: [rise|fall] op [low high] [hyst H] [for T]
+#rise/fall make the condition true only on the cycle it turns on/off, hyst is a deadband the value must
+#move back through before the condition turns off, and for is how many seconds it must hold before it is true
+def parse_condition(text):
+    words = str(text).lower().split()
+    edge = ''
+    if len(words) > 0 and words[0] in ['rise', 'fall']:
+        edge = words.pop(0)
+    if len(words) == 0 or words[0] not in CONDITION_OPS:
+        raise ValueError('unknown condition "%s"' % text)
+    op = words.pop(0)
+    low = 0.0
+    high = 0.0
+    hyst = 0.0
+    hold = 0.0
+    try:
+        if op in ['range', 'outside']:
+            low = float(words.pop(0))
+            high = float(words.pop(0))
+        while len(words) > 0:
+            key = words.pop(0)
+            if key == 'hyst':
+                hyst = float(words.pop(0))
+            elif key == 'for':
+                hold = float(words.pop(0))
+            else:
+                raise ValueError('unknown option "%s" in condition "%s"' % (key, text))
+    except IndexError:
+        raise ValueError('missing number in condition "%s"' % text)
+    return edge, op, low, high, hyst, hold
+
+#Compile a logic expression over condition numbers, e.g. (1 and 2) or not 3
+#conditions are numbered from 1 in the order they are listed across all the trigger's PLCs
+def compile_logic(logic, N):
+    if type(logic) is list:
+        logic = ','.join(logic)
+    if logic is None or logic.strip() == '':
+        return None
+    words = {'and':'and', 'or':'or', 'not':'not', '&':'and', '|':'or', '!':'not', '(':'(', ')':')'}
+    expr = []
+    for token in re.findall(r'\d+|[a-z]+|\S', logic.lower()):
+        if token.isdigit():
+            if int(token) < 1 or int(token) > N:
+                raise ValueError('logic refers to condition %s, there are %u' % (token, N))
+            expr.append('c[%u]' % (int(token) - 1))
+        elif token in words:
+            expr.append(words[token])
+        else:
+            raise ValueError('unknown word "%s" in logic "%s"' % (token, logic))
+    try:
+        return compile(' '.join(expr), '<trigger logic>', 'eval')
+    except SyntaxError:
+        raise ValueError('invalid logic "%s"' % logic)
+
+#Trigger conditions compiled once into arrays so every condition of a Trigger is checked in one pass
+#Without a logic expression all conditions must be true
+class Condition_Plan:
+    def __init__(self, conditions, values, logic=None):
+        self.N = len(conditions)
+        op = []
+        edge = []
+        low = []
+        high = []
+        hyst = []
+        hold = []
+        for i in range(self.N):
+            c_edge, c_op, c_low, c_high, c_hyst, c_hold = parse_condition(conditions[i])
+            op.append(CONDITION_OPS.index(c_op))
+            edge.append(['', 'rise', 'fall'].index(c_edge))
+            low.append(c_low)
+            high.append(c_high)
+            hyst.append(c_hyst)
+            hold.append(c_hold)
+        self.logic = compile_logic(logic, self.N)
+        value = [float(x) for x in values]
+
+        if np is not None:
+            op = np.array(op)
+            #masks for each operator are worked out once
+            self.masks = [op == i for i in range(len(CONDITION_OPS))]
+            self.upper = self.masks[0] | self.masks[2]
+            self.lower = self.masks[1] | self.masks[3]
+            edge = np.array(edge)
+            self.rise = edge == 1
+            self.fall = edge == 2
+            self.value = np.array(value)
+            self.low = np.array(low)
+            self.high = np.array(high)
+            self.hyst = np.array(hyst)
+            self.hold = np.array(hold)
+            self.state = np.zeros(self.N, dtype=bool)
+            self.held = np.zeros(self.N, dtype=bool)
+            self.since = np.zeros(self.N)
+        else:
+            self.op = op
+            self.edge = edge
+            self.value = value
+            self.low = low
+            self.high = high
+            self.hyst = hyst
+            self.hold = hold
+            self.state = [False for i in range(self.N)]
+            self.held = [False for i in range(self.N)]
+            self.since = [0.0 for i in range(self.N)]
+        self.result = None
+
+    #Check the latest values, missing values keep their condition's last state
+    #returns True when the Trigger's conditions are met
+    def evaluate(self, values, now=None):
+        if now is None:
+            now = time.monotonic()
+        if np is None:
+            result = [self.evaluate_one(i, values[i], now) for i in range(self.N)]
+        else:
+            result = self.evaluate_array(np.asarray(values, dtype=float), now)
+        self.result = result
+
+        if self.logic is None:
+            return bool(all(result))
+        return bool(eval(self.logic, {'__builtins__':{}}, {'c':result}))
+
+    #How far each value is from changing its condition, the gap to the trigger value or the nearest end of a range
+    #!= conditions and missing values have no distance and are nan
+    def distance(self, values):
+        if np is None:
+            distance = []
+            for i in range(self.N):
+                op = CONDITION_OPS[self.op[i]]
+                v = float(values[i])
+                if op == '!=':
+                    distance.append(MISSING)
+                elif op in ['range', 'outside']:
+                    distance.append(min(abs(v - self.low[i]), abs(v - self.high[i])))
+                else:
+                    distance.append(abs(v - self.value[i]))
+            return distance
+        v = np.asarray(values, dtype=float)
+        distance = np.where(self.masks[6] | self.masks[7], np.minimum(np.abs(v - self.low), np.abs(v - self.high)), np.abs(v - self.value))
+        return np.where(self.masks[5], np.nan, distance).tolist()
+
+    #Vectorized check of every condition
+    def evaluate_array(self, v, now):
+        m = self.masks
+        raw = np.select(m, [v > self.value, v < self.value, v >= self.value, v <= self.value, v == self.value, v != self.value,
+            (v >= self.low) & (v <= self.high), (v < self.low) | (v > self.high)], False)
+
+        #with hysteresis a condition stays on until the value moves back past the deadband
+        release = np.select([self.upper, self.lower, m[6]], [v < self.value - self.hyst, v > self.value + self.hyst,
+            (v < self.low - self.hyst) | (v > self.high + self.hyst)], ~raw)
+        state = np.where(self.hyst > 0, raw | (self.state & ~release), raw)
+        state = np.where(np.isnan(v), self.state, state)
+
+        #debounce, the condition has to stay on for hold seconds
+        self.since = np.where(state & ~self.state, now, self.since)
+        held = state & ((self.hold <= 0) | (now - self.since >= self.hold))
+
+        result = np.where(self.rise, held & ~self.held, np.where(self.fall, self.held & ~held, held))
+        self.state = state
+        self.held = held
+        return result
+
+    #Check one condition, used when NumPy is not installed
+    def evaluate_one(self, i, v, now):
+        op = CONDITION_OPS[self.op[i]]
+        state = self.state[i]
+        if v == v:
+            value = self.value[i]
+            hyst = self.hyst[i]
+            if op == '>':
+                raw = v > value
+                release = v < value - hyst
+            elif op == '<':
+                raw = v < value
+                release = v > value + hyst
+            elif op == '>=':
+                raw = v >= value
+                release = v < value - hyst
+            elif op == '<=':
+                raw = v <= value
+                release = v > value + hyst
+            elif op == '==':
+                raw = v == value
+                release = not raw
+            elif op == '!=':
+                raw = v != value
+                release = not raw
+            elif op == 'range':
+                raw = v >= self.low[i] and v <= self.high[i]
+                release = v < self.low[i] - hyst or v > self.high[i] + hyst
+            else:
+                raw = v < self.low[i] or v > self.high[i]
+                release = not raw
+            if hyst > 0:
+                state = raw or (self.state[i] and not release)
+            else:
+                state = raw
+
+        if state and not self.state[i]:
+            self.since[i] = now
+        held = state and (self.hold[i] <= 0 or now - self.since[i] >= self.hold[i])
+
+        if self.edge[i] == 1:
+            result = held and not self.held[i]
+        elif self.edge[i] == 2:
+            result = self.held[i] and not held
+        else:
+            result = held
+        self.state[i] = state
+        self.held[i] = held
+        return result
+
+    def __repr__(self):
+        return "Condition_Plan('{}')".format(self.N)
+
+#Slowest and fastest adaptive poll rates in polls per second
+POLL_MIN_RATE = 0.5
+POLL_MAX_RATE = 100.0
+#An adaptive Trigger polls at least this many times in the time a value could take to reach its trigger value
+POLL_LOOKAHEAD = 4
+#How much an adaptive Trigger slows down each poll its values do not move
+POLL_BACKOFF = 1.5
+
+#How often a Trigger reads its PLCs
+#rate polls that many times per second, adaptive works the rate out from the values, otherwise it polls as fast as the PLCs answer
+#Adaptive polling speeds up as values move towards their trigger values and backs off while they are far away or still
+class Poll_Policy:
+    def __init__(self, rate=0, adaptive=False, min_rate=POLL_MIN_RATE, max_rate=POLL_MAX_RATE):
+        self.rate = rate
+        self.adaptive = adaptive
+        self.min_interval = 1.0/max_rate
+        self.max_interval = 1.0/min_rate
+        self.reset()
+
+    #forget the last values, for a Trigger starting again
+    def reset(self):
+        self.current = self.min_interval
+        self.last = None
+        self.last_time = None
+        self.polls = 0
+        self.started = None
+
+    #True if the Trigger waits between polls
+    def throttled(self):
+        return self.adaptive or self.rate > 0
+
+    #Seconds until the next poll after checking values at now, plan is the Trigger's Condition_Plan
+    def interval(self, plan, values, now):
+        self.polls = self.polls + 1
+        if self.started is None:
+            self.started = now
+        if not self.adaptive:
+            return 1.0/self.rate if self.rate > 0 else 0.0
+
+        distance = plan.distance(values)
+        interval = None
+        for i in range(len(distance)):
+            d = distance[i]
+            if d != d:
+                continue
+            #a condition that is on, or right on its trigger value, may be about to change the result
+            if d == 0 or plan.state[i]:
+                interval = self.min_interval
+                break
+            if self.last is not None and self.last[i] == self.last[i] and now > self.last_time:
+                speed = abs(values[i] - self.last[i])/(now - self.last_time)
+                if speed > 0:
+                    reach = d/speed/POLL_LOOKAHEAD
+                    interval = reach if interval is None else min(interval, reach)
+        #nothing is moving, slow down a step at a time
+        if interval is None:
+            interval = self.current*POLL_BACKOFF
+        self.current = min(max(interval, self.min_interval), self.max_interval)
+        self.last = list(values)
+        self.last_time = now
+        return self.current
+
+    #polls per second since the first poll
+    def effective_rate(self, now):
+        if self.started is None or now <= self.started:
+            return 0.0
+        return (self.polls - 1)/(now - self.started)
+
+    def __repr__(self):
+        if self.adaptive:
+            return "Poll_Policy('adaptive','{}','{}')".format(1.0/self.max_interval,1.0/self.min_interval)
+        return "Poll_Policy('{}')".format(self.rate)
+
+#Polls every register any Trigger watches on one PLC, reading each address once per cycle
+#Contiguous addresses are read in blocks and the values are published to all subscribed Triggers
+class Poller:
+    #values come from reading the PLC in this process
+    remote = False
+
+    def __init__(self, PLC):
+        self.plc = PLC
+        self.cond = threading.Condition()
+        self.watch = {}
+        self.mem_addr = []
+        self.mem_format = []
+        self.blocks = []
+        self.plan = 0
+        self.values = []
+        self.values_plan = 0
+        self.cycle = 0
+        self.subscribers = 0
+        #subscribers that ask for each read, and the ones waiting for one
+        #the poller only reads nonstop while some subscriber does not ask
+        self.throttled = set()
+        self.wanted = set()
+        self.reading = False
+        self.thread = None
+        self.thread_stop = False
+
+    #Add memory addresses to the watch list, use subscribe_poller() so a stopping poller is not reused
+    #a subscriber that will ask for its reads is given so the poller does not read nonstop before its first request
+    #returns the plan number the addresses first show up in and the index of each address in the published values
+    def subscribe(self, mem_addr, mem_format, subscriber=None):
+        with self.cond:
+            indexes = []
+            replan = False
+            for i in range(len(mem_addr)):
+                key = (int(mem_addr[i]), mem_format[i])
+                if key not in self.watch:
+                    self.watch[key] = len(self.mem_addr)
+                    self.mem_addr.append(key[0])
+                    self.mem_format.append(key[1])
+                    replan = True
+                indexes.append(self.watch[key])
+            self.subscribers = self.subscribers + 1
+            if subscriber is not None:
+                self.throttled.add(subscriber)
+            if replan:
+                self.plan = self.plan + 1
+                self.replan()
+            #a subscriber that does not ask wakes a loop waiting for requests
+            self.cond.notify_all()
+            self.start()
+            return self.plan, indexes
+
+    #plan the block reads for the watched addresses, called holding cond
+    def replan(self):
+        self.blocks = self.plc.plan_read(self.mem_addr, self.mem_format)
+
+    #start the poll loop if it is not running, called holding cond
+    def start(self):
+        if self.thread is None:
+            self.thread_stop = False
+            self.thread = threading.Thread(target=self.loop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    #Remove a subscriber, the poller stops when nothing is subscribed
+    def unsubscribe(self, subscriber=None):
+        with POLLERS_LOCK:
+            with self.cond:
+                self.throttled.discard(subscriber)
+                self.wanted.discard(subscriber)
+                self.subscribers = self.subscribers - 1
+                if self.subscribers > 0:
+                    return
+                self.thread_stop = True
+                self.cond.notify_all()
+            if POLLERS.get(self.plc) is self:
+                del POLLERS[self.plc]
+
+    #Ask for a read by a subscriber that polls at its own rate
+    #returns the last cycle started before the request, wait for a cycle after it
+    def request(self, subscriber):
+        with self.cond:
+            self.throttled.add(subscriber)
+            self.wanted.add(subscriber)
+            self.cond.notify_all()
+            if self.reading:
+                return self.cycle + 1
+            return self.cycle
+
+    #A subscriber starts or stops asking for its reads
+    def ask(self, subscriber, asks):
+        with self.cond:
+            if asks:
+                self.throttled.add(subscriber)
+            else:
+                self.throttled.discard(subscriber)
+                self.wanted.discard(subscriber)
+            self.cond.notify_all()
+
+    #Wait for values from a cycle after last that include the addresses of plan
+    #Returns early when the Trigger is stopping, returns the cycle number and all published values
+    def wait(self, last, plan, trigger):
+        with self.cond:
+            while (self.cycle <= last or self.values_plan < plan) and not self.thread_stop and not trigger.thread_stop:
+                self.cond.wait()
+            return self.cycle, self.values
+
+    #Wake every waiting Trigger so it can check if it is stopping
+    def wake(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    #Poll loop, one read of every watched block per cycle
+    #Reads nonstop while any subscriber does not ask for reads, otherwise only when asked
+    def loop(self):
+        PLC = self.plc
+        PLC.connect()
+        while True:
+            with self.cond:
+                while not self.thread_stop and self.subscribers <= len(self.throttled) and len(self.wanted) == 0:
+                    self.cond.wait()
+                if self.thread_stop:
+                    break
+                self.wanted.clear()
+                self.reading = True
+                blocks = self.blocks
+                plan = self.plan
+                N = len(self.mem_addr)
+
+            PLC.check()
+            try:
+                values = PLC.read_blocks(blocks)
+            except:
+                values = [None for i in range(N)]
+
+            with self.cond:
+                self.values = values
+                self.values_plan = plan
+                self.cycle = self.cycle + 1
+                self.reading = False
+                self.cond.notify_all()
+        PLC.close()
+
+    def __repr__(self):
+        return "Poller('{}')".format(self.plc)
+
+#Poller for a PLC owned by another worker process in a sharded run
+#The owner polls the watched addresses and sends each cycle of values here over the shard link
+#While every subscriber here asks for its reads the requests are passed on, so the owner polls at their rates
+class Remote_Poller(Poller):
+    remote = True
+
+    def __init__(self, PLC, link, number):
+        Poller.__init__(self, PLC)
+        self.link = link
+        self.number = number
+        #whether the owner was last told every subscriber here asks for its reads
+        self.asks = False
+        link.remotes[number] = self
+
+    #ask the owner to poll the new watch list, called holding cond
+    def replan(self):
+        self.asks = self.subscribers <= len(self.throttled)
+        self.link.send(self.number, ('subscribe', self.link.shard, self.number, self.plan, list(self.mem_addr), list(self.mem_format), self.asks))
+
+    #tell the owner when the subscribers here start or stop all asking for their reads, called holding cond
+    def throttle(self):
+        asks = self.subscribers <= len(self.throttled)
+        if asks != self.asks:
+            self.asks = asks
+            self.link.send(self.number, ('throttle', self.link.shard, self.number, asks))
+
+    #nothing to start, values arrive through publish()
+    def start(self):
+        pass
+
+    def subscribe(self, mem_addr, mem_format, subscriber=None):
+        plan, indexes = Poller.subscribe(self, mem_addr, mem_format, subscriber)
+        with self.cond:
+            self.throttle()
+        return plan, indexes
+
+    def unsubscribe(self, subscriber=None):
+        Poller.unsubscribe(self, subscriber)
+        if self.thread_stop:
+            self.link.send(self.number, ('unsubscribe', self.link.shard, self.number))
+            if self.link.remotes.get(self.number) is self:
+                del self.link.remotes[self.number]
+        else:
+            with self.cond:
+                self.throttle()
+
+    #pass a read request on to the owner, the next values published come from a read after it
+    def request(self, subscriber):
+        with self.cond:
+            self.throttled.add(subscriber)
+            self.throttle()
+            if self.asks:
+                self.link.send(self.number, ('request', self.link.shard, self.number))
+            return self.cycle
+
+    #values from the owner for the watch list of plan
+    def publish(self, plan, values):
+        with self.cond:
+            self.values = values
+            self.values_plan = plan
+            self.cycle = self.cycle + 1
+            self.cond.notify_all()
+
+    def __repr__(self):
+        return "Remote_Poller('{}','{}')".format(self.plc,self.link.shards[self.number])
+
+#One poller per PLC shared by every Trigger watching that PLC
+POLLERS = {}
+POLLERS_LOCK = threading.Lock()
+#Link to the other worker processes when running sharded, see shard_worker
+SHARD_LINK = None
+
+#Subscribe memory addresses to the shared poller for a PLC, starting one if needed
+#subscriber is given when it asks for its own reads, see Poller.request
+#returns the poller, the plan number and the index of each address in the published values
+def subscribe_poller(PLC, mem_addr, mem_format, subscriber=None):
+    with POLLERS_LOCK:
+        if PLC not in POLLERS:
+            #PLCs owned by another worker are polled there
+            if SHARD_LINK is not None and SHARD_LINK.remote(PLC):
+                POLLERS[PLC] = Remote_Poller(PLC, SHARD_LINK, SHARD_LINK.numbers[PLC])
+            else:
+                POLLERS[PLC] = Poller(PLC)
+        poller = POLLERS[PLC]
+        plan, indexes = poller.subscribe(mem_addr, mem_format, subscriber)
+        return poller, plan, indexes
+
+#define trigger class that will launch Event when conditions are met        
+class Trigger:
+    #Triggers are numbered in the order they are made unless they are given a name
+    numbers = itertools.count(1)
+    __slots__ = ('plc', 'Event', 'name', 'metrics', 'trigger_mem', 'mem_alloc', 'trigger_format', 'trigger_value', 'trigger_conditions', 'thread_stop',
+        'threaded', 'pollers', 'logic', 'plan', 'prearm', 'poll', 'resumed', 'fired', 'fired_at')
+
+    def __init__(self, Event, name=None):
+        self.plc = []
+        self.Event = Event
+        self.name = str(next(Trigger.numbers)) if name is None else name
+        self.metrics = METRICS.new('trigger', self.name)
+        self.trigger_mem = []
+        self.mem_alloc = []
+        self.trigger_format = []
+        self.trigger_value = []
+        self.trigger_conditions = []
+        self.thread_stop = False
+        self.threaded = None
+        self.pollers = []
+        self.logic = None
+        self.plan = None
+        #arm the Event before polling so it is connected and encoded when the Trigger fires
+        self.prearm = True
+        #how often the PLCs are read, as fast as they answer by default
+        self.poll = Poll_Policy()
+        #made the first time the Trigger is paused, cleared while it is paused
+        self.resumed = None
+        self.fired = False
+        self.fired_at = None
+    
+    #define method to set all trigger options
+    def set_trigger(self, **kwargs):
+        options = {
+            'plc':self.plc,
+            'Event':self.Event,
+            'mem_alloc':self.mem_alloc,
+            'trigger_mem':self.trigger_mem,
+            'trigger_format':self.trigger_format,
+            'trigger_value':self.trigger_value,
+            'trigger_conditions':self.trigger_conditions,
+            'logic':self.logic,
+            'prearm':self.prearm,
+            'poll':self.poll }
+        options.update(kwargs)
+
+        #memory format checking
+        if len(options['trigger_format'])==0:
+            if type(options['plc']) is list:
+                plc = options['plc'][-1]
+            else:
+                plc = options['plc']
+            self.trigger_mem = [plc.Mem_default for i in range(len(options['trigger_mem']))]
+
+        elif len(options['trigger_format']) != len(options['trigger_mem']):
+            self.trigger_mem.append([options['trigger_format'][-1] for i in range(len(options['trigger_mem'])-len(options['trigger_format']))])
+            print('Wrong number of format elements, rest set to last format')
+
+        else:
+            self.trigger_mem.append(options['trigger_mem'])
+
+        self.plc = options['plc']
         self.Event = options['Event']
         self.mem_alloc = options['mem_alloc']
         self.trigger_mem = options['trigger_mem']
         self.trigger_format = options['trigger_format']
         self.trigger_value = options['trigger_value']
         self.trigger_conditions = options['trigger_conditions']
+        self.logic = options['logic']
+        self.prearm = options['prearm']
+        self.poll = options['poll']
 
     #Method to set up new PLCs and conditions on that PLC
-    def set_plc(self, PLC, mem_addr, conditions, values):
+    #formats gives the memory format of each address, they default to the PLC's
+    def set_plc(self, PLC, mem_addr, conditions, values, formats=None):
         #check to make sure there are values for each input
         if PLC is None:
             print('Must include PLC!')
@@ -474,6 +3396,7 @@ class Trigger:
         #append memory ranges
         for i in range(len(mem_addr)):
             self.trigger_mem.append(mem_addr[i]) 
+            self.trigger_format.append(formats[i] if formats and i < len(formats) else PLC.Mem_default)
 
         #memory allocation tells the program which memory values in the list go to which PLC
         if type(self.mem_alloc) is list and len(self.mem_alloc) == 0:
@@ -485,7 +3408,7 @@ class Trigger:
         
         #set conditions for starting Event
         if type(conditions) is list and len(conditions) < len(mem_addr):
-            conditions.append([conditions[-1] for i in range(len(mem_addr)-len(conditions))])
+            conditions.extend([conditions[-1] for i in range(len(mem_addr)-len(conditions))])
             for i in range(len(conditions)):
                 self.trigger_conditions.append(conditions[i])
         elif type(conditions) is not list and type(mem_addr) is list and len(mem_addr) > 1:
@@ -498,10 +3421,9 @@ class Trigger:
         
         #set values for conditional chceks
         if type(values) is list and len(values) < len(mem_addr):
-            values.append([values[-1] for i in range(len(mem_addr)-len(values))])
+            values.extend([values[-1] for i in range(len(mem_addr)-len(values))])
             for i in range(len(values)):
                 self.trigger_value.append(values[i])
-            self.trigger_value.append(values)
         elif type(values) is not list and type(mem_addr) is list and len(mem_addr) > 1:
             values = [values for i in range(len(mem_addr))]
             for i in range(len(values)):
@@ -510,361 +3432,2112 @@ class Trigger:
             for i in range(len(values)):
                 self.trigger_value.append(values[i])
     
+    #Check trigger settings for errors and compile the conditions
+    def check(self):
+        Error_Check = True
+        if len(self.trigger_value) != len(self.trigger_mem) or len(self.trigger_value) != len(self.trigger_conditions):
+            Error_Check=False
+            print('Incorrect number of arguments.')
+        else:
+            try:
+                self.plan = Condition_Plan(self.trigger_conditions, self.trigger_value, self.logic)
+            except ValueError as error:
+                Error_Check=False
+                print('Trigger condition error: %s' % error)
+        #if sum(self.mem_alloc) != len(self.trigger_mem):
+        #    Error_Check=False
+        #    print('Memory allocation does not match number of memory addresses.')
+        return Error_Check
+
+    #work out which PLC and memory addresses go together
+    #returns a list of (PLC, first memory index, end memory index)
+    def plc_ranges(self):
+        #figure out the number of PLCs
+        if type(self.plc) is not list:
+            N_PLC = 1
+        else:
+            N_PLC = len(self.plc)
+
+        PLCS = []
+        for i in range(N_PLC):
+            # find the correct way to pull PLCs from the list of PLCs
+            if type(self.plc) is not list:
+                PLC = self.plc
+            elif N_PLC == 1:
+                PLC = self.plc[0]
+            else:
+                PLC = self.plc[i]
+
+            # find correct way to pull memory addresses
+            N_mem = 0 
+            if i > 0:
+                for n in range(0,i+1):
+                    N_mem = N_mem + self.mem_alloc[n]
+            else:
+                N_mem = self.mem_alloc[0]
+
+            if N_PLC == 1:
+                N_mem_s = 0
+            else:
+                N_mem_s = N_mem - self.mem_alloc[i]
+
+            PLCS.append((PLC, N_mem_s, N_mem))
+        return PLCS
+
+    #memory formats of the watched addresses on one PLC, the PLC default unless every address has one
+    def formats(self, PLC, N_mem_s, N_mem):
+        if len(self.trigger_format) == len(self.trigger_mem):
+            return [self.trigger_format[m] for m in range(N_mem_s, N_mem)]
+        return [PLC.Mem_default for m in range(N_mem_s, N_mem)]
+
+    #plan the block reads for each PLC once
+    #returns a list of (PLC, first memory index, end memory index, read blocks)
+    def plan_reads(self):
+        PLCS = []
+        for PLC, N_mem_s, N_mem in self.plc_ranges():
+            mem = [int(self.trigger_mem[m]) for m in range(N_mem_s, N_mem)]
+            PLCS.append((PLC, N_mem_s, N_mem, PLC.plan_read(mem, self.formats(PLC, N_mem_s, N_mem))))
+        return PLCS
+
+    #subscribe the watched memory addresses to each PLC's shared poller
+    #returns a list of (PLC, first memory index, end memory index, poller, poller plan, value indexes)
+    def subscribe(self):
+        PLCS = []
+        self.pollers = []
+        #a Trigger with a poll rate asks for its reads
+        subscriber = self if self.poll.throttled() else None
+        for PLC, N_mem_s, N_mem in self.plc_ranges():
+            mem = [int(self.trigger_mem[m]) for m in range(N_mem_s, N_mem)]
+            poller, plan, indexes = subscribe_poller(PLC, mem, self.formats(PLC, N_mem_s, N_mem), subscriber)
+            PLCS.append((PLC, N_mem_s, N_mem, poller, plan, indexes))
+            self.pollers.append(poller)
+        return PLCS
+
+    #put the values read from one PLC in the value table, failed reads are marked missing
+    def fill(self, VAL, PLC, N_mem_s, N_mem, Read_VAL):
+        #loop over all PLC memory addresses for this PLC
+        for m in range(N_mem_s, N_mem):
+            #if the read fails, the condition keeps its last state
+            if Read_VAL[m - N_mem_s] is None:
+                print("Read Failed on PLC IP: %s Mem Address %u" % (PLC.ip, self.trigger_mem[m]))
+                VAL[m] = MISSING
+            else:
+                VAL[m] = Read_VAL[m - N_mem_s]
+
     #define the thread for the trigger
     def thread(self):
-        Error_Check = True
         #error checking
+        Error_Check = self.check()
+
+        #value table setup
+        VAL = [MISSING for i in range(len(self.trigger_mem))]
+        
+        fired = False
+        armed = False
+        #if no errors start loop
+        if Error_Check == True:
+            #the Event connects and encodes while the Trigger polls, so firing only has to release it
+            if self.prearm:
+                self.Event.arm()
+                armed = True
+
+            #registers are read by each PLC's shared poller, which reads every watched address once per cycle
+            PLCS = self.subscribe()
+            cycles = [0 for i in range(len(PLCS))]
+            #borrow the PLC connections once, they stay open until the Event is done
+            #PLCs polled by another worker process are not connected here
+            for PLC, N_mem_s, N_mem, poller, plan, indexes in PLCS:
+                if not poller.remote:
+                    PLC.connect()
+
+            self.poll.reset()
+            throttled = self.poll.throttled()
+            due = time.perf_counter()
+            stop = lambda: self.thread_stop
+            while True:
+                #a paused Trigger stops polling
+                resumed = self.resumed
+                if resumed is not None and not resumed.is_set():
+                    resumed.wait()
+                    due = time.perf_counter()
+                #a Trigger with a poll rate asks its pollers for a read when it is due
+                if throttled:
+                    if not wait_until(due, stop):
+                        break
+                    for i in range(len(PLCS)):
+                        cycles[i] = max(cycles[i], PLCS[i][3].request(self))
+
+                #begin loop to check all PLCs
+                for i in range(len(PLCS)):
+                    PLC, N_mem_s, N_mem, poller, plan, indexes = PLCS[i]
+                    #wait for the next set of values from the poller
+                    cycles[i], values = poller.wait(cycles[i], plan, self)
+                    if self.thread_stop:
+                        break
+                    Read_VAL = [values[n] for n in indexes]
+                    self.fill(VAL, PLC, N_mem_s, N_mem, Read_VAL)
+
+                #if the conditions are met or we are stopping the thready, break out of loop
+                self.metrics.count('checks')
+                if self.thread_stop:
+                    break
+                if self.plan.evaluate(VAL):
+                    fired = True
+                    self.fire()
+                    break
+                if throttled:
+                    now = time.perf_counter()
+                    interval = self.poll.interval(self.plan, VAL, now)
+                    self.metrics.observe('poll_interval', interval)
+                    due = now + interval
+
+            for PLC, N_mem_s, N_mem, poller, plan, indexes in PLCS:
+                poller.unsubscribe(self)
+            self.report_polls()
+
+        #if we are not stoping the thread, start the Event
+        if fired:
+            if not armed:
+                self.Event.run()
+            self.Event.wait()
+        elif armed:
+            self.Event.stop()
+
+        if Error_Check == True:
+            for PLC, N_mem_s, N_mem, poller, plan, indexes in PLCS:
+                if not poller.remote:
+                    PLC.close()
+
+    #print how often a Trigger with a poll rate read its PLCs
+    def report_polls(self):
+        if self.poll.throttled() and self.poll.polls > 1:
+            print("Trigger %s polled %u times at %.2f/s (%r)" % (self.name, self.poll.polls, self.poll.effective_rate(time.perf_counter()), self.poll))
+
+    #Count the Trigger firing and mark the time so the Event can measure how long its first write took
+    #fired_at keeps the perf_counter time it fired, the benchmark times reactions with it
+    #An armed Event is released straight away
+    def fire(self):
+        self.fired = True
+        self.fired_at = time.perf_counter()
+        self.metrics.count('fires')
+        self.Event.fired = (self, self.fired_at)
+        if self.Event.go is not None:
+            self.Event.release()
+
+    #define how to run trigger thread
+    def run(self):
+        self.thread_stop = False
+        self.fired = False
+        self.fired_at = None
+        threaded = threading.Thread(target=self.thread)
+        threaded.daemon = True
+        threaded.start()
+        self.threaded = threaded
+
+    #define how to stop thread
+    def stop(self):
+        self.thread_stop = True
+        if self.resumed is not None:
+            self.resumed.set()
+        for poller in self.pollers:
+            poller.wake()
+        self.threaded.join()
+
+    #wait for trigger thread to finish
+    def wait(self):
+        self.threaded.join()
+
+    #Stop polling until resume(), an Event it already started keeps going
+    def pause(self):
+        if self.resumed is None:
+            self.resumed = threading.Event()
+        self.resumed.clear()
+
+    def resume(self):
+        if self.resumed is not None:
+            self.resumed.set()
+
+    #idle before it is run, then polling, paused, fired while its Event runs, stopped or done
+    def state(self):
+        if self.threaded is None:
+            return 'idle'
+        if not self.threaded.is_alive():
+            return 'stopped' if self.thread_stop else 'done'
+        if self.fired:
+            return 'fired'
+        if self.resumed is not None and not self.resumed.is_set():
+            return 'paused'
+        return 'polling'
+
+    def __repr__(self):
+        return "Trigger('{}')".format(self.Event)
+
+    #debug settings printer
+    def show(self):
+        print("PLC: " + str(self.plc))
+        print("Trigger Conditions: " + str(self.trigger_conditions))
+        print("Trigger Values: " + str(self.trigger_value))
+        print("Trigger Memory: " + str(self.trigger_mem))
+        print("Trigger Logic: " + str(self.logic))
+
+#Async version of a modbus PLC used by the asyncio engine
+#It wraps a configured MB_PLC and keeps the .connect(), .close(), .write(), and .read() contract as coroutines
+class Async_MB_PLC:
+
+    def __init__(self, PLC, timeout=None):
+        #the async client is only needed when the asyncio engine is used
+        from pymodbus.client import AsyncModbusTcpClient
+        self.plc = PLC
+        self.ip = PLC.ip
+        self.port = PLC.port
+        if SIMULATOR is not None:
+            self.client = SIMULATOR.async_client(PLC.ip, PLC.port)
+        elif timeout is None:
+            self.client = AsyncModbusTcpClient(PLC.ip, port=PLC.port)
+        else:
+            self.client = AsyncModbusTcpClient(PLC.ip, port=PLC.port, timeout=timeout)
+        self.mlock = asyncio.Lock()
+
+    #Define how to connect with PLC, Events and Triggers on the same PLC share one connection
+    async def connect(self):
+        async with self.mlock:
+            if self.client.connected:
+                return
+            if not await self.client.connect():
+                print("Failed to connect to %s\n" % self.ip)
+
+    #Define how to read values from PLCs
+    async def read(self, mem_addr, formating=None):
+        codec = self.plc.codec(formating)
+        coils = codec.format == COIL_FORMAT
+        results = await self.read_registers(mem_addr, codec.count, coils)
+        return codec.decode(self.plc.result_registers(results, codec.count, coils))
+
+    #Define how to read a block of raw registers from PLC, see MB_PLC.read_registers
+    async def read_registers(self, mem_addr, count, coils=False):
+        metrics = self.plc.metrics
+        waited = time.perf_counter()
+        async with self.mlock:
+            sent = time.perf_counter()
+            try:
+                if coils:
+                    results = await self.client.read_coils(mem_addr,count,slave=self.plc.unit)
+                else:
+                    results = await self.client.read_holding_registers(mem_addr,count,slave=self.plc.unit)
+            except Exception:
+                results = None
+        metrics.observe('lock_wait', sent - waited)
+        metrics.observe('read', time.perf_counter() - sent)
+        metrics.count('reads')
+        if results is None or results.isError():
+            metrics.count('read_errors')
+        return results
+
+    #Read a planned set of blocks, see MB_PLC.read_blocks
+    async def read_blocks(self, blocks):
+        values = [None for i in range(plan_size(blocks))]
+
+        for block in blocks:
+            results = await self.read_registers(block.start, block.count, block.coils)
+            if results is None or results.isError():
+                if len(block.items) > 1:
+                    for idx, offset, formating in block.items:
+                        try:
+                            values[idx] = await self.read(block.start + offset, formating)
+                        except Exception:
+                            values[idx] = None
+                continue
+            self.plc.block_values(block, self.plc.result_registers(results, block.count, block.coils), values)
+
+        return values
+
+    #define how to write to registers
+    async def write(self, mem_addr, value, formating=None):
+        return await self.write_registers(mem_addr, self.plc.encode(value, formating), coils=formating == COIL_FORMAT)
+
+    #Define how to write a block of raw registers to PLC, see MB_PLC.write_registers
+    async def write_registers(self, mem_addr, payload, coils=False):
+        policy = self.plc.retry
+        connection = self.plc.connection
+        result = Write_Result()
+        start = time.monotonic()
+
+        while connection.allow(policy):
+            result.attempts = result.attempts + 1
+            waited = time.perf_counter()
+            async with self.mlock:
+                sent = time.perf_counter()
+                try:
+                    if coils:
+                        Check_write = await self.client.write_coils(mem_addr, [bool(value) for value in payload], slave=self.plc.unit)
+                    else:
+                        Check_write = await self.client.write_registers(mem_addr, payload, slave=self.plc.unit)
+                    result.ok = not Check_write.isError()
+                    result.error = None if result.ok else str(Check_write)
+                except Exception as error:
+                    result.error = str(error) or type(error).__name__
+            self.plc.metrics.observe('lock_wait', sent - waited)
+            self.plc.metrics.observe('write', time.perf_counter() - sent)
+
+            if result.ok or result.attempts >= policy.attempts:
+                break
+            delay = policy.backoff(result.attempts)
+            if policy.deadline is not None and time.monotonic() - start + delay > policy.deadline:
+                break
+            await asyncio.sleep(delay)
+            if not self.client.connected:
+                await self.connect()
+
+        result.elapsed = time.monotonic() - start
+        self.plc.finish_write(mem_addr, payload, result, coils)
+        return result
+
+    #Write a block of registers only if the PLC does not already hold the payload, see MB_PLC.write_changed
+    async def write_changed(self, mem_addr, payload, verify=False, refresh=0, coils=False):
+        current = None
+        if verify:
+            results = await self.read_registers(mem_addr, len(payload), coils)
+            current = [] if results is None or results.isError() else self.plc.result_registers(results, len(payload), coils)
+        if self.plc.needs_write(mem_addr, payload, current, refresh, coils):
+            return await self.write_registers(mem_addr, payload, coils=coils)
+        return None
+
+    #Write a planned set of blocks, see MB_PLC.write_blocks
+    async def write_blocks(self, blocks, values):
+        return [await self.write_registers(block.start, self.plc.block_payload(block, values), coils=block.coils) for block in blocks]
+
+    #define how to close connection to PLC
+    def close(self):
+        self.client.close()
+
+    def __repr__(self):
+        return "Async_MB_PLC('{}','{}')".format(self.ip,self.port)
+
+#Start_Barrier for the asyncio engine, Events are tasks on one loop so waiting is done with an asyncio.Event
+class Async_Start_Barrier(Start_Barrier):
+    def __init__(self, parties, lead=START_LEAD):
+        Start_Barrier.__init__(self, parties, lead)
+        self.ready = asyncio.Event()
+
+    def party(self):
+        return asyncio.current_task()
+
+    async def wait(self):
+        with self.cond:
+            self.arrived.add(self.party())
+            self.check()
+        await self.ready.wait()
+        if self.instant is not None:
+            await asyncio.sleep(max(0, self.instant - time.perf_counter()))
+
+    def check(self):
+        if self.instant is None and len(self.arrived) >= self.parties:
+            self.instant = time.perf_counter() + self.lead
+            self.ready.set()
+
+    def set(self):
+        self.aborted = True
+        self.ready.set()
+
+    def __repr__(self):
+        return "Async_Start_Barrier('{}','{}')".format(len(self.arrived), self.parties)
+
+#asyncio engine that runs Events and Triggers as tasks on one event loop instead of a thread each
+#timeout cancels the whole scenario after that many seconds, request_timeout is passed to each modbus client
+class Async_Engine:
+    def __init__(self, timeout=None, request_timeout=None):
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        self.PLCS = {}
+        self.tasks = []
+        self.loop = None
+        self.barrier = None
+
+    #find the async PLC for a MB_PLC, one async client is shared by everything using that PLC
+    def plc(self, PLC):
+        if PLC not in self.PLCS:
+            self.PLCS[PLC] = Async_MB_PLC(PLC, self.request_timeout)
+        return self.PLCS[PLC]
+
+    #'single' type Event, see Event.single
+    #Wait for an armed Event's Trigger, then the time delay, see Event.start_wait
+    async def start_wait(self, event, go):
+        if go is not None:
+            await go.wait()
+        if event.time_delay != 0:
+            await asyncio.sleep(event.time_delay)
+            fired = event.fired
+            if fired is not None:
+                event.fired = (fired[0], time.perf_counter())
 
-        if len(self.trigger_value) != len(self.trigger_mem) or len(self.trigger_value) != len(self.trigger_conditions):
-            Error_Check=False
-            print('Incorrect number of arguments.')
-        #if sum(self.mem_alloc) != len(self.trigger_mem):
-        #    Error_Check=False
-        #    print('Memory allocation does not match number of memory addresses.')
+    #go is set by the Trigger of an armed Event
+    async def single(self, event, go=None):
+        Error_Check, timing = event.single_check()
 
-        #figure out the number of PLCs
-        if type(self.plc) is not list:
-            N_PLC = 1
-        else:
-            N_PLC = len(self.plc)
+        #time delay, an armed Event gets ready first and waits after
+        if go is None:
+            await self.start_wait(event, None)
 
-        #truth table setup and value table setup
-        T_Table = [False for i in range(len(self.trigger_mem))]
-        VAL = [0 for i in range(len(self.trigger_mem))]
-        
-        #if no errors start loop
-        if Error_Check == True:
+        PLC = self.plc(event.plc)
+        await PLC.connect()
+
+        if Error_Check:
+            values = event.single_values()
+            blocks = event.plc.plan_write(event.mem_addr, event.mem_format)
+            payloads = [event.plc.block_payload(block, values) for block in blocks]
+            if go is not None:
+                await self.start_wait(event, go)
+
+            #absolute deadlines so timing errors do not add up from one period to the next
+            deadline = self.loop.time()
             while True:
-                #begin loop to check all PLCs
-                for i in range(N_PLC):
-                    # find the correct way to pull PLCs from the list of PLCs
-                    if type(self.plc) is not list:
-                        PLC = self.plc
-                    elif N_PLC == 1:
-                        PLC = self.plc[0]
-                    else:
-                        PLC = self.plc[i]
+                if timing > 0:
+                    deadline = max(deadline + timing, self.loop.time())
+                    await asyncio.sleep(deadline - self.loop.time())
+                    if event.thread_stop:
+                        break
+                else:
+                    #skipped writes do not await anything, let the other tasks and the timeout run
+                    await asyncio.sleep(0)
 
-                    # find correct way to pull memory addresses
-                    N_mem = 0 
-                    if i > 0:
-                        for n in range(0,i+1):
-                            N_mem = N_mem + self.mem_alloc[n]
+                cycle = time.perf_counter()
+                for b in range(len(blocks)):
+                    if event.suppress:
+                        await PLC.write_changed(blocks[b].start, payloads[b], event.verify, event.refresh, blocks[b].coils)
                     else:
-                        N_mem = self.mem_alloc[0]
+                        await PLC.write_registers(blocks[b].start, payloads[b], coils=blocks[b].coils)
+                event.wrote(len(blocks))
+                event.metrics.observe('cycle', time.perf_counter() - cycle)
 
-                    if N_PLC == 1:
-                        N_mem_s = 0
-                    else:
-                        N_mem_s = N_mem - self.mem_alloc[i]
-                    
-                    #connect to PLC
-                    PLC.connect()               
-                    m = 0
-                    #loop to poll all PLC memory addresses for this PLC
-                    for m in range(N_mem_s, N_mem):
-                        Read_True = False
-                        #set up check to see if we actually read a memory address
-                        try:
-                            VAL[m] = PLC.read(int(self.trigger_mem[m]))
-                            Read_True = True
-                        except:
-                            print("Read Failed on PLC IP: %s Mem Address %u" % (PLC.ip, self.trigger_mem[m]))
-                            Read_fail = False  
-                        
-                        #if the read fails, dont update the truth table
-                        if Read_True:
-                            if self.trigger_conditions[m] == '>':
-                                T_Table[m] = VAL[m] > self.trigger_value[m]
-                            elif self.trigger_conditions[m] == '<':
-                                T_Table[m] = VAL[m] < self.trigger_value[m]
-
-                #if truth table is true or we are stopping the thready, break out of loop
-                if all(T_Table) == True:
+                if event.persist == False or event.thread_stop:
                     break
-                if self.thread_stop:
+
+    #'ramp' type Event, see Event.ramp
+    async def ramp(self, event, go=None):
+        Error_Check = event.ramp_check()
+
+        #time delay, an armed Event gets ready first and waits after
+        if go is None:
+            await self.start_wait(event, None)
+
+        PLC = self.plc(event.plc)
+        await PLC.connect()
+
+        if Error_Check:
+            blocks = event.plc.plan_write(event.mem_addr, event.mem_format)
+            N_mem = len(event.mem_addr)
+            rate = event.ramp_rate()
+            prepared = event.ramp_prepare(event.plc, blocks, rate)
+            if go is not None:
+                await self.start_wait(event, go)
+
+            while True:
+                #with a rate set, send the precomputed profile on schedule
+                if rate > 0:
+                    times, profile, payloads = prepared
+                    start = self.loop.time()
+                    k = 0
+                    while event.thread_stop == False:
+                        if payloads is None:
+                            await PLC.write_blocks(blocks, [profile[k] for n in range(N_mem)])
+                        else:
+                            for b in range(len(blocks)):
+                                await PLC.write_registers(blocks[b].start, payloads[b][k].tolist(), coils=blocks[b].coils)
+                        event.wrote(len(blocks))
+                        if k == len(times)-1:
+                            break
+                        await asyncio.sleep(max(0, start + times[k+1] - self.loop.time()))
+                        k = max(min(int((self.loop.time() - start)*rate), len(times)-1), k + 1)
+                    if event.persist == False:
+                        break
+                    if event.Event == 'noise':
+                        prepared = event.ramp_prepare(event.plc, blocks, rate)
+                    continue
+
+                for i in range(len(event.values)-1):
+                    dV = float(event.values[i+1] - event.values[i])
+                    dt = dV/event.ramp_time(i)
+                    value = event.values[i]
+                    start_time = self.loop.time()
+                    while abs(dV) > abs((value - event.values[i])) and event.thread_stop == False:
+                        value = event.values[i] + dt*(self.loop.time() - start_time)
+                        if abs(dV) < abs((value - event.values[i])):
+                            value = event.values[i+1]
+                        await PLC.write_blocks(blocks, [value for n in range(N_mem)])
+                        event.wrote(len(blocks))
+                if event.persist == False:
                     break
-        #if we are not stoping the thread, start the Event
-        if self.thread_stop == False and Error_Check == True:
-            self.Event.run()
-            self.Event.wait()
 
-    #define how to run trigger thread
-    def run(self):
-        threaded = threading.Thread(target=self.thread)
-        threaded.daemon = True
-        threaded.start()
-        self.threaded = threaded
+    #'playback' type Event, see Event.playback
+    async def playback(self, event, go=None):
+        if event.file is None or len(event.mem_addr) == 0:
+            print('Playback needs a file and memory addresses!')
+            return
+        if type(event.time_delay) is list:
+            event.time_delay = event.time_delay[0]
+        if go is None:
+            await self.start_wait(event, None)
 
-    #define how to stop thread
+        PLC = self.plc(event.plc)
+        await PLC.connect()
+        blocks = event.plc.plan_write(event.mem_addr, event.mem_format)
+        while True:
+            chunks = playback_chunks(event.file, len(event.mem_addr))
+            try:
+                chunk = next(chunks, None)
+                chunk = chunk and (chunk, event.plc.profile_payloads(blocks, chunk[1]))
+            except (ValueError, OSError) as error:
+                print('Playback of %s failed: %s' % (event.file, error))
+                return
+            if go is not None:
+                await self.start_wait(event, go)
+                go = None
+
+            writes = 0
+            start = self.loop.time()
+            t0 = None
+            while chunk is not None and event.thread_stop == False:
+                (times, values), payloads = chunk
+                if t0 is None and len(times) > 0:
+                    t0 = times[0]
+                for k in range(len(times)):
+                    if event.thread_stop:
+                        break
+                    if k+1 < len(times) and self.loop.time() > start + times[k+1] - t0:
+                        continue
+                    await asyncio.sleep(max(0, start + times[k] - t0 - self.loop.time()))
+                    if payloads is None:
+                        await PLC.write_blocks(blocks, list(values[k]))
+                    else:
+                        for b in range(len(blocks)):
+                            await PLC.write_registers(blocks[b].start, payloads[b][k].tolist(), coils=blocks[b].coils)
+                    writes = writes + 1
+                    event.wrote(len(blocks))
+                try:
+                    chunk = next(chunks, None)
+                    chunk = chunk and (chunk, event.plc.profile_payloads(blocks, chunk[1]))
+                except (ValueError, OSError) as error:
+                    print('Playback of %s stopped: %s' % (event.file, error))
+                    chunk = None
+            print("Playback on PLC IP: %s wrote %u rows in %.3f s" % (PLC.ip, writes, self.loop.time() - start))
+            if event.persist == False or event.thread_stop:
+                break
+
+    #run an Event by its type
+    #go is set by the Trigger of an armed Event
+    async def event(self, event, go=None):
+        Event_lib = {
+            'single':self.single,
+            'ramp':self.ramp,
+            'sine':self.ramp,
+            'square':self.ramp,
+            'noise':self.ramp,
+            'step':self.ramp,
+            'playback':self.playback
+        }
+        event.metrics.count('runs')
+        try:
+            await Event_lib[event.Event](event, go)
+        finally:
+            if isinstance(go, Start_Barrier):
+                go.leave()
+
+    #Trigger, see Trigger.thread
+    async def trigger(self, trigger):
+        Error_Check = trigger.check()
+        if Error_Check == False:
+            return
+
+        #the Event connects and encodes while the Trigger polls, so firing only has to release it
+        armed = None
+        if trigger.prearm:
+            go = asyncio.Event()
+            armed = asyncio.ensure_future(self.event(trigger.Event, go))
+
+        try:
+            if await self.watch(trigger):
+                if armed is not None:
+                    go.set()
+                    await armed
+                else:
+                    await self.event(trigger.Event)
+        finally:
+            trigger.report_polls()
+            #an armed Event that never fired, or a Trigger that was cancelled, takes its Event with it
+            if armed is not None and not armed.done():
+                armed.cancel()
+                await asyncio.gather(armed, return_exceptions=True)
+
+    #Poll a Trigger's PLCs until its conditions are met, returns False if it was stopped first
+    async def watch(self, trigger):
+        VAL = [MISSING for i in range(len(trigger.trigger_mem))]
+        PLCS = [(self.plc(PLC), N_mem_s, N_mem, blocks) for PLC, N_mem_s, N_mem, blocks in trigger.plan_reads()]
+        for PLC, N_mem_s, N_mem, blocks in PLCS:
+            await PLC.connect()
+
+        trigger.poll.reset()
+        while True:
+            for PLC, N_mem_s, N_mem, blocks in PLCS:
+                Read_VAL = await PLC.read_blocks(blocks)
+                trigger.fill(VAL, PLC, N_mem_s, N_mem, Read_VAL)
+
+            trigger.metrics.count('checks')
+            if trigger.thread_stop:
+                return False
+            if trigger.plan.evaluate(VAL):
+                trigger.fire()
+                return True
+            #let the other tasks run between polls, or wait out the Trigger's poll interval
+            interval = 0
+            if trigger.poll.throttled():
+                interval = trigger.poll.interval(trigger.plan, VAL, time.perf_counter())
+                trigger.metrics.observe('poll_interval', interval)
+            await asyncio.sleep(interval)
+
+    #start all tasks and wait for them to finish, be cancelled, or time out
+    #a synchronized start prepares every Event and releases them together, see Async_Start_Barrier
+    async def main(self, Events, Triggers, sync=False):
+        self.loop = asyncio.get_running_loop()
+        self.barrier = None
+        if sync:
+            self.barrier = Async_Start_Barrier(len(Events))
+            for e in Events:
+                e.sync = self.barrier
+        self.tasks = [asyncio.ensure_future(self.event(e, self.barrier)) for e in Events]
+        self.tasks.extend([asyncio.ensure_future(self.trigger(t)) for t in Triggers])
+
+        try:
+            done, pending = await asyncio.wait(self.tasks, timeout=self.timeout)
+            if pending:
+                print('Scenario timed out after %s seconds, cancelling %u tasks' % (self.timeout, len(pending)))
+                #pymodbus can swallow a cancel while a request is in flight, so the loops are told to stop too
+                for item in list(Events) + list(Triggers):
+                    item.thread_stop = True
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    print('Task failed: %r' % task.exception())
+        finally:
+            for PLC in self.PLCS.values():
+                PLC.close()
+
+    #run the Events and Triggers to completion on a new event loop
+    #returns the skew of a synchronized start, see Start_Barrier.stats
+    def run(self, Events, Triggers, sync=False):
+        try:
+            asyncio.run(self.main(Events, Triggers, sync))
+        except KeyboardInterrupt:
+            print('Interrupted')
+        if sync:
+            return self.barrier.report()
+        return None
+
+    #cancel every running task, safe to call from another thread
     def stop(self):
-        self.thread_stop = True
-        self.threaded.join()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.cancel)
 
-    #wait for trigger thread to finish
-    def wait(self):
-        self.threaded.join()
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
 
     def __repr__(self):
-        return "Trigger('{}')".format(self.Event)
+        return "Async_Engine('{}')".format(len(self.tasks))
 
-    #debug settings printer
-    def show(self):
-        print("PLC: " + str(self.plc))
-        print("Trigger Conditions: " + str(self.trigger_conditions))
-        print("Trigger Values: " + str(self.trigger_value))
-        print("Trigger Memory: " + str(self.trigger_mem))
+#Event types the constructor can build
+EVENT_TYPES = ['single', 'ramp'] + WAVE_TYPES + ['playback']
+#Version of the compiled plan layout, cached plans from other versions are ignored
+PLAN_VERSION = 10
+#PLC script keys for the write retry policy and the Retry_Policy option each one sets
+RETRY_KEYS = {'attempts':'attempts', 'backoff':'delay', 'maxbackoff':'max_delay', 'deadline':'deadline', 'breaker':'breaker', 'cooldown':'cooldown'}
+#Default folder for cached plans
+PLAN_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'ManiPIO')
 
-#define the constructor that will read scripts and build Events
-def constructor(FILE_PATH):
-    #define dictionaries and number of objects
-    PLCS = {}
-    NPLC = 0
-    Events = {}
-    NEvent = 0
-    Triggers = {}
-    Ntrigger = 0
-    
-    #define what to do if you find 'PLC' in the script
-    def PLC_Text(line, file):
-        nonlocal NPLC
-        nonlocal PLCS
-        NPLC = NPLC +1
-
-        #set up local vars
-        IP = ''
-        port = 502
-        byte_order = Endian.BIG
-        word_order = Endian.BIG
-
-        PLC_Lib ={
-            'ip':IP,
-            'port':port,
-            'byteorder':byte_order,
-            'wordorder':word_order
-        }
+#One template block of a script expanded into count PLCs, Events or Triggers without storing each one
+#row is the first copy, columns hold the values that change from copy to copy as ranges or lists,
+#and stride is added to every memory address once per copy. Copies are made when they are looked up
+class Template_Rows:
+    __slots__ = ('row', 'count', 'columns', 'stride')
+
+    def __init__(self, row, count, columns=None, stride=0):
+        self.row = row
+        self.count = count
+        self.columns = columns or {}
+        self.stride = stride
+
+    def __len__(self):
+        return self.count
+
+    #copy i of the template, trigger PLC columns are named plc.0, plc.1, ... for each PLC the trigger watches
+    def __getitem__(self, i):
+        if i < 0:
+            i = i + self.count
+        if i < 0 or i >= self.count:
+            raise IndexError('template copy %d out of range' % i)
+        row = dict(self.row)
+        for key, column in self.columns.items():
+            if not key.startswith('plc.'):
+                row[key] = column[i]
+        offset = i*self.stride
+        if 'plcs' in row:
+            plcs = []
+            for j in range(len(row['plcs'])):
+                plc = dict(row['plcs'][j])
+                if 'plc.%u' % j in self.columns:
+                    plc['plc'] = self.columns['plc.%u' % j][i]
+                plc['mem'] = [m + offset for m in plc['mem']]
+                plcs.append(plc)
+            row['plcs'] = plcs
+        elif 'mem' in row:
+            row['mem'] = [m + offset for m in row['mem']]
+        return row
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def freeze(self):
+        return Template_Rows(freeze(self.row), self.count, {key: column if isinstance(column, range) else tuple(column) for key, column in self.columns.items()}, self.stride)
+
+    #JSON form, ranges are saved as their start and stop
+    def thaw(self):
+        columns = {}
+        for key, column in self.columns.items():
+            columns[key] = {'range':[column.start, column.stop]} if isinstance(column, range) else list(column)
+        return {'template':thaw(self.row), 'count':self.count, 'columns':columns, 'stride':self.stride}
+
+    @staticmethod
+    def load(data):
+        columns = {}
+        for key, column in data['columns'].items():
+            columns[key] = range(*column['range']) if isinstance(column, dict) else column
+        return Template_Rows(data['template'], data['count'], columns, data['stride'])
+
+    def __repr__(self):
+        return "Template_Rows('{}','{}')".format(self.count,self.stride)
+
+#The PLCs, Events or Triggers of a script in order, plain rows are kept in lists and template blocks as Template_Rows
+#Indexes like a list of every row
+class Plan_Rows:
+    __slots__ = ('blocks', 'ends')
+
+    def __init__(self, blocks=()):
+        self.blocks = []
+        self.ends = []
+        for block in blocks:
+            self.add(block)
+
+    #add a list of rows or a Template_Rows
+    def add(self, block):
+        self.blocks.append(block)
+        self.ends.append(len(self) + len(block))
+
+    def append(self, row):
+        if len(self.blocks) > 0 and isinstance(self.blocks[-1], list):
+            self.blocks[-1].append(row)
+            self.ends[-1] = self.ends[-1] + 1
+        else:
+            self.add([row])
+
+    def __len__(self):
+        return self.ends[-1] if len(self.ends) > 0 else 0
+
+    def __getitem__(self, i):
+        N = self.ends[-1] if len(self.ends) > 0 else 0
+        if i < 0:
+            i = i + N
+        if i < 0 or i >= N:
+            raise IndexError('row %d out of range' % i)
+        b = bisect.bisect_right(self.ends, i)
+        return self.blocks[b][i - (self.ends[b-1] if b > 0 else 0)]
+
+    def __iter__(self):
+        for block in self.blocks:
+            for row in block:
+                yield row
+
+    def freeze(self):
+        return Plan_Rows([block.freeze() if isinstance(block, Template_Rows) else tuple(freeze(row) for row in block) for block in self.blocks])
+
+    #JSON form, a list of plain rows and templates
+    def thaw(self):
+        rows = []
+        for block in self.blocks:
+            if isinstance(block, Template_Rows):
+                rows.append(block.thaw())
+            else:
+                rows.extend(thaw(row) for row in block)
+        return rows
+
+    #Plan_Rows from a list saved by thaw
+    @staticmethod
+    def load(data):
+        if isinstance(data, Plan_Rows):
+            return data
+        rows = Plan_Rows()
+        for row in data:
+            if 'template' in row:
+                rows.add(Template_Rows.load(row))
+            else:
+                rows.append(row)
+        return rows
+
+    def __repr__(self):
+        return "Plan_Rows('{}','{}')".format(len(self),len(self.blocks))
+
+#turn the dicts and lists of a parsed script into read only mappings and tuples
+def freeze(data):
+    if isinstance(data, (Plan_Rows, Template_Rows)):
+        return data.freeze()
+    if isinstance(data, (dict, MappingProxyType)):
+        return MappingProxyType({key: freeze(value) for key, value in data.items()})
+    if isinstance(data, (list, tuple)):
+        return tuple(freeze(x) for x in data)
+    return data
+
+#turn a frozen plan back into dicts and lists so it can be saved as JSON
+def thaw(data):
+    if isinstance(data, (Plan_Rows, Template_Rows)):
+        return data.thaw()
+    if isinstance(data, (dict, MappingProxyType)):
+        return {key: thaw(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [thaw(x) for x in data]
+    return data
+
+#Validated plan compiled from a script, nothing in it can be changed once it is made
+#PLCs, Events and Triggers are numbered from 1 in the order they are listed
+class Script_Plan:
+    def __init__(self, digest, plcs, events, triggers, starts, warnings=()):
+        object.__setattr__(self, 'digest', digest)
+        object.__setattr__(self, 'plcs', freeze(Plan_Rows.load(plcs)))
+        object.__setattr__(self, 'events', freeze(Plan_Rows.load(events)))
+        object.__setattr__(self, 'triggers', freeze(Plan_Rows.load(triggers)))
+        object.__setattr__(self, 'starts', freeze(starts))
+        object.__setattr__(self, 'warnings', freeze(warnings))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Script plans cannot be changed')
+
+    #save the plan as JSON
+    def to_json(self):
+        return json.dumps({'version':PLAN_VERSION, 'digest':self.digest, 'plcs':thaw(self.plcs), 'events':thaw(self.events),
+            'triggers':thaw(self.triggers), 'starts':thaw(self.starts), 'warnings':thaw(self.warnings)})
 
-        line = file.readline()
-        #until we hit a blank line keep reading, might be comments between 'PLC' and 'IP'
-        while line:
-            if line in ['\n', '\r\n']:
+    #load a plan saved with to_json, returns None if it was saved by another plan version
+    @staticmethod
+    def from_json(text):
+        data = json.loads(text)
+        if data.get('version') != PLAN_VERSION:
+            return None
+        return Script_Plan(data['digest'], data['plcs'], data['events'], data['triggers'], data['starts'], data['warnings'])
+
+    def __repr__(self):
+        return "Script_Plan('{}','{}','{}')".format(len(self.plcs),len(self.events),len(self.triggers))
+
+#Parse script lines into plain data, nothing is built or started
+#returns the PLCs, Events, Triggers, start lists and any errors found while parsing
+def parse_script(lines):
+    plcs = Plan_Rows()
+    events = Plan_Rows()
+    triggers = Plan_Rows()
+    starts = []
+    errors = []
+
+    #read 'Key:Value' lines until a blank line, returns (line number, key, values, raw value) for each and the next line index
+    def read_block(n):
+        entries = []
+        while n < len(lines):
+            line = lines[n]
+            if line.strip() == '':
                 break
-            #split things up, looking for key values
             Key = line.split(':',1)
-            Keys = [x.lower() for x in Key]
-            if Keys[0] in PLC_Lib: #if we find a key value
-                #format values
-                values = Keys[1].strip(' []')
-                values_splt = values.split(',')
-                values = [x.strip() for x in values_splt]
-
-                if Keys[0] == 'ip': #find the IP
-                    PLC_Lib['ip'] = values
-                if Keys[0] == 'byteorder' or Keys[0] == 'wordorder':
-                    if values[0] == 'big':
-                        PLC_Lib[Keys[0]] = Endian.BIG
-                    elif values[0] == 'little':
-                        PLC_Lib[Keys[0]] = Endian.LITTLE
+            if len(Key) == 2 and line[0] != '#':
+                values = Key[1].lower().strip(' []\r\n')
+                values = [x.strip() for x in values.split(',')]
+                entries.append((n+1, Key[0].strip().lower(), values, Key[1]))
+            n = n + 1
+        return entries, n
+
+    #convert a list of values, recording an error instead of failing
+    def convert(values, kind, line_n, key):
+        try:
+            return [kind(x) for x in values]
+        except ValueError:
+            errors.append('line %u: %s must be a list of numbers, not "%s"' % (line_n, key, ','.join(values)))
+            return []
+
+    #convert a list of whole numbers where a-b is every number from a to b, a single range stays a range
+    def convert_range(values, line_n, key):
+        numbers = []
+        for x in values:
+            ends = x.split('-')
+            if len(ends) == 2 and ends[0].strip().isdigit() and ends[1].strip().isdigit() and int(ends[0]) <= int(ends[1]):
+                if len(values) == 1:
+                    return range(int(ends[0]), int(ends[1]) + 1)
+                numbers.extend(range(int(ends[0]), int(ends[1]) + 1))
+            else:
+                numbers.extend(convert([x], int, line_n, key))
+        return numbers
+
+    #IP addresses from a.b.c.d-a.b.c.e or a.b.c.d-e, anything else is one address
+    def convert_ips(value, line_n):
+        ends = value.split('-')
+        if len(ends) != 2:
+            return [value]
+        try:
+            first = ipaddress.ip_address(ends[0].strip())
+            if ends[1].strip().isdigit():
+                last = ipaddress.ip_address(ends[0].strip().rsplit('.', 1)[0] + '.' + ends[1].strip())
+            else:
+                last = ipaddress.ip_address(ends[1].strip())
+        except ValueError:
+            errors.append('line %u: IP range %s must look like 10.0.0.1-10.0.0.200 or 10.0.0.1-200' % (line_n, value))
+            return [value]
+        if int(last) < int(first):
+            errors.append('line %u: IP range %s ends before it starts' % (line_n, value))
+            return [value]
+        return [str(first + i) for i in range(int(last) - int(first) + 1)]
+
+    #Add a parsed PLC, Event or Trigger, a template block numbered a-b is added as count copies
+    #columns are the values that change per copy, each must have one value per copy
+    def add_rows(items, row, count, columns, stride, name):
+        for key in list(columns):
+            #the row already holds a value every copy shares
+            if len(columns[key]) == 1:
+                del columns[key]
+            elif len(columns[key]) != count:
+                errors.append('line %u: %s %s has %u values for %u copies' % (row['line'], name, key.split('.')[0], len(columns[key]), count))
+                del columns[key]
+        if count == 1 and stride == 0 and len(columns) == 0:
+            items.append(row)
+        else:
+            items.add(Template_Rows(row, count, columns, stride))
+
+    n = 0
+    while n < len(lines):
+        line = lines[n]
+        #if line is not empty and does not start with comment
+        if line.strip() == '' or line[0] == '#':
+            n = n + 1
+            continue
+        words = line.split()
+        keyword = words[0].lower()
+        line_n = n + 1
+
+        #index numbers are for the reader, but if they are there they have to match the order
+        #a template block is numbered a-b and makes that many copies, returns how many
+        def check_number(items, name):
+            if len(words) < 2:
+                return 1
+            number = words[1].split('-')
+            if not all(x.isdigit() for x in number) or len(number) > 2:
+                return 1
+            if int(number[0]) != len(items) + 1:
+                errors.append('line %u: %s %s is number %u in order, numbers must be in order and not skip' % (line_n, name, words[1], len(items) + 1))
+            if len(number) == 2 and int(number[1]) < int(number[0]):
+                errors.append('line %u: %s %s ends before it starts' % (line_n, name, words[1]))
+                return 1
+            return int(number[-1]) - int(number[0]) + 1
+
+        if keyword == 'plc':
+            count = check_number(plcs, 'PLC')
+            entries, n = read_block(n + 1)
+            plc = {'line':line_n, 'ip':None, 'port':502, 'unit':1, 'pipeline':0, 'byteorder':'big', 'wordorder':'big', 'retry':{}}
+            #a template gets a PLC for every IP, port and unit it lists
+            addresses = {'ip':[None], 'port':[502], 'unit':[1]}
+            for entry_n, key, values, raw in entries:
+                if key == 'ip':
+                    addresses['ip'] = convert_ips(values[0], entry_n)
+                elif key in ['port', 'unit']:
+                    option = convert_range(values, entry_n, key)
+                    if len(option) > 0:
+                        addresses[key] = option
+                elif key == 'pipeline':
+                    option = convert(values, int, entry_n, key)
+                    if len(option) > 0:
+                        plc[key] = option[0]
+                elif key in ['byteorder', 'wordorder']:
+                    plc[key] = values[0]
+                elif key in RETRY_KEYS:
+                    option = convert(values, float, entry_n, key)
+                    if len(option) > 0:
+                        plc['retry'][RETRY_KEYS[key]] = option[0]
+            copies = [(ip, port, unit) for ip in addresses['ip'] for port in addresses['port'] for unit in addresses['unit']]
+            if len(copies) != count:
+                errors.append('line %u: PLC %s makes %u PLCs, number it %u-%u' % (line_n, words[1] if len(words) > 1 else '', len(copies), len(plcs) + 1, len(plcs) + len(copies)))
+                count = len(copies)
+            plc['ip'], plc['port'], plc['unit'] = copies[0]
+            columns = {}
+            if count > 1:
+                columns = {'ip':[x[0] for x in copies], 'port':[x[1] for x in copies], 'unit':[x[2] for x in copies]}
+            add_rows(plcs, plc, count, columns, 0, 'PLC')
+
+        elif keyword == 'event':
+            count = check_number(events, 'Event')
+            entries, n = read_block(n + 1)
+            event = {'line':line_n, 'plc':None, 'values':[], 'mem':[], 'format':[], 'timing':None, 'delay':None, 'type':'single', 'persist':False, 'rate':None,
+                'period':None, 'file':None, 'suppress':False, 'verify':False, 'refresh':None}
+            columns = {}
+            stride = 0
+            for entry_n, key, values, raw in entries:
+                if key == 'plc':
+                    #a template can give each copy its own PLC, e.g. PLC:1-200
+                    plc = convert_range(values, entry_n, key)
+                    if len(plc) > 0:
+                        event['plc'] = plc[0]
+                        columns['plc'] = plc
+                elif key == 'stride':
+                    option = convert(values[:1], int, entry_n, key)
+                    if len(option) > 0:
+                        stride = option[0]
+                elif key == 'mem':
+                    event['mem'] = convert(values, int, entry_n, key)
+                elif key in ['values', 'timing', 'delay', 'rate', 'period', 'refresh']:
+                    event[key] = convert(values, float, entry_n, key)
+                elif key == 'format':
+                    event['format'] = values
+                elif key == 'file':
+                    #values are lower case, file names keep theirs
+                    event['file'] = raw.strip(' []\r\n')
+                elif key == 'type':
+                    event['type'] = values[0]
+                elif key in ['persist', 'suppress', 'verify']:
+                    event[key] = values[0] in ['true', 't']
+            add_rows(events, event, count, columns, stride, 'Event')
+
+        elif keyword == 'trigger':
+            count = check_number(triggers, 'Trigger')
+            entries, n = read_block(n + 1)
+            trigger = {'line':line_n, 'event':None, 'plcs':[], 'logic':'', 'prearm':True, 'poll':{}}
+            columns = {}
+            stride = 0
+            for entry_n, key, values, raw in entries:
+                if key == 'event':
+                    event = convert_range(values, entry_n, key)
+                    if len(event) > 0:
+                        trigger['event'] = event[0]
+                        columns['event'] = event
+                elif key == 'stride':
+                    option = convert(values[:1], int, entry_n, key)
+                    if len(option) > 0:
+                        stride = option[0]
+                elif key == 'logic':
+                    trigger['logic'] = raw.strip(' []\r\n')
+                elif key == 'prearm':
+                    trigger['prearm'] = values[0] in ['true', 't']
+                elif key == 'poll':
+                    #poll:rate, or poll:adaptive with an optional slowest and fastest rate
+                    if values[0] == 'adaptive':
+                        rates = convert(values[1:3], float, entry_n, key)
+                        trigger['poll'] = {'adaptive':True}
+                        if len(rates) > 0:
+                            trigger['poll']['min_rate'] = rates[0]
+                        if len(rates) > 1:
+                            trigger['poll']['max_rate'] = rates[1]
                     else:
-                        print('Error: Wordorder and Byteorder must be either Big or Little!\n Defaulted to Big\n')
-                if Keys[0] == 'port':
-                    PLC_Lib[Keys[0]] = int(values[0])
-                    
-            line = file.readline()
-
-        #put PLC in PLC dict
-        PLCS[NPLC] = MB_PLC(PLC_Lib['ip'][0], PLC_Lib['port'])
-        PLCS[NPLC].wordOrder = PLC_Lib['wordorder']
-        PLCS[NPLC].byteOrder = PLC_Lib['byteorder']
-
-    #what to do if we find 'Event' in script
-    def Event_Text(line,file):
-        nonlocal NEvent, Events, PLCS
-        #set up variables
-        plc = 0
-        Val = 0.0
-        Mem = []
-        Mem_form = ''
-        time = 0.0
-        time_d = 0.0
-        att_type = 'single'
-        persistance = False
-        
-        NEvent = NEvent + 1
-        #set up dict of valid operators
-        Att_Lib = {
-            'plc':plc,
-            'values':Val,
-            'mem':Mem,
-            'format':Mem_form,
-            'timing':time,
-            'delay':time_d,
-            'type':att_type,
-            'persist':persistance
-            }
-
-        line = file.readline()
-        while line: #until a blank line keep reading
-            if line in ['\n', '\r\n']:
-                break
-            #split things up, looking for key values
-            Key = line.split(':',1)
-            Keys = [x.lower() for x in Key]
-            if Keys[0] in Att_Lib: #if we find a key value
-                #format values
-                values = Keys[1].strip(' []')
-                values_splt = values.split(',')
-                values = [x.strip() for x in values_splt]
-
-                #depending on the type of the key, format the value correctly
-                if type(Att_Lib[Keys[0]]) is str:
-                    Att_Lib[Keys[0]] = values
-                elif type(Att_Lib[Keys[0]]) is bool:
-                    if values[0] == 'true' or values[0] == 't':
-                         Att_Lib[Keys[0]] = True
-                elif type(Att_Lib[Keys[0]]) is float:
-                    Att_Lib[Keys[0]] = [float(x) for x in values]
-                else:
-                    Att_Lib[Keys[0]] = [int(x) for x in values]
-            line = file.readline()
-
-        #setup Event and put it in the Event dict
-        #print(PLCS[Att_Lib['plc'][0]])
-        Events[NEvent] = Event(PLCS[Att_Lib['plc'][0]])
-        #set all Event options
-        #print(Att_Lib['format'])
-        Events[NEvent].set_Event(values = Att_Lib['values'], mem_addr = Att_Lib['mem'], mem_format = Att_Lib['format'], time_delay = Att_Lib['delay'], timing = Att_Lib['timing'], persist = Att_Lib['persist'], Event = Att_Lib['type'][0] )
-
-    #what to do if 'trigger' is found in script
-    def Trigger_Text(line,file):
-        nonlocal Ntrigger, Triggers, Events, PLCS
-        Ntrigger = Ntrigger + 1
-
-        plc_count = 0
-        Event = 0
-        plc = 0
-        Val = 0.0
-        Mem = []
-        Mem_form = ''
-        conditions = ''
-
-        #set up 2 libraries one for keywords
-        #the other is to assemble a library of plcs
-        PLC_Lib = {}
-        Trig_Lib = {
-            'plc':plc,
-            'event':Event,
-            'values':Val,
-            'mem':Mem,
-            'format':Mem_form,
-            'conditions':conditions,
-            }
-
-        line = file.readline()
-        while line:
-            if line in ['\n', '\r\n']:
-                break
-            Key = line.split(':',1)
-            Keys = [x.lower() for x in Key]
-            if Keys[0] in Trig_Lib:
-                #if we find a plc, incriment the plc library index
-                if Keys[0] == 'plc':
-                    plc_count = plc_count + 1
-                
-                values = Keys[1].strip(' []')
-                values_splt = values.split(',')
-                values = [x.strip() for x in values_splt]
-
-                #if the keyword is anything but 'Event' put it in the plc dict
-                if type(Trig_Lib[Keys[0]]) is str:
-                    PLC_Lib[(plc_count,Keys[0])] = values
-                elif type(Trig_Lib[Keys[0]]) is float:
-                    PLC_Lib[(plc_count,Keys[0])] = [float(x) for x in values]
-                elif Keys[0] == 'event':
-                    Trig_Lib[Keys[0]] = [int(x) for x in values]
-                else:
-                    PLC_Lib[(plc_count,Keys[0])] = [int(x) for x in values]
-            line = file.readline()
-
-        #set up the trigger
-        Triggers[Ntrigger] = Trigger(Events[Trig_Lib['event'][0]])
-        #set up each plc in the trigger
-        for i in range(plc_count):
-            n = i + 1
-            Triggers[Ntrigger].set_plc(PLCS[PLC_Lib[(n,'plc')][0]], PLC_Lib[(n,'mem')], PLC_Lib[(n,'conditions')], PLC_Lib[(n,'values')])
-            
-    #what to do if we find 'start' in the script
-    def Start_Text(line,file):
-        nonlocal PLCS, Events, Triggers
-        nonlocal NPLC, NEvent, Ntrigger
-        #make lists of trigger and Event indexes 
-        ATT = []
-        TRG = []
+                        rate = convert(values[:1], float, entry_n, key)
+                        if len(rate) > 0:
+                            trigger['poll'] = {'rate':rate[0]}
+                elif key == 'plc':
+                    plc = convert_range(values, entry_n, key)
+                    if len(plc) > 1:
+                        columns['plc.%u' % len(trigger['plcs'])] = plc
+                    trigger['plcs'].append({'line':entry_n, 'plc':plc[0] if len(plc) > 0 else None, 'mem':[], 'conditions':[], 'values':[], 'format':[]})
+                elif key in ['mem', 'conditions', 'values', 'format']:
+                    if len(trigger['plcs']) == 0:
+                        errors.append('line %u: trigger %s must come after a PLC' % (entry_n, key))
+                    elif key == 'mem':
+                        trigger['plcs'][-1]['mem'] = convert(values, int, entry_n, key)
+                    elif key == 'values':
+                        trigger['plcs'][-1]['values'] = convert(values, float, entry_n, key)
+                    else:
+                        trigger['plcs'][-1][key] = values
+            add_rows(triggers, trigger, count, columns, stride, 'Trigger')
+
+        elif keyword == 'start':
+            #'Start sync' releases its Events together once they are all ready
+            start = {'line':line_n, 'events':[], 'triggers':[], 'sync':len(words) > 1 and words[1].lower() == 'sync'}
+            n = n + 1
+            while n < len(lines) and lines[n].strip() != '':
+                if lines[n][0] != '#':
+                    #if we find Event or trigger, put its index number in the lists
+                    for item in lines[n].lower().split(','):
+                        Keys = item.split()
+                        if len(Keys) > 1 and Keys[0] in ['event', 'trigger']:
+                            number = Keys[1].split('-')
+                            if not all(x.isdigit() for x in number) or len(number) > 2:
+                                errors.append('line %u: "%s" needs an index number or a range of them like 1-200' % (n+1, item.strip()))
+                            elif int(number[0]) != 0:
+                                start[Keys[0] + 's'].extend(range(int(number[0]), int(number[-1]) + 1))
+                n = n + 1
+            starts.append(start)
+
+        else:
+            n = n + 1
+
+    return plcs, events, triggers, starts, errors
+
+#Registers an Event writes, as (first register, end register, memory address)
+def write_ranges(event):
+    ranges = []
+    for i in range(len(event['mem'])):
+        if len(event['format']) == len(event['mem']):
+            formating = event['format'][i]
+        else:
+            formating = '32_float'
+        #coils are their own address space, they are placed after the registers so they never overlap them
+        base = 65536 if formating == COIL_FORMAT else 0
+        if formating in MEM_FORMATS:
+            ranges.append((base + event['mem'][i], base + event['mem'][i] + reg_count(formating), event['mem'][i]))
+    return sorted(ranges)
+
+#Checks of a parsed script that depend on the machine it runs on rather than on the script itself
+#returns a list of errors
+def check_environment(events):
+    errors = []
+    for i in range(len(events)):
+        event = events[i]
+        if event['type'] == 'playback' and event['file'] and not os.path.isfile(event['file']):
+            errors.append('line %u: Event %u playback file %s does not exist' % (event['line'], i+1, event['file']))
+    return errors
+
+#Check a parsed script for every error that would stop it running properly
+#returns a list of errors and a list of warnings
+def validate_script(plcs, events, triggers, starts):
+    errors = []
+    warnings = []
+
+    #check a memory address fits in the modbus register space
+    def check_address(addr, formating, where):
+        count = 1
+        if formating in MEM_FORMATS:
+            count = reg_count(formating)
+        if addr < 0 or addr + count > 65536:
+            errors.append('%s: memory address %d is outside the modbus register range' % (where, addr))
+
+    for i in range(len(plcs)):
+        plc = plcs[i]
+        where = 'line %u: PLC %u' % (plc['line'], i+1)
+        if plc['ip'] is None or plc['ip'] == '':
+            errors.append('%s has no IP' % where)
+        if plc['port'] < 1 or plc['port'] > 65535:
+            errors.append('%s port %d is not a valid port' % (where, plc['port']))
+        if plc['unit'] < 0 or plc['unit'] > 255:
+            errors.append('%s unit %d must be between 0 and 255' % (where, plc['unit']))
+        if plc['pipeline'] < 0 or plc['pipeline'] > 65535:
+            errors.append('%s pipeline %d must be between 0 and 65535' % (where, plc['pipeline']))
+        for key in ['byteorder', 'wordorder']:
+            if plc[key] not in ['big', 'little']:
+                errors.append('%s %s must be either Big or Little' % (where, key))
+        for key, option in RETRY_KEYS.items():
+            if plc['retry'].get(option, 0) < 0:
+                errors.append('%s %s cannot be negative' % (where, key))
+        if plc['retry'].get('attempts', 1) < 1:
+            errors.append('%s attempts must be at least 1' % where)
+
+    errors.extend(check_environment(events))
+    for i in range(len(events)):
+        event = events[i]
+        where = 'line %u: Event %u' % (event['line'], i+1)
+        #PLCs must be defined before they are used
+        if event['plc'] is None:
+            errors.append('%s has no PLC' % where)
+        elif event['plc'] < 1 or event['plc'] > len(plcs) or plcs[event['plc']-1]['line'] > event['line']:
+            errors.append('%s uses PLC %d which is not defined before it' % (where, event['plc']))
+        if len(event['mem']) == 0:
+            errors.append('%s has no memory address' % where)
+        if len(event['format']) != 0 and len(event['format']) != len(event['mem']):
+            errors.append('%s has %u formats for %u memory addresses, give one format per address' % (where, len(event['format']), len(event['mem'])))
+        for formating in event['format']:
+            if formating not in MEM_FORMATS:
+                errors.append('%s format %s is not one of %s' % (where, formating, ', '.join(MEM_FORMATS)))
+        for m in range(len(event['mem'])):
+            formating = event['format'][m] if len(event['format']) == len(event['mem']) else '32_float'
+            check_address(event['mem'][m], formating, where)
+        if event['type'] not in EVENT_TYPES:
+            errors.append('%s type %s is not one of %s' % (where, event['type'], ', '.join(EVENT_TYPES)))
+        if event['type'] == 'ramp':
+            if len(event['values']) < 2:
+                errors.append('%s does not have enough values to preform ramp' % where)
+            if event['timing'] is None or 0 in event['timing']:
+                errors.append('%s timing for ramp cannot be 0' % where)
+        if event['type'] in WAVE_TYPES:
+            if len(event['values']) < 2:
+                errors.append('%s %s needs at least two values' % (where, event['type']))
+            if event['type'] in ['sine', 'square'] and (event['period'] is None or len(event['period']) == 0 or event['period'][0] <= 0):
+                errors.append('%s %s needs a period above 0' % (where, event['type']))
+            elif event['type'] in ['noise', 'step'] and event['timing'] is not None and 0 in event['timing']:
+                errors.append('%s timing for %s cannot be 0' % (where, event['type']))
+            elif event['type'] in ['noise', 'step'] and event['timing'] is None:
+                errors.append('%s %s needs timing' % (where, event['type']))
+        if event['type'] == 'playback':
+            if event['file'] is None or event['file'] == '':
+                errors.append('%s playback needs a file' % where)
+        elif event['file'] is not None:
+            warnings.append('%s File only applies to playback Events' % where)
+        if event['rate'] is not None and len(event['rate']) > 0 and event['rate'][0] < 0:
+            errors.append('%s rate cannot be negative' % where)
+        if event['refresh'] is not None and len(event['refresh']) > 0 and event['refresh'][0] < 0:
+            errors.append('%s refresh cannot be negative' % where)
+        if (event['suppress'] or event['verify'] or event['refresh'] is not None) and not (event['type'] == 'single' and event['persist']):
+            warnings.append('%s Suppress, Verify and Refresh only apply to persistent single Events' % where)
+
+        #two addresses in one Event writing the same registers fight each other
+        ranges = write_ranges(event)
+        for r in range(1, len(ranges)):
+            if ranges[r][0] < ranges[r-1][1]:
+                errors.append('%s memory addresses %d and %d overlap' % (where, ranges[r-1][2], ranges[r][2]))
+
+    for i in range(len(triggers)):
+        trigger = triggers[i]
+        where = 'line %u: Trigger %u' % (trigger['line'], i+1)
+        if trigger['event'] is None:
+            errors.append('%s has no Event' % where)
+        elif trigger['event'] < 1 or trigger['event'] > len(events) or events[trigger['event']-1]['line'] > trigger['line']:
+            errors.append('%s uses Event %d which is not defined before it' % (where, trigger['event']))
+        if len(trigger['plcs']) == 0:
+            errors.append('%s has no PLC' % where)
+
+        conditions = []
+        for plc in trigger['plcs']:
+            plc_where = 'line %u: Trigger %u' % (plc['line'], i+1)
+            if plc['plc'] is None or plc['plc'] < 1 or plc['plc'] > len(plcs) or plcs[plc['plc']-1]['line'] > trigger['line']:
+                errors.append('%s uses PLC %s which is not defined before it' % (plc_where, plc['plc']))
+            if len(plc['mem']) == 0:
+                errors.append('%s has no memory address for PLC %s' % (plc_where, plc['plc']))
+            for key in ['conditions', 'values']:
+                if len(plc[key]) == 0 or len(plc[key]) > len(plc['mem']):
+                    errors.append('%s needs between 1 and %u %s for PLC %s' % (plc_where, len(plc['mem']), key, plc['plc']))
+            if len(plc['format']) != 0 and len(plc['format']) != len(plc['mem']):
+                errors.append('%s has %u formats for %u memory addresses of PLC %s, give one format per address' % (plc_where, len(plc['format']), len(plc['mem']), plc['plc']))
+            for formating in plc['format']:
+                if formating not in MEM_FORMATS:
+                    errors.append('%s format %s is not one of %s' % (plc_where, formating, ', '.join(MEM_FORMATS)))
+            for m in range(len(plc['mem'])):
+                formating = plc['format'][m] if len(plc['format']) == len(plc['mem']) else '32_float'
+                check_address(plc['mem'][m], formating, plc_where)
+            for condition in plc['conditions']:
+                try:
+                    parse_condition(condition)
+                except ValueError as error:
+                    errors.append('%s %s' % (plc_where, error))
+            #short condition lists repeat the last condition
+            if len(plc['conditions']) > 0:
+                conditions.extend(plc['conditions'])
+                conditions.extend([plc['conditions'][-1] for m in range(len(plc['mem']) - len(plc['conditions']))])
+        try:
+            compile_logic(trigger['logic'], len(conditions))
+        except ValueError as error:
+            errors.append('%s %s' % (where, error))
+        poll = trigger['poll']
+        if poll.get('rate', 0) < 0:
+            errors.append('%s poll rate cannot be negative' % where)
+        if poll.get('min_rate', POLL_MIN_RATE) <= 0 or poll.get('max_rate', POLL_MAX_RATE) < poll.get('min_rate', POLL_MIN_RATE):
+            errors.append('%s adaptive poll rates must be above 0 with the slowest first' % where)
+
+    for start in starts:
+        where = 'line %u: start' % start['line']
+        for n in start['events']:
+            if n < 1 or n > len(events):
+                errors.append('%s Event %d is not defined' % (where, n))
+        for n in start['triggers']:
+            if n < 1 or n > len(triggers):
+                errors.append('%s Trigger %d is not defined' % (where, n))
+
+        #Events that can run at the same time and write the same registers on the same PLC
+        started = [n for n in start['events'] if n >= 1 and n <= len(events)]
+        for n in start['triggers']:
+            if n >= 1 and n <= len(triggers) and triggers[n-1]['event'] is not None:
+                started.append(triggers[n-1]['event'])
+        writes = {}
+        for n in sorted(set(started)):
+            event = events[n-1]
+            if event['plc'] is None or event['plc'] < 1 or event['plc'] > len(plcs):
+                continue
+            key = (plcs[event['plc']-1]['ip'], plcs[event['plc']-1]['port'], plcs[event['plc']-1]['unit'])
+            for first, end, addr in write_ranges(event):
+                for other, other_first, other_end in writes.get(key, []):
+                    if first < other_end and other_first < end:
+                        warnings.append('%s Events %u and %u both write memory address %d on %s:%u unit %u' % (where, other, n, addr, key[0], key[1], key[2]))
+                writes.setdefault(key, []).append((n, first, end))
+
+    return errors, warnings
+
+#Compile a script into a validated plan, using the cached plan when the script has not changed
+#raises ValueError listing every error found in the script
+def compile_script(FILE_PATH, cache=True, cache_dir=None):
+    FILE = open(FILE_PATH, 'rb')
+    data = FILE.read()
+    FILE.close()
+    digest = hashlib.sha256(data).hexdigest()
+
+    if cache_dir is None:
+        cache_dir = PLAN_CACHE
+    cache_path = os.path.join(cache_dir, digest + '.json')
+    if cache and os.path.exists(cache_path):
+        try:
+            FILE = open(cache_path, 'r')
+            plan = Script_Plan.from_json(FILE.read())
+            FILE.close()
+            #a cached plan whose files have gone is compiled again so the errors are reported
+            if plan is not None and plan.digest == digest and len(check_environment(plan.events)) == 0:
+                return plan
+        except (OSError, ValueError, KeyError):
+            pass
+
+    lines = data.decode('utf-8', 'replace').splitlines()
+    plcs, events, triggers, starts, errors = parse_script(lines)
+    more_errors, warnings = validate_script(plcs, events, triggers, starts)
+    errors.extend(more_errors)
+    if len(errors) > 0:
+        raise ValueError('Script %s has %u errors:\n%s' % (FILE_PATH, len(errors), '\n'.join(errors)))
+
+    plan = Script_Plan(digest, plcs, events, triggers, starts, warnings)
+    if cache:
+        #write then rename so another process never reads half a plan
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            FILE = open(cache_path + '.tmp', 'w')
+            FILE.write(plan.to_json())
+            FILE.close()
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError:
+            pass
+    return plan
+
+#Build the PLC, Event and Trigger objects for a plan
+#returns dicts of each keyed by their index number
+def build(plan):
+    PLCS = {}
+    Events = {}
+    Triggers = {}
+    for i in range(len(plan.plcs)):
+        PLCS[i+1] = build_plc(plan.plcs[i])
+    for i in range(len(plan.events)):
+        Events[i+1] = build_event(plan.events[i], PLCS, i+1)
+    for i in range(len(plan.triggers)):
+        Triggers[i+1] = build_trigger(plan.triggers[i], PLCS, Events, i+1)
+    return PLCS, Events, Triggers
+
+#Build one PLC of a plan
+def build_plc(plc):
+    Endians = {'big':Endian.BIG, 'little':Endian.LITTLE}
+    PLC = MB_PLC(plc['ip'], plc['port'], plc['unit'])
+    if plc['pipeline'] > 0:
+        PLC.set_pipeline(plc['pipeline'])
+    PLC.wordOrder = Endians[plc['wordorder']]
+    PLC.byteOrder = Endians[plc['byteorder']]
+    PLC.set_retry(**plc['retry'])
+    return PLC
+
+#Build Event number n of a plan on the PLCs already built
+def build_event(event, PLCS, n):
+    new = Event(PLCS[event['plc']], name=str(n))
+    options = {'values':list(event['values']), 'mem_addr':list(event['mem']), 'mem_format':list(event['format']), 'persist':event['persist'], 'Event':event['type'],
+        'suppress':event['suppress'], 'verify':event['verify'], 'file':event['file']}
+    #timing, delay, rate, period and refresh are lists when they are given
+    for key, option in [('timing','timing'), ('delay','time_delay'), ('rate','rate'), ('period','period'), ('refresh','refresh')]:
+        if event[key] is not None:
+            options[option] = list(event[key])
+    new.set_Event(**options)
+    return new
+
+#Build Trigger number n of a plan on the PLCs and Events already built
+def build_trigger(trigger, PLCS, Events, n):
+    new = Trigger(Events[trigger['event']], name=str(n))
+    #set up each plc in the trigger
+    for plc in trigger['plcs']:
+        new.set_plc(PLCS[plc['plc']], list(plc['mem']), list(plc['conditions']), list(plc['values']), list(plc['format']))
+    new.logic = trigger['logic']
+    new.prearm = trigger['prearm']
+    new.poll = Poll_Policy(**trigger['poll'])
+    return new
+
+#Start Events and Triggers and wait for them to finish
+#engine selects how they run, 'thread' or 'async', timeout only applies to the async engine
+#sync connects and prepares every Event first and releases them all at one instant, see Start_Barrier
+#returns the first write skew of a synchronized start, otherwise None
+#shared makes a synchronized start span worker processes, see Start_Barrier.join_shards
+def start(Events, Triggers, ATT, TRG, engine='thread', timeout=None, sync=False, shared=None):
+    #the async engine runs everything on one event loop
+    if engine == 'async':
+        return Async_Engine(timeout=timeout).run([Events[i] for i in ATT], [Triggers[i] for i in TRG], sync)
+
+    #now start the Events and triggers and wait for completion
+    barrier = Start_Barrier(len(ATT), shared=shared) if sync else None
+    for i in range(len(ATT)):
+        if sync:
+            Events[ATT[i]].sync_start(barrier)
+        else:
+            Events[ATT[i]].run()
+    if sync:
+        barrier.begin()
+
+    for i in range(len(TRG)):
+        Triggers[TRG[i]].run()
+
+    for i in range(len(ATT)):
+        Events[ATT[i]].wait()
         
-        line = file.readline()
-        while line:
-            if line in ['\n', '\r\n']:
+    for i in range(len(TRG)):
+        Triggers[TRG[i]].wait()
+
+    if sync:
+        barrier.join()
+        return barrier.report()
+    return None
+
+#Forwards the values one shard polls for a PLC to a Trigger in another shard
+#While the home shard's Triggers all ask for their reads the feed asks too, see Remote_Poller
+class Shard_Feed:
+    def __init__(self, link, home, number):
+        self.link = link
+        self.home = home
+        self.number = number
+        self.lock = threading.Lock()
+        self.asks = False
+        self.poller = None
+        self.local_plan = 0
+        self.indexes = []
+        self.plan = 0
+        self.thread = None
+        self.thread_stop = False
+
+    #poll a new watch list for the home shard, plan is the home shard's plan number for it
+    def update(self, plan, mem_addr, mem_format, asks=False):
+        self.asks = asks
+        poller, local_plan, indexes = subscribe_poller(self.link.plcs[self.number], mem_addr, mem_format, self if asks else None)
+        with self.lock:
+            old = self.poller
+            self.poller = poller
+            self.local_plan = local_plan
+            self.indexes = indexes
+            self.plan = plan
+        if old is poller:
+            #subscribed to the same poller again, drop the old subscription but keep asking as the home shard does
+            old.unsubscribe()
+            poller.ask(self, asks)
+            old.wake()
+        elif old is not None:
+            old.unsubscribe(self)
+            old.wake()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.loop)
+            self.thread.daemon = True
+            self.thread.start()
+
+    #send every cycle of the watched values to the home shard
+    def loop(self):
+        cycle = 0
+        inbox = self.link.inboxes[self.home]
+        current = None
+        while not self.thread_stop:
+            with self.lock:
+                poller, local_plan, indexes, plan = self.poller, self.local_plan, self.indexes, self.plan
+            if poller is not current:
+                current = poller
+                cycle = 0
+            cycle, values = poller.wait(cycle, local_plan, self)
+            if self.thread_stop or poller.thread_stop or poller is not self.poller:
+                continue
+            inbox.put(('values', self.number, plan, [values[i] for i in indexes]))
+        with self.lock:
+            poller = self.poller
+            self.poller = None
+        if poller is not None:
+            poller.unsubscribe()
+
+    #the home shard's Triggers started or stopped all asking for their reads
+    def throttle(self, asks):
+        self.asks = asks
+        poller = self.poller
+        if poller is not None:
+            poller.ask(self, asks)
+
+    #a Trigger in the home shard asked for a read
+    def request(self):
+        poller = self.poller
+        if poller is not None and self.asks:
+            poller.request(self)
+
+    def stop(self):
+        self.thread_stop = True
+        poller = self.poller
+        if poller is not None:
+            poller.wake()
+
+    def __repr__(self):
+        return "Shard_Feed('{}','{}')".format(self.home,self.number)
+
+#Messages between the worker processes of a sharded run
+#Each shard reads its own inbox, subscriptions go to the shard owning a PLC and values come back to the shard that asked
+class Shard_Link:
+    def __init__(self, shard, inboxes, shards, PLCS):
+        self.shard = shard
+        self.inboxes = inboxes
+        self.shards = shards
+        self.plcs = PLCS
+        self.numbers = {PLCS[n]: n for n in PLCS}
+        self.remotes = {}
+        self.feeds = {}
+        self.thread = None
+
+    #True if another shard owns the PLC
+    def remote(self, PLC):
+        return PLC in self.numbers and self.shards[self.numbers[PLC]] != self.shard
+
+    #send a message to the shard owning a PLC number
+    def send(self, number, message):
+        self.inboxes[self.shards[number]].put(message)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #handle messages until told to stop
+    def loop(self):
+        inbox = self.inboxes[self.shard]
+        while True:
+            message = inbox.get()
+            if message[0] == 'stop':
                 break
-            low_line = line.lower()
-            values_splt = low_line.split(',')
-            Keys = [x.strip() for x in values_splt]
-            Keys = [x.split(' ') for x in Keys]
-
-            #if we find Event or trigger, put its index number in the lists
-            for i in range(len(Keys)):
-                if Keys[i][0] == 'event':
-                    if len(Keys[i]) > 1 and int(Keys[i][1]) != 0: #make sure their is a value following the keyword
-                        ATT.append(int(Keys[i][1]))
-                elif Keys[i][0] == 'trigger':
-                    if len(Keys[i]) > 1 and int(Keys[i][1]) != 0:
-                        TRG.append(int(Keys[i][1]))
-            
-            line = file.readline()
-        
-        #now start the Events and triggers and wait for completion
-        for i in range(len(ATT)):
-            Events[ATT[i]].run()
-            
-        for i in range(len(TRG)):
-            Triggers[TRG[i]].run()
-
-        for i in range(len(ATT)):
-            Events[ATT[i]].wait()
-            
-        for i in range(len(TRG)):
-            Triggers[TRG[i]].wait()
-
-    #library of base keywords    
-    Base_lib = {
-        'plc':PLC_Text,
-        'event':Event_Text,
-        'trigger':Trigger_Text,
-        'start':Start_Text
-    }
-
-    #open the file and begin parsing lines
-    FILE = open(FILE_PATH, 'r')
-    Line = FILE.readline()
-    while Line:
-        #if line is not empty and does not start with comment
-        if Line and Line[0] != '#':
-            nline = Line.strip('\n')
-            Keys = nline.split(' ', 1)
-            Key = [x.lower() for x in Keys]
-            if Key[0] in Base_lib: #if we find a keyword execute the function associated with it
-                print(Key)
-                Base_lib[Key[0]](Line, FILE)
-                Line = FILE.readline()
-            else:
-                Line = FILE.readline()
+            elif message[0] == 'values':
+                remote = self.remotes.get(message[1])
+                if remote is not None:
+                    remote.publish(message[2], message[3])
+            elif message[0] == 'subscribe':
+                key = (message[1], message[2])
+                if key not in self.feeds:
+                    self.feeds[key] = Shard_Feed(self, message[1], message[2])
+                self.feeds[key].update(message[3], message[4], message[5], message[6])
+            elif message[0] == 'throttle':
+                feed = self.feeds.get((message[1], message[2]))
+                if feed is not None:
+                    feed.throttle(message[3])
+            elif message[0] == 'request':
+                feed = self.feeds.get((message[1], message[2]))
+                if feed is not None:
+                    feed.request()
+            elif message[0] == 'unsubscribe':
+                feed = self.feeds.pop((message[1], message[2]), None)
+                if feed is not None:
+                    feed.stop()
+        for feed in self.feeds.values():
+            feed.stop()
+
+    def stop(self):
+        self.inboxes[self.shard].put(('stop',))
+        self.thread.join()
+
+    def __repr__(self):
+        return "Shard_Link('{}','{}')".format(self.shard,len(self.inboxes))
+
+#Split the PLCs of a plan between worker processes, PLCs at the same address always share one
+#Addresses are weighed by the Events and Triggers that run on them and the heaviest are placed first
+#returns the shard of each PLC number and the number of shards
+def plan_shards(plan, processes):
+    groups = {}
+    for i in range(len(plan.plcs)):
+        groups.setdefault((plan.plcs[i]['ip'], plan.plcs[i]['port']), []).append(i+1)
+    address = {n: key for key in groups for n in groups[key]}
+    load = {key: 1 for key in groups}
+    for event in plan.events:
+        load[address[event['plc']]] = load[address[event['plc']]] + 1
+    for trigger in plan.triggers:
+        key = address[plan.events[trigger['event']-1]['plc']]
+        load[key] = load[key] + 1
+
+    N = max(1, min(processes, len(groups)))
+    totals = [0 for i in range(N)]
+    shards = {}
+    for key in sorted(groups, key=lambda key: -load[key]):
+        shard = totals.index(min(totals))
+        totals[shard] = totals[shard] + load[key]
+        for n in groups[key]:
+            shards[n] = shard
+    return shards, N
+
+#Entry point of one worker process in a sharded run
+#Builds the whole plan but only runs the Events and Triggers on its own PLCs, each start list ends at a barrier
+#syncs are the shared start barriers of synchronized start lists, None for the others
+#metrics are the start_metrics options, each shard serves and writes its own, and records to its own file
+def shard_worker(shard, plan_json, shards, inboxes, barrier, starts, syncs, metrics, record=None, simulate=None):
+    global SHARD_LINK
+    plan = Script_Plan.from_json(plan_json)
+    simulator = start_simulator(simulate_options(simulate))
+    if simulator is not None:
+        #a forked worker starts with the connections the parent built for real PLCs
+        CONNECTIONS.forget(False)
+    PLCS, Events, Triggers = build(plan)
+    server, writer = start_metrics(shard=shard, **metrics)
+    recorder = start_recording(record, shard)
+    SHARD_LINK = Shard_Link(shard, inboxes, shards, PLCS)
+    SHARD_LINK.start()
+    try:
+        for i in range(len(starts)):
+            ATT, TRG, sync = starts[i]
+            start(Events, Triggers, ATT, TRG, sync=sync, shared=syncs[i])
+            barrier.wait()
+    except threading.BrokenBarrierError:
+        print('Shard %u stopping, another shard failed' % shard)
+    SHARD_LINK.stop()
+    CONNECTIONS.close_all()
+    stop_metrics(server, writer)
+    stop_recording(recorder)
+    stop_simulator(simulator, PLCS, simulate_path(simulate), shard)
+
+#Run the start lists of a plan in worker processes split by PLC, see plan_shards
+#Events run in the shard owning their PLC and Triggers in the shard owning their Event's PLC
+#sync synchronizes the start of every start list across all the shards, see Start_Barrier.join_shards
+def run_sharded(plan, processes, metrics={}, record=None, sync=False, simulate=None):
+    shards, N = plan_shards(plan, processes)
+    starts = [[] for i in range(N)]
+    for start_list in plan.starts:
+        for shard in range(N):
+            starts[shard].append(([], [], sync or start_list['sync']))
+        for n in start_list['events']:
+            starts[shards[plan.events[n-1]['plc']]][-1][0].append(n)
+        for n in start_list['triggers']:
+            starts[shards[plan.events[plan.triggers[n-1]['event']-1]['plc']]][-1][1].append(n)
+
+    context = multiprocessing.get_context()
+    inboxes = [context.Queue() for i in range(N)]
+    barrier = context.Barrier(N)
+    #one barrier per synchronized start list, an aborted one can not be used again
+    syncs = []
+    for start_list in plan.starts:
+        syncs.append((context.Barrier(N), context.Value('d', 0.0)) if sync or start_list['sync'] else None)
+    plan_json = plan.to_json()
+    workers = []
+    for shard in range(N):
+        print('Shard %u runs PLCs %s' % (shard, ', '.join(str(n) for n in sorted(shards) if shards[n] == shard)))
+        worker = context.Process(target=shard_worker, args=(shard, plan_json, shards, inboxes, barrier, starts[shard], syncs, metrics, record, simulate))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    #a shard that dies would leave the others waiting at the barrier forever
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(0.5)
+                if worker.exitcode not in [None, 0]:
+                    barrier.abort()
+                    for shared in syncs:
+                        if shared is not None:
+                            shared[0].abort()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+#Simulator options of a constructor simulate dict, path is where the final state is saved and is not one of them
+def simulate_options(simulate):
+    if simulate is None:
+        return None
+    return dict((key, value) for key, value in simulate.items() if key != 'path')
+
+def simulate_path(simulate):
+    if simulate is None:
+        return None
+    return simulate.get('path')
+
+#Runtime control of a running scenario over a local socket, see Control_Plane
+#Requests and replies are one JSON object per line, e.g. {"cmd":"stop","event":2} gets {"ok":true} back
+#Seconds between state updates streamed by a watch request
+CONTROL_INTERVAL = 1.0
+
+#The PLCs, Events and Triggers of a scenario that a control socket can list, start, stop, pause, resume,
+#retarget and add to while it runs. lines are the script the scenario was built from, added objects are
+#checked as if they were written after it
+class Control_Plane:
+    def __init__(self, lines, PLCS, Events, Triggers):
+        self.lines = list(lines)
+        self.PLCS = PLCS
+        self.Events = Events
+        self.Triggers = Triggers
+        self.plcs, self.events, self.triggers, self.starts, errors = parse_script(self.lines)
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.server = None
+
+    #Answer one request, returns the reply
+    def handle(self, request):
+        commands = {
+            'list':self.list,
+            'start':self.start,
+            'stop':self.stop,
+            'pause':self.pause,
+            'resume':self.resume,
+            'retarget':self.retarget,
+            'add':self.add,
+            'quit':self.quit
+        }
+        if type(request) is not dict or request.get('cmd') not in commands:
+            return {'ok':False, 'error':'cmd must be one of %s' % ', '.join(list(commands) + ['watch'])}
+        try:
+            with self.lock:
+                reply = commands[request['cmd']](request)
+        except ValueError as error:
+            return {'ok':False, 'error':str(error)}
+        reply['ok'] = True
+        return reply
+
+    #the Event or Trigger a request names, returns (kind, number, object)
+    def target(self, request):
+        for kind, objects in [('event', self.Events), ('trigger', self.Triggers)]:
+            if kind in request:
+                number = request[kind]
+                if number not in objects:
+                    raise ValueError('%s %s does not exist' % (kind.capitalize(), number))
+                return kind, number, objects[number]
+        raise ValueError('%s needs an event or trigger number' % request['cmd'])
+
+    #number of a PLC object
+    def plc_number(self, PLC):
+        for number, plc in self.PLCS.items():
+            if plc is PLC:
+                return number
+        return None
+
+    #state of everything in the scenario
+    def list(self, request=None):
+        plcs = [{'number':n, 'plc':'%s:%u/%u' % (PLC.ip, PLC.port, PLC.unit)} for n, PLC in sorted(self.PLCS.items())]
+        events = []
+        for n, event in sorted(self.Events.items()):
+            events.append({'number':n, 'type':event.Event, 'plc':self.plc_number(event.plc), 'mem':list(event.mem_addr), 'state':event.state(),
+                'writes':event.metrics.counters.get('writes', 0)})
+        triggers = []
+        for n, trigger in sorted(self.Triggers.items()):
+            triggers.append({'number':n, 'event':int(trigger.Event.name) if trigger.Event.name.isdigit() else trigger.Event.name, 'state':trigger.state(),
+                'checks':trigger.metrics.counters.get('checks', 0), 'fires':trigger.metrics.counters.get('fires', 0)})
+        return {'time':time.time(), 'plcs':plcs, 'events':events, 'triggers':triggers}
+
+    #start an Event or Trigger that is not running, Events get back the persist their script gave them
+    def start(self, request):
+        kind, number, item = self.target(request)
+        if item.state() in ['running', 'armed', 'paused', 'polling', 'fired']:
+            raise ValueError('%s %u is already %s' % (kind.capitalize(), number, item.state()))
+        if kind == 'event':
+            item.persist = self.events[number-1]['persist']
+        item.run()
+        return {'state':item.state()}
+
+    def stop(self, request):
+        kind, number, item = self.target(request)
+        if item.state() in ['idle', 'done', 'stopped']:
+            raise ValueError('%s %u is not running' % (kind.capitalize(), number))
+        item.stop()
+        return {'state':item.state()}
+
+    def pause(self, request):
+        kind, number, item = self.target(request)
+        item.pause()
+        return {'state':item.state()}
+
+    def resume(self, request):
+        kind, number, item = self.target(request)
+        item.resume()
+        return {'state':item.state()}
+
+    #Point an Event at another PLC and memory addresses, or a Trigger at another Event
+    #{"cmd":"retarget","event":1,"plc":2,"mem":[10,11],"format":["16_int","16_int"]} or {"cmd":"retarget","trigger":1,"fires":3}
+    #a running Event or Trigger is stopped, changed and started again, a paused one is started again paused
+    def retarget(self, request):
+        kind, number, item = self.target(request)
+        if kind == 'event':
+            if isinstance(item.go, threading.Event) and not item.go.is_set() and item.state() in ['armed', 'paused']:
+                raise ValueError('Event %u is armed by a Trigger, stop the Trigger first' % number)
+            PLC = item.plc
+            if 'plc' in request:
+                if request['plc'] not in self.PLCS:
+                    raise ValueError('PLC %s does not exist' % request['plc'])
+                PLC = self.PLCS[request['plc']]
+            mem = [int(x) for x in request.get('mem', item.mem_addr)]
+            formats = list(request.get('format', item.mem_format if 'mem' not in request else []))
+            if len(formats) not in [0, len(mem)]:
+                raise ValueError('give one format per memory address')
+            for formating in formats:
+                if formating not in MEM_FORMATS:
+                    raise ValueError('format %s is not one of %s' % (formating, ', '.join(MEM_FORMATS)))
+        else:
+            if request.get('fires') not in self.Events:
+                raise ValueError('Event %s does not exist' % request.get('fires'))
+
+        state = item.state()
+        running = state not in ['idle', 'done', 'stopped']
+        if running:
+            item.stop()
+        if kind == 'event':
+            item.plc = PLC
+            item.set_Event(mem_addr=mem, mem_format=formats)
+            if running:
+                item.persist = self.events[number-1]['persist']
+        else:
+            item.Event = self.Events[request['fires']]
+        if running:
+            if state == 'paused':
+                item.pause()
+            item.run()
+        return {'state':item.state()}
+
+    #Add PLCs, Events and Triggers written in script form, numbered on from the ones running
+    #{"cmd":"add","script":"Event 3\nPLC:1\n..."}, Start lists in it are started straight away
+    def add(self, request):
+        lines = self.lines + [''] + str(request.get('script', '')).splitlines()
+        plcs, events, triggers, starts, errors = parse_script(lines)
+        more_errors, warnings = validate_script(plcs, events, triggers, starts)
+        errors.extend(more_errors)
+        if len(errors) > 0:
+            raise ValueError('; '.join(errors))
+
+        added = {'plcs':[], 'events':[], 'triggers':[]}
+        for i in range(len(self.plcs), len(plcs)):
+            self.PLCS[i+1] = build_plc(plcs[i])
+            added['plcs'].append(i+1)
+        for i in range(len(self.events), len(events)):
+            self.Events[i+1] = build_event(events[i], self.PLCS, i+1)
+            added['events'].append(i+1)
+        for i in range(len(self.triggers), len(triggers)):
+            self.Triggers[i+1] = build_trigger(triggers[i], self.PLCS, self.Events, i+1)
+            added['triggers'].append(i+1)
+        self.lines, self.plcs, self.events, self.triggers = lines, plcs, events, triggers
+
+        for start_list in starts[len(self.starts):]:
+            for n in start_list['events']:
+                self.Events[n].run()
+            for n in start_list['triggers']:
+                self.Triggers[n].run()
+        self.starts = starts
+        added['warnings'] = warnings
+        return added
+
+    #let the process finish once its start lists are done
+    def quit(self, request):
+        self.done.set()
+        return {}
+
+    #Serve requests on address, host:port for TCP on that interface or a path for a Unix socket
+    def serve(self, address):
+        import socketserver
+        plane = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                    except ValueError:
+                        self.reply({'ok':False, 'error':'requests are one JSON object per line'})
+                        continue
+                    if type(request) is dict and request.get('cmd') == 'watch':
+                        self.watch(float(request.get('interval', CONTROL_INTERVAL)))
+                        return
+                    self.reply(plane.handle(request))
+
+            def reply(self, reply):
+                self.wfile.write((json.dumps(reply) + '\n').encode())
+                self.wfile.flush()
+
+            #stream the state of everything until the client goes away or the scenario quits
+            def watch(self, interval):
+                try:
+                    while True:
+                        with plane.lock:
+                            state = plane.list()
+                        state['ok'] = True
+                        self.reply(state)
+                        if plane.done.wait(max(interval, 0.05)):
+                            break
+                except OSError:
+                    pass
+
+        match = re.match(r'^([^/:]*):(\d+)$', address)
+        if match is not None:
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            self.server = socketserver.ThreadingTCPServer((match.group(1) or '127.0.0.1', int(match.group(2))), Handler)
         else:
-            Line = FILE.readline()
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = socketserver.ThreadingUnixStreamServer(address, Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        print('Control on %s' % address)
+        return self.server
+
+    #stop serving and stop everything still running
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            if isinstance(self.server.server_address, str) and os.path.exists(self.server.server_address):
+                os.remove(self.server.server_address)
+        for item in list(self.Triggers.values()) + list(self.Events.values()):
+            if item.state() not in ['idle', 'done', 'stopped']:
+                item.stop()
+
+    def __repr__(self):
+        return "Control_Plane('{}','{}','{}')".format(len(self.PLCS),len(self.Events),len(self.Triggers))
+
+#Send one request to a control socket, see Control_Plane.serve
+#returns the reply, a watch request calls show with every state update until the connection closes
+def control_request(address, request, show=None):
+    match = re.match(r'^([^/:]*):(\d+)$', address)
+    if match is not None:
+        connection = socket.create_connection((match.group(1) or '127.0.0.1', int(match.group(2))))
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(address)
+    try:
+        connection.sendall((json.dumps(request) + '\n').encode())
+        FILE = connection.makefile('r')
+        reply = None
+        for line in FILE:
+            reply = json.loads(line)
+            if request.get('cmd') != 'watch':
+                break
+            if show is not None:
+                show(reply)
+        return reply
+    finally:
+        connection.close()
+
+#define the constructor that will read scripts and build Events
+#The script is compiled and fully checked before anything is built or started
+#engine selects how the started Events and Triggers run, 'thread' or 'async'
+#timeout only applies to the async engine, check_only stops after building
+#processes above 1 runs the scenario in that many worker processes split by PLC, the returned objects are then not the ones that ran
+#metrics_port serves Prometheus metrics and metrics_file gets a JSON summary every metrics_interval seconds while the scenario runs
+#record appends every value written and every Trigger sample read to that binary recording, see replay
+#sync gives every start list a synchronized start as if it was written 'Start sync'
+#control serves a Control_Plane on that address, the scenario then keeps running after its start lists until it is told to quit
+#returns dicts of the PLCs, Events and Triggers, or None if the script has errors
+def constructor(FILE_PATH, engine='thread', timeout=None, cache=True, cache_dir=None, check_only=False, processes=1,
+        metrics_port=None, metrics_file=None, metrics_interval=10.0, record=None, sync=False, control=None, simulate=None):
+    if control is not None and (engine != 'thread' or processes > 1):
+        print('Control needs the thread engine in one process')
+        return None
+    try:
+        plan = compile_script(FILE_PATH, cache, cache_dir)
+    except ValueError as error:
+        print(error)
+        return None
+    for warning in plan.warnings:
+        print('Warning: ' + warning)
+    print('Compiled %s: %u PLCs, %u Events, %u Triggers' % (FILE_PATH, len(plan.plcs), len(plan.events), len(plan.triggers)))
+
+    #simulated PLCs have to be in place before the PLCs are built, shards start their own
+    simulator = None
+    if not check_only and processes == 1:
+        simulator = start_simulator(simulate_options(simulate))
+    PLCS, Events, Triggers = build(plan)
+
+    #run each start list in the order they appear in the script
+    metrics = {'port':metrics_port, 'path':metrics_file, 'interval':metrics_interval}
+    if not check_only and processes > 1:
+        run_sharded(plan, processes, metrics, record, sync, simulate)
+    elif not check_only:
+        server, writer = start_metrics(**metrics)
+        recorder = start_recording(record)
+        plane = None
+        if control is not None:
+            FILE = open(FILE_PATH, 'r', errors='replace')
+            plane = Control_Plane(FILE.read().splitlines(), PLCS, Events, Triggers)
+            FILE.close()
+            try:
+                plane.serve(control)
+            except OSError as error:
+                print('Could not serve control on %s: %s' % (control, error))
+                plane = None
+        for start_list in plan.starts:
+            start(Events, Triggers, start_list['events'], start_list['triggers'], engine, timeout, sync or start_list['sync'])
+        if plane is not None:
+            print('Start lists done, waiting for quit on %s' % control)
+            try:
+                while not plane.done.wait(1.0):
+                    pass
+            except KeyboardInterrupt:
+                print('Interrupted')
+            plane.close()
+        stop_metrics(server, writer)
+        stop_recording(recorder)
+        stop_simulator(simulator, PLCS, simulate_path(simulate))
+
+    return PLCS, Events, Triggers
 
 #main program
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='ManiPIO - Manipulate Process IO')
     parser.add_argument('file', nargs='+', help='Path to Event script')
+    parser.add_argument('--engine', choices=['thread', 'async'], default='thread', help='Run Events and Triggers as threads or on one asyncio loop')
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds before the async engine cancels the scenario')
+    parser.add_argument('--processes', type=int, default=1, help='Split the scenario by PLC across this many worker processes (thread engine only)')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Serve Prometheus metrics on this local port')
+    parser.add_argument('--metrics-file', default=None, help='Append a JSON metrics summary to this file while running')
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help='Seconds between metrics summaries (default 10)')
+    parser.add_argument('--record', default=None, help='Record every value written and Trigger sample read to this binary file')
+    parser.add_argument('--replay', action='store_true', help='The file is a recording, replay its writes instead of running a script')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay this many times faster than recorded (default 1)')
+    parser.add_argument('--target', action='append', default=[], help='Replay the writes of recorded PLC N to another address, N=IP:PORT[/UNIT]')
+    parser.add_argument('--sync', action='store_true', help='Connect and prepare the Events of each start list first, then start them all at one instant')
+    parser.add_argument('--control', default=None, help='Serve runtime control on HOST:PORT or a Unix socket path, see Control_Plane')
+    parser.add_argument('--send', default=None, help='The file is a control address, send it this JSON request and print the reply')
+    parser.add_argument('--simulate', action='store_true', help='Run against in-memory simulated PLCs instead of the addresses in the script')
+    parser.add_argument('--sim-latency', type=float, default=0.0, help='Seconds each simulated request takes (default 0)')
+    parser.add_argument('--sim-jitter', type=float, default=0.0, help='Spread the simulated latency by up to this many seconds either way')
+    parser.add_argument('--sim-fail', type=float, default=0.0, help='Chance a simulated request answers with an exception (0 to 1)')
+    parser.add_argument('--sim-drop', type=float, default=0.0, help='Chance a simulated request drops its connection (0 to 1)')
+    parser.add_argument('--sim-seed', type=int, default=None, help='Seed for simulated jitter and failures, for runs that repeat exactly')
+    parser.add_argument('--sim-state', default=None, help='Save the final value of every simulated address written to this JSON file')
+    parser.add_argument('--check', action='store_true', help='Compile and check the script without starting anything')
+    parser.add_argument('--no-cache', action='store_true', help='Do not use or save compiled script plans')
+    parser.add_argument('--cache-dir', default=None, help='Folder for compiled script plans (default ~/.cache/ManiPIO)')
     args_namespace = parser.parse_args()
+    if args_namespace.processes > 1 and args_namespace.engine == 'async':
+        parser.error('--processes runs the thread engine in each worker, it cannot be used with --engine async')
     args = vars(args_namespace)['file']
+    if args_namespace.control is not None and (args_namespace.processes > 1 or args_namespace.engine == 'async'):
+        parser.error('--control needs the thread engine in one process')
+    if args_namespace.send is not None:
+        try:
+            reply = control_request(args[0], json.loads(args_namespace.send), lambda state: print(json.dumps(state)))
+        except (ValueError, OSError) as error:
+            print(error)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            sys.exit(0)
+        print(json.dumps(reply))
+        sys.exit(0 if reply and reply.get('ok') else 1)
+    if args_namespace.replay:
+        if args_namespace.speed <= 0:
+            parser.error('--speed must be above 0')
+        targets = {}
+        for target in args_namespace.target:
+            match = re.match(r'^(\d+)=([^:/]+):(\d+)(?:/(\d+))?$', target)
+            if match is None:
+                parser.error('--target %s must look like N=IP:PORT or N=IP:PORT/UNIT' % target)
+            targets[int(match.group(1))] = (match.group(2), int(match.group(3)), int(match.group(4) or 1))
+        try:
+            replay(args[0], args_namespace.speed, targets)
+        except (ValueError, OSError) as error:
+            print(error)
+            sys.exit(1)
+        sys.exit(0)
+    simulate = None
+    if args_namespace.simulate:
+        if not (0 <= args_namespace.sim_fail <= 1 and 0 <= args_namespace.sim_drop <= 1):
+            parser.error('--sim-fail and --sim-drop are chances between 0 and 1')
+        simulate = {'latency':args_namespace.sim_latency, 'jitter':args_namespace.sim_jitter, 'fail':args_namespace.sim_fail,
+            'drop':args_namespace.sim_drop, 'seed':args_namespace.sim_seed, 'path':args_namespace.sim_state}
     #parse arguments and find file location to pluggin to Event constructor
-    constructor(args[0])
+    result = constructor(args[0], engine=args_namespace.engine, timeout=args_namespace.timeout, cache=not args_namespace.no_cache,
+        cache_dir=args_namespace.cache_dir, check_only=args_namespace.check, processes=args_namespace.processes,
+        metrics_port=args_namespace.metrics_port, metrics_file=args_namespace.metrics_file, metrics_interval=args_namespace.metrics_interval,
+        record=args_namespace.record, sync=args_namespace.sync, control=args_namespace.control, simulate=simulate)
+    if result is None:
+        sys.exit(1)
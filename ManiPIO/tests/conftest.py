@@ -0,0 +1,27 @@
+import os
+import sys
+import pytest
+
+#ManiPIO, Capture_Modbus and the benchmarks are scripts, not packages, so the tests import them from their folders
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, os.path.join(HERE, '..', 'Capture_ModBus'))
+sys.path.insert(0, os.path.join(HERE, '..', 'Benchmark'))
+
+import ManiPIO
+
+#PLCs built while this is in use talk to an in memory simulator instead of the network
+@pytest.fixture
+def simulator():
+    simulator = ManiPIO.start_simulator({})
+    yield simulator
+    ManiPIO.stop_simulator(simulator)
+
+#Build the PLCs, Events and Triggers of a script on the simulator, returns them as build() does
+@pytest.fixture
+def scenario(simulator, tmp_path):
+    def build(text):
+        path = tmp_path / 'script.txt'
+        path.write_text(text)
+        return ManiPIO.build(ManiPIO.compile_script(str(path), cache=False))
+    return build
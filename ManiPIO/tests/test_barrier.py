@@ -0,0 +1,126 @@
+import time
+import threading
+import multiprocessing
+
+import ManiPIO
+
+#a party that leaves before the start, waiting or not, is not waited for and does not stop the others
+def test_leaving_before_the_start():
+    barrier = ManiPIO.Start_Barrier(3, lead=0.01)
+    released = {}
+    def party(name):
+        barrier.wait()
+        released[name] = barrier.instant
+    threads = {name: threading.Thread(target=party, args=(name,)) for name in ['stopped', 'waiting']}
+    for thread in threads.values():
+        thread.start()
+    time.sleep(0.05)
+    barrier.leave(threads['stopped'])
+    threads['stopped'].join(1)
+    assert released == {'stopped': None}
+    assert threads['waiting'].is_alive()
+    #the third party never arrives, it leaves too and the one still waiting starts
+    barrier.leave(threading.Thread())
+    threads['waiting'].join(1)
+    assert released['waiting'] is not None
+    assert not barrier.aborted
+    barrier.leave(threads['waiting'])
+    assert barrier.parties == 1
+
+#one worker process, its Events get ready after a pause and put the time they were released
+def shard(shared, pause, parties, released):
+    barrier = ManiPIO.Start_Barrier(parties, lead=0.1, shared=shared)
+    def event():
+        time.sleep(pause)
+        barrier.wait()
+        released.put(time.time())
+    threads = [threading.Thread(target=event) for i in range(parties)]
+    for thread in threads:
+        thread.start()
+    barrier.begin()
+    for thread in threads:
+        thread.join()
+    barrier.join()
+    if parties == 0:
+        released.put(barrier.instant is not None)
+
+#every shard is released at one instant, after the slowest is ready, including a shard with no Events
+def test_shards_start_together():
+    ctx = multiprocessing.get_context()
+    shared = (ctx.Barrier(3), ctx.Value('d', 0.0))
+    released = ctx.Queue()
+    shards = [ctx.Process(target=shard, args=(shared, pause, parties, released)) for pause, parties in [(0.0, 2), (0.5, 1), (0.0, 0)]]
+    begun = time.time()
+    for process in shards:
+        process.start()
+    results = [released.get(timeout=10) for i in range(4)]
+    for process in shards:
+        process.join(10)
+        assert process.exitcode == 0
+    times = [r for r in results if type(r) is float]
+    assert results.count(True) == 1
+    assert len(times) == 3
+    assert min(times) - begun >= 0.5
+    assert max(times) - min(times) < 0.05
+    assert abs(min(times) - shared[1].value) < 0.05
+
+#stopping a shard before the start lets its Events go and stops the other shards waiting
+def test_stop_before_start_releases_every_shard():
+    ctx = multiprocessing.get_context()
+    shared = (ctx.Barrier(2), ctx.Value('d', 0.0))
+    released = ctx.Queue()
+    other = ctx.Process(target=shard, args=(shared, 1, 1, released))
+    other.start()
+    barrier = ManiPIO.Start_Barrier(1, shared=shared)
+    waiting = threading.Thread(target=barrier.wait)
+    waiting.start()
+    barrier.begin()
+    time.sleep(0.2)
+    barrier.set()
+    waiting.join(2)
+    assert not waiting.is_alive()
+    assert barrier.instant is None
+    released.get(timeout=10)
+    other.join(10)
+    assert other.exitcode == 0
+
+SYNC = """PLC 1
+IP:127.0.0.1
+Port:5601
+
+Event 1
+PLC:1
+mem:10
+format:16_int
+values:1
+
+Event 2
+PLC:1
+mem:20
+format:16_int
+values:2
+
+Event 3
+PLC:1
+mem:30
+format:16_int
+values:3
+"""
+
+#stopping one Event of a synchronized start leaves the others waiting to start together
+def test_stopped_event_leaves_the_start(scenario, simulator):
+    PLCS, Events, Triggers = scenario(SYNC)
+    barrier = ManiPIO.Start_Barrier(3)
+    Events[1].sync_start(barrier)
+    Events[2].sync_start(barrier)
+    time.sleep(0.1)
+    Events[1].stop()
+    Events[1].wait()
+    assert not barrier.aborted and barrier.instant is None
+    assert Events[2].state() != 'done'
+    Events[3].sync_start(barrier)
+    Events[2].wait()
+    Events[3].wait()
+    image = simulator.image('127.0.0.1', 5601)
+    assert (image[10], image[20], image[30]) == (0, 2, 3)
+    assert barrier.stats()['events'] == 2
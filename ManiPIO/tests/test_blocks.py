@@ -0,0 +1,53 @@
+import ManiPIO
+
+def layout(blocks):
+    return [(block.start, block.count, block.coils, block.items) for block in blocks]
+
+def test_contiguous_addresses_share_a_block():
+    blocks = ManiPIO.plan_blocks([10, 11, 12], ['16_int']*3, 125)
+    assert layout(blocks) == [(10, 3, False, [(0, 0, '16_int'), (1, 1, '16_int'), (2, 2, '16_int')])]
+
+def test_unsorted_addresses_keep_their_index():
+    blocks = ManiPIO.plan_blocks([12, 10, 11], ['16_int']*3, 125)
+    assert layout(blocks) == [(10, 3, False, [(0, 2, '16_int'), (1, 0, '16_int'), (2, 1, '16_int')])]
+
+def test_gap_joins_only_close_addresses():
+    mem = [0, 5, 20]
+    assert len(ManiPIO.plan_blocks(mem, ['16_int']*3, 125)) == 3
+    assert [block.start for block in ManiPIO.plan_blocks(mem, ['16_int']*3, 125, gap=4)] == [0, 20]
+    assert layout(ManiPIO.plan_blocks(mem, ['16_int']*3, 125, gap=15))[0][:2] == (0, 21)
+
+def test_multi_register_formats():
+    blocks = ManiPIO.plan_blocks([100, 102, 106], ['32_float', '64_float', '16_int'], 125)
+    assert layout(blocks) == [(100, 7, False, [(0, 0, '32_float'), (1, 2, '64_float'), (2, 6, '16_int')])]
+
+def test_limit_splits_blocks():
+    blocks = ManiPIO.plan_blocks(list(range(300)), ['16_int']*300, ManiPIO.MAX_WRITE_REGS)
+    assert [block.count for block in blocks] == [123, 123, 54]
+    assert ManiPIO.plan_size(blocks) == 300
+
+def test_value_never_straddles_the_limit():
+    #the 32 bit value at 3 would end past a 4 register limit, so it starts the next block
+    blocks = ManiPIO.plan_blocks([0, 1, 2, 3], ['16_int', '16_int', '16_int', '32_int'], 4)
+    assert [(block.start, block.count) for block in blocks] == [(0, 3), (3, 2)]
+
+def test_overlapping_addresses_keep_script_order():
+    blocks = ManiPIO.plan_blocks([10, 10, 11], ['16_int', '16_int', '16_int'], 125)
+    assert layout(blocks) == [(10, 2, False, [(0, 0, '16_int'), (1, 0, '16_int'), (2, 1, '16_int')])]
+    #a 32 bit value over 10-11 and a 16 bit one at 11 overlap without growing the block
+    blocks = ManiPIO.plan_blocks([10, 11], ['32_int', '16_int'], 125)
+    assert [(block.start, block.count) for block in blocks] == [(10, 2)]
+
+def test_coils_get_their_own_blocks():
+    coil = ManiPIO.COIL_FORMAT
+    blocks = ManiPIO.plan_blocks([5, 6, 5, 6], [coil, coil, '16_int', '16_int'], 125)
+    assert layout(blocks) == [(5, 2, False, [(2, 0, '16_int'), (3, 1, '16_int')]), (5, 2, True, [(0, 0, coil), (1, 1, coil)])]
+
+def test_coil_limit():
+    coil = ManiPIO.COIL_FORMAT
+    blocks = ManiPIO.plan_blocks(list(range(3000)), [coil]*3000, ManiPIO.MAX_READ_REGS, coil_limit=ManiPIO.MAX_READ_COILS)
+    assert [block.count for block in blocks] == [2000, 1000]
+
+def test_no_addresses():
+    assert ManiPIO.plan_blocks([], [], 125) == []
+    assert ManiPIO.plan_size([]) == 0
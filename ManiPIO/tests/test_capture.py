@@ -0,0 +1,168 @@
+import io
+import ctypes
+import socket
+import struct
+import pytest
+
+import Capture_Modbus
+import Capture_Benchmark
+from Capture_Modbus import parse_frame, MODBUS_PORT
+from Capture_Benchmark import build_frame
+
+READ = struct.pack('>BHH', 0x3, 200, 4)
+WRITE = struct.pack('>BHHB', 0x10, 100, 4, 8) + struct.pack('>ff', 1.5, -2.0)
+RESPONSE = struct.pack('>BB', 0x3, 8) + struct.pack('>ff', 3.25, 4.5)
+
+def request_frame(pdu=READ, Trans_ID=7):
+    return build_frame('10.0.0.1', 40000, '10.0.0.2', MODBUS_PORT, Trans_ID, pdu)
+
+def response_frame(pdu=RESPONSE, Trans_ID=7):
+    return build_frame('10.0.0.2', MODBUS_PORT, '10.0.0.1', 40000, Trans_ID, pdu)
+
+#the same IP packet behind each link layer header
+def with_link(frame, link):
+    ip = frame[14:]
+    return {'ether':frame, 'sll':b'\x00'*14 + b'\x08\x00' + ip, 'null':b'\x02\x00\x00\x00' + ip, 'raw':ip}[link]
+
+@pytest.mark.parametrize('link', ['ether', 'sll', 'null', 'raw'])
+def test_links(link):
+    adus = parse_frame(with_link(request_frame(), link), link)
+    assert len(adus) == 1
+    assert adus[0][:6] == ('10.0.0.1', 40000, '10.0.0.2', MODBUS_PORT, 7, 1)
+    assert bytes(adus[0][6]) == READ
+
+def test_response():
+    (adu,) = parse_frame(response_frame())
+    assert adu[:5] == ('10.0.0.2', MODBUS_PORT, '10.0.0.1', 40000, 7)
+    assert bytes(adu[6]) == RESPONSE
+
+def test_vlan_tag():
+    frame = request_frame()
+    tagged = frame[:12] + b'\x81\x00\x00\x05' + frame[12:]
+    assert bytes(parse_frame(tagged)[0][6]) == READ
+
+def test_several_adus_in_one_segment():
+    frame = request_frame(READ)
+    second = Capture_Modbus.MBAP.pack(8, 0, len(WRITE) + 1, 1) + WRITE
+    frame = frame[:16] + struct.pack('>H', struct.unpack_from('>H', frame, 16)[0] + len(second)) + frame[18:] + second
+    adus = parse_frame(frame)
+    assert [(adu[4], bytes(adu[6])) for adu in adus] == [(7, READ), (8, WRITE)]
+
+def test_ethernet_padding_is_ignored():
+    adus = parse_frame(request_frame() + b'\x00'*10)
+    assert bytes(adus[0][6]) == READ
+
+def test_other_traffic_is_skipped():
+    frame = request_frame()
+    assert parse_frame(frame, port=503) == []
+    #not IPv4
+    assert parse_frame(frame[:12] + b'\x86\xdd' + frame[14:]) == []
+    #UDP
+    assert parse_frame(frame[:23] + b'\x11' + frame[24:]) == []
+    #a fragment after the first
+    assert parse_frame(frame[:20] + b'\x00\x10' + frame[22:]) == []
+    #not the Modbus protocol ID
+    assert parse_frame(frame[:56] + b'\x00\x01' + frame[58:]) == []
+
+#every prefix of a frame is decoded as far as it goes without raising
+@pytest.mark.parametrize('link', ['ether', 'sll', 'null', 'raw'])
+def test_runt_frames(link):
+    frame = with_link(request_frame(WRITE), link)
+    for n in range(len(frame)):
+        adus = parse_frame(frame[:n], link)
+        assert len(adus) <= 1
+    assert parse_frame(b'', link) == []
+
+def test_runt_vlan_frame():
+    assert parse_frame(request_frame()[:12] + b'\x81\x00\x00') == []
+
+#frames sent on loopback through the kernel filter, a raw socket needs root
+@pytest.fixture
+def filtered():
+    if not hasattr(socket, 'AF_PACKET'):
+        pytest.skip('raw sockets are Linux only')
+    try:
+        rx = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(Capture_Modbus.ETH_P_ALL))
+        tx = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+    except PermissionError:
+        pytest.skip('raw sockets need root')
+    rx.bind(('lo', Capture_Modbus.ETH_P_ALL))
+    tx.bind(('lo', 0))
+    code = Capture_Modbus.port_filter(5502)
+    program = ctypes.create_string_buffer(b''.join(struct.pack('HBBI', *op) for op in code))
+    rx.setsockopt(socket.SOL_SOCKET, Capture_Modbus.SO_ATTACH_FILTER, struct.pack('HL', len(code), ctypes.addressof(program)))
+    rx.settimeout(0.2)
+    #send a frame and return every frame the filter let through
+    def send(frame):
+        tx.send(frame)
+        frames = []
+        try:
+            while True:
+                frames.append(rx.recv(65536))
+        except socket.timeout:
+            pass
+        return frames
+    yield send
+    rx.close()
+    tx.close()
+
+#tagged frames reach parse_frame too, the kernel may strip the tag from the copy it receives
+def test_kernel_filter(filtered):
+    frame = build_frame('10.0.0.1', 40000, '10.0.0.2', 5502, 7, READ)
+    tagged = frame[:12] + b'\x81\x00\x00\x05' + frame[12:]
+    other = build_frame('10.0.0.1', 40000, '10.0.0.2', 5503, 7, READ)
+    assert frame in filtered(frame)
+    assert tagged in filtered(tagged)
+    assert filtered(other) == []
+    assert filtered(other[:12] + b'\x81\x00\x00\x05' + other[12:]) == []
+
+def make_log():
+    FILE = io.StringIO()
+    return Capture_Modbus.Modbus_Log(FILE, echo=False), FILE
+
+def test_log_matches_responses_to_requests():
+    log, FILE = make_log()
+    log.frame(request_frame(READ, 7))
+    log.frame(request_frame(struct.pack('>BHH', 0x3, 300, 4), 8))
+    log.frame(response_frame(RESPONSE, 8))
+    log.frame(response_frame(RESPONSE, 7))
+    text = FILE.getvalue()
+    assert 'ID: 8 IP: 10.0.0.2:502 --> 10.0.0.1:40000 Memory Address: 300' in text
+    assert 'ID: 7 IP: 10.0.0.2:502 --> 10.0.0.1:40000 Memory Address: 200' in text
+    assert 'Values: [3.25, 4.5]' in text
+    assert log.pending == {}
+    assert (log.packets, log.adus, log.errors) == (4, 4, 0)
+
+def test_log_writes():
+    log, FILE = make_log()
+    log.frame(request_frame(WRITE))
+    assert 'Write Registers IP: 10.0.0.1:40000 --> 10.0.0.2:502 Memory Address: 100' in FILE.getvalue()
+    assert 'Values: [1.5, -2.0]' in FILE.getvalue()
+
+def test_short_write_values_are_zero():
+    assert Capture_Modbus.decode_floats(struct.pack('>f', 1.5), 3) == [1.5, 0, 0]
+
+def test_unanswered_requests_are_forgotten(monkeypatch):
+    monkeypatch.setattr(Capture_Modbus, 'PENDING_MAX', 5)
+    log, FILE = make_log()
+    for Trans_ID in range(20):
+        log.frame(request_frame(READ, Trans_ID))
+    assert len(log.pending) == 5
+    assert [key[4] for key in log.pending] == [15, 16, 17, 18, 19]
+
+def test_old_requests_time_out(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(Capture_Modbus.time, 'monotonic', lambda: now[0])
+    log, FILE = make_log()
+    log.frame(request_frame(READ, 1))
+    now[0] = now[0] + Capture_Modbus.PENDING_TIMEOUT + 1
+    log.frame(request_frame(READ, 2))
+    assert [key[4] for key in log.pending] == [2]
+
+def test_benchmark_decodes_every_frame():
+    frames = Capture_Benchmark.benchmark_frames(4)
+    log, FILE = make_log()
+    for frame in frames:
+        log.frame(frame)
+    assert (log.packets, log.adus, log.errors) == (300, 300, 0)
+    assert log.pending == {}
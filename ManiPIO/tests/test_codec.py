@@ -0,0 +1,70 @@
+import pytest
+from pymodbus.constants import Endian
+from pymodbus.payload import BinaryPayloadBuilder, BinaryPayloadDecoder
+
+import ManiPIO
+
+ORDERS = [(Endian.BIG, Endian.BIG), (Endian.BIG, Endian.LITTLE), (Endian.LITTLE, Endian.BIG), (Endian.LITTLE, Endian.LITTLE)]
+
+#a value of each register format and the pymodbus builder and decoder methods for it
+VALUES = {
+    '16_int': (-1234, 'add_16bit_int', 'decode_16bit_int'),
+    '32_int': (-123456789, 'add_32bit_int', 'decode_32bit_int'),
+    '64_int': (-1234567890123, 'add_64bit_int', 'decode_64bit_int'),
+    '16_uint': (54321, 'add_16bit_uint', 'decode_16bit_uint'),
+    '32_uint': (3123456789, 'add_32bit_uint', 'decode_32bit_uint'),
+    '64_uint': (12345678901234567, 'add_64bit_uint', 'decode_64bit_uint'),
+    '16_float': (1.5, 'add_16bit_float', 'decode_16bit_float'),
+    '32_float': (-2.75, 'add_32bit_float', 'decode_32bit_float'),
+    '64_float': (3.141592653589793, 'add_64bit_float', 'decode_64bit_float'),
+}
+
+def pymodbus_registers(formating, value, byteOrder, wordOrder):
+    builder = BinaryPayloadBuilder(byteorder=byteOrder, wordorder=wordOrder)
+    getattr(builder, VALUES[formating][1])(value)
+    return builder.to_registers()
+
+@pytest.mark.parametrize('byteOrder,wordOrder', ORDERS)
+@pytest.mark.parametrize('formating', sorted(VALUES))
+def test_encode_matches_pymodbus(formating, byteOrder, wordOrder):
+    value = VALUES[formating][0]
+    codec = ManiPIO.get_codec(formating, byteOrder, wordOrder)
+    assert codec.encode(value) == pymodbus_registers(formating, value, byteOrder, wordOrder)
+
+@pytest.mark.parametrize('byteOrder,wordOrder', ORDERS)
+@pytest.mark.parametrize('formating', sorted(VALUES))
+def test_decode_matches_pymodbus(formating, byteOrder, wordOrder):
+    value = VALUES[formating][0]
+    registers = pymodbus_registers(formating, value, byteOrder, wordOrder)
+    decoder = BinaryPayloadDecoder.fromRegisters(registers, byteorder=byteOrder, wordorder=wordOrder)
+    codec = ManiPIO.get_codec(formating, byteOrder, wordOrder)
+    assert codec.decode(registers) == getattr(decoder, VALUES[formating][2])()
+    assert codec.decode(registers) == pytest.approx(value)
+
+def test_codecs_are_shared():
+    assert ManiPIO.get_codec('32_float', Endian.BIG, Endian.LITTLE) is ManiPIO.get_codec('32_float', Endian.BIG, Endian.LITTLE)
+    assert ManiPIO.get_codec('32_float', Endian.BIG, Endian.LITTLE) is not ManiPIO.get_codec('32_float', Endian.BIG, Endian.BIG)
+
+def test_integer_formats_truncate_floats():
+    codec = ManiPIO.get_codec('16_int', Endian.BIG, Endian.BIG)
+    assert codec.encode(7.9) == codec.encode(7)
+
+@pytest.mark.parametrize('numpy', [True, False])
+@pytest.mark.parametrize('byteOrder,wordOrder', ORDERS)
+def test_arrays_match_single_values(monkeypatch, numpy, byteOrder, wordOrder):
+    if not numpy:
+        monkeypatch.setattr(ManiPIO, 'np', None)
+    elif ManiPIO.np is None:
+        pytest.skip('NumPy is not installed')
+    codec = ManiPIO.get_codec('32_float', byteOrder, wordOrder)
+    values = [0.5, -1.25, 1000.0]
+    registers = [register for value in values for register in codec.encode(value)]
+    assert [int(register) for register in codec.encode_array(values)] == registers
+    assert [float(value) for value in codec.decode_array(registers)] == values
+
+def test_coils():
+    codec = ManiPIO.get_codec(ManiPIO.COIL_FORMAT, Endian.BIG, Endian.BIG)
+    assert codec.encode(5) == [1]
+    assert codec.encode(0) == [0]
+    assert codec.decode([3]) == 1
+    assert [int(value) for value in codec.encode_array([0, 2, 0.5])] == [0, 1, 1]
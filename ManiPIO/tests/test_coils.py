@@ -0,0 +1,116 @@
+import socket
+import struct
+import pytest
+
+import ManiPIO
+
+COIL = ManiPIO.COIL_FORMAT
+
+@pytest.fixture
+def PLC(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 6401)
+    PLC.connect()
+    yield PLC
+    PLC.close()
+
+#a run of coils is one request each way, coils are apart from the registers at the same addresses
+def test_coil_ranges(PLC, simulator):
+    assert PLC.write_coils(20, [True, False, True, True]).ok
+    assert PLC.read_coils(20, 5).bits[:5] == [True, False, True, True, False]
+    device = simulator.devices[('127.0.0.1', 6401)]
+    assert (device.counts['writes'], device.counts['reads']) == (1, 1)
+    assert list(simulator.image('127.0.0.1', 6401, coils=True)[20:24]) == [1, 0, 1, 1]
+    assert simulator.image('127.0.0.1', 6401)[20] == 0
+
+def test_single_coils(PLC):
+    PLC.writecoil(7, True)
+    assert PLC.readcoil(7) is True
+    PLC.writecoil(7, 0)
+    assert PLC.readcoil(7) is False
+    assert PLC.write(8, 1, COIL).ok
+    assert PLC.read(8, COIL) == 1
+
+#the write goes first, so reading the written registers back shows the new values
+def test_write_read(PLC, simulator):
+    simulator.image('127.0.0.1', 6401)[40] = 9
+    result, registers = PLC.write_read(30, [1, 2, 3], 29, 3)
+    assert result.ok
+    assert registers == [0, 1, 2]
+    result, registers = PLC.write_read(50, [4], 40, 1)
+    assert registers == [9]
+    assert simulator.devices[('127.0.0.1', 6401)].counts['writes'] == 2
+
+def test_failed_write_read(PLC):
+    PLC.set_retry(attempts=1)
+    result, registers = PLC.write_read(ManiPIO.SIM_REGISTERS, [1], 0, 1)
+    assert not result.ok and registers is None
+
+#blocks mixing coils and registers read back in the order the addresses were planned
+def test_mixed_blocks(PLC):
+    PLC.write_coils(5, [True, True])
+    PLC.write(5, 77, '16_int')
+    blocks = PLC.plan_write([5, 5, 6], ['16_int', COIL, COIL])
+    assert sorted(block.coils for block in blocks) == [False, True]
+    assert PLC.read_blocks(PLC.plan_read([5, 5, 6], ['16_int', COIL, COIL])) == [77, 1, 1]
+    #the write shadow keys coils apart from registers, the coils written above are shadowed
+    assert PLC.write_changed(5, [1, 1], coils=True) is None
+    assert PLC.write_changed(6, [1, 0], coils=True) is not None
+    assert PLC.write_changed(6, [1, 0]) is not None
+
+SCRIPT = """PLC 1
+IP:127.0.0.1
+Port:6402
+
+Event 1
+PLC:1
+mem:10,11,12
+format:1_coil,1_coil,16_int
+values:1,0,5
+
+Event 2
+PLC:1
+mem:100
+format:1_coil
+values:1
+
+Trigger 1
+Event:2
+PLC:1
+mem:20
+format:1_coil
+values:0
+conditions:>
+
+Start
+Event 1, Trigger 1
+"""
+
+#Events write coils and Triggers watch them
+def test_coil_events_and_triggers(scenario, simulator):
+    PLCS, Events, Triggers = scenario(SCRIPT)
+    simulator.image('127.0.0.1', 6402, coils=True)[20] = 1
+    ManiPIO.start(Events, Triggers, [1], [1])
+    coils = simulator.image('127.0.0.1', 6402, coils=True)
+    assert (coils[10], coils[11], coils[100]) == (1, 0, 1)
+    assert simulator.image('127.0.0.1', 6402)[12] == 5
+    assert Triggers[1].metrics.counters['fires'] == 1
+
+#the pipelined client frames functions 1, 15 and 23 the way the Modbus spec does
+def test_pipelined_frames():
+    client = ManiPIO.Pipeline_Client('127.0.0.1', 502)
+    client.sock, PLC_end = socket.socketpair()
+    client.submit_read_coils(20, 10, slave=2)
+    client.submit_write_coils(20, [True, False, True] + [False]*5 + [True])
+    client.submit(1, 23, struct.pack('>HHHHB2H', 30, 2, 40, 2, 4, 5, 6))
+    frames = PLC_end.recv(1024)
+    assert frames == (struct.pack('>HHHBBHH', 1, 0, 6, 2, 1, 20, 10)
+        + struct.pack('>HHHBBHHB', 2, 0, 9, 1, 15, 20, 9, 2) + bytes([0b101, 1])
+        + struct.pack('>HHHBBHHHHB2H', 3, 0, 15, 1, 23, 30, 2, 40, 2, 4, 5, 6))
+    #answers go back to the request with their transaction ID
+    requests = dict(client.pending)
+    client.complete(1, bytes([1, 2, 0b11, 0b10]))
+    client.complete(3, struct.pack('>BB2H', 23, 4, 7, 8))
+    assert requests[1].result(0).bits[:10] == [True, True] + [False]*7 + [True]
+    assert requests[3].result(0).registers == [7, 8]
+    client.close()
+    PLC_end.close()
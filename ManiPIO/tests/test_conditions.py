@@ -0,0 +1,102 @@
+import math
+import pytest
+
+import ManiPIO
+
+#every plan is checked with NumPy and with the plain Python fallback
+@pytest.fixture(params=['numpy', 'python'])
+def plan(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(ManiPIO, 'np', None)
+    elif ManiPIO.np is None:
+        pytest.skip('NumPy is not installed')
+    return ManiPIO.Condition_Plan
+
+def run(plan, values, now=None):
+    return [plan.evaluate(v, now) for v in values]
+
+def test_parse_condition():
+    assert ManiPIO.parse_condition('>') == ('', '>', 0.0, 0.0, 0.0, 0.0)
+    assert ManiPIO.parse_condition('rise >= hyst 2 for 1.5') == ('rise', '>=', 0.0, 0.0, 2.0, 1.5)
+    assert ManiPIO.parse_condition('FALL range 10 20') == ('fall', 'range', 10.0, 20.0, 0.0, 0.0)
+    assert ManiPIO.parse_condition('outside -5 5 hyst 1') == ('', 'outside', -5.0, 5.0, 1.0, 0.0)
+
+@pytest.mark.parametrize('text', ['', 'bigger', 'rise', 'range 10', '> hyst', '> later 3'])
+def test_parse_condition_errors(text):
+    with pytest.raises(ValueError):
+        ManiPIO.parse_condition(text)
+
+@pytest.mark.parametrize('logic', ['1 and', '4', '0', 'maybe 1', '(1'])
+def test_logic_errors(logic):
+    with pytest.raises(ValueError):
+        ManiPIO.compile_logic(logic, 3)
+
+def test_no_logic():
+    assert ManiPIO.compile_logic(None, 2) is None
+    assert ManiPIO.compile_logic('  ', 2) is None
+
+@pytest.mark.parametrize('op,value,results', [
+    ('>', 5, [False, False, True]),
+    ('<', 5, [True, False, False]),
+    ('>=', 5, [False, True, True]),
+    ('<=', 5, [True, True, False]),
+    ('==', 5, [False, True, False]),
+    ('!=', 5, [True, False, True]),
+])
+def test_operators(plan, op, value, results):
+    conditions = plan([op], [value])
+    assert run(conditions, [[4], [5], [6]]) == results
+
+def test_ranges(plan):
+    inside = plan(['range 10 20'], [0])
+    assert run(inside, [[9], [10], [20], [21]]) == [False, True, True, False]
+    outside = plan(['outside 10 20'], [0])
+    assert run(outside, [[9], [10], [20], [21]]) == [True, False, False, True]
+
+def test_all_conditions_by_default(plan):
+    conditions = plan(['>', '<'], [0, 10])
+    assert run(conditions, [[1, 5], [1, 15], [-1, 5]]) == [True, False, False]
+
+def test_logic(plan):
+    conditions = plan(['>', '>', '>'], [0, 0, 0], '(1 and 2) or not 3')
+    assert conditions.evaluate([1, 1, 1])
+    assert not conditions.evaluate([1, 0, 1])
+    assert conditions.evaluate([0, 0, 0])
+    conditions = plan(['>', '>'], [0, 0], ['1 | 2'])
+    assert conditions.evaluate([0, 1])
+    assert not conditions.evaluate([0, 0])
+
+def test_hysteresis(plan):
+    conditions = plan(['> hyst 2'], [10])
+    #turns on above 10 and stays on until the value drops below 8
+    assert run(conditions, [[9], [11], [9], [8], [7.5], [9]]) == [False, True, True, True, False, False]
+
+def test_hysteresis_range(plan):
+    conditions = plan(['range 10 20 hyst 1'], [0])
+    assert run(conditions, [[15], [9.5], [20.5], [21.5]]) == [True, True, True, False]
+
+def test_missing_values_keep_the_last_state(plan):
+    conditions = plan(['>'], [0])
+    assert run(conditions, [[1], [math.nan], [-1], [math.nan]]) == [True, True, False, False]
+
+def test_edges(plan):
+    rise = plan(['rise >'], [0])
+    assert run(rise, [[1], [1], [0], [1]]) == [True, False, False, True]
+    fall = plan(['fall >'], [0])
+    assert run(fall, [[1], [1], [0], [0]]) == [False, False, True, False]
+
+def test_hold(plan):
+    conditions = plan(['> for 2'], [0])
+    assert conditions.evaluate([1], 100.0) is False
+    assert conditions.evaluate([1], 101.0) is False
+    assert conditions.evaluate([1], 102.0) is True
+    #dropping out starts the wait again
+    assert conditions.evaluate([0], 103.0) is False
+    assert conditions.evaluate([1], 104.0) is False
+
+def test_distance(plan):
+    conditions = plan(['>', '!=', 'range 10 20'], [5, 5, 0])
+    distance = conditions.distance([2, 2, 12])
+    assert distance[0] == 3
+    assert math.isnan(distance[1])
+    assert distance[2] == 2
@@ -0,0 +1,132 @@
+import time
+import pytest
+
+import ManiPIO
+
+SCRIPT = """PLC 1
+IP:127.0.0.1
+Port:5401
+
+PLC 2
+IP:127.0.0.1
+Port:5402
+
+Event 1
+PLC:1
+mem:10
+format:16_int
+values:0,1000
+timing:10
+rate:50
+type:ramp
+
+Event 2
+PLC:1
+mem:20
+format:16_int
+values:1
+
+Trigger 1
+Event:2
+PLC:2
+mem:30
+format:16_int
+values:0
+conditions:>
+poll:50
+"""
+
+@pytest.fixture
+def plane(scenario):
+    PLCS, Events, Triggers = scenario(SCRIPT)
+    plane = ManiPIO.Control_Plane(SCRIPT.splitlines(), PLCS, Events, Triggers)
+    yield plane
+    for item in list(Triggers.values()) + list(Events.values()):
+        if item.state() not in ['idle', 'done', 'stopped']:
+            item.stop()
+
+def writes(plane, n):
+    return plane.Events[n].metrics.counters.get('writes', 0)
+
+def test_list(plane):
+    state = plane.handle({'cmd':'list'})
+    assert state['ok']
+    assert [plc['plc'] for plc in state['plcs']] == ['127.0.0.1:5401/1', '127.0.0.1:5402/1']
+    assert [(event['number'], event['state']) for event in state['events']] == [(1, 'idle'), (2, 'idle')]
+    assert [(trigger['number'], trigger['event'], trigger['state']) for trigger in state['triggers']] == [(1, 2, 'idle')]
+
+@pytest.mark.parametrize('request_', [None, {}, {'cmd':'jump'}, {'cmd':'stop'}, {'cmd':'stop', 'event':9}])
+def test_bad_requests(plane, request_):
+    reply = plane.handle(request_)
+    assert not reply['ok'] and reply['error']
+
+def test_start_pause_resume_stop(plane):
+    assert plane.handle({'cmd':'start', 'event':1})['state'] == 'running'
+    assert not plane.handle({'cmd':'start', 'event':1})['ok']
+    time.sleep(0.1)
+    assert plane.handle({'cmd':'pause', 'event':1})['state'] == 'paused'
+    time.sleep(0.05)
+    paused = writes(plane, 1)
+    time.sleep(0.1)
+    assert writes(plane, 1) == paused
+    assert plane.handle({'cmd':'resume', 'event':1})['state'] == 'running'
+    time.sleep(0.1)
+    assert writes(plane, 1) > paused
+    assert plane.handle({'cmd':'stop', 'event':1})['state'] == 'stopped'
+    assert not plane.handle({'cmd':'stop', 'event':1})['ok']
+
+def test_retarget_running_event(plane, simulator):
+    plane.handle({'cmd':'start', 'event':1})
+    time.sleep(0.05)
+    reply = plane.handle({'cmd':'retarget', 'event':1, 'plc':2, 'mem':[40], 'format':['16_int']})
+    assert reply['state'] == 'running'
+    time.sleep(0.1)
+    assert plane.Events[1].plc is plane.PLCS[2]
+    assert simulator.image('127.0.0.1', 5402)[40] > 0
+
+#a paused Event stays paused and writes nothing until it is resumed
+def test_retarget_keeps_an_event_paused(plane, simulator):
+    plane.handle({'cmd':'start', 'event':1})
+    time.sleep(0.05)
+    plane.handle({'cmd':'pause', 'event':1})
+    reply = plane.handle({'cmd':'retarget', 'event':1, 'plc':2, 'mem':[40], 'format':['16_int']})
+    assert reply['state'] == 'paused'
+    time.sleep(0.1)
+    assert simulator.image('127.0.0.1', 5402)[40] == 0
+    assert plane.handle({'cmd':'resume', 'event':1})['state'] == 'running'
+    time.sleep(0.1)
+    assert simulator.image('127.0.0.1', 5402)[40] > 0
+
+def test_retarget_keeps_a_trigger_paused(plane):
+    plane.handle({'cmd':'start', 'trigger':1})
+    plane.handle({'cmd':'pause', 'trigger':1})
+    assert plane.handle({'cmd':'retarget', 'trigger':1, 'fires':1})['state'] == 'paused'
+    assert plane.Triggers[1].Event is plane.Events[1]
+
+def test_retarget_armed_event_is_refused(plane):
+    plane.handle({'cmd':'start', 'trigger':1})
+    time.sleep(0.05)
+    assert plane.Events[2].state() == 'armed'
+    reply = plane.handle({'cmd':'retarget', 'event':2, 'mem':[21]})
+    assert not reply['ok'] and 'armed by a Trigger' in reply['error']
+    plane.handle({'cmd':'pause', 'event':2})
+    assert not plane.handle({'cmd':'retarget', 'event':2, 'mem':[21]})['ok']
+
+@pytest.mark.parametrize('request_,error', [
+    ({'cmd':'retarget', 'event':1, 'plc':9}, 'PLC 9 does not exist'),
+    ({'cmd':'retarget', 'event':1, 'mem':[1, 2], 'format':['16_int']}, 'give one format per memory address'),
+    ({'cmd':'retarget', 'event':1, 'mem':[1], 'format':['8_int']}, 'format 8_int is not one of'),
+    ({'cmd':'retarget', 'trigger':1, 'fires':9}, 'Event 9 does not exist'),
+])
+def test_retarget_errors(plane, request_, error):
+    reply = plane.handle(request_)
+    assert not reply['ok'] and error in reply['error']
+
+def test_add(plane, simulator):
+    reply = plane.handle({'cmd':'add', 'script':'Event 3\nPLC:2\nmem:50\nformat:16_int\nvalues:6\n\nStart\nEvent 3'})
+    assert reply['ok'] and reply['events'] == [3]
+    plane.Events[3].wait()
+    assert simulator.image('127.0.0.1', 5402)[50] == 6
+    reply = plane.handle({'cmd':'add', 'script':'Event 4\nPLC:7\nmem:50'})
+    assert not reply['ok'] and 'PLC 7' in reply['error']
+    assert 4 not in plane.Events
@@ -0,0 +1,178 @@
+import time
+import pytest
+
+import ManiPIO
+
+SCRIPT = """PLC 1
+IP:127.0.0.1
+Port:%u
+
+Event 1 Ramp
+PLC:1
+mem:10
+format:16_int
+values:0,10
+timing:0.2
+rate:50
+type:ramp
+
+Event 2 Level
+PLC:1
+mem:20
+format:16_int
+values:5
+delay:0.1
+
+Event 3 Alarm
+PLC:1
+mem:30
+format:16_int
+values:9
+
+Trigger 1
+Event:3
+PLC:1
+mem:20
+format:16_int
+values:4
+conditions:>
+
+Start
+Event 1, Event 2, Trigger 1
+"""
+
+ENGINES = ['thread', 'async']
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_events_and_triggers_run(scenario, simulator, engine):
+    port = 5301 + ENGINES.index(engine)
+    PLCS, Events, Triggers = scenario(SCRIPT % port)
+    ManiPIO.start(Events, Triggers, [1, 2], [1], engine, timeout=10)
+    image = simulator.image('127.0.0.1', port)
+    assert (image[10], image[20], image[30]) == (10, 5, 9)
+    #a sample the PLC was too slow for is skipped, the last one is always written
+    assert 2 <= Events[1].metrics.counters['writes'] <= 11
+    assert Triggers[1].metrics.counters['fires'] == 1
+    assert Events[3].metrics.counters['writes'] == 1
+
+SYNC = """PLC 1
+IP:127.0.0.1
+Port:%u
+
+PLC 2
+IP:127.0.0.2
+Port:%u
+
+Event 1
+PLC:1
+mem:10
+values:1
+
+Event 2
+PLC:2
+mem:10
+values:2
+
+Event 3
+PLC:2
+mem:20
+values:3
+delay:0.05
+
+Start sync
+Event 1-3
+"""
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_synchronized_start(scenario, engine):
+    port = 5311 + 2*ENGINES.index(engine)
+    PLCS, Events, Triggers = scenario(SYNC % (port, port + 1))
+    stats = ManiPIO.start(Events, Triggers, [1, 2, 3], [], engine, timeout=10, sync=True)
+    assert (stats['events'], stats['plcs']) == (3, 2)
+    #the delay is taken off, so only the skew of the start itself is left
+    assert 0 <= stats['event_skew'] < 0.05
+    assert stats['first_write'] >= 0
+
+def test_synchronized_start_with_nothing_to_start(scenario):
+    PLCS, Events, Triggers = scenario(SYNC % (5315, 5316))
+    assert ManiPIO.start(Events, Triggers, [], [], sync=True) is None
+
+PERSIST = """PLC 1
+IP:127.0.0.1
+Port:5321
+
+Event 1
+PLC:1
+mem:10
+values:1
+timing:0.01
+persist:true
+
+Event 2
+PLC:1
+mem:20
+values:1
+
+Trigger 1
+Event:2
+PLC:1
+mem:50
+values:1
+conditions:>
+poll:20
+
+Start
+Event 1, Trigger 1
+"""
+
+#a persistent Event and a Trigger that never fires are stopped when the async engine times out
+def test_async_timeout_stops_the_scenario(scenario):
+    PLCS, Events, Triggers = scenario(PERSIST)
+    started = time.monotonic()
+    ManiPIO.start(Events, Triggers, [1], [1], 'async', timeout=0.3)
+    assert time.monotonic() - started < 2
+    writes = Events[1].metrics.counters['writes']
+    assert writes > 5
+    assert Triggers[1].metrics.counters.get('fires', 0) == 0
+    assert Events[2].metrics.counters.get('writes', 0) == 0
+    time.sleep(0.05)
+    assert Events[1].metrics.counters['writes'] == writes
+
+SUPPRESSED = """PLC 1
+IP:127.0.0.1
+Port:5322
+
+Event 1
+PLC:1
+mem:10
+format:16_int
+values:3
+persist:true
+suppress:true
+
+Start
+Event 1
+"""
+
+#once the PLC has the value no write awaits anything, the Event still has to let the timeout run
+def test_async_timeout_stops_a_suppressed_event(scenario, simulator):
+    PLCS, Events, Triggers = scenario(SUPPRESSED)
+    started = time.monotonic()
+    ManiPIO.start(Events, Triggers, [1], [], 'async', timeout=1.0)
+    assert time.monotonic() - started < 3
+    assert simulator.image('127.0.0.1', 5322)[10] == 3
+    #the value is sent once and then suppressed
+    assert simulator.devices[('127.0.0.1', 5322)].counts['writes'] == 1
+
+def test_thread_engine_stop(scenario):
+    PLCS, Events, Triggers = scenario(PERSIST)
+    Events[1].run()
+    Triggers[1].run()
+    time.sleep(0.1)
+    assert (Events[1].state(), Triggers[1].state()) == ('running', 'polling')
+    Triggers[1].stop()
+    Events[1].stop()
+    assert (Events[1].state(), Triggers[1].state()) == ('stopped', 'stopped')
+    #the Event the Trigger armed is stopped with it
+    assert Events[2].state() == 'stopped'
+    assert Events[2].metrics.counters.get('writes', 0) == 0
@@ -0,0 +1,106 @@
+import json
+import urllib.request
+import pytest
+
+import ManiPIO
+
+def test_histogram_percentiles():
+    histogram = ManiPIO.Histogram()
+    assert histogram.percentile(50) == 0.0
+    for i in range(100):
+        histogram.add(0.002)
+    histogram.add(0.3)
+    #interpolated inside the bucket between 0.001 and 0.0025, never past the largest value
+    assert 0.001 < histogram.percentile(50) <= 0.0025
+    assert histogram.percentile(100) == pytest.approx(0.3)
+    assert histogram.count == 101 and histogram.max == 0.3
+    assert histogram.sum == pytest.approx(0.5)
+
+#values past the last bound land in the overflow bucket
+def test_histogram_overflow():
+    histogram = ManiPIO.Histogram([1.0])
+    histogram.add(0.5)
+    histogram.add(7.0)
+    assert histogram.buckets == [1, 1]
+    assert histogram.percentile(99) <= 7.0
+
+def test_summary_rates_and_latency():
+    metrics = ManiPIO.Metrics('event', '1')
+    metrics.count('writes', 4)
+    metrics.observe('cycle', 0.01)
+    summary = metrics.summary()
+    assert summary['counts'] == {'writes':4}
+    assert summary['per_second']['writes'] > 0
+    assert summary['latency']['cycle']['count'] == 1
+    assert summary['latency']['cycle']['max'] == 0.01
+
+@pytest.fixture
+def registry():
+    registry = ManiPIO.Metrics_Registry()
+    plc = registry.new('plc', '127.0.0.1:502')
+    plc.count('writes', 3)
+    plc.observe('write', 0.003)
+    plc.observe('write', 0.2)
+    registry.new('event', '2').count('writes')
+    registry.new('trigger', 'idle')
+    return registry
+
+def test_prometheus_text(registry):
+    lines = registry.render().splitlines()
+    assert '# TYPE manipio_plc_writes_total counter' in lines
+    assert 'manipio_plc_writes_total{plc="127.0.0.1:502"} 3' in lines
+    assert 'manipio_event_writes_total{event="2"} 1' in lines
+    assert '# TYPE manipio_plc_write_seconds histogram' in lines
+    #buckets count every value up to their bound
+    assert 'manipio_plc_write_seconds_bucket{plc="127.0.0.1:502",le="0.001"} 0' in lines
+    assert 'manipio_plc_write_seconds_bucket{plc="127.0.0.1:502",le="0.005"} 1' in lines
+    assert 'manipio_plc_write_seconds_bucket{plc="127.0.0.1:502",le="5.0"} 2' in lines
+    assert 'manipio_plc_write_seconds_bucket{plc="127.0.0.1:502",le="+Inf"} 2' in lines
+    assert 'manipio_plc_write_seconds_sum{plc="127.0.0.1:502"} 0.203000000' in lines
+    assert 'manipio_plc_write_seconds_count{plc="127.0.0.1:502"} 2' in lines
+    buckets = [line for line in lines if line.startswith('manipio_plc_write_seconds_bucket')]
+    assert len(buckets) == len(ManiPIO.LATENCY_BUCKETS) + 1
+    #a family's TYPE line comes before its samples
+    assert lines.index('# TYPE manipio_event_writes_total counter') < lines.index('manipio_event_writes_total{event="2"} 1')
+
+#what has done nothing is left out of the summary
+def test_registry_summary(registry):
+    summary = registry.summary()
+    assert summary['plc']['127.0.0.1:502']['counts'] == {'writes':3}
+    assert list(summary['event']) == ['2']
+    assert summary['trigger'] == {}
+
+def test_plc_writes_are_counted(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 6101)
+    PLC.connect()
+    PLC.write(10, 1.5)
+    PLC.read(10)
+    PLC.close()
+    text = ManiPIO.METRICS.render()
+    assert 'manipio_plc_writes_total{plc="127.0.0.1:6101"} 1' in text
+    assert 'manipio_plc_reads_total{plc="127.0.0.1:6101"} 1' in text
+    assert 'manipio_plc_write_seconds_count{plc="127.0.0.1:6101"} 1' in text
+
+def test_served_metrics(monkeypatch, registry):
+    monkeypatch.setattr(ManiPIO, 'METRICS', registry)
+    server = ManiPIO.serve_metrics(0)
+    url = 'http://127.0.0.1:%u' % server.server_address[1]
+    try:
+        response = urllib.request.urlopen(url + '/metrics')
+        assert response.headers['Content-Type'].startswith('text/plain')
+        assert response.read().decode() == registry.render()
+        summary = json.loads(urllib.request.urlopen(url + '/summary').read())
+        assert summary['event']['2']['counts'] == {'writes':1}
+    finally:
+        ManiPIO.stop_metrics(server, None)
+
+#each shard writes its own file, one summary a line and a last one when stopped
+def test_summary_file(monkeypatch, registry, tmp_path):
+    monkeypatch.setattr(ManiPIO, 'METRICS', registry)
+    path = str(tmp_path / 'metrics.json')
+    server, writer = ManiPIO.start_metrics(path=path, interval=60, shard=1)
+    assert server is None and writer.path == path + '.1'
+    ManiPIO.stop_metrics(server, writer)
+    lines = open(path + '.1').read().splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])['plc']['127.0.0.1:502']['counts'] == {'writes':3}
@@ -0,0 +1,203 @@
+import socket
+import struct
+import threading
+import pytest
+
+import ManiPIO
+
+#Modbus/TCP server that holds requests and answers them in reverse order
+#A register read answers each register with its address plus 1000 times the unit ID, writes are echoed
+#Requests are answered once hold of them arrived, or as soon as no more come in for a moment unless idle is False
+class Reversing_Server:
+    def __init__(self, hold):
+        self.hold = hold
+        self.idle = True
+        self.requests = []
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.port = self.listener.getsockname()[1]
+        self.conns = []
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                conn, address = self.listener.accept()
+            except OSError:
+                return
+            self.conns.append(conn)
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def answer(self, conn, frames):
+        for tid, unit, pdu in reversed(frames):
+            if pdu[0] == 3:
+                address, count = struct.unpack_from('>HH', pdu, 1)
+                reply = struct.pack('>BB%uH' % count, 3, 2 * count, *[address + i + 1000 * unit for i in range(count)])
+            else:
+                reply = pdu[:5]
+            try:
+                conn.sendall(struct.pack('>HHHB', tid, 0, len(reply) + 1, unit) + reply)
+            except OSError:
+                return
+
+    def serve(self, conn):
+        conn.settimeout(0.05)
+        buffer = bytearray()
+        frames = []
+        while True:
+            try:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    return
+                buffer += chunk
+            except socket.timeout:
+                if self.idle:
+                    self.answer(conn, frames)
+                    frames = []
+                continue
+            except OSError:
+                return
+            while len(buffer) >= 7:
+                tid, pid, length = struct.unpack_from('>HHH', buffer)
+                if len(buffer) < 6 + length:
+                    break
+                frames.append((tid, buffer[6], bytes(buffer[7:6+length])))
+                self.requests.append(frames[-1])
+                del buffer[:6+length]
+            if len(frames) >= self.hold:
+                self.answer(conn, frames)
+                frames = []
+
+    def close(self):
+        self.listener.close()
+        for conn in self.conns:
+            conn.close()
+
+@pytest.fixture
+def server():
+    server = Reversing_Server(4)
+    yield server
+    server.close()
+
+@pytest.fixture
+def client(server):
+    client = ManiPIO.Pipeline_Client('127.0.0.1', server.port, window=4, timeout=1.0)
+    assert client.connect()
+    yield client
+    client.close()
+
+#responses come back in reverse and are matched to their requests by transaction ID
+def test_out_of_order_responses(client, server):
+    requests = [client.submit_read(10 * i, 2) for i in range(4)]
+    results = [request.result(1.0) for request in requests]
+    assert [result.registers for result in results] == [[1000 + 10 * i, 1001 + 10 * i] for i in range(4)]
+    assert [tid for tid, unit, pdu in server.requests] == [1, 2, 3, 4]
+
+def test_unit_ids_share_the_socket(client):
+    requests = [client.submit_read(5, 1, slave=unit) for unit in [1, 2, 3, 4]]
+    assert [request.result(1.0).registers for request in requests] == [[1005], [2005], [3005], [4005]]
+
+#threads share the socket without waiting on each other's answers
+def test_threads_share_the_client(client):
+    results = {}
+    def read(i):
+        results[i] = client.read_holding_registers(i, 1).registers
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {i: [1000 + i] for i in range(12)}
+
+def test_writes_are_answered(client, server):
+    requests = [client.submit_write(100 + i, [i, i]) for i in range(4)]
+    assert not any(request.result(1.0).isError() for request in requests)
+    assert [pdu[:5] for tid, unit, pdu in server.requests] == [struct.pack('>BHH', 16, 100 + i, 2) for i in range(4)]
+
+#a request the server holds on to times out and frees its slot, its late answer is dropped
+def test_timeout_frees_the_slot(server):
+    server.hold = 100
+    client = ManiPIO.Pipeline_Client('127.0.0.1', server.port, window=1, timeout=0.02)
+    client.connect()
+    with pytest.raises(TimeoutError):
+        client.read_holding_registers(1, 1)
+    assert client.pending == {}
+    client.timeout = 1.0
+    assert client.read_holding_registers(2, 1).registers == [1002]
+    client.close()
+
+def test_close_fails_requests_in_flight(server):
+    server.hold = 100
+    server.answer = lambda conn, frames: None
+    client = ManiPIO.Pipeline_Client('127.0.0.1', server.port, window=4, timeout=1.0)
+    client.connect()
+    request = client.submit_read(1, 1)
+    client.close()
+    with pytest.raises(ConnectionError):
+        request.result(1.0)
+    assert not client.is_socket_open()
+    #every slot is free again
+    for i in range(4):
+        assert client.slots.acquire(blocking=False)
+
+def test_exception_responses():
+    assert ManiPIO.Pipeline_Response(3, bytes([0x83, 2])).error == 'exception code 2'
+    assert ManiPIO.Pipeline_Response(3, b'').isError()
+    assert ManiPIO.Pipeline_Response(1, bytes([1, 1, 0b101])).bits[:3] == [True, False, True]
+
+@pytest.fixture
+def address(server):
+    yield '127.0.0.1', server.port
+    ManiPIO.CONNECTIONS.connections.pop(('127.0.0.1', server.port), None)
+
+#PLCs at one address share one connection whatever their unit, pipelined with the largest window asked for
+def test_units_share_a_pipelined_connection(address):
+    PLCS = [ManiPIO.MB_PLC(*address, unit=unit) for unit in [1, 2, 3]]
+    assert PLCS[1].connection is PLCS[0].connection
+    PLCS[0].set_pipeline(2)
+    PLCS[1].set_pipeline(4)
+    PLCS[2].set_pipeline(1)
+    assert isinstance(PLCS[2].client, ManiPIO.Pipeline_Client)
+    assert PLCS[2].client.window == 4
+    for PLC in PLCS:
+        PLC.connect()
+    assert PLCS[0].connection.refs == 3
+    results = {}
+    def read(PLC):
+        results[PLC.unit] = PLC.read(7, '16_int')
+    threads = [threading.Thread(target=read, args=(PLC,)) for PLC in PLCS]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {1:1007, 2:2007, 3:3007}
+    #metrics are kept per unit
+    assert PLCS[1].metrics.label == '127.0.0.1:%u/2' % address[1]
+    for PLC in PLCS:
+        PLC.close()
+    assert not PLCS[0].client.is_socket_open()
+
+#blocks are all sent before any answer is waited for, the server answers none of them until it has all four
+def test_pipelined_block_reads(address, server):
+    server.idle = False
+    PLC = ManiPIO.MB_PLC(*address)
+    PLC.set_pipeline(4)
+    PLC.connect()
+    blocks = PLC.plan_read([0, 200, 400, 600], ['16_int'] * 4)
+    assert len(blocks) == 4
+    assert PLC.read_blocks(blocks) == [1000, 1200, 1400, 1600]
+    PLC.close()
+
+#simulated PLCs share the connection too, each unit writes to its own memory
+def test_units_share_a_simulated_connection(simulator):
+    PLCS = [ManiPIO.MB_PLC('127.0.0.1', 6301, unit=unit) for unit in [1, 2]]
+    assert PLCS[0].client is PLCS[1].client
+    for PLC in PLCS:
+        PLC.connect()
+        PLC.write(10, PLC.unit * 3, '16_int')
+    assert simulator.image('127.0.0.1', 6301, unit=1)[10] == 3
+    assert simulator.image('127.0.0.1', 6301, unit=2)[10] == 6
+    assert len(simulator.devices) == 1
+    for PLC in PLCS:
+        PLC.close()
@@ -0,0 +1,79 @@
+import time
+
+import ManiPIO
+
+#stands in for the Trigger a poller wakes early when it is stopping
+class Waiting:
+    thread_stop = False
+
+WAITING = Waiting()
+
+def test_triggers_share_one_poller(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 5801)
+    first, plan, indexes = ManiPIO.subscribe_poller(PLC, [10, 12], ['16_int', '16_int'])
+    second, plan_2, indexes_2 = ManiPIO.subscribe_poller(PLC, [12, 14], ['16_int', '16_int'])
+    assert second is first
+    assert first.subscribers == 2
+    #an address watched already keeps its index, only new ones change the plan
+    assert indexes == [0, 1] and indexes_2 == [1, 2]
+    assert plan_2 == plan + 1
+    third, plan_3, indexes_3 = ManiPIO.subscribe_poller(PLC, [10], ['16_int'])
+    assert plan_3 == plan_2 and indexes_3 == [0]
+    #the same address in another format is watched apart
+    assert ManiPIO.subscribe_poller(PLC, [10], ['32_float'])[2] == [3]
+    for i in range(4):
+        first.unsubscribe()
+
+def test_values_are_published_to_every_subscriber(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 5802)
+    image = simulator.image('127.0.0.1', 5802)
+    image[10] = 3
+    image[14] = 9
+    poller, plan, indexes = ManiPIO.subscribe_poller(PLC, [10], ['16_int'])
+    cycle, values = poller.wait(0, plan, WAITING)
+    assert values[indexes[0]] == 3
+    poller, plan, indexes = ManiPIO.subscribe_poller(PLC, [14], ['16_int'])
+    cycle, values = poller.wait(cycle, plan, WAITING)
+    assert values == [3, 9]
+    poller.unsubscribe()
+    poller.unsubscribe()
+
+def test_last_unsubscribe_releases_the_poller(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 5803)
+    poller = ManiPIO.subscribe_poller(PLC, [10], ['16_int'])[0]
+    ManiPIO.subscribe_poller(PLC, [10], ['16_int'])
+    poller.unsubscribe()
+    assert ManiPIO.POLLERS[PLC] is poller and poller.thread.is_alive()
+    poller.unsubscribe()
+    assert PLC not in ManiPIO.POLLERS
+    poller.thread.join(2)
+    assert not poller.thread.is_alive()
+    #a released poller is never handed out again
+    again = ManiPIO.subscribe_poller(PLC, [10], ['16_int'])[0]
+    assert again is not poller
+    again.unsubscribe()
+
+#a stopping poller wakes whoever waits on it
+def test_waiting_returns_when_the_poller_stops(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 5804)
+    poller, plan, indexes = ManiPIO.subscribe_poller(PLC, [10], ['16_int'], WAITING)
+    poller.unsubscribe(WAITING)
+    assert poller.wait(10**6, plan, WAITING)[0] < 10**6
+
+#with every subscriber asking for its reads the poller reads only when asked
+def test_throttled_subscribers_read_on_request(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 5805)
+    device = simulator.device('127.0.0.1', 5805)
+    poller, plan, indexes = ManiPIO.subscribe_poller(PLC, [10], ['16_int'], WAITING)
+    time.sleep(0.2)
+    assert device.counts['reads'] == 0
+    for i in range(3):
+        last = poller.request(WAITING)
+        poller.wait(last, plan, WAITING)
+    assert device.counts['reads'] == 3
+    #one subscriber that does not ask makes the poller read nonstop
+    ManiPIO.subscribe_poller(PLC, [10], ['16_int'])
+    time.sleep(0.2)
+    assert device.counts['reads'] > 10
+    poller.unsubscribe(WAITING)
+    poller.unsubscribe()
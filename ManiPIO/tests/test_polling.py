@@ -0,0 +1,93 @@
+import re
+import pytest
+
+import ManiPIO
+
+def test_fixed_rate():
+    policy = ManiPIO.Poll_Policy(rate=20)
+    assert policy.throttled()
+    assert policy.interval(None, [], 0.0) == pytest.approx(0.05)
+    assert not ManiPIO.Poll_Policy().throttled()
+    assert ManiPIO.Poll_Policy().interval(None, [], 0.0) == 0.0
+
+def test_adaptive_backs_off_while_values_are_still():
+    plan = ManiPIO.Condition_Plan(['>'], [100])
+    policy = ManiPIO.Poll_Policy(adaptive=True, min_rate=1, max_rate=100)
+    intervals = [policy.interval(plan, [0], t) for t in range(20)]
+    assert intervals[0] == pytest.approx(0.015)
+    assert intervals[1] == pytest.approx(0.0225)
+    assert intervals[-1] == 1.0
+
+def test_adaptive_speeds_up_as_values_close_in():
+    plan = ManiPIO.Condition_Plan(['>'], [100])
+    policy = ManiPIO.Poll_Policy(adaptive=True, min_rate=1, max_rate=100)
+    policy.interval(plan, [0], 0.0)
+    #10 a second with 80 to go reaches the trigger value in 8 seconds, polled 4 times in that
+    assert policy.interval(plan, [20], 2.0) == pytest.approx(1.0)
+    assert policy.interval(plan, [99], 3.0) == pytest.approx(0.01)
+
+def test_adaptive_polls_fast_while_a_condition_is_on():
+    plan = ManiPIO.Condition_Plan(['>', '>'], [0, 100])
+    policy = ManiPIO.Poll_Policy(adaptive=True)
+    plan.evaluate([1, 0])
+    assert policy.interval(plan, [1, 0], 0.0) == policy.min_interval
+
+SCRIPT = """PLC 1
+IP:127.0.0.1
+Port:%u
+
+PLC 2
+IP:127.0.0.2
+Port:%u
+
+Event 1
+PLC:1
+mem:10
+values:5
+
+Event 2
+PLC:2
+mem:20
+format:16_int
+values:7
+delay:0.5
+
+Trigger 1
+Event:1
+PLC:2
+mem:20
+format:16_int
+values:0
+conditions:>
+poll:50
+
+Start
+Event 2, Trigger 1
+"""
+
+def reads(simulator, port):
+    return simulator.devices[('127.0.0.2', port)].counts['reads']
+
+#a Trigger polling 50 times a second reads its PLC about that often, not as fast as it answers
+def test_trigger_reads_at_its_poll_rate(scenario, simulator):
+    PLCS, Events, Triggers = scenario(SCRIPT % (5501, 5502))
+    ManiPIO.start(Events, Triggers, [2], [1])
+    assert Triggers[1].metrics.counters['fires'] == 1
+    assert 15 <= reads(simulator, 5502) <= 35
+
+def test_unthrottled_trigger_reads_nonstop(scenario, simulator):
+    PLCS, Events, Triggers = scenario((SCRIPT % (5503, 5504)).replace('poll:50\n', ''))
+    ManiPIO.start(Events, Triggers, [2], [1])
+    assert reads(simulator, 5504) > 100
+
+#the PLC the Trigger watches is polled by the other worker process at the Trigger's rate
+def test_trigger_in_another_shard_reads_at_its_poll_rate(tmp_path, capfd):
+    path = tmp_path / 'script.txt'
+    path.write_text(SCRIPT % (5505, 5506))
+    ManiPIO.constructor(str(path), cache=False, processes=2, simulate={})
+    out = capfd.readouterr().out
+    assert 'Shard 0 runs PLCs 1' in out and 'Shard 1 runs PLCs 2' in out
+    assert 'Event 1 on PLC IP: 127.0.0.1 first write' in out
+    counts = [int(n) for n in re.findall(r'Simulated 1 PLCs at 1 addresses: (\d+) reads', out)]
+    assert len(counts) == 2
+    assert max(counts) <= 35
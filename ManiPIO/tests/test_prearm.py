@@ -0,0 +1,94 @@
+import time
+import pytest
+
+import ManiPIO
+
+SCRIPT = """PLC 1
+IP:127.0.0.1
+Port:%u
+
+Event 1
+PLC:1
+mem:10
+format:16_int
+values:4
+delay:%s
+
+Trigger 1
+Event:1
+PLC:1
+mem:20
+format:16_int
+values:0
+conditions:>
+%s
+"""
+
+def build(scenario, port, delay=0, prearm=''):
+    return scenario(SCRIPT % (port, delay, prearm))
+
+def writes(simulator, port):
+    return simulator.devices[('127.0.0.1', port)].counts['writes']
+
+def wait_for(check, seconds=2):
+    end = time.monotonic() + seconds
+    while not check() and time.monotonic() < end:
+        time.sleep(0.01)
+    return check()
+
+#the Event is connected and waiting before the Trigger fires, firing only releases it
+def test_armed_event_writes_when_the_trigger_fires(scenario, simulator):
+    PLCS, Events, Triggers = build(scenario, 6201)
+    image = simulator.image('127.0.0.1', 6201)
+    Triggers[1].run()
+    assert wait_for(lambda: Events[1].state() == 'armed')
+    time.sleep(0.1)
+    assert writes(simulator, 6201) == 0
+    image[20] = 1
+    Triggers[1].wait()
+    assert image[10] == 4
+    assert Events[1].state() == 'done'
+    assert Triggers[1].metrics.histograms['fire_to_write'].count == 1
+    assert Events[1].metrics.histograms['fire_to_write'].count == 1
+
+def test_prearm_off_starts_the_event_on_firing(scenario, simulator):
+    PLCS, Events, Triggers = build(scenario, 6202, prearm='prearm:false')
+    assert not Triggers[1].prearm
+    Triggers[1].run()
+    time.sleep(0.1)
+    assert Events[1].state() == 'idle'
+    simulator.image('127.0.0.1', 6202)[20] = 1
+    Triggers[1].wait()
+    assert simulator.image('127.0.0.1', 6202)[10] == 4
+    assert Events[1].metrics.histograms['fire_to_write'].count == 1
+
+#the time delay still runs after firing, but is not part of the measured gap
+def test_delay_is_left_out_of_the_gap(scenario, simulator):
+    PLCS, Events, Triggers = build(scenario, 6203, delay=0.3)
+    Triggers[1].run()
+    assert wait_for(lambda: Events[1].state() == 'armed')
+    simulator.image('127.0.0.1', 6203)[20] = 1
+    time.sleep(0.15)
+    assert writes(simulator, 6203) == 0
+    Triggers[1].wait()
+    assert writes(simulator, 6203) == 1
+    assert Events[1].metrics.histograms['fire_to_write'].max < 0.3
+
+def test_trigger_stopped_before_firing_stops_its_event(scenario, simulator):
+    PLCS, Events, Triggers = build(scenario, 6204)
+    Triggers[1].run()
+    assert wait_for(lambda: Events[1].state() == 'armed')
+    Triggers[1].stop()
+    Triggers[1].wait()
+    assert wait_for(lambda: Events[1].state() == 'stopped')
+    assert writes(simulator, 6204) == 0
+
+@pytest.mark.parametrize('prearm', ['', 'prearm:false'])
+def test_async_trigger_fires_its_event(scenario, simulator, prearm):
+    port = 6205 if prearm == '' else 6206
+    PLCS, Events, Triggers = build(scenario, port, prearm=prearm)
+    simulator.image('127.0.0.1', port)[20] = 1
+    ManiPIO.start(Events, Triggers, [], [1], 'async', timeout=5)
+    assert simulator.image('127.0.0.1', port)[10] == 4
+    assert Triggers[1].metrics.counters['fires'] == 1
+    assert writes(simulator, port) == 1
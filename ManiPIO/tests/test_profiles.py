@@ -0,0 +1,197 @@
+import time
+import pytest
+
+import ManiPIO
+
+WAVE = """PLC 1
+IP:127.0.0.1
+Port:%u
+
+Event 1
+PLC:1
+mem:10
+format:16_int
+type:%s
+values:0,100
+period:0.5
+rate:20
+%s
+Start
+Event 1
+"""
+
+#sine and square with timing 0 run for one period, the same as without timing
+@pytest.mark.parametrize('kind', ['sine', 'square'])
+@pytest.mark.parametrize('timing', ['timing:0\n', ''])
+def test_wave_with_timing_zero_runs_one_period(scenario, simulator, kind, timing):
+    PLCS, Events, Triggers = scenario(WAVE % (5701, kind, timing))
+    event = Events[1]
+    assert event.one_period()
+    assert event.ramp_check()
+    times, profile = event.profile(event.ramp_rate())
+    assert len(times) == 11
+    assert times[-1] == pytest.approx(0.5)
+    ManiPIO.start(Events, Triggers, [1], [])
+    assert event.metrics.counters['writes'] + event.ramp_stats['skipped'] == 11
+
+def test_noise_with_timing_zero_is_an_error(tmp_path):
+    path = tmp_path / 'script.txt'
+    path.write_text(WAVE % (5702, 'noise', 'timing:0\n'))
+    with pytest.raises(ValueError, match='timing for noise cannot be 0'):
+        ManiPIO.compile_script(str(path), cache=False)
+
+#profiles are computed with NumPy and with the plain Python fallback
+@pytest.fixture(params=['numpy', 'python'])
+def numpy(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(ManiPIO, 'np', None)
+    elif ManiPIO.np is None:
+        pytest.skip('NumPy is not installed')
+    return request.param == 'numpy'
+
+#Events are built on the simulator, a PLC made without it would connect to the network
+def make_event(**options):
+    event = ManiPIO.Event(ManiPIO.MB_PLC('127.0.0.1', 5711))
+    options.setdefault('mem_addr', [10])
+    options.setdefault('mem_format', ['16_int'])
+    event.set_Event(**options)
+    return event
+
+#samples sit on a fixed grid and follow each segment of the ramp
+def test_ramp_profile(simulator, numpy):
+    event = make_event(Event='ramp', values=[0, 10, 5], timing=[1, 0.5])
+    times, profile = event.profile(10)
+    assert len(times) == 16
+    assert list(times[:3]) == pytest.approx([0.0, 0.1, 0.2])
+    assert profile[5] == pytest.approx(5.0)
+    assert profile[10] == pytest.approx(10.0)
+    assert profile[13] == pytest.approx(7.0)
+    assert profile[-1] == pytest.approx(5.0)
+
+#the last sample lands just after the end when the grid does not meet it, and holds the last value
+def test_ramp_profile_ends_on_the_last_value(simulator, numpy):
+    event = make_event(Event='ramp', values=[0, 100], timing=0.25)
+    times, profile = event.profile(10)
+    assert list(times) == pytest.approx([0.0, 0.1, 0.2, 0.3])
+    assert list(profile) == pytest.approx([0.0, 40.0, 80.0, 100.0])
+
+def test_numpy_and_python_profiles_match(simulator, monkeypatch):
+    if ManiPIO.np is None:
+        pytest.skip('NumPy is not installed')
+    event = make_event(Event='ramp', values=[-3, 7, 7, 2], timing=[0.3, 0.2, 0.45])
+    fast = event.profile(37)
+    monkeypatch.setattr(ManiPIO, 'np', None)
+    slow = event.profile(37)
+    assert list(fast[0]) == pytest.approx(slow[0])
+    assert list(fast[1]) == pytest.approx(slow[1])
+
+#each sample is encoded into the payload of every block once, before the ramp starts
+def test_profile_payloads(simulator):
+    if ManiPIO.np is None:
+        pytest.skip('NumPy is not installed')
+    event = make_event(Event='ramp', values=[0, 4], timing=1, mem_addr=[10, 11, 20], mem_format=['16_int', '32_float', '16_int'])
+    PLC = event.plc
+    blocks = PLC.plan_write(event.mem_addr, event.mem_format)
+    times, profile, payloads = event.ramp_prepare(PLC, blocks, 4)
+    assert len(payloads) == len(blocks) == 2
+    for k in range(len(times)):
+        assert payloads[0][k].tolist() == PLC.encode(profile[k], '16_int') + PLC.encode(profile[k], '32_float')
+        assert payloads[1][k].tolist() == PLC.encode(profile[k], '16_int')
+    assert event.ramp_prepare(PLC, blocks, 0) is None
+
+#a ramp with a rate writes its profile in order, on schedule
+def test_scheduled_ramp_writes_the_profile(simulator, numpy):
+    event = make_event(Event='ramp', values=[0, 100], timing=0.2, rate=50)
+    device = simulator.device('127.0.0.1', 5711)
+    written = []
+    request = device.request
+    def record(function, unit, read_addr=0, count=0, mem_addr=0, values=None):
+        if values is not None:
+            written.append((time.monotonic(), values[0]))
+        return request(function, unit, read_addr, count, mem_addr, values)
+    device.request = record
+    event.run()
+    event.wait()
+    stats = event.ramp_stats
+    assert stats['writes'] + stats['skipped'] == 11
+    values = [value for when, value in written]
+    assert values == sorted(values)
+    assert values[-1] == 100
+    assert written[-1][0] - written[0][0] == pytest.approx(0.2, abs=0.05)
+    assert stats['target_rate'] == 50
+
+#sine and square swing between the two values every period, starting from the middle and the high value
+def test_sine_profile(simulator, numpy):
+    event = make_event(Event='sine', values=[0, 100], period=1, timing=1)
+    times, profile = event.profile(4)
+    assert list(times) == pytest.approx([0.0, 0.25, 0.5, 0.75, 1.0])
+    assert list(profile) == pytest.approx([50, 100, 50, 0, 50], abs=1e-9)
+
+def test_square_profile(simulator, numpy):
+    event = make_event(Event='square', values=[0, 100], period=1, timing=2)
+    times, profile = event.profile(4)
+    assert list(profile) == [100, 100, 0, 0, 100, 100, 0, 0, 100]
+
+def test_noise_profile(simulator, numpy):
+    event = make_event(Event='noise', values=[-1, 1], timing=2)
+    times, profile = event.profile(50)
+    assert len(profile) == 101
+    assert all(-1 <= value <= 1 for value in profile)
+    assert len(set(float(value) for value in profile)) > 90
+
+#step holds each value for its timing, the last one once it is reached
+def test_step_profile(simulator, numpy):
+    event = make_event(Event='step', values=[1, 5, 3], timing=[0.2, 0.3])
+    times, profile = event.profile(10)
+    assert list(profile) == [1, 1, 5, 5, 5, 3]
+
+#without a rate waveforms are sampled WAVE_RATE times a second
+def test_wave_rate(simulator):
+    assert make_event(Event='sine', values=[0, 1], period=1).ramp_rate() == ManiPIO.WAVE_RATE
+
+def chunks(path, N_mem, chunk=ManiPIO.PLAYBACK_CHUNK):
+    return [(list(times), [list(row) for row in values]) for times, values in ManiPIO.playback_chunks(str(path), N_mem, chunk)]
+
+#a header row, comments and blank lines are skipped and columns past the addresses are ignored
+def test_playback_csv(tmp_path, numpy):
+    path = tmp_path / 'levels.csv'
+    path.write_text('time,a,b\n# a comment\n0,1,2,9\n\n0.5,3,4\n1.0,5,6\n')
+    assert chunks(path, 2) == [([0.0, 0.5, 1.0], [[1, 2], [3, 4], [5, 6]])]
+    assert chunks(path, 1, chunk=2) == [([0.0, 0.5], [[1], [3]]), ([1.0], [[5]])]
+
+@pytest.mark.parametrize('text, error', [('0,1\n', 'line 1 needs a time and 2 values'), ('0,1,2\nx,1,2\n', 'line 2 is not a row of numbers')])
+def test_playback_csv_errors(tmp_path, text, error):
+    path = tmp_path / 'levels.csv'
+    path.write_text(text)
+    with pytest.raises(ValueError, match=error):
+        chunks(path, 2)
+
+def test_playback_npy(tmp_path):
+    if ManiPIO.np is None:
+        pytest.skip('NumPy is not installed')
+    path = str(tmp_path / 'levels.npy')
+    ManiPIO.np.save(path, ManiPIO.np.array([[0, 1, 2], [0.5, 3, 4], [1, 5, 6]]))
+    assert chunks(path, 2, chunk=2) == [([0.0, 0.5], [[1, 2], [3, 4]]), ([1.0], [[5, 6]])]
+    with pytest.raises(ValueError, match='a time column and 3 value columns'):
+        chunks(path, 3)
+
+#each row is written to every address at its time from the start
+def test_playback_event(simulator, numpy, tmp_path):
+    path = tmp_path / 'levels.csv'
+    path.write_text('t,a,b\n' + ''.join('%g,%u,%u\n' % (k*0.05, k, 100 + k) for k in range(6)))
+    event = make_event(Event='playback', file=str(path), mem_addr=[10, 11], mem_format=['16_int', '16_int'])
+    device = simulator.device('127.0.0.1', 5711)
+    written = []
+    request = device.request
+    def record(function, unit, read_addr=0, count=0, mem_addr=0, values=None):
+        if values is not None:
+            written.append((time.monotonic(), list(values)))
+        return request(function, unit, read_addr, count, mem_addr, values)
+    device.request = record
+    event.run()
+    event.wait()
+    stats = event.ramp_stats
+    assert stats['writes'] + stats['skipped'] == 6
+    assert written[-1][1] == [5, 105]
+    assert all(values[1] == values[0] + 100 for when, values in written)
+    assert written[-1][0] - written[0][0] == pytest.approx(0.25, abs=0.05)
@@ -0,0 +1,98 @@
+import time
+import pytest
+
+import ManiPIO
+
+COIL = ManiPIO.COIL_FORMAT
+
+@pytest.fixture(params=['numpy', 'python'])
+def numpy(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(ManiPIO, 'np', None)
+    elif ManiPIO.np is None:
+        pytest.skip('NumPy is not installed')
+
+@pytest.fixture
+def recording(tmp_path):
+    path = str(tmp_path / 'run.rec')
+    recorder = ManiPIO.start_recording(path)
+    yield path
+    ManiPIO.stop_recording(recorder)
+
+def rows(path):
+    start, plcs, records = ManiPIO.load_recording(path)
+    return [(int(r[1]), int(r[2]), int(r[3]), ManiPIO.MEM_FORMATS[r[4]], [int(register) for register in r[6][:r[5]]]) for r in (records.tolist() if hasattr(records, 'tolist') else records)]
+
+#writes are split into values by the formats planned for them, reads by the block's items
+def test_round_trip(simulator, recording, numpy):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 6501)
+    PLC.connect()
+    PLC.write(10, 1.5)
+    PLC.write_coils(30, [True, False])
+    #registers with no planned format are recorded one at a time, as 16_uint unless they are coils
+    PLC.write_registers(20, [7, 8])
+    PLC.read_blocks(PLC.plan_read([10, 12], ['32_float', '16_int']))
+    ManiPIO.MB_PLC('127.0.0.1', 6501, unit=2).write(5, 3, '16_int')
+    PLC.close()
+    ManiPIO.RECORDER.close()
+    float_registers = PLC.encode(1.5)
+    assert rows(recording) == [
+        (1, 10, ManiPIO.RECORD_WRITE, '32_float', float_registers),
+        (1, 30, ManiPIO.RECORD_WRITE, COIL, [1]),
+        (1, 31, ManiPIO.RECORD_WRITE, COIL, [0]),
+        (1, 20, ManiPIO.RECORD_WRITE, '16_uint', [7]),
+        (1, 21, ManiPIO.RECORD_WRITE, '16_uint', [8]),
+        (1, 10, ManiPIO.RECORD_READ, '32_float', float_registers),
+        (1, 12, ManiPIO.RECORD_READ, '16_int', [0]),
+        (2, 5, ManiPIO.RECORD_WRITE, '16_int', [3])]
+    start, plcs, records = ManiPIO.load_recording(recording)
+    assert plcs == [['127.0.0.1', 6501, 1], ['127.0.0.1', 6501, 2]]
+    assert abs(start - time.time()) < 60
+    times = [row[0] for row in records]
+    assert times == sorted(times) and times[0] >= 0
+
+#a recording started again is appended to with the same start and PLC numbers, a record cut short is dropped
+def test_append(simulator, tmp_path):
+    path = str(tmp_path / 'run.rec')
+    recorder = ManiPIO.start_recording(path)
+    ManiPIO.MB_PLC('127.0.0.2', 6503).write(1, 1, '16_int')
+    ManiPIO.MB_PLC('127.0.0.1', 6503).write(1, 2, '16_int')
+    ManiPIO.stop_recording(recorder)
+    start = ManiPIO.load_recording(path)[0]
+    FILE = open(path, 'ab')
+    FILE.write(b'\x01\x02\x03')
+    FILE.close()
+    recorder = ManiPIO.start_recording(path)
+    ManiPIO.MB_PLC('127.0.0.1', 6503).write(1, 3, '16_int')
+    ManiPIO.stop_recording(recorder)
+    assert ManiPIO.load_recording(path)[0] == start
+    assert [(row[0], row[4]) for row in rows(path)] == [(1, [1]), (2, [2]), (2, [3])]
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / 'other.rec'
+    path.write_bytes(b'x' * 64)
+    with pytest.raises(ValueError):
+        ManiPIO.load_recording(str(path))
+
+#writes recorded together go out together again, at the recorded pace divided by speed
+def test_replay(simulator, tmp_path, numpy):
+    path = str(tmp_path / 'run.rec')
+    recorder = ManiPIO.start_recording(path)
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 6504)
+    PLC.plan_write([10, 11, 12], ['16_int', '16_int', '16_int'])
+    PLC.write_registers(10, [1, 2, 3])
+    time.sleep(0.4)
+    PLC.write_registers(10, [4, 5, 6])
+    PLC.write_coils(40, [True])
+    ManiPIO.stop_recording(recorder)
+
+    #sent to another PLC than the one recorded
+    device = simulator.device('127.0.0.1', 6505)
+    started = time.perf_counter()
+    stats = ManiPIO.replay(path, speed=2.0, targets={1:('127.0.0.1', 6505, 1)})
+    assert time.perf_counter() - started >= 0.19
+    assert (stats['batches'], stats['writes']) == (3, 3)
+    assert device.counts['writes'] == 3
+    assert list(simulator.image('127.0.0.1', 6505)[10:13]) == [4, 5, 6]
+    assert simulator.image('127.0.0.1', 6505, coils=True)[40] == 1
+    assert stats['error_max'] < 0.1
@@ -0,0 +1,90 @@
+import time
+import pytest
+
+import ManiPIO
+
+#the faults the simulated PLC injects into each request in turn, then none
+def inject(monkeypatch, simulator, faults):
+    faults = list(faults)
+    monkeypatch.setattr(simulator, 'fault', lambda: faults.pop(0) if len(faults) > 0 else None)
+
+def make_plc(port, **retry):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', port)
+    PLC.set_retry(**retry)
+    PLC.connect()
+    return PLC
+
+def test_backoff_doubles_up_to_max_delay():
+    policy = ManiPIO.Retry_Policy(delay=0.1, max_delay=0.5, jitter=0)
+    assert [policy.backoff(retry) for retry in range(1, 6)] == pytest.approx([0.1, 0.2, 0.4, 0.5, 0.5])
+
+def test_backoff_jitter():
+    policy = ManiPIO.Retry_Policy(delay=1.0, jitter=0.25)
+    delays = [policy.backoff(1) for i in range(200)]
+    assert min(delays) >= 0.75 and max(delays) <= 1.25
+    assert max(delays) - min(delays) > 0.1
+
+def test_at_least_one_attempt():
+    assert ManiPIO.Retry_Policy(attempts=0).attempts == 1
+
+def test_write_succeeds(simulator):
+    PLC = make_plc(5101)
+    result = PLC.write(10, 1.5)
+    assert result.ok and result.attempts == 1 and result.retries == 0
+    assert PLC.read(10) == 1.5
+    assert PLC.stats()['ok'] == 1
+
+def test_retries_until_the_write_goes_through(simulator, monkeypatch):
+    PLC = make_plc(5102, delay=0.001, jitter=0)
+    inject(monkeypatch, simulator, ['fail', 'drop'])
+    result = PLC.write(10, 2.5)
+    assert result.ok and result.attempts == 3
+    assert PLC.stats() == {'calls':1, 'ok':1, 'failed':0, 'rejected':0, 'retries':2, 'skipped':0}
+    assert PLC.read(10) == 2.5
+
+def test_gives_up_after_attempts(simulator, monkeypatch):
+    PLC = make_plc(5103, attempts=3, delay=0.001, jitter=0)
+    inject(monkeypatch, simulator, ['fail']*10)
+    result = PLC.write(10, 1)
+    assert not result.ok and result.attempts == 3
+    assert 'exception code 4' in result.error
+    assert PLC.stats()['failed'] == 1
+
+def test_deadline_bounds_the_call(simulator, monkeypatch):
+    PLC = make_plc(5104, attempts=100, delay=0.02, max_delay=0.02, jitter=0, deadline=0.1)
+    inject(monkeypatch, simulator, ['fail']*100)
+    result = PLC.write(10, 1)
+    assert not result.ok
+    assert 2 <= result.attempts <= 6
+    assert result.elapsed < 0.2
+
+def test_breaker_rejects_writes_while_open(simulator, monkeypatch):
+    PLC = make_plc(5105, attempts=1, breaker=2, cooldown=60)
+    inject(monkeypatch, simulator, ['fail']*2)
+    assert not PLC.write(10, 1)
+    assert not PLC.write(10, 1)
+    result = PLC.write(10, 1)
+    assert not result.ok and result.attempts == 0
+    assert PLC.stats()['rejected'] == 1
+    #PLCs at the same address share the circuit
+    other = ManiPIO.MB_PLC('127.0.0.1', 5105, unit=2)
+    other.set_retry(breaker=2, cooldown=60)
+    assert other.write(10, 1).attempts == 0
+
+def test_breaker_closes_after_cooldown(simulator, monkeypatch):
+    PLC = make_plc(5106, attempts=1, breaker=1, cooldown=0.05)
+    inject(monkeypatch, simulator, ['fail', 'fail'])
+    assert PLC.write(10, 1).attempts == 1
+    assert PLC.write(10, 1).attempts == 0
+    time.sleep(0.06)
+    #failures are not reset by the cooldown, so one more failure opens the circuit again
+    assert PLC.write(10, 1).attempts == 1
+    assert PLC.write(10, 1).attempts == 0
+    time.sleep(0.06)
+    assert PLC.write(10, 1).ok
+    assert PLC.connection.failures == 0
+
+def test_no_breaker_by_default(simulator, monkeypatch):
+    PLC = make_plc(5107, attempts=1)
+    inject(monkeypatch, simulator, ['fail']*20)
+    assert all(PLC.write(10, 1).attempts == 1 for i in range(20))
@@ -0,0 +1,163 @@
+import ast
+import math
+import os
+import threading
+import time
+import pytest
+
+import ManiPIO
+
+@pytest.mark.parametrize('period', [0, 0.0, -1, math.nan])
+def test_period_must_be_above_zero(period):
+    with pytest.raises(ValueError):
+        ManiPIO.Scheduler().every(period)
+
+def test_timer_ticks_on_schedule():
+    #timed from before the first deadline is set, so a pause before the loop is not taken off
+    start = time.monotonic()
+    timer = ManiPIO.Scheduler().every(0.01)
+    for i in range(10):
+        assert timer.wait()
+    elapsed = time.monotonic() - start
+    #deadlines follow each other, so lateness does not add up over the ticks
+    assert 0.095 <= elapsed < 0.2
+    stats = timer.stats()
+    assert stats['ticks'] == 10
+    assert 0 <= stats['jitter_mean'] <= stats['jitter_max'] < 0.05
+
+def test_timers_wake_in_deadline_order():
+    scheduler = ManiPIO.Scheduler()
+    woke = []
+    def run(name, period):
+        timer = scheduler.every(period)
+        timer.wait()
+        woke.append(name)
+    threads = [threading.Thread(target=run, args=args) for args in [('slow', 0.06), ('fast', 0.02), ('middle', 0.04)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert woke == ['fast', 'middle', 'slow']
+
+def test_overrun_periods_are_skipped():
+    timer = ManiPIO.Scheduler().every(0.01)
+    assert timer.wait()
+    time.sleep(0.055)
+    assert timer.wait()
+    assert timer.stats()['missed'] >= 3
+    assert timer.deadline > time.monotonic()
+
+def test_cancel_wakes_a_waiting_thread():
+    timer = ManiPIO.Scheduler().every(60)
+    results = []
+    thread = threading.Thread(target=lambda: results.append(timer.wait()))
+    thread.start()
+    time.sleep(0.02)
+    timer.cancel()
+    thread.join(1)
+    assert results == [False]
+    assert not timer.wait()
+
+def test_stop_event():
+    stop = threading.Event()
+    timer = ManiPIO.Scheduler().every(0.01, stop)
+    assert timer.wait()
+    stop.set()
+    assert not timer.wait()
+
+#setting the stop Event wakes a timer that is already waiting, not just the next wait
+def test_stop_event_wakes_a_waiting_thread():
+    stop = threading.Event()
+    timer = ManiPIO.Scheduler().every(60, stop)
+    results = []
+    thread = threading.Thread(target=lambda: results.append(timer.wait()))
+    thread.start()
+    time.sleep(0.02)
+    started = time.monotonic()
+    stop.set()
+    thread.join(1)
+    assert results == [False]
+    assert time.monotonic() - started < 0.5
+
+#cancelling one timer leaves the others on the same scheduler ticking
+def test_cancel_only_stops_its_own_timer():
+    scheduler = ManiPIO.Scheduler()
+    stop = threading.Event()
+    timers = [scheduler.every(0.01), scheduler.every(0.01, stop)]
+    other = scheduler.every(0.01)
+    for timer in timers:
+        timer.cancel()
+        assert not timer.wait()
+    assert other.wait() and other.wait()
+    assert not stop.is_set()
+
+def test_scheduler_stop_cancels_every_timer():
+    scheduler = ManiPIO.Scheduler()
+    timers = [scheduler.every(60) for i in range(3)]
+    scheduler.stop()
+    assert all(not timer.wait() for timer in timers)
+
+def test_wait_until():
+    deadline = time.perf_counter() + 0.02
+    assert ManiPIO.wait_until(deadline)
+    assert time.perf_counter() >= deadline
+    assert not ManiPIO.wait_until(time.perf_counter() + 60, lambda: True)
+
+EVENT = """PLC 1
+IP:127.0.0.1
+Port:5201
+
+Event 1
+PLC:1
+mem:10
+format:16_int
+values:7
+timing:%s
+persist:true
+
+Start
+Event 1
+"""
+
+#a persistent single Event with timing 0 writes as fast as it can without a timer
+def test_single_event_with_timing_zero(scenario, simulator):
+    PLCS, Events, Triggers = scenario(EVENT % 0)
+    event = Events[1]
+    event.run()
+    time.sleep(0.1)
+    assert event.state() == 'running'
+    event.stop()
+    assert event.state() == 'stopped'
+    writes = event.metrics.counters.get('writes', 0)
+    assert writes > 10
+    assert simulator.image('127.0.0.1', 5201)[10] == 7
+    #a stopped Event does not write again
+    time.sleep(0.02)
+    assert event.metrics.counters.get('writes', 0) == writes
+
+def test_single_event_on_the_scheduler(scenario):
+    PLCS, Events, Triggers = scenario(EVENT % 0.02)
+    event = Events[1]
+    event.run()
+    time.sleep(0.15)
+    event.stop()
+    assert 4 <= event.metrics.counters.get('writes', 0) <= 9
+
+#the Data Broker End Point runs on its own, so it keeps a copy of the scheduler and register codecs that must match these
+#get_codec is left out, only ManiPIO has coils
+def test_endpoint_copies_match():
+    def definitions(path):
+        source = open(path).read()
+        lines = source.splitlines()
+        found = {}
+        for node in ast.parse(source).body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+                found[node.name] = lines[node.lineno-1:node.end_lineno]
+            elif isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+                found[node.targets[0].id] = lines[node.lineno-1:node.end_lineno]
+        return found
+    here = os.path.dirname(os.path.abspath(__file__))
+    ours = definitions(os.path.join(here, '..', 'ManiPIO.py'))
+    endpoint = definitions(os.path.join(here, '..', '..', 'OT_Emulation_Data_Broker', 'Endpoint', 'EndPoint.py'))
+    for name in ['reg_count', 'FORMAT_CODES', 'Codec', 'CODECS', 'Timer', 'Scheduler', 'SCHEDULER']:
+        assert endpoint[name] == ours[name], name
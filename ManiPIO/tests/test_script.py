@@ -0,0 +1,143 @@
+import os
+import pytest
+
+import ManiPIO
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPT = """PLC 1 Tank
+IP:127.0.0.1
+Port:5020
+
+Event 1 Fill
+PLC:1
+mem:100,102
+format:32_float,16_int
+values:10,20
+timing:1
+
+Trigger 1
+Event:1
+PLC:1
+mem:200
+values:50
+conditions:rise > hyst 2
+poll:adaptive,1,20
+
+Start sync
+Event 1, Trigger 1
+"""
+
+def compile_text(tmp_path, text, name='script.txt', **kwargs):
+    path = tmp_path / name
+    path.write_text(text)
+    return ManiPIO.compile_script(str(path), **kwargs)
+
+def check(text):
+    plcs, events, triggers, starts, errors = ManiPIO.parse_script(text.splitlines())
+    more_errors, warnings = ManiPIO.validate_script(plcs, events, triggers, starts)
+    return errors + more_errors, warnings
+
+def test_parse_script():
+    plcs, events, triggers, starts, errors = ManiPIO.parse_script(SCRIPT.splitlines())
+    assert errors == []
+    assert (plcs[0]['ip'], plcs[0]['port'], plcs[0]['unit']) == ('127.0.0.1', 5020, 1)
+    assert events[0]['mem'] == [100, 102]
+    assert events[0]['format'] == ['32_float', '16_int']
+    assert events[0]['values'] == [10.0, 20.0]
+    assert triggers[0]['event'] == 1
+    assert triggers[0]['plcs'][0]['conditions'] == ['rise > hyst 2']
+    assert triggers[0]['poll'] == {'adaptive':True, 'min_rate':1.0, 'max_rate':20.0}
+    assert starts == [{'line':20, 'events':[1], 'triggers':[1], 'sync':True}]
+
+def test_example_script_compiles():
+    plan = ManiPIO.compile_script(os.path.join(HERE, '..', 'Script.txt'), cache=False)
+    assert (len(plan.plcs), len(plan.events), len(plan.triggers)) == (1, 2, 1)
+
+@pytest.mark.parametrize('old,new,error', [
+    ('Port:5020', 'Port:70000', 'port 70000 is not a valid port'),
+    ('PLC:1\nmem:100,102', 'PLC:2\nmem:100,102', 'uses PLC 2 which is not defined before it'),
+    ('mem:100,102', 'mem:100,101', 'memory addresses 100 and 101 overlap'),
+    ('mem:100,102', 'mem:65535,102', 'memory address 65535 is outside the modbus register range'),
+    ('format:32_float,16_int', 'format:32_float', 'has 1 formats for 2 memory addresses'),
+    ('values:10,20\ntiming:1', 'values:10\ntiming:1\ntype:ramp', 'does not have enough values to preform ramp'),
+    ('conditions:rise > hyst 2', 'conditions:above', 'unknown condition "above"'),
+    ('poll:adaptive,1,20', 'poll:adaptive,20,1', 'adaptive poll rates must be above 0'),
+    ('Event 1, Trigger 1', 'Event 1, Trigger 2', 'Trigger 2 is not defined'),
+    ('Event 1 Fill', 'Event 2 Fill', 'numbers must be in order'),
+])
+def test_validate_errors(old, new, error):
+    assert SCRIPT.count(old) == 1
+    errors, warnings = check(SCRIPT.replace(old, new))
+    assert any(error in e for e in errors), errors
+
+def test_every_error_is_listed():
+    errors, warnings = check(SCRIPT.replace('Port:5020', 'Port:0').replace('conditions:rise > hyst 2', 'conditions:above'))
+    assert len(errors) == 2
+
+def test_overlapping_events_warn():
+    text = SCRIPT.replace('Start sync\nEvent 1, Trigger 1', 'Event 2\nPLC:1\nmem:101\nvalues:1\n\nStart\nEvent 1, Event 2')
+    errors, warnings = check(text)
+    assert errors == []
+    assert any('Events 1 and 2 both write memory address' in w for w in warnings)
+
+def test_compile_errors(tmp_path):
+    with pytest.raises(ValueError) as error:
+        compile_text(tmp_path, SCRIPT.replace('Port:5020', 'Port:0'), cache=False)
+    assert 'has 1 errors' in str(error.value)
+
+def test_plan_cannot_change(tmp_path):
+    plan = compile_text(tmp_path, SCRIPT, cache=False)
+    with pytest.raises(AttributeError):
+        plan.digest = 'x'
+    with pytest.raises(TypeError):
+        plan.events[0]['mem'] = [1]
+
+def test_plan_json_round_trip(tmp_path):
+    plan = compile_text(tmp_path, SCRIPT, cache=False)
+    loaded = ManiPIO.Script_Plan.from_json(plan.to_json())
+    assert loaded.to_json() == plan.to_json()
+    assert ManiPIO.Script_Plan.from_json(plan.to_json().replace('"version": %u' % ManiPIO.PLAN_VERSION, '"version": -1')) is None
+
+def test_cache_is_used(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    plan = compile_text(tmp_path, SCRIPT, cache_dir=cache_dir)
+    assert os.listdir(cache_dir) == [plan.digest + '.json']
+
+    #an unchanged script is loaded from the cache without being parsed
+    def parse_script(lines):
+        raise AssertionError('cached script was parsed again')
+    monkeypatch.setattr(ManiPIO, 'parse_script', parse_script)
+    cached = compile_text(tmp_path, SCRIPT, cache_dir=cache_dir)
+    assert cached.to_json() == plan.to_json()
+
+def test_changed_script_is_compiled_again(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    first = compile_text(tmp_path, SCRIPT, cache_dir=cache_dir)
+    second = compile_text(tmp_path, SCRIPT.replace('values:10,20', 'values:30,40'), cache_dir=cache_dir)
+    assert first.digest != second.digest
+    assert second.events[0]['values'] == (30.0, 40.0)
+    assert len(os.listdir(cache_dir)) == 2
+
+def test_no_cache(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    compile_text(tmp_path, SCRIPT, cache=False, cache_dir=cache_dir)
+    assert not os.path.exists(cache_dir)
+
+def test_bad_cache_file_is_ignored(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    plan = compile_text(tmp_path, SCRIPT, cache_dir=cache_dir)
+    with open(os.path.join(cache_dir, plan.digest + '.json'), 'w') as FILE:
+        FILE.write('{not json')
+    assert compile_text(tmp_path, SCRIPT, cache_dir=cache_dir).to_json() == plan.to_json()
+
+def test_cached_plan_checks_playback_files(tmp_path):
+    levels = tmp_path / 'levels.csv'
+    levels.write_text('0,1\n1,2\n')
+    text = 'PLC 1\nIP:127.0.0.1\n\nEvent 1\nPLC:1\nmem:10\ntype:playback\nfile:%s\n\nStart\nEvent 1\n' % levels
+    cache_dir = str(tmp_path / 'cache')
+    compile_text(tmp_path, text, cache_dir=cache_dir)
+    levels.unlink()
+    with pytest.raises(ValueError) as error:
+        compile_text(tmp_path, text, cache_dir=cache_dir)
+    assert 'playback file %s does not exist' % levels in str(error.value)
@@ -0,0 +1,87 @@
+import time
+
+import ManiPIO
+
+def writes(simulator, port):
+    return simulator.devices[('127.0.0.1', port)].counts['writes']
+
+def test_confirmed_writes_are_not_repeated(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 5901)
+    assert PLC.write_changed(10, [1, 2]).ok
+    assert PLC.write_changed(10, [1, 2]) is None
+    #part of a shadowed block is shadowed too
+    assert PLC.write_changed(11, [2]) is None
+    assert PLC.write_changed(10, [1, 3]).ok
+    assert writes(simulator, 5901) == 2
+    assert PLC.write_counts['skipped'] == 2
+    assert simulator.image('127.0.0.1', 5901)[11] == 3
+
+#PLCs at one address share the shadow of each unit, registers and coils are shadowed apart
+def test_shadow_is_kept_per_connection_and_unit(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 5902)
+    PLC.write_changed(10, [1])
+    assert ManiPIO.MB_PLC('127.0.0.1', 5902).write_changed(10, [1]) is None
+    assert ManiPIO.MB_PLC('127.0.0.1', 5902, unit=2).write_changed(10, [1]).ok
+    assert PLC.write_changed(10, [1], coils=True).ok
+    assert writes(simulator, 5902) == 3
+
+def test_verify_reads_the_registers_back(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 5903)
+    image = simulator.image('127.0.0.1', 5903)
+    PLC.write_changed(10, [4])
+    image[10] = 0
+    #the shadow still believes the PLC holds 4, a read-back shows it does not
+    assert PLC.write_changed(10, [4]) is None
+    assert PLC.write_changed(10, [4], verify=True).ok
+    assert image[10] == 4
+    #a value already on the PLC is not rewritten even though it was never sent
+    image[20] = 6
+    assert PLC.write_changed(20, [6], verify=True) is None
+
+def test_refresh_rewrites_old_values(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 5904)
+    PLC.write_changed(10, [4])
+    assert PLC.write_changed(10, [4], refresh=0.2) is None
+    time.sleep(0.3)
+    assert PLC.write_changed(10, [4], refresh=0.2).ok
+    assert PLC.write_changed(10, [4], refresh=0.2) is None
+
+#after a failed write what the PLC holds is not known, so the next write goes out
+def test_failed_write_forgets_the_shadow(simulator):
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 5905)
+    PLC.set_retry(attempts=1)
+    PLC.write_changed(10, [4])
+    simulator.fail = 1.0
+    assert not PLC.write_changed(10, [5]).ok
+    simulator.fail = 0.0
+    #the failure dropped the connection, Events reconnect like this each period
+    PLC.check()
+    assert PLC.write_changed(10, [4]).ok
+
+VERIFIED = """PLC 1
+IP:127.0.0.1
+Port:5906
+
+Event 1
+PLC:1
+mem:10
+format:16_int
+values:3
+timing:0.02
+persist:true
+suppress:true
+verify:true
+"""
+
+#a persistent Event puts back a value changed on the PLC and otherwise leaves it alone
+def test_verified_event_restores_changed_values(scenario, simulator):
+    PLCS, Events, Triggers = scenario(VERIFIED)
+    image = simulator.image('127.0.0.1', 5906)
+    Events[1].run()
+    time.sleep(0.2)
+    assert image[10] == 3 and writes(simulator, 5906) == 1
+    image[10] = 0
+    time.sleep(0.2)
+    Events[1].stop()
+    assert image[10] == 3 and writes(simulator, 5906) == 2
+    assert PLCS[1].write_counts['skipped'] > 5
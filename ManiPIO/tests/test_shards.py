@@ -0,0 +1,120 @@
+import queue
+import time
+import pytest
+
+import ManiPIO
+
+SCRIPT = """PLC 1
+IP:127.0.0.1
+Port:502
+
+PLC 2
+IP:127.0.0.2
+Port:502
+
+PLC 3
+IP:127.0.0.1
+Port:502
+unit:2
+
+Event 1
+PLC:1
+mem:10
+values:1
+
+Event 2
+PLC:3
+mem:10
+values:1
+
+Event 3
+PLC:2
+mem:10
+values:1
+
+Trigger 1
+Event:2
+PLC:2
+mem:20
+values:0
+conditions:>
+
+Start
+Event 1, Event 3, Trigger 1
+"""
+
+@pytest.fixture
+def plan(tmp_path):
+    path = tmp_path / 'script.txt'
+    path.write_text(SCRIPT)
+    return ManiPIO.compile_script(str(path), cache=False)
+
+#PLCs at one address share a shard, the address with the most Events and Triggers is placed first
+def test_plan_shards(plan):
+    shards, N = ManiPIO.plan_shards(plan, 2)
+    assert N == 2
+    assert shards == {1:0, 2:1, 3:0}
+
+def test_no_more_shards_than_addresses(plan):
+    assert ManiPIO.plan_shards(plan, 8) == ({1:0, 2:1, 3:0}, 2)
+    assert ManiPIO.plan_shards(plan, 1) == ({1:0, 2:0, 3:0}, 1)
+    assert ManiPIO.plan_shards(plan, 0)[1] == 1
+
+class Waiting:
+    thread_stop = False
+
+WAITING = Waiting()
+
+#Two shards in this process, shard 1 owns PLC 2 and shard 0 watches it through the link
+#each shard builds its own PLCs, as the worker processes do
+@pytest.fixture
+def links(simulator, monkeypatch):
+    inboxes = [queue.Queue(), queue.Queue()]
+    shards = {1:0, 2:1}
+    links = []
+    for shard in range(2):
+        PLCS = {1:ManiPIO.MB_PLC('127.0.0.1', 6001), 2:ManiPIO.MB_PLC('127.0.0.2', 6002)}
+        links.append(ManiPIO.Shard_Link(shard, inboxes, shards, PLCS))
+        links[-1].start()
+    monkeypatch.setattr(ManiPIO, 'SHARD_LINK', links[0])
+    yield links
+    for link in links:
+        link.stop()
+
+def test_owned_plcs_are_polled_here(links):
+    poller = ManiPIO.subscribe_poller(links[0].plcs[1], [10], ['16_int'])[0]
+    assert not poller.remote
+    poller.unsubscribe()
+
+def test_remote_poller_gets_the_owners_values(links, simulator):
+    simulator.image('127.0.0.2', 6002)[20] = 7
+    poller, plan, indexes = ManiPIO.subscribe_poller(links[0].plcs[2], [20], ['16_int'])
+    assert poller.remote and links[0].remotes[2] is poller
+    cycle, values = poller.wait(0, plan, WAITING)
+    assert values[indexes[0]] == 7
+    #the owner polls with its own PLC
+    owner = ManiPIO.POLLERS[links[1].plcs[2]]
+    assert list(links[1].feeds) == [(0, 2)]
+    #a watch list that grows is sent to the owner again
+    poller, plan, indexes = ManiPIO.subscribe_poller(links[0].plcs[2], [21], ['16_int'])
+    cycle, values = poller.wait(cycle, plan, WAITING)
+    assert values == [7, 0]
+    assert owner.mem_addr == [20, 21]
+    poller.unsubscribe()
+    poller.unsubscribe()
+    assert 2 not in links[0].remotes
+    #the owner lets go of its poller once the feed stops
+    owner.thread.join(2)
+    assert links[1].plcs[2] not in ManiPIO.POLLERS
+
+#read requests go to the owner, which then polls only when asked
+def test_remote_requests_are_passed_on(links, simulator):
+    device = simulator.device('127.0.0.2', 6002)
+    poller, plan, indexes = ManiPIO.subscribe_poller(links[0].plcs[2], [20], ['16_int'], WAITING)
+    time.sleep(0.2)
+    assert device.counts['reads'] == 0
+    for i in range(3):
+        last = poller.request(WAITING)
+        poller.wait(last, plan, WAITING)
+    assert device.counts['reads'] == 3
+    poller.unsubscribe(WAITING)
@@ -0,0 +1,117 @@
+import json
+import time
+import pytest
+
+import ManiPIO
+
+#start a simulator with options in place of the plain one of the simulator fixture
+@pytest.fixture
+def simulate():
+    started = []
+    def start(**options):
+        started.append(ManiPIO.start_simulator(options))
+        return started[-1]
+    yield start
+    for simulator in started:
+        ManiPIO.stop_simulator(simulator)
+
+def test_fault_rates():
+    simulator = ManiPIO.Simulator(fail=0.3, drop=0.1, seed=1)
+    faults = [simulator.fault() for i in range(10000)]
+    assert 0.08 < faults.count('drop')/10000.0 < 0.12
+    assert 0.27 < faults.count('fail')/10000.0 < 0.33
+    #a seed repeats the same faults
+    again = ManiPIO.Simulator(fail=0.3, drop=0.1, seed=1)
+    assert [again.fault() for i in range(10000)] == faults
+    assert ManiPIO.Simulator().fault() is None
+
+def test_latency_and_jitter():
+    simulator = ManiPIO.Simulator(latency=0.01, jitter=0.005, seed=2)
+    delays = [simulator.delay() for i in range(1000)]
+    assert 0.005 <= min(delays) < 0.006 and 0.014 < max(delays) <= 0.015
+    assert ManiPIO.Simulator(latency=0.01).delay() == 0.01
+    #latency can not be spread below 0
+    assert min(ManiPIO.Simulator(latency=0.001, jitter=0.01).delay() for i in range(100)) == 0.0
+
+def test_requests_take_the_latency(simulate):
+    simulate(latency=0.05)
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 6601)
+    PLC.connect()
+    started = time.perf_counter()
+    PLC.write(1, 1, '16_int')
+    assert time.perf_counter() - started >= 0.05
+    PLC.close()
+
+#a failed request is answered with an exception, a dropped one closes the connection
+def test_injected_faults(simulate):
+    simulator = simulate(fail=1.0)
+    client = simulator.client('127.0.0.1', 6602)
+    with pytest.raises(ConnectionError):
+        client.read_holding_registers(0, 1)
+    client.connect()
+    assert str(client.write_registers(0, [1])) == 'Modbus function 16 error: exception code 4'
+    simulator.fail = 0.0
+    simulator.drop = 1.0
+    with pytest.raises(ConnectionError):
+        client.read_holding_registers(0, 1)
+    assert not client.is_socket_open()
+    assert simulator.devices[('127.0.0.1', 6602)].counts == {'reads':0, 'writes':0, 'failed':1, 'dropped':1}
+
+def test_addresses_past_the_image(simulator):
+    client = simulator.client('127.0.0.1', 6603)
+    client.connect()
+    assert client.read_holding_registers(ManiPIO.SIM_REGISTERS - 1, 2).isError()
+    assert client.write_coils(ManiPIO.SIM_REGISTERS, [1]).isError()
+    assert not client.read_holding_registers(ManiPIO.SIM_REGISTERS - 1, 1).isError()
+
+#writes are retried through failures and dropped connections, which are counted on both sides
+def test_retries_get_through_faults(simulate):
+    simulator = simulate(fail=0.3, drop=0.1, seed=4)
+    PLC = ManiPIO.MB_PLC('127.0.0.1', 6604)
+    PLC.connection.retry_interval = 0
+    PLC.set_retry(attempts=20, delay=0.001, max_delay=0.001)
+    PLC.connect()
+    for i in range(50):
+        assert PLC.write(i, i, '16_int').ok
+    device = simulator.devices[('127.0.0.1', 6604)]
+    assert device.counts['writes'] == 50
+    assert device.counts['failed'] > 0 and device.counts['dropped'] > 0
+    assert PLC.write_counts['retries'] == device.counts['failed'] + device.counts['dropped']
+    assert list(simulator.image('127.0.0.1', 6604)[:50]) == list(range(50))
+    PLC.close()
+
+SCRIPT = """PLC 1
+IP:127.0.0.1
+Port:6605
+
+PLC 2
+IP:127.0.0.1
+Port:6605
+unit:2
+
+Event 1
+PLC:1
+mem:10,12
+format:32_float,16_int
+values:2.5,-3
+
+Event 2
+PLC:2
+mem:5
+format:1_coil
+values:1
+
+Start
+Event 1, Event 2
+"""
+
+#the final state decodes each address written with the format planned for it
+def test_final_state(scenario, simulator, tmp_path):
+    PLCS, Events, Triggers = scenario(SCRIPT)
+    ManiPIO.start(Events, Triggers, [1, 2], [])
+    assert simulator.state(PLCS) == {
+        '1':{'address':'127.0.0.1:6605/1', 'values':{'10':2.5, '12':-3}, 'coils':{}},
+        '2':{'address':'127.0.0.1:6605/2', 'values':{}, 'coils':{'5':1}}}
+    path = str(tmp_path / 'state.json')
+    ManiPIO.stop_simulator(simulator, PLCS, path, shard=1)
+    assert json.load(open(path + '.1')) == simulator.state(PLCS)
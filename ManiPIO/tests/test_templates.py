@@ -0,0 +1,83 @@
+import json
+
+import ManiPIO
+
+SCRIPT = """PLC 1 Historian
+IP:127.0.0.1
+
+PLC 2-201
+IP:10.0.1.1-200
+port:502
+
+Event 1-200 Fan out
+PLC:2-201
+mem:100
+values:1
+stride:10
+
+Trigger 1-200
+Event:1-200
+PLC:2-201
+mem:200
+values:50
+conditions:>
+stride:10
+
+Start
+Event 1-200, Trigger 1-200
+"""
+
+def parse(text):
+    plcs, events, triggers, starts, errors = ManiPIO.parse_script(text.splitlines())
+    more_errors, warnings = ManiPIO.validate_script(plcs, events, triggers, starts)
+    return plcs, events, triggers, starts, errors + more_errors
+
+def test_templates_make_every_copy():
+    plcs, events, triggers, starts, errors = parse(SCRIPT)
+    assert errors == []
+    assert (len(plcs), len(events), len(triggers)) == (201, 200, 200)
+    assert (plcs[1]['ip'], plcs[200]['ip'], plcs[200]['port']) == ('10.0.1.1', '10.0.1.200', 502)
+    assert (events[0]['plc'], events[0]['mem']) == (2, [100])
+    assert (events[2]['plc'], events[2]['mem']) == (4, [120])
+    assert (triggers[199]['event'], triggers[199]['plcs'][0]['plc'], triggers[199]['plcs'][0]['mem']) == (200, 201, [2190])
+    assert starts[0]['events'] == list(range(1, 201))
+    assert starts[0]['triggers'] == list(range(1, 201))
+
+def test_templates_stay_one_block():
+    plcs, events, triggers, starts, errors = parse(SCRIPT)
+    assert len(events.blocks) == 1 and isinstance(events.blocks[0], ManiPIO.Template_Rows)
+    assert [len(block) for block in plcs.blocks] == [1, 200]
+
+def test_negative_index():
+    plcs, events, triggers, starts, errors = parse(SCRIPT)
+    assert events[-1] == events[199]
+
+def test_plan_json_keeps_templates(tmp_path):
+    path = tmp_path / 'script.txt'
+    path.write_text(SCRIPT)
+    plan = ManiPIO.compile_script(str(path), cache=False)
+    data = json.loads(plan.to_json())
+    assert len(data['events']) == 1 and data['events'][0]['count'] == 200
+    loaded = ManiPIO.Script_Plan.from_json(plan.to_json())
+    assert [dict(event) for event in loaded.events] == [dict(event) for event in plan.events]
+
+def test_ip_range_written_out():
+    plcs, events, triggers, starts, errors = parse('PLC 1-3\nIP:10.0.0.254-10.0.1.0\n')
+    assert errors == []
+    assert [plc['ip'] for plc in plcs] == ['10.0.0.254', '10.0.0.255', '10.0.1.0']
+
+def test_ports_and_units_multiply():
+    plcs, events, triggers, starts, errors = parse('PLC 1-4\nIP:127.0.0.1\nport:5020-5021\nunit:1-2\n')
+    assert errors == []
+    assert [(plc['port'], plc['unit']) for plc in plcs] == [(5020, 1), (5020, 2), (5021, 1), (5021, 2)]
+
+def test_template_size_must_match():
+    plcs, events, triggers, starts, errors = parse('PLC 1-3\nIP:10.0.0.1-4\n')
+    assert any('makes 4 PLCs, number it 1-4' in error for error in errors)
+    errors = parse(SCRIPT.replace('PLC:2-201\nmem:100', 'PLC:2-100\nmem:100'))[4]
+    assert any('Event plc has 99 values for 200 copies' in error for error in errors)
+
+def test_template_copies_are_checked():
+    #the last copies would write past the end of the register space
+    errors = parse(SCRIPT.replace('mem:100\nvalues:1\nstride:10', 'mem:100\nvalues:1\nstride:400'))[4]
+    assert any('Event 200' in error and 'outside the modbus register range' in error for error in errors)
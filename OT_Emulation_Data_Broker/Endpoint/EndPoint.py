@@ -22,11 +22,18 @@ import time
 import socket
 import sys
 import os
+import struct
+import heapq
 import zmq
 from pymodbus.client.sync import ModbusTcpClient as ModbusClient
-from pymodbus.payload import BinaryPayloadBuilder, BinaryPayloadDecoder
 from pymodbus.constants import Endian
 
+#NumPy is optional, it is only used to encode and decode whole arrays of values at once
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class Data_Repo(object):
     def __init__(self,SetString):
@@ -47,6 +54,83 @@ class Data_Repo(object):
     def UDP_TAGS(self):
         return self.Tag_NoDuplicates
 
+#Find the number of 16 bit registers a memory format uses
+def reg_count(formating):
+    bits = int(formating.split('_')[0])
+    if bits >= 16:
+        return int(bits/16)
+    return 1
+
+#struct codes for each memory format
+FORMAT_CODES = { '16_float':'e', '32_float':'f', '64_float':'d', '16_int':'h', '32_int':'i', '64_int':'q', '16_uint':'H', '32_uint':'I', '64_uint':'Q' }
+
+#Compiled encoder/decoder for one memory format, byte order and word order
+#This packs the same register layout as pymodbus BinaryPayloadBuilder/Decoder
+class Codec:
+    def __init__(self, formating, byteOrder, wordOrder):
+        code = FORMAT_CODES[formating]
+        self.format = formating
+        self.count = reg_count(formating)
+        self.integer = code not in 'efd'
+
+        #The word order sets the endianness of the packed value, and when the byte order
+        #differs from the word order the bytes inside each register are swapped
+        if wordOrder == Endian.LITTLE:
+            value_order = '<'
+        else:
+            value_order = '>'
+        if byteOrder == wordOrder:
+            reg_order = '>'
+        else:
+            reg_order = '<'
+
+        self.value = struct.Struct(value_order + code)
+        self.regs = struct.Struct(reg_order + 'H'*self.count)
+        self.np_value = value_order + code
+        self.np_regs = reg_order + 'u2'
+
+    #Encode one value into a list of registers
+    def encode(self, value):
+        #Catch incorrect formating of ints
+        if self.integer and type(value) is not int:
+            value = int(value)
+        return list(self.regs.unpack(self.value.pack(value)))
+
+    #Decode a list of registers into one value
+    def decode(self, registers):
+        return self.value.unpack(self.regs.pack(*registers))[0]
+
+    #Encode an array of values into one flat array of registers
+    def encode_array(self, values):
+        if np is None:
+            registers = []
+            for value in values:
+                registers.extend(self.encode(value))
+            return registers
+        values = np.ascontiguousarray(values, dtype=self.np_value)
+        return values.view(self.np_regs).astype(np.uint16)
+
+    #Decode a flat array of registers into an array of values
+    def decode_array(self, registers):
+        if np is None:
+            return [self.decode(registers[i:i+self.count]) for i in range(0, len(registers), self.count)]
+        registers = np.ascontiguousarray(registers, dtype=np.uint16).astype(self.np_regs)
+        return registers.view(self.np_value)
+
+    def __repr__(self):
+        return "Codec('{}')".format(self.format)
+
+#Codecs are compiled once per (format, byteOrder, wordOrder) and shared by all PLCs
+CODECS = {}
+
+def get_codec(formating, byteOrder, wordOrder):
+    key = (formating, byteOrder, wordOrder)
+    codec = CODECS.get(key)
+    if codec is None:
+        codec = Codec(formating, byteOrder, wordOrder)
+        CODECS[key] = codec
+    return codec
+
 #Define class for modbus PLCs
 class MB_PLC:
 
@@ -66,52 +150,21 @@ class MB_PLC:
 
     #Define how to read values from PLCs
     def read(self, mem_addr, formating=None):
-        #define decode options
-        def float_64(decode):
-            return decode.decode_64bit_float()
-        def float_32(decode):
-            return decode.decode_32bit_float()
-        def float_16(decode):
-            return decode.decode_16bit_float()
-        def int_64(decode):
-            return decode.decode_64bit_int()
-        def int_32(decode):
-            return decode.decode_32bit_int()
-        def int_16(decode):
-            return decode.decode_16bit_int()
-        def uint_64(decode):
-            return decode.decode_64bit_uint()
-        def uint_32(decode):
-            return decode.decode_32bit_uint()
-        def uint_16(decode):
-            return decode.decode_16bit_uint()
-
-        #Check formatting and split off bit count
+        #Check formatting and find the compiled codec
         if formating is None:
             formating = self.Mem_default
-        Format = formating.split('_')
-
-        if int(Format[0]) >= 16:  #determine number of registers to read
-            count = int(int(Format[0])/16)
-        else:
-            count = 1
+        codec = get_codec(formating, self.byteOrder, self.wordOrder)
 
         client = self.client #define client
 
         try:
-            results = client.read_holding_registers(mem_addr,count,unit=1) #read client PLC
+            results = client.read_holding_registers(mem_addr,codec.count,unit=1) #read client PLC
         except:
             results = None
 
-        #decoder dictionary
-        Decode_dict = { '16_float':float_16, '32_float':float_32, '64_float':float_64, '16_int':int_16, '32_int':int_32, '64_int':int_64, '16_uint':uint_16, '32_uint':uint_32, '64_uint':uint_64 }
-
         try:
-            #Set up decoder
-            decoder = BinaryPayloadDecoder.fromRegisters(results.registers, byteorder=self.byteOrder, wordorder=self.wordOrder)
-            
-            return Decode_dict[formating](decoder)
             #return decoded value
+            return codec.decode(results.registers)
         except:
             #return a Nonetype
             return None
@@ -133,54 +186,18 @@ class MB_PLC:
 
     #define how to write to registers
     def write(self, mem_addr, value, formating=None):
-        #define encode options
-        def float_64(build, value):
-            build.add_64bit_float(float(value))
-        def float_32(build, value):
-            build.add_32bit_float(float(value))
-        def float_16(build, value):
-            build.add_16bit_float(float(value))
-        def int_16(build, value):
-            build.add_16bit_int(value)
-        def int_32(build, value):
-            build.add_32bit_int(value)
-        def int_64(build, value):
-            build.add_64bit_int(value)
-        def uint_16(build, value):
-            build.add_16bit_uint(value)
-        def uint_32(build, value):
-            build.add_32bit_uint(value)
-        def uint_64(build, value):
-            build.add_64bit_uint(value)
-
-        #Catch default format conditions and split bits value to determine register write count
+        #Catch default format conditions and find the compiled codec
         if formating is None:
             formating = self.Mem_default
-        Format = formating.split('_')
-
-        #Catch incorrect formating of ints
-        if Format[1] == 'int' or Format[1] == 'uint':
-            if type(value) is not int:
-                value = int(value)
+        codec = get_codec(formating, self.byteOrder, self.wordOrder)
 
-
-        if int(Format[0]) >= 16:  #determine number of registers to write
-            count = int(Format[0])/16
-        else:
-            count = 1
+        #Catch incorrect formating of floats, ints are handled by the codec
+        if not codec.integer:
+            value = float(value)
 
         client = self.client #define client
 
-        #start builder for writng to registers
-        builder = BinaryPayloadBuilder(byteorder=self.byteOrder, wordorder=self.wordOrder)
-
-        #encoder dictionary
-        Encode_dict = { '16_float':float_16, '32_float':float_32, '64_float':float_64, '16_int':int_16, '32_int':int_32, '64_int':int_64, '16_uint':uint_16, '32_uint':uint_32, '64_uint':uint_64 }
-
-        #Encode value with builder
-        Encode_dict[formating](builder, value)
-
-        payload = builder.to_registers()
+        payload = codec.encode(value)
         
         #read/write operations
         
@@ -210,6 +227,129 @@ class MB_PLC:
     def __repr__(self):
         return "MB_PLC('{}')".format(self.ip)
 
+#Periodic timer handed out by the Scheduler
+#Deadlines are absolute on the monotonic clock so timing errors do not add up from one period to the next
+class Timer:
+    def __init__(self, scheduler, period, stop=None):
+        self.scheduler = scheduler
+        self.period = period
+        self.stop = stop
+        self.deadline = time.monotonic() + period
+        self.wake = threading.Event()
+        self.stopped = False
+        #timing measurements, jitter is how late a wait returned after its deadline
+        self.ticks = 0
+        self.missed = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+
+    #Block until the next deadline, returns False if the timer was cancelled or stop was set
+    #A timer with a stop Event sleeps on that Event instead of the scheduler, so setting it wakes the timer straight away
+    def wait(self):
+        if self.stopped or (self.stop is not None and self.stop.is_set()):
+            return False
+        if self.stop is None:
+            self.wake.wait()
+        else:
+            delay = self.deadline - time.monotonic()
+            while delay > 0 and not self.stopped:
+                if self.stop.wait(delay):
+                    return False
+                delay = self.deadline - time.monotonic()
+        if self.stopped:
+            return False
+        self.wake.clear()
+
+        now = time.monotonic()
+        late = now - self.deadline
+        self.ticks = self.ticks + 1
+        self.jitter_total = self.jitter_total + late
+        if late > self.jitter_max:
+            self.jitter_max = late
+
+        #next deadline follows the last one, skipping any periods that were overrun
+        self.deadline = self.deadline + self.period
+        if self.deadline <= now:
+            skip = int((now - self.deadline)/self.period) + 1
+            self.missed = self.missed + skip
+            self.deadline = self.deadline + skip*self.period
+        if self.stop is None:
+            self.scheduler.add(self)
+        return True
+
+    #Stop the timer, a thread blocked in wait() returns right away, or at its deadline if it sleeps on a stop Event
+    def cancel(self):
+        self.stopped = True
+        self.wake.set()
+
+    #Timing summary in seconds
+    def stats(self):
+        mean = 0.0
+        if self.ticks > 0:
+            mean = self.jitter_total/self.ticks
+        return {'ticks':self.ticks, 'missed':self.missed, 'jitter_mean':mean, 'jitter_max':self.jitter_max}
+
+    def __repr__(self):
+        return "Timer('{}')".format(self.period)
+
+#One thread that keeps a heap of timer deadlines and wakes each timer when its deadline passes
+#Threads waiting on timers sleep instead of spinning on the clock
+class Scheduler:
+    def __init__(self):
+        self.heap = []
+        self.count = 0
+        self.cond = threading.Condition()
+        self.thread = None
+
+    #Start a periodic timer, the first deadline is one period from now
+    #raises ValueError for a period that is not above 0, it would never wait
+    def every(self, period, stop=None):
+        if not period > 0:
+            raise ValueError('timer period must be above 0, not %r' % period)
+        timer = Timer(self, period, stop)
+        if stop is None:
+            self.add(timer)
+        return timer
+
+    #Put a timer on the heap at its deadline
+    def add(self, timer):
+        with self.cond:
+            self.count = self.count + 1
+            heapq.heappush(self.heap, (timer.deadline, self.count, timer))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop)
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+
+    #Wake timers as their deadlines pass, sleeping until the earliest deadline in between
+    def loop(self):
+        with self.cond:
+            while True:
+                if len(self.heap) == 0:
+                    self.cond.wait()
+                    continue
+                delay = self.heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                deadline, count, timer = heapq.heappop(self.heap)
+                if not timer.stopped:
+                    timer.wake.set()
+
+    #Cancel every timer
+    def stop(self):
+        with self.cond:
+            for deadline, count, timer in self.heap:
+                timer.cancel()
+            self.heap = []
+            self.cond.notify()
+
+    def __repr__(self):
+        return "Scheduler('{}')".format(len(self.heap))
+
+SCHEDULER = Scheduler()
+
 def initialization():
     context = zmq.Context()
     reciever = context.socket(zmq.REP)
@@ -331,6 +471,7 @@ class Connector:
         self.Actuator_String = ''
         self.Sensor_String = ''
         self.thread = None
+        self.timer = None
 
     def Set(self, **kwargs):
         #uses dictionary to parse kargs
@@ -393,8 +534,11 @@ class Connector:
             DB.connect("tcp://"+serverAddress+":5555")
             logging.info("Successfully connected to server: " + serverAddress)
         
-        #Setup timing mechanism
-        time_end = time.time()
+        #Setup timing mechanism, the timer wakes this thread every scan and as soon as the Event is set
+        timer = None
+        if self.Scan_Time != 0:
+            timer = SCHEDULER.every(self.Scan_Time, self.Event)
+        self.timer = timer
 
         while not self.Event.is_set():
 
@@ -415,10 +559,8 @@ class Connector:
                     self.PLC.write(int(self.Time_Mem),Time_stamp)
             
             #perform scan time delay if requested
-            if self.Scan_Time != 0:
-                    time1 = 0
-                    while time1 < self.Scan_Time and not self.Event.is_set():
-                        time1 = time.time() - time_end
+            if timer is not None:
+                timer.wait()
             
             if self.actuator:
                 #gather and report data from PLC
@@ -429,10 +571,12 @@ class Connector:
                         DB.send(acutation_signal,zmq.NOBLOCK)
                     else:
                         print("Read Failure on IP: %s" % self.PLC.ip)
-
-            time_end = time.time()
         
         #close up shop
+        if timer is not None:
+            timer.cancel()
+            stats = timer.stats()
+            logging.info('Scan timing for PLC IP:%s %u scans, jitter mean %.6f s max %.6f s, %u scans missed' % (self.PLC.ip, stats['ticks'], stats['jitter_mean'], stats['jitter_max'], stats['missed']))
         self.PLC.close()
         #if actuator, then close connection
         if self.actuator:
@@ -446,9 +590,11 @@ class Connector:
         self.thread = threading.Thread(target=self.Agent)
         self.thread.daemon = True
         self.thread.start()
-    #Define how to stop Event thread
+    #Define how to stop Event thread, only this connector's timer is cancelled
     def stop(self):
         self.Event.set()
+        if self.timer is not None:
+            self.timer.cancel()
         self.thread.join()
     #wait for Event to finish
     def wait(self):